@@ -398,6 +398,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(minute=0, hour=1),  # Every day at 01:00 UTC,
         'enabled': False
     },
+    'rollup-circulation': {
+        'task': ('rero_ils.modules.stats.tasks.rollup_circulation'),
+        'schedule': timedelta(hours=1),
+        'enabled': False
+    },
     'collect-stats-librarian': {
         'task': ('rero_ils.modules.stats.tasks.collect_stats_librarian'),
         'schedule': crontab(minute=30, hour=1, day_of_month='1'),  # First day of the month at 01:30 UTC,
@@ -429,6 +434,15 @@ CELERY_BEAT_SCHEDULE = {
 }
 CELERY_BROKER_HEARTBEAT = 0
 INDEXER_BULK_REQUEST_TIMEOUT = 60
+#: Number of queued messages consumed at once by the bulk indexer
+#: (1 disables the batched mode).
+RERO_ILS_INDEXER_BATCH_SIZE = 500
+#: Number of concurrent bulk requests sent by the batched bulk indexer.
+RERO_ILS_INDEXER_PARALLEL = 2
+#: Maximum number of persistent identifiers cached to resolve the `$ref`.
+RERO_ILS_JSONRESOLVER_CACHE_SIZE = 100000
+#: Time to live (in seconds) of the cached persistent identifiers.
+RERO_ILS_JSONRESOLVER_CACHE_TTL = 300
 
 CELERY_BEAT_SCHEDULER = 'rero_ils.schedulers.RedisScheduler'
 CELERY_REDIS_SCHEDULER_URL = 'redis://localhost:6379/4'
@@ -2725,11 +2739,40 @@ RERO_ILS_ENABLE_OPERATION_LOG = {
     'ill_requests': 'illr'
 }
 RERO_ILS_ENABLE_OPERATION_LOG_VALIDATION = False
+#: Buffer the operation logs and index them by batch using a celery task
+#: instead of indexing them one by one during the request.
+RERO_ILS_OPERATION_LOG_BUFFER = False
+#: Number of buffered operation logs triggering a flush.
+RERO_ILS_OPERATION_LOG_BUFFER_SIZE = 500
+#: Maximum time (in seconds) an operation log stays in the buffer.
+RERO_ILS_OPERATION_LOG_BUFFER_DELAY = 5
+#: Maximum number of record snapshots cached to build the loan operation logs.
+RERO_ILS_LOAN_OPERATION_LOG_CACHE_SIZE = 10000
+#: Time to live (in seconds) of the loan operation logs record snapshots.
+RERO_ILS_LOAN_OPERATION_LOG_CACHE_TTL = 300
+#: Number of loan operation logs created at once inside a batch context.
+RERO_ILS_LOAN_OPERATION_LOG_BATCH_SIZE = 1000
 
 # Statistics Configuration
 # ========================
 # Compute the stats with a timeframe given in monthes
 RERO_ILS_STATS_BILLING_TIMEFRAME_IN_MONTHES = 3
+#: Compute the circulation stats from the daily circulation rollups instead of
+#: the loan operation logs (see the `rollup-circulation` task).
+RERO_ILS_STATS_CIRCULATION_ROLLUPS = False
+
+# Inventory Configuration
+# =======================
+#: Number of items written at once by the inventory list CSV export.
+RERO_ILS_INVENTORY_CHUNK_SIZE = 1000
+#: Number of threads fetching the documents and the loans of the next chunk
+#: while the current chunk is written.
+RERO_ILS_INVENTORY_PREFETCH_WORKERS = 2
+#: Directory of the asynchronous inventory list exports, it must be shared by
+#: the web and the celery nodes (default: `<instance path>/inventory`).
+RERO_ILS_INVENTORY_EXPORT_DIR = None
+#: Time (in seconds) an asynchronous inventory list export is kept.
+RERO_ILS_INVENTORY_EXPORT_TTL = 86400
 
 # =============================================================================
 # NOTIFICATIONS MODULE SPECIFIC SETTINGS
@@ -2755,6 +2798,21 @@ RERO_ILS_COMMUNICATION_DISPATCHER_FUNCTIONS = {
     #  'telepathy': self.madness_mind
     #  ...
 }
+# Number of loans processed at once by the reminder notifications creation
+# (see `ReminderEngine`).
+RERO_ILS_NOTIFICATIONS_REMINDERS_BATCH_SIZE = 1000
+# Number of threads sending the aggregated notifications of the notification
+# processing task. Each thread reuses its transports for all its messages.
+RERO_ILS_NOTIFICATIONS_DISPATCH_WORKERS = 4
+# Number of aggregated notifications sent before storing their process dates
+# with one database commit and one bulk indexing request.
+RERO_ILS_NOTIFICATIONS_DISPATCH_BATCH_SIZE = 500
+# Define the transports opened once by dispatch thread. Each key is the
+# transport name, value is a function returning a context manager (i.e. one
+# SMTP connection for all the emails sent by a thread).
+RERO_ILS_NOTIFICATIONS_DISPATCH_TRANSPORTS = {
+    'mail': NotificationDispatcher.mail_connection
+}
 
 # Login Configuration
 # ===================
@@ -2804,6 +2862,18 @@ RERO_ILS_UI_GIT_HASH = None
 # RERO_ILS_MEF_AGENTS_URL = 'https://mef.rero.ch/api/agents'
 RERO_ILS_MEF_AGENTS_URL = 'https://mef.rero.ch/api'
 RERO_ILS_MEF_RESULT_SIZE = 100
+#: Persistent cache of the MEF responses: `sqlite:///<path>` or `redis://...`
+#: (`None`: the MEF responses are not cached). The dojson transformations use
+#: the environment variables of the same names.
+RERO_ILS_MEF_CACHE_URL = None
+#: Time to live (in seconds) of the cached MEF responses.
+RERO_ILS_MEF_CACHE_TTL = 7 * 24 * 3600
+#: Time to live (in seconds) of the cached MEF "not found" responses.
+RERO_ILS_MEF_CACHE_NEGATIVE_TTL = 24 * 3600
+#: Use only the cached MEF responses (the MEF server is never requested).
+RERO_ILS_MEF_OFFLINE = False
+#: Number of concurrent MEF requests to resolve a batch of references.
+RERO_ILS_MEF_WORKERS = 8
 
 RERO_ILS_APP_HELP_PAGE = (
     'https://github.com/rero/rero-ils/wiki/Public-demo-help'
@@ -2849,6 +2919,16 @@ OAISERVER_ID_PREFIX = 'oai:bib.rero.ch:'
 # circulation policy related to a loan that allows request.
 RERO_ILS_DEFAULT_PICKUP_HOLD_DURATION = 10
 
+# Time to live (in seconds) of the circulation policies resolution tables
+# (see `CircPoliciesMatrix`): a table is rebuilt at least this often.
+RERO_ILS_CIRC_POLICIES_MATRIX_TTL = 300
+
+# Number of items whose expired requests are cancelled at once by the expired
+# requests task (see `ExpiredRequestCanceller`).
+RERO_ILS_EXPIRED_REQUESTS_BATCH_SIZE = 500
+# Number of threads cancelling the expired requests of a batch.
+RERO_ILS_EXPIRED_REQUESTS_WORKERS = 4
+
 # =============================================================================
 # ANONYMISATION PROCESS CONFIGURATION
 # =============================================================================
@@ -2861,6 +2941,10 @@ RERO_ILS_ANONYMISATION_MIN_TIME_LIMIT = 3*365/12
 # concluded.
 RERO_ILS_ANONYMISATION_MAX_TIME_LIMIT = 6*365/12
 
+# Number of loans processed at once by the anonymisation task (see
+# `LoanAnonymizer`).
+RERO_ILS_ANONYMISATION_CHUNK_SIZE = 1000
+
 
 #: Invenio circulation configuration.
 CIRCULATION_ITEM_EXISTS = Item.item_exists
@@ -3184,6 +3268,9 @@ SIP2_SUPPORT_ONLINE_STATUS = True
 SIP2_SUPPORT_OFFLINE_STATUS = True
 SIP2_SUPPORT_STATUS_UPDATE = True
 SIP2_DATE_FORMAT = '%Y%m%d    %H%M%S'
+#: Time (in seconds) a selfcheck patron account summary is kept in cache,
+#: `0` to disable the cache.
+RERO_ILS_SELFCHECK_PATRON_SUMMARY_TIMEOUT = 30
 
 SIP2_PERMISSIONS_FACTORY = seflcheck_permission_factory
 
@@ -21,6 +21,7 @@ import os
 import re
 import sys
 import traceback
+from contextlib import contextmanager
 from copy import deepcopy
 
 import click
@@ -413,61 +414,126 @@ def remove_special_characters(value, chars=['\u0098', '\u009C']):
     return value
 
 
-def get_contribution_link(bibid, reroid, id, key):
-    """Get MEF contribution link.
+def _get_mef_url():
+    """Get the MEF api url.
+
+    In dojson we dont have app. mef_url should be the same as
+    RERO_ILS_MEF_AGENTS_URL in config.py
+    """
+    mef_host = os.environ.get('RERO_ILS_MEF_HOST', 'mef.rero.ch')
+    return f'https://{mef_host}/api'
+
+
+def _get_contribution_ref(id, key):
+    """Get the MEF reference of a contribution.
 
-    :params bibid: Bib id from the record.
-    :params reroid: RERO id from the record.
     :params id: $0 from the marc field.
     :params key: Tag from the marc field.
-    :returns: MEF url.
+    :returns: (type, value) tuple, None if $0 is not a contribution
+              identifier.
     """
-    from rero_ils.modules.utils import requests_retry_session
-
-    # In dojson we dont have app. mef_url should be the same as
-    # RERO_ILS_MEF_AGENTS_URL in config.py
-    # https://mef.test.rero.ch/api/mef/?q=rero.rero_pid:"A012327677"
-    mef_host = os.environ.get('RERO_ILS_MEF_HOST', 'mef.rero.ch')
-    mef_url = f'https://{mef_host}/api'
     if type(id) is str:
         match = re_identified.search(id)
     else:
         match = re_identified.search(id[0])
     if match and len(match.groups()) == 2 and key[:3] in _CONTRIBUTION_TAGS:
         match_type = match.group(1).lower()
-        match_value = match.group(2)
         match_type = match_type.replace('de-588', 'gnd')
+        return match_type, match.group(2)
+
+
+def _get_viaf_source_ref(hit):
+    """Get the idref or gnd reference of a MEF viaf hit.
+
+    :params hit: MEF hit of a viaf pid.
+    :returns: (type, value) tuple, None if not found.
+    """
+    mdata = (hit or {}).get('metadata', {})
+    for source in ['idref', 'gnd']:
+        match_value = mdata.get(source, {}).get('pid')
+        if match_value:
+            return source, match_value
+
+
+def get_contribution_link(bibid, reroid, id, key):
+    """Get MEF contribution link.
+
+    The MEF responses are cached (see ``mef_contributions_batch``).
+
+    :params bibid: Bib id from the record.
+    :params reroid: RERO id from the record.
+    :params id: $0 from the marc field.
+    :params key: Tag from the marc field.
+    :returns: MEF url.
+    """
+    from rero_ils.modules.contributions.mef import MefRequestError, \
+        get_mef_resolver
+
+    # https://mef.test.rero.ch/api/mef/?q=rero.rero_pid:"A012327677"
+    mef_url = _get_mef_url()
+    ref = _get_contribution_ref(id, key)
+    if ref:
+        match_type, match_value = ref
+        resolver = get_mef_resolver(mef_url, pooled=True)
         # if we have a viafid, look for the contributor in MEF
         if match_type == "viaf":
-            url = f'{mef_url}/mef/?q=viaf_pid:"{match_value}"'
-            response = requests_retry_session().get(url)
-            status_code = response.status_code
-            if status_code == requests.codes.ok:
-                resp = response.json()
-                try:
-                    mdata = resp['hits']['hits'][0]['metadata']
-                    for source in ['idref', 'gnd']:
-                        match_value = mdata.get(source, {}).get('pid')
-                        if match_value:
-                            match_type = source
-                            break
-                except (IndexError, KeyError):
-                    pass
+            try:
+                hit = resolver.get(match_type, match_value)
+            except (MefRequestError, ValueError):
+                hit = None
+            if hit:
+                match_type, match_value = \
+                    _get_viaf_source_ref(hit) or (match_type, None)
         if match_type in ['idref', 'gnd']:
-            url = f'{mef_url}/mef/?q={match_type}.pid:"{match_value}"'
-            response = requests_retry_session().get(url)
-            status_code = response.status_code
-            total = 0
-            if status_code == requests.codes.ok:
-                total = response.json().get('hits', {}).get('total', 0)
-                if total > 0:
+            url = resolver.query_url(match_type, match_value)
+            status_code = requests.codes.ok
+            try:
+                if resolver.get(match_type, match_value):
                     return f'{mef_url}/{match_type}/{match_value}'
+            except MefRequestError as err:
+                status_code = err.status_code
+            except ValueError:
+                pass
             error_print('WARNING GET MEF CONTRIBUTION:',
-                        bibid, reroid, key, id, url, status_code, total)
+                        bibid, reroid, key, id, url, status_code)
     else:
         error_print('ERROR GET MEF CONTRIBUTION:', bibid, reroid, key, id)
 
 
+@contextmanager
+def mef_contributions_batch(marc21records):
+    """Resolve the MEF contributions of several records at once.
+
+    The $0 of the contribution fields are resolved concurrently (the viaf
+    ones first, then their idref or gnd pids) and kept in memory until the
+    end of the context: ``get_contribution_link`` uses them instead of
+    requesting MEF for each field.
+
+    :params marc21records: MARC21 json records.
+    :returns: the MEF resolver.
+    """
+    from rero_ils.modules.contributions.mef import get_mef_resolver
+
+    resolver = get_mef_resolver(_get_mef_url(), pooled=True)
+    refs = set()
+    for record in marc21records:
+        for key, values in record.items():
+            if key[:3] not in _CONTRIBUTION_TAGS:
+                continue
+            for value in utils.force_list(values):
+                if isinstance(value, dict) and value.get('0'):
+                    ref = _get_contribution_ref(value['0'], key)
+                    if ref and ref[0] in ['viaf', 'idref', 'gnd']:
+                        refs.add(ref)
+    with resolver.batch(refs) as hits:
+        source_refs = [
+            _get_viaf_source_ref(hit)
+            for ref, hit in hits.items() if ref[0] == 'viaf'
+        ]
+        resolver.prefetch([ref for ref in source_refs if ref])
+        yield resolver
+
+
 def add_note(new_note, data):
     """Add a new note to the data avoiding duplicate notes.
 
@@ -18,7 +18,12 @@
 
 """API for manipulating records."""
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, \
+    as_completed, wait
+from contextlib import contextmanager
 from copy import deepcopy
+from datetime import datetime
+from itertools import islice
 from uuid import uuid4
 
 import click
@@ -36,15 +41,18 @@ from invenio_indexer.utils import _es7_expand_action
 from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_pidstore.models import PersistentIdentifier, PIDStatus
 from invenio_records.api import Record
+from invenio_records.signals import after_record_insert, before_record_insert
 from invenio_records_rest.utils import obj_or_import_string
 from invenio_search import current_search
 from invenio_search.api import RecordsSearch
 from jsonschema.exceptions import ValidationError
 from kombu.compat import Consumer
-from sqlalchemy import text
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.local import LocalProxy
 
-from .utils import extracted_data_from_ref
+from .deferred_indexing import current_deferred_indexing
+from .identity_map import current_identity_map
+from .utils import extracted_data_from_ref, iter_persistent_identifiers
 
 
 class IlsRecordError:
@@ -110,6 +118,9 @@ class IlsRecord(Record):
     object_type = 'rec'
     pids_exist_check = None
     pid_check = True
+    # if True, records loaded inside an `identity_map` context are kept and
+    # returned by the next `get_record_by_pid`/`get_record_by_id` calls.
+    enable_identity_map = False
 
     @classmethod
     def get_indexer_class(cls):
@@ -134,7 +145,7 @@ class IlsRecord(Record):
         if self.get('_draft'):
             # No validation is needed for draft records
             return self
-        json = super()._validate(**kwargs)
+        json = self._validate_schema(**kwargs)
         validation_message = self.extended_validation(**kwargs)
         # We only like to run pids_exist_check if validation_message is True
         # and not a string with error from extended_validation
@@ -153,6 +164,28 @@ class IlsRecord(Record):
             raise ValidationError(';'.join(validation_message))
         return json
 
+    def _validate_schema(self, format_checker=None, validator=None,
+                         use_model=False):
+        """Validate record against its schema.
+
+        A local schema is compiled once per process (see `validation`), other
+        schemas or custom validators use the invenio records validation.
+
+        :returns: the encoded record data.
+        """
+        from .validation import get_validator, validate
+        schema = self.get('$schema')
+        if not isinstance(schema, str) or format_checker or validator or \
+                self.format_checker or self.validator or \
+                not get_validator(schema):
+            return super()._validate(
+                format_checker=format_checker, validator=validator,
+                use_model=use_model)
+        json = self.model.json if use_model else \
+            self.model_cls.encode(dict(self))
+        validate(json, schema)
+        return json
+
     def extended_validation(self, **kwargs):
         """Returns reasons for validation failures, otherwise True.
 
@@ -203,6 +236,184 @@ class IlsRecord(Record):
             raise
         return record
 
+    @classmethod
+    def bulk_create(cls, records, batch_size=1000, workers=1, dbcommit=False,
+                    reindex=False, pidcheck=True):
+        """Create records by batches.
+
+        For each batch, the given pids are checked with a single query, the
+        missing pids are minted by block, the records are validated (in a
+        pool of threads if `workers` > 1) and the valid records and their
+        persistent identifiers are inserted with one multi-row `INSERT` by
+        table. The record extensions and the insert signals are applied as
+        for `create`. The records of a class with a specific `create` are
+        created one by one.
+
+        An invalid record does not stop the creation of the other records:
+        its error is returned with it.
+
+        :param records: an iterable of record data.
+        :param batch_size: the number of records by batch.
+        :param workers: the number of validation threads. The threads do not
+                        see the uncommitted records: use them with `dbcommit`
+                        if the records link to each other.
+        :param dbcommit: commit the database after each batch.
+        :param reindex: index the records of each committed batch.
+        :param pidcheck: check the existence of the linked records.
+        :returns: a generator of (record, error) tuples in the order of the
+                  given data, `error` is `None` if the record is created.
+        """
+        assert cls.minter
+        assert cls.provider
+        records = iter(records)
+        batch = list(islice(records, batch_size))
+        while batch:
+            if cls.create.__func__ is IlsRecord.create.__func__:
+                results = cls._bulk_create(batch, workers, pidcheck)
+            else:
+                results = []
+                for data in batch:
+                    try:
+                        results.append((cls.create(data, pidcheck=pidcheck),
+                                        None))
+                    except Exception as error:
+                        results.append((data, error))
+            if dbcommit:
+                db.session.commit()
+                ids = [record.id for record, error in results if not error]
+                if reindex and ids:
+                    # the indexers `bulk_index` do not all accept a doc_type
+                    cls.get_indexer_class()()._bulk_op(
+                        ids, op_type='index',
+                        doc_type=cls.provider.pid_type)
+            yield from results
+            batch = list(islice(records, batch_size))
+
+    @classmethod
+    def _bulk_create(cls, batch, workers=1, pidcheck=True):
+        """Create a batch of records of a class without specific `create`.
+
+        :param batch: a list of record data.
+        :param workers: the number of validation threads.
+        :param pidcheck: check the existence of the linked records.
+        :returns: a list of (record, error) tuples.
+        """
+        pid_type = cls.provider.pid_type
+        schema = None
+        if pid_type in current_app.config.get('RECORDS_JSON_SCHEMA', {}):
+            from .utils import get_schema_for_resource
+            schema = get_schema_for_resource(pid_type)
+        given_pids = {str(data['pid']) for data in batch if data.get('pid')}
+        used_pids = set()
+        if given_pids:
+            used_pids = {
+                pid for pid, in db.session
+                .query(PersistentIdentifier.pid_value)
+                .filter(
+                    PersistentIdentifier.pid_type == pid_type,
+                    PersistentIdentifier.pid_value.in_(given_pids)
+                )
+            }
+        new_pids = iter(cls.provider.next_pids(
+            sum(1 for data in batch if not data.get('pid'))))
+
+        results = []
+        for data in batch:
+            if schema and '$schema' not in data:
+                data['$schema'] = schema
+            pid = str(data['pid']) if data.get('pid') else None
+            if pid in used_pids:
+                results.append((data, IlsRecordError.PidAlreadyUsed(
+                    f'PidAlreadyUsed {pid_type} {pid}')))
+                continue
+            if pid:
+                used_pids.add(pid)
+            else:
+                data['pid'] = next(new_pids)
+            record = cls(data)
+            try:
+                before_record_insert.send(
+                    current_app._get_current_object(), record=record)
+                for extension in cls._extensions:
+                    extension.pre_create(record)
+            except Exception as error:
+                results.append((data, error))
+                continue
+            results.append((record, None))
+
+        # validate the records
+        cls.pid_check = pidcheck
+        app = current_app._get_current_object()
+
+        def validate(record):
+            """Validate a record, return the encoded data or the error."""
+            try:
+                if workers > 1:
+                    with app.app_context():
+                        return record._validate(), None
+                return record._validate(), None
+            except Exception as error:
+                return None, error
+
+        to_validate = [record for record, error in results if not error]
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                validations = list(executor.map(validate, to_validate))
+        else:
+            validations = [validate(record) for record in to_validate]
+        validations = dict(zip(map(id, to_validate), validations))
+
+        # insert the valid records
+        now = datetime.utcnow()
+        created = []
+        for idx, (record, error) in enumerate(results):
+            if error:
+                continue
+            json, error = validations[id(record)]
+            if error:
+                current_app.logger.error(
+                    f'{cls.__name__} data:{dict(record)} err:{error}')
+                results[idx] = (dict(record), error)
+                continue
+            record.model = cls.model_cls(
+                id=uuid4(), json=json, version_id=1, created=now,
+                updated=now)
+            created.append(record)
+        if created:
+            if current_app.config.get('DB_VERSIONING'):
+                # the record versions are only tracked by the session
+                db.session.add_all(record.model for record in created)
+            else:
+                db.session.execute(cls.model_cls.__table__.insert().values([
+                    dict(id=record.model.id, json=record.model.json,
+                         version_id=1, created=now, updated=now)
+                    for record in created
+                ]))
+            db.session.execute(PersistentIdentifier.__table__.insert().values([
+                dict(pid_type=pid_type, pid_value=record.pid,
+                     status=PIDStatus.REGISTERED, object_type=cls.object_type,
+                     object_uuid=record.model.id, created=now, updated=now)
+                for record in created
+            ]))
+            db.session.flush()
+            for record in created:
+                for extension in cls._extensions:
+                    extension.post_create(record)
+                after_record_insert.send(
+                    current_app._get_current_object(), record=record)
+        return results
+
+    @classmethod
+    def _get_identity_map(cls, with_deleted=False):
+        """Get the active identity map usable for this record class.
+
+        :param with_deleted: If `True` deleted records are requested, the
+                             identity map can not be used.
+        :returns: the active identity map, `None` if not usable.
+        """
+        if cls.enable_identity_map and not with_deleted:
+            return current_identity_map()
+
     @classmethod
     def get_record_by_pid(cls, pid, with_deleted=False, verbose=False):
         """Get ils record by pid value."""
@@ -210,6 +421,11 @@ class IlsRecord(Record):
             click.echo(f'\t\tget_record_by_pid: {cls.__name__} {pid}')
         if pid:
             assert cls.provider
+            records_map = cls._get_identity_map(with_deleted)
+            if records_map is not None:
+                record = records_map.get(cls.provider.pid_type, pid=pid)
+                if record is not None:
+                    return record
             try:
                 persistent_identifier = PersistentIdentifier.get(
                     cls.provider.pid_type,
@@ -219,11 +435,51 @@ class IlsRecord(Record):
                     persistent_identifier.object_uuid,
                     with_deleted=with_deleted
                 )
+                if records_map is not None:
+                    records_map.add(cls.provider.pid_type, record)
                 return record
             # TODO: is it better to raise a error or to return None?
             except (NoResultFound, PIDDoesNotExistError):
                 return None
 
+    @classmethod
+    def get_records_by_pids(cls, pids, with_deleted=False, chunk_size=1000):
+        """Get ils records by pid values.
+
+        The pids are resolved by chunks: each chunk costs a single SQL query
+        joining the persistent identifier table with the record metadata
+        table, instead of two queries per pid.
+
+        :param pids: an iterable of pid values.
+        :param with_deleted: If `True` then it includes deleted records.
+        :param chunk_size: the number of pids to resolve by SQL query.
+        :returns: a generator of records, in the same order as the given
+                  pids. Unknown pids are skipped.
+        """
+        assert cls.provider
+        pids = (str(pid) for pid in pids if pid)
+        chunk = list(islice(pids, chunk_size))
+        while chunk:
+            with db.session.no_autoflush:
+                model_cls = cls.model_cls
+                query = db.session \
+                    .query(PersistentIdentifier.pid_value, model_cls) \
+                    .join(model_cls,
+                          model_cls.id == PersistentIdentifier.object_uuid) \
+                    .filter(
+                        PersistentIdentifier.pid_type == cls.provider.pid_type,
+                        PersistentIdentifier.pid_value.in_(set(chunk))
+                    )
+                if not with_deleted:
+                    query = query.filter(
+                        model_cls.is_deleted != True)  # noqa
+                models = dict(query.all())
+            for pid in chunk:
+                model = models.get(pid)
+                if model is not None:
+                    yield cls(model.data, model=model)
+            chunk = list(islice(pids, chunk_size))
+
     @classmethod
     def record_pid_exists(cls, pid):
         """Check if a persistent identifier exists.
@@ -264,7 +520,15 @@ class IlsRecord(Record):
     @classmethod
     def get_record_by_id(cls, id, with_deleted=False):
         """Get ils record by uuid."""
-        return super().get_record(id, with_deleted=with_deleted)
+        records_map = cls._get_identity_map(with_deleted)
+        if records_map is not None:
+            record = records_map.get(cls.provider.pid_type, id_=id)
+            if record is not None:
+                return record
+        record = super().get_record(id, with_deleted=with_deleted)
+        if records_map is not None:
+            records_map.add(cls.provider.pid_type, record)
+        return record
 
     @classmethod
     def get_persistent_identifier(cls, id):
@@ -289,37 +553,15 @@ class IlsRecord(Record):
     def get_all_pids(cls, with_deleted=False, limit=100000):
         """Get all records pids. Return a generator iterator."""
         query = cls._get_all(with_deleted=with_deleted)
-        if limit:
-            count = query.count()
-            # slower, less memory
-            query = query.order_by(text('pid_value')).limit(limit)
-            offset = 0
-            while offset < count:
-                for identifier in query.offset(offset):
-                    yield identifier.pid_value
-                offset += limit
-        else:
-            # faster, more memory
-            for identifier in query:
-                yield identifier.pid_value
+        for identifier in iter_persistent_identifiers(query, limit=limit):
+            yield identifier.pid_value
 
     @classmethod
     def get_all_ids(cls, with_deleted=False, limit=100000):
         """Get all records uuids. Return a generator iterator."""
         query = cls._get_all(with_deleted=with_deleted)
-        if limit:
-            # slower, less memory
-            query = query.order_by(text('pid_value')).limit(limit)
-            offset = 0
-            count = cls.count(with_deleted=with_deleted)
-            while offset < count:
-                for identifier in query.limit(limit).offset(offset):
-                    yield identifier.object_uuid
-                offset += limit
-        else:
-            # faster, more memory
-            for identifier in query:
-                yield identifier.object_uuid
+        for identifier in iter_persistent_identifiers(query, limit=limit):
+            yield identifier.object_uuid
 
     @classmethod
     def _list_object_by_id(cls, record_class, query):
@@ -338,18 +580,25 @@ class IlsRecord(Record):
         :param query: search query
         :return record object.
         """
-        for hit in query.source(['pid']).scan():
-            yield record_class.get_record_by_pid(hit.pid)
+        pids = (hit.pid for hit in query.source(['pid']).scan())
+        yield from record_class.get_records_by_pids(pids)
 
     @classmethod
     def count(cls, with_deleted=False):
         """Get record count."""
         return cls._get_all(with_deleted=with_deleted).count()
 
+    def _invalidate_identity_map(self):
+        """Remove this record from the active identity map."""
+        records_map = self._get_identity_map()
+        if records_map is not None:
+            records_map.invalidate(self.provider.pid_type, id_=self.id)
+
     def delete(self, force=False, dbcommit=False, delindex=False):
         """Delete record and persistent identifier."""
         can, _ = self.can_delete
         if can:
+            self._invalidate_identity_map()
             if delindex:
                 self.delete_from_index()
             persistent_identifier = self.get_persistent_identifier(self.id)
@@ -385,6 +634,7 @@ class IlsRecord(Record):
                     )
                 )
         record = self
+        self._invalidate_identity_map()
 
         # TODO: find a way to make extended validations.
         # Add schema if missing.
@@ -419,6 +669,7 @@ class IlsRecord(Record):
         persistent_identifier = self.get_persistent_identifier(self.id)
         if persistent_identifier.is_deleted():
             raise IlsRecordError.Deleted()
+        self._invalidate_identity_map()
         self = super().revert(revision_id=revision_id)
         if reindex:
             self.reindex(forceindex=False)
@@ -445,7 +696,14 @@ class IlsRecord(Record):
         return self
 
     def reindex(self, forceindex=False):
-        """Reindex record."""
+        """Reindex record.
+
+        Inside a ``deferred_indexing`` context of its type, the record is
+        indexed when the context is flushed.
+        """
+        deferred = current_deferred_indexing()
+        if deferred is not None and deferred.add(self):
+            return None
         indexer = self.get_indexer_class()
         if forceindex:
             return indexer(version_type="external_gte").index(self)
@@ -536,15 +794,58 @@ class IlsRecordsIndexer(RecordIndexer):
             record_id_iterator, op_type='index', doc_type=doc_type,
             index=index)
 
-    def process_bulk_queue(self, es_bulk_kwargs=None, stats_only=True):
+    def bulk_index_records(self, records, index=None, stats_only=True,
+                           **kwargs):
+        """Index a batch of loaded records with one bulk request.
+
+        :param records: the list of records to index.
+        :param index: the index name (default: the record index).
+        :param boolean stats_only: if `True` only report number of
+            successful/failed operations instead of just number of
+            successful and a list of error responses
+        :param kwargs: Passed to :func:`elasticsearch.helpers.bulk`.
+        :returns: the number of successful and failed operations.
+        """
+        with self.prefetch_records(records):
+            actions = [
+                self._record_action(record, {'index': index})
+                for record in records
+            ]
+        return bulk(
+            self.client,
+            actions,
+            stats_only=stats_only,
+            request_timeout=current_app.config[
+                'INDEXER_BULK_REQUEST_TIMEOUT'],
+            expand_action_callback=(
+                _es7_expand_action if ES_VERSION[0] >= 7
+                else default_expand_action
+            ),
+            **kwargs
+        )
+
+    def process_bulk_queue(self, es_bulk_kwargs=None, stats_only=True,
+                           batch_size=None, parallel=None):
         """Process bulk indexing queue.
 
+        With a batch size greater than one, the queued messages are consumed
+        by batches: the records of a batch are loaded with one SQL query and
+        the bulk requests are sent to Elasticsearch by `parallel` threads
+        while the next batch is prepared.
+
         :param dict es_bulk_kwargs: Passed to
             :func:`elasticsearch:elasticsearch.helpers.bulk`.
         :param boolean stats_only: if `True` only report number of
             successful/failed operations instead of just number of
             successful and a list of error responses
+        :param int batch_size: number of messages consumed at once
+            (default: `RERO_ILS_INDEXER_BATCH_SIZE`).
+        :param int parallel: number of concurrent bulk requests
+            (default: `RERO_ILS_INDEXER_PARALLEL`).
         """
+        config = current_app.config
+        batch_size = batch_size or config.get('RERO_ILS_INDEXER_BATCH_SIZE', 1)
+        parallel = parallel or config.get('RERO_ILS_INDEXER_PARALLEL', 1)
         with current_celery_app.pool.acquire(block=True) as conn:
             consumer = Consumer(
                 connection=conn,
@@ -552,25 +853,77 @@ class IlsRecordsIndexer(RecordIndexer):
                 exchange=self.mq_exchange.name,
                 routing_key=self.mq_routing_key,
             )
-            req_timeout = current_app.config['INDEXER_BULK_REQUEST_TIMEOUT']
+            req_timeout = config['INDEXER_BULK_REQUEST_TIMEOUT']
 
-            es_bulk_kwargs = es_bulk_kwargs or {}
-            count = bulk(
-                self.client,
-                self._actionsiter(consumer.iterqueue()),
+            es_bulk_kwargs = dict(
                 stats_only=stats_only,
                 request_timeout=req_timeout,
                 expand_action_callback=(
                     _es7_expand_action if ES_VERSION[0] >= 7
                     else default_expand_action
                 ),
-                **es_bulk_kwargs
+                **(es_bulk_kwargs or {})
             )
+            if batch_size > 1:
+                count = self._bulk_batches(
+                    self._batched_actionsiter(
+                        consumer.iterqueue(), batch_size),
+                    parallel=parallel,
+                    **es_bulk_kwargs
+                )
+            else:
+                count = bulk(
+                    self.client,
+                    self._actionsiter(consumer.iterqueue()),
+                    **es_bulk_kwargs
+                )
 
             consumer.close()
 
         return self.mq_queue.name, count
 
+    def _bulk_batches(self, batches, parallel=1, **kwargs):
+        """Send batches of actions to Elasticsearch.
+
+        Up to `parallel` bulk requests are running in background threads
+        while the next batch of actions is built by the calling thread (which
+        owns the application context and the database session).
+
+        :param batches: Iterator yielding lists of bulk actions.
+        :param parallel: the maximum number of concurrent bulk requests.
+        :param kwargs: Passed to :func:`elasticsearch.helpers.bulk`.
+        :returns: the number of successful operations and either the number
+            of failed operations or the list of errors (see `stats_only`).
+        """
+        success = 0
+        errors = 0 if kwargs.get('stats_only') else []
+
+        def collect(future):
+            nonlocal success, errors
+            ok, failed = future.result()
+            success += ok
+            errors += failed
+
+        # the search client proxy needs an application context: the threads
+        # use the proxied client
+        client = self.client
+        if isinstance(client, LocalProxy):
+            client = client._get_current_object()
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            running = set()
+            for actions in batches:
+                if not actions:
+                    continue
+                if len(running) >= parallel:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                running.add(
+                    executor.submit(bulk, client, actions, **kwargs))
+            for future in as_completed(running):
+                collect(future)
+        return success, errors
+
     def _get_record_class(self, payload):
         """Get the record class from payload."""
         from .utils import get_record_class_from_schema_or_pid_type
@@ -601,6 +954,98 @@ class IlsRecordsIndexer(RecordIndexer):
                     "Failed to index record {id}".format(id=payload.get('id')),
                     exc_info=True)
 
+    def _batched_actionsiter(self, message_iterator, batch_size):
+        """Iterate bulk actions by batches.
+
+        :param message_iterator: Iterator yielding messages from a queue.
+        :param batch_size: the number of messages consumed at once.
+        :returns: a generator of bulk actions lists.
+        """
+        messages = iter(message_iterator)
+        batch = list(islice(messages, batch_size))
+        while batch:
+            yield self._batch_actions(batch)
+            batch = list(islice(messages, batch_size))
+
+    def _batch_actions(self, messages):
+        """Build the bulk actions of a batch of messages.
+
+        Index messages are grouped by indexer class and the records of each
+        group are loaded at once.
+
+        :param messages: a list of messages from a queue.
+        :returns: the list of bulk actions.
+        """
+        actions = []
+        to_index = {}
+        for message in messages:
+            payload = message.decode()
+            try:
+                indexer = self._get_record_class(payload).get_indexer_class()
+                if payload['op'] == 'delete':
+                    actions.append(indexer()._delete_action(payload=payload))
+                    message.ack()
+                else:
+                    to_index.setdefault(indexer, []).append((message, payload))
+            except NoResultFound:
+                message.reject()
+            except Exception:
+                message.reject()
+                current_app.logger.error(
+                    "Failed to index record {id}".format(id=payload.get('id')),
+                    exc_info=True)
+        for indexer, messages_payloads in to_index.items():
+            actions.extend(indexer()._index_actions(messages_payloads))
+        return actions
+
+    def _index_actions(self, messages_payloads):
+        """Bulk index actions for a batch of messages.
+
+        :param messages_payloads: a list of (message, decoded message body).
+        :returns: a list of Elasticsearch bulk 'index' actions.
+        """
+        ids = {payload['id'] for _, payload in messages_payloads}
+        with db.session.begin_nested():
+            records = {
+                str(record.id): record
+                for record in self.record_cls.get_records(list(ids))
+            }
+
+        actions = []
+        with self.prefetch_records(list(records.values())):
+            for message, payload in messages_payloads:
+                record = records.get(str(payload['id']))
+                if record is None:
+                    message.reject()
+                    continue
+                try:
+                    actions.append(self._record_action(record, payload))
+                    message.ack()
+                except Exception:
+                    message.reject()
+                    current_app.logger.error(
+                        "Failed to index record {id}".format(
+                            id=payload.get('id')),
+                        exc_info=True)
+        return actions
+
+    @contextmanager
+    def prefetch_records(self, records):
+        """Prefetch the data needed to index a batch of records.
+
+        The records of a batch are prepared for indexing inside this context.
+        Indexers can override it to load at once the data their
+        `before_record_index` listeners would otherwise load record by record.
+        By default, the persistent identifiers of the `$ref` of the records
+        are loaded at once for their resolution by `replace_refs`.
+
+        :param records: the list of records to index.
+        """
+        from .jsonresolver import iter_json_refs, prewarm_json_refs
+        prewarm_json_refs(
+            ref for record in records for ref in iter_json_refs(record))
+        yield
+
     def _index_action(self, payload):
         """Bulk index action.
 
@@ -609,6 +1054,15 @@ class IlsRecordsIndexer(RecordIndexer):
         """
         with db.session.begin_nested():
             record = self.record_cls.get_record(payload['id'])
+        return self._record_action(record, payload)
+
+    def _record_action(self, record, payload):
+        """Bulk index action for a loaded record.
+
+        :param record: the record to index.
+        :param payload: Decoded message body.
+        :return: Dictionary defining an Elasticsearch bulk 'index' action.
+        """
         index, doc_type = self.record_to_index(record)
 
         arguments = {}
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Process memory caches."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class SnapshotCache:
+    """Bounded LRU cache of record snapshots with a time to live.
+
+    A snapshot is a small projection of a record (i.e. a location name for
+    the loan operation logs, a persistent identifier for the `$ref`
+    resolution). Snapshots are stored by (pid_type, pid) and kept in the
+    process memory: the least recently used ones are dropped when the cache
+    is full and every snapshot expires after a time to live. A record update
+    invalidates its snapshot in the current process, the time to live bounds
+    the staleness for the other processes.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        """Constructor.
+
+        :param maxsize: the maximum number of snapshots.
+        :param ttl: the snapshots time to live (in seconds).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Get the number of snapshots."""
+        return len(self._snapshots)
+
+    @property
+    def stats(self):
+        """Get the cache usage counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self)
+        }
+
+    def get(self, pid_type, pid):
+        """Get a snapshot.
+
+        :param pid_type: the record pid type.
+        :param pid: the record pid value.
+        :return: the snapshot, `None` if not cached or expired.
+        """
+        key = (pid_type, str(pid))
+        with self._lock:
+            value = self._snapshots.get(key)
+            if value is not None:
+                expire, snapshot = value
+                if expire > time.monotonic():
+                    self._snapshots.move_to_end(key)
+                    self.hits += 1
+                    return snapshot
+                del self._snapshots[key]
+            self.misses += 1
+        return None
+
+    def set(self, pid_type, pid, snapshot):
+        """Store a snapshot.
+
+        :param pid_type: the record pid type.
+        :param pid: the record pid value.
+        :param snapshot: the record snapshot.
+        """
+        key = (pid_type, str(pid))
+        with self._lock:
+            self._snapshots[key] = (time.monotonic() + self.ttl, snapshot)
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last=False)
+
+    def invalidate(self, pid_type, pid):
+        """Remove a snapshot.
+
+        :param pid_type: the record pid type.
+        :param pid: the record pid value.
+        """
+        with self._lock:
+            self._snapshots.pop((pid_type, str(pid)), None)
+
+    def clear(self):
+        """Remove all the snapshots."""
+        with self._lock:
+            self._snapshots.clear()
+            self.hits = self.misses = 0
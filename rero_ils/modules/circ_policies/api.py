@@ -70,6 +70,7 @@ class CircPolicy(IlsRecord):
     fetcher = circ_policy_id_fetcher
     provider = CircPolicyProvider
     model_cls = CircPolicyMetadata
+    enable_identity_map = True
     pids_exist_check = {
         'required': {
             'org': 'organisation',
@@ -167,8 +168,31 @@ class CircPolicy(IlsRecord):
         """Create a new circulation policy record."""
         # default behavior is to reindex the record. Needed to check that there
         # is only one default policy by organisation
-        return super().create(
+        record = super().create(
             data, id_, delete_pid, dbcommit, reindex, **kwargs)
+        record.invalidate_matrix()
+        return record
+
+    def update(self, data, commit=False, dbcommit=False, reindex=False):
+        """Update a circulation policy record."""
+        record = super().update(data, commit, dbcommit, reindex)
+        self.invalidate_matrix()
+        return record
+
+    def delete(self, force=False, dbcommit=False, delindex=False):
+        """Delete a circulation policy record."""
+        record = super().delete(force, dbcommit, delindex)
+        self.invalidate_matrix()
+        return record
+
+    def invalidate_matrix(self):
+        """Invalidate the policies resolution table of the organisation.
+
+        The table is invalidated by any policy change, whatever the way the
+        policy is indexed (i.e. by the bulk indexing queue).
+        """
+        from .utils import CircPoliciesMatrix
+        CircPoliciesMatrix.invalidate(self.organisation_pid)
 
     @classmethod
     def exist_name_and_organisation_pid(cls, name, organisation_pid):
@@ -273,22 +297,12 @@ class CircPolicy(IlsRecord):
         :param item_type_pid: the item_type pid.
         :return the best circulation policy corresponding to criteria.
         """
-        LPI_policy = CircPolicy.get_circ_policy_by_LPI(
-            organisation_pid,
-            library_pid,
-            patron_type_pid,
-            item_type_pid
-        )
-        if LPI_policy:
-            return LPI_policy
-        PI_policy = CircPolicy.get_circ_policy_by_OPI(
-            organisation_pid,
-            patron_type_pid,
-            item_type_pid
-        )
-        if PI_policy:
-            return PI_policy
-        return CircPolicy.get_default_circ_policy(organisation_pid)
+        from .utils import CircPoliciesMatrix
+        matrix = CircPoliciesMatrix.get_matrix(organisation_pid)
+        policy_pid = matrix.resolve(
+            library_pid, patron_type_pid, item_type_pid)
+        if policy_pid:
+            return CircPolicy.get_record_by_pid(policy_pid)
 
     def reasons_to_keep(self):
         """Reasons aside from record_links to keep a circ policy."""
@@ -452,6 +466,29 @@ class CircPoliciesIndexer(IlsRecordsIndexer):
 
     record_cls = CircPolicy
 
+    def index(self, record):
+        """Index a circulation policy.
+
+        The policies resolution table of the organisation is invalidated once
+        the index is up to date.
+
+        :param record: the circulation policy to index.
+        """
+        from .utils import CircPoliciesMatrix
+        return_value = super().index(record)
+        CircPoliciesMatrix.invalidate(record.organisation_pid)
+        return return_value
+
+    def delete(self, record):
+        """Delete a circulation policy from the index.
+
+        :param record: the circulation policy to delete.
+        """
+        from .utils import CircPoliciesMatrix
+        return_value = super().delete(record)
+        CircPoliciesMatrix.invalidate(record.organisation_pid)
+        return return_value
+
     def bulk_index(self, record_id_iterator):
         """Bulk index records.
 
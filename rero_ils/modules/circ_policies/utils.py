@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Circulation policies utils."""
+
+from uuid import uuid4
+
+from flask import current_app
+from invenio_cache.proxies import current_cache
+
+from .api import CircPoliciesSearch
+
+
+class CircPoliciesMatrix:
+    """Circulation policies resolution table of an organisation.
+
+    The table is built once from all the circulation policies of the
+    organisation. Resolving a policy is then a dictionary lookup:
+      1. library level policy: (library, patron type, item type)
+      2. organisation level policy: (patron type, item type)
+      3. default organisation policy
+
+    Built tables are kept in the process memory. A version token stored into
+    the shared cache allows to invalidate the tables of every process when a
+    policy of the organisation changes. The token expires after
+    `RERO_ILS_CIRC_POLICIES_MATRIX_TTL` seconds: the tables are then rebuilt
+    even if a policy change was not notified (i.e. a database restore).
+    """
+
+    # process tables :: organisation_pid --> CircPoliciesMatrix
+    _matrices = {}
+
+    def __init__(self, organisation_pid, version=None):
+        """Build the resolution table for an organisation.
+
+        :param organisation_pid: the organisation pid.
+        :param version: the version token of the table.
+        """
+        self.organisation_pid = organisation_pid
+        self.version = version
+        self.library_policies = {}
+        self.organisation_policies = {}
+        self.default_policy_pid = None
+        self._build()
+
+    @staticmethod
+    def _cache_key(organisation_pid):
+        """Get the shared cache key of the organisation table version."""
+        return f'circ_policies_matrix::{organisation_pid}'
+
+    def _build(self):
+        """Load all the organisation policies into the resolution table."""
+        query = CircPoliciesSearch()\
+            .filter('term', organisation__pid=self.organisation_pid)\
+            .params(preserve_order=True)\
+            .sort({'pid': {'order': 'asc'}})\
+            .source(['pid', 'is_default', 'policy_library_level',
+                     'libraries', 'settings'])
+        for hit in query.scan():
+            hit = hit.to_dict()
+            if hit.get('is_default'):
+                self.default_policy_pid = hit['pid']
+            settings = [
+                (setting['patron_type']['pid'], setting['item_type']['pid'])
+                for setting in hit.get('settings', [])
+            ]
+            if hit.get('policy_library_level'):
+                for library in hit.get('libraries', []):
+                    for patron_type_pid, item_type_pid in settings:
+                        key = (library['pid'], patron_type_pid, item_type_pid)
+                        self.library_policies.setdefault(key, hit['pid'])
+            else:
+                for key in settings:
+                    self.organisation_policies.setdefault(key, hit['pid'])
+
+    def resolve(self, library_pid, patron_type_pid, item_type_pid):
+        """Get the best circulation policy pid for library/patron/item.
+
+        :param library_pid: the library pid.
+        :param patron_type_pid: the patron type pid.
+        :param item_type_pid: the item type pid.
+        :return the best circulation policy pid corresponding to criteria.
+        """
+        return self.library_policies.get(
+            (library_pid, patron_type_pid, item_type_pid)
+        ) or self.organisation_policies.get(
+            (patron_type_pid, item_type_pid)
+        ) or self.default_policy_pid
+
+    @classmethod
+    def get_matrix(cls, organisation_pid):
+        """Get the up to date resolution table of an organisation.
+
+        :param organisation_pid: the organisation pid.
+        :return the ``CircPoliciesMatrix`` of the organisation.
+        """
+        key = cls._cache_key(organisation_pid)
+        version = current_cache.get(key)
+        matrix = cls._matrices.get(organisation_pid)
+        if version is None or matrix is None or matrix.version != version:
+            if version is None:
+                version = uuid4().hex
+                current_cache.set(key, version, timeout=current_app.config.get(
+                    'RERO_ILS_CIRC_POLICIES_MATRIX_TTL', 300))
+            matrix = cls(organisation_pid, version=version)
+            cls._matrices[organisation_pid] = matrix
+        return matrix
+
+    @classmethod
+    def invalidate(cls, organisation_pid):
+        """Invalidate the resolution table of an organisation.
+
+        :param organisation_pid: the organisation pid.
+        """
+        cls._matrices.pop(organisation_pid, None)
+        current_cache.delete(cls._cache_key(organisation_pid))
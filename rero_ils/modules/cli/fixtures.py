@@ -87,17 +87,22 @@ fixtures.add_command(destroy_operation_logs)
 @click.option('-d', '--debug', 'debug', is_flag=True, default=False)
 @click.option('-s', '--schema', 'schema', default=None)
 @click.option('-t', '--pid_type', 'pid_type', default=None)
-@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False)
+@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False,
+              help='deprecated, the file is always read lazily')
 @click.option('-o', '--dont-stop', 'dont_stop_on_error',
               is_flag=True, default=False)
 @click.option('-P', '--pid-check', 'pid_check',
               is_flag=True, default=False)
 @click.option('-e', '--save_errors', 'save_errors', type=click.File('w'))
+@click.option('-b', '--bulk', 'bulk', default=0, type=int,
+              help='create the new records by batches of this size.')
+@click.option('-w', '--workers', 'workers', default=1, type=int,
+              help='number of validation threads for the bulk creation.')
 @click.argument('infile', type=click.File('r'), default=sys.stdin)
 @with_appcontext
 def create(infile, create_or_update, append, reindex, dbcommit, commit,
            verbose, debug, schema, pid_type, lazy, dont_stop_on_error,
-           pid_check, save_errors):
+           pid_check, save_errors, bulk, workers):
     """Load REROILS record.
 
     :param infile: Json file
@@ -108,10 +113,13 @@ def create(infile, create_or_update, append, reindex, dbcommit, commit,
     :param commit: commit to database every count records
     :param pid_type: record type
     :param schema: recoord schema
-    :param lazy: lazy reads file
+    :param lazy: deprecated, the file is always read lazily
     :param dont_stop_on_error: don't stop on error
     :param pidcheck: check pids
     :param save_errors: save error records to file
+    :param bulk: create the records by batches of this size (the existing
+                 records are not updated)
+    :param workers: number of validation threads for the bulk creation
     """
     click.secho(
         f'Loading {pid_type} records from {infile.name}.',
@@ -126,17 +134,14 @@ def create(infile, create_or_update, append, reindex, dbcommit, commit,
         error_file = JsonWriter(err_file_name)
 
     pids = []
-    if lazy:
-        # try to lazy read json file (slower, better memory management)
-        records = read_json_record(infile)
-    else:
-        # load everything in memory (faster, bad memory management)
-        records = json.load(infile)
+    records = read_json_record(infile)
     count = 0
     now = datetime.now(timezone.utc)
     order_date = now.strftime('%Y-%m-%d')
     year = str(now.year)
-    for count, record in enumerate(records, 1):
+
+    def prepare(record):
+        """Prepare a record before its creation."""
         if pid_type == 'budg' and not record.get('name'):
             # ensure a budget is created for the current year
             record['name'] = year
@@ -150,6 +155,37 @@ def create(infile, create_or_update, append, reindex, dbcommit, commit,
             record['receipt_date'] = f'{order_date}'
         if schema:
             record['$schema'] = schema
+        return record
+
+    if bulk:
+        records = record_class.bulk_create(
+            map(prepare, records), batch_size=bulk, workers=workers,
+            dbcommit=dbcommit, reindex=reindex, pidcheck=pid_check)
+        for count, (rec, error) in enumerate(records, 1):
+            if not error:
+                if append:
+                    pids.append(rec.pid)
+                if verbose:
+                    click.echo(
+                        f'{count: <8} {pid_type} created {rec.pid}:{rec.id}')
+            else:
+                click.secho(
+                    f'{count: <8} {pid_type} create error '
+                    f'{rec.get("pid", "???")}: {error}',
+                    fg='red'
+                )
+                if save_errors:
+                    error_file.write(rec)
+                if not dont_stop_on_error:
+                    sys.exit(1)
+            if count % commit == 0:
+                if verbose:
+                    click.echo(f'DB commit: {count}')
+                db.session.commit()
+        # all the records are consumed by the bulk creation
+        records = []
+
+    for count, record in enumerate(map(prepare, records), 1):
         try:
             pid = record.get('pid')
             msg = 'created'
@@ -220,35 +256,34 @@ def create(infile, create_or_update, append, reindex, dbcommit, commit,
 
 
 @fixtures.command('count')
-@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False)
+@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False,
+              help='deprecated, the file is always read lazily')
 @click.argument('infile', type=click.File('r'), default=sys.stdin)
 def count_cli(infile, lazy):
     """Count records in file.
 
     :param infile: Json file
-    :param lazy: lazy reads file
+    :param lazy: deprecated, the file is always read lazily
     :return: count of records
     """
     click.secho(
         f'Count records from {infile.name}.',
         fg='green'
     )
-    if lazy:
-        # try to lazy read json file (slower, better memory management)
-        records = read_json_record(infile)
-    else:
-        # load everything in memory (faster, bad memory management)
-        records = json.load(infile)
+    start_time = datetime.now()
     count = 0
-    for record in records:
+    for record in read_json_record(infile):
         count += 1
+    duration = (datetime.now() - start_time).total_seconds()
     click.echo(f'Count: {count}')
+    if duration:
+        click.echo(f'Throughput: {count / duration:.0f} records/s')
 
 
 @fixtures.command('get_all_mef_records')
 @click.argument('infile', type=click.File('r'), default=sys.stdin)
 @click.option('-l', '--lazy', 'lazy', is_flag=True, default=False,
-              help="lazy reads file")
+              help='deprecated, the file is always read lazily')
 @click.option('-k', '--enqueue', 'enqueue', is_flag=True, default=False,
               help="Enqueue record creation.")
 @click.option('-v', '--verbose', 'verbose', is_flag=True, default=False,
@@ -295,12 +330,7 @@ def get_all_mef_records(infile, lazy, verbose, enqueue, wait, outfile_name):
         outfile = JsonWriter(outfile_name)
         contribution_schema = get_schema_for_resource('cont')
         click.secho(f'Write to: {outfile_name}.')
-    if lazy:
-        # try to lazy read json file (slower, better memory management)
-        records = read_json_record(infile)
-    else:
-        # load everything in memory (faster, bad memory management)
-        records = json.load(infile)
+    records = read_json_record(infile)
     count = 0
     refs = {}
     for count, record in enumerate(records, 1):
@@ -320,7 +350,8 @@ def get_all_mef_records(infile, lazy, verbose, enqueue, wait, outfile_name):
 @click.argument('record_type')
 @click.argument('json_file')
 @click.argument('output_directory')
-@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False)
+@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False,
+              help='deprecated, the file is always read lazily')
 @click.option('-v', '--verbose', 'verbose', is_flag=True, default=False)
 @click.option('-p', '--create_pid', 'create_pid', is_flag=True, default=False)
 @with_appcontext
@@ -344,12 +375,7 @@ def create_csv(record_type, json_file, output_directory, lazy, verbose,
     count = 0
     errors_count = 0
     with open(json_file) as infile:
-        if lazy:
-            # try to lazy read json file (slower, better memory management)
-            records = read_json_record(infile)
-        else:
-            # load everything in memory (faster, bad memory management)
-            records = json.load(infile)
+        records = read_json_record(infile)
 
         file_name_pidstore = os.path.join(
             output_directory, f'{record_type}_pidstore.csv')
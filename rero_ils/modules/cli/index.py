@@ -36,9 +36,10 @@ from invenio_search.proxies import current_search, current_search_client
 from jsonpatch import make_patch
 from kombu import Queue
 
+from .reindex import BlueGreenReindex, PartitionedReindex
 from .utils import get_record_class_from_schema_or_pid_type
 from ..api import IlsRecordsIndexer
-from ..monitoring.api import Monitoring
+from ..monitoring.consistency import ConsistencyChecker
 from ..tasks import process_bulk_queue
 
 
@@ -81,9 +82,13 @@ def index():
 @click.option('--version-type', help='Elasticsearch version type to use.')
 @click.option('--raise-on-error/--skip-errors', default=True,
               help='Controls if ES bulk indexing errors raise an exception.')
+@click.option('--batch-size', '-b', type=int, default=None,
+              help='Number of messages consumed at once (1: no batch).')
+@click.option('--parallel', '-p', type=int, default=None,
+              help='Number of concurrent bulk requests.')
 @with_appcontext
 def run(delayed, concurrency, with_stats, version_type=None, queue=None,
-        raise_on_error=True):
+        raise_on_error=True, batch_size=None, parallel=None):
     """Run bulk record indexing."""
     if delayed:
         click.secho(
@@ -96,7 +101,9 @@ def run(delayed, concurrency, with_stats, version_type=None, queue=None,
                 'version_type': version_type,
                 'queue': queue,
                 'es_bulk_kwargs': {'raise_on_error': raise_on_error},
-                'stats_only': not with_stats
+                'stats_only': not with_stats,
+                'batch_size': batch_size,
+                'parallel': parallel
             }
         }
         for _ in range(0, concurrency):
@@ -119,7 +126,9 @@ def run(delayed, concurrency, with_stats, version_type=None, queue=None,
         )
         name, count = indexer.process_bulk_queue(
                 es_bulk_kwargs={'raise_on_error': raise_on_error},
-                stats_only=(not with_stats)
+                stats_only=(not with_stats),
+                batch_size=batch_size,
+                parallel=parallel
             )
         click.secho(
             f'"{name}" indexed: {count[0]} error: {count[1]}', fg='yellow')
@@ -135,8 +144,17 @@ def run(delayed, concurrency, with_stats, version_type=None, queue=None,
 @click.option('-d', '--direct', 'direct', is_flag=True, default=False)
 @click.option('-i', '--index', 'index')
 @click.option('-q', '--queue', 'queue', default=None)
+@click.option('-p', '--partitions', 'partitions', type=int, default=None,
+              help='Index directly by UUID range partitions.')
+@click.option('--processes', 'processes', type=int, default=None,
+              help='Number of processes indexing the partitions.')
+@click.option('-b', '--batch-size', 'batch_size', type=int, default=500,
+              help='Number of records indexed at once by partition.')
+@click.option('-c', '--checkpoint', 'checkpoint', type=click.Path(),
+              default=None, help='Checkpoint file used to resume indexing.')
 @with_appcontext
-def reindex(pid_types, from_date, until_date, direct, index, queue):
+def reindex(pid_types, from_date, until_date, direct, index, queue,
+            partitions, processes, batch_size, checkpoint):
     """Reindex records.
 
     :param pid_type: Pid type.
@@ -145,10 +163,37 @@ def reindex(pid_types, from_date, until_date, direct, index, queue):
     :param direct: Use record class for indexing.
     :param index: Index name to index.
     :param queue: Queue name to use.
+    :param partitions: Number of partitions to index in parallel.
+    :param processes: Number of processes indexing the partitions.
+    :param batch_size: Number of records indexed at once by partition.
+    :param checkpoint: Checkpoint file used to resume indexing.
     """
     endpoints = current_app.config.get('RECORDS_REST_ENDPOINTS')
     if not pid_types:
         pid_types = [endpoint for endpoint in endpoints]
+    if partitions:
+        for pid_type in pid_types:
+            if pid_type not in endpoints:
+                click.secho(
+                    f'ERROR type does not exist: {pid_type}', fg='red')
+                continue
+            click.secho(
+                f'Indexing {pid_type} by {partitions} partitions:',
+                fg='green')
+            count, errors = PartitionedReindex(
+                pid_type,
+                partitions=partitions,
+                processes=processes,
+                batch_size=batch_size,
+                checkpoint=checkpoint,
+                from_date=from_date,
+                until_date=until_date,
+                index=index
+            ).run()
+            click.secho(
+                f'"{pid_type}" indexed: {count} error: {errors}',
+                fg='yellow')
+        return
     for pid_type in pid_types:
         if pid_type in endpoints:
             msg = f'Sending {pid_type} to indexing queue '
@@ -214,12 +259,16 @@ def reindex(pid_types, from_date, until_date, direct, index, queue):
 
 @index.command('reindex_missing')
 @click.option('-t', '--pid-types', multiple=True, required=True)
+@click.option('-i', '--incremental', 'incremental', is_flag=True,
+              default=False,
+              help='Only check records updated since the last check.')
 @click.option('-v', '--verbose', 'verbose', is_flag=True, default=False)
 @with_appcontext
-def reindex_missing(pid_types, verbose):
-    """Index all missing records.
+def reindex_missing(pid_types, incremental, verbose):
+    """Index all missing or outdated records.
 
     :param pid_type: Pid type.
+    :param incremental: Only check records updated since the last check.
     """
     for p_type in pid_types:
         click.secho(
@@ -236,14 +285,14 @@ def reindex_missing(pid_types, verbose):
                 fg='red',
             )
             continue
-        monitoring = Monitoring(time_delta=0)
-        pids_es, pids_db, pids_es_double, index = \
-            monitoring.get_es_db_missing_pids(p_type)
+        checker = ConsistencyChecker(p_type, time_delta=0)
+        result = checker.check(incremental=incremental)
+        pids = result['missing_in_es'] + result['outdated']
         click.secho(
-            f'{len(pids_db)}',
+            f'{len(pids)}',
             fg='green',
         )
-        for idx, pid in enumerate(pids_db, 1):
+        for idx, pid in enumerate(pids, 1):
             record = record_class.get_record_by_pid(pid)
             if record:
                 record.reindex()
@@ -252,6 +301,9 @@ def reindex_missing(pid_types, verbose):
             else:
                 if verbose:
                     click.secho(f'NOT FOUND: {idx}\t{p_type}\t{pid}', fg='red')
+        # the differences are repaired: the next incremental check starts
+        # from this check
+        checker.commit_checkpoint()
 
 
 @index.command()
@@ -333,6 +385,55 @@ def create_index(resource, index, verbose, templates):
     click.secho(f'Index {index} has been created.', fg='green')
 
 
+@index.command('rebuild')
+@click.option('--yes-i-know', is_flag=True, callback=abort_if_false,
+              expose_value=False,
+              prompt='Do you really want to rebuild the index?')
+@click.option('-n', '--index-name', 'index_name', default=None,
+              help='New index name (reuse it to resume a rebuild).')
+@click.option('-p', '--partitions', 'partitions', type=int, default=1,
+              help='Number of partitions of the bulk load.')
+@click.option('--processes', 'processes', type=int, default=1,
+              help='Number of processes of the bulk load.')
+@click.option('-b', '--batch-size', 'batch_size', type=int, default=500,
+              help='Number of records indexed at once.')
+@click.option('-c', '--checkpoint', 'checkpoint', type=click.Path(),
+              default=None, help='Checkpoint file used to resume a rebuild.')
+@click.option('-d', '--delete-old', 'delete_old', is_flag=True,
+              default=False, help='Delete the old index after the switch.')
+@click.argument('alias')
+@with_appcontext
+@es_version_check
+def rebuild(alias, index_name, partitions, processes, batch_size, checkpoint,
+            delete_old):
+    """Rebuild an index and switch its alias without search downtime.
+
+    :param alias: the alias to rebuild such as documents.
+    :param index_name: the new index name.
+    :param partitions: number of partitions of the bulk load.
+    :param processes: number of processes of the bulk load.
+    :param batch_size: number of records indexed at once.
+    :param checkpoint: checkpoint file used to resume a rebuild.
+    :param delete_old: delete the old index after the switch.
+    """
+    if alias not in current_search.aliases:
+        click.secho(f'ERROR alias does not exist: {alias}', fg='red')
+        return
+    rebuilder = BlueGreenReindex(
+        alias,
+        index=index_name,
+        partitions=partitions,
+        processes=processes,
+        batch_size=batch_size,
+        checkpoint=checkpoint
+    )
+    click.secho(f'Rebuilding {alias} into {rebuilder.index}', fg='green')
+    old_indices = rebuilder.run(delete_old=delete_old)
+    click.secho(
+        f'Sucessfully rebuilt: {", ".join(old_indices)} -> {rebuilder.index}',
+        fg='green')
+
+
 @index.command('update_mapping')
 @click.option('--aliases', '-a', multiple=True, help='all if not specified')
 @click.option(
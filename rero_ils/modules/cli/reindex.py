@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Partitioned and resumable reindexing."""
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from queue import Empty
+from time import time
+from uuid import UUID
+
+import click
+import dateparser
+from elasticsearch.helpers import bulk
+from flask import current_app
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_search.proxies import current_search, current_search_client
+
+from ..utils import get_record_class_from_schema_or_pid_type
+
+
+def partition_bounds(partitions):
+    """Split the UUID space into ranges of the same size.
+
+    Records UUIDs are random: each range contains about the same number of
+    records.
+
+    :param partitions: the number of partitions.
+    :return: a list of (lower, upper) UUID strings, `None` for no bound.
+    """
+    step = 2 ** 128 // partitions
+    bounds = [str(UUID(int=idx * step)) for idx in range(1, partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def partition_query(pid_type, lower=None, upper=None, from_date=None,
+                    until_date=None):
+    """Query the record UUIDs of a partition.
+
+    :param pid_type: the records pid type.
+    :param lower: the UUID lower bound (included).
+    :param upper: the UUID upper bound (excluded).
+    :param from_date: only records updated after this date.
+    :param until_date: only records updated until this date.
+    :return: a query of record UUIDs ordered by UUID.
+    """
+    query = PersistentIdentifier.query\
+        .filter_by(object_type='rec', status=PIDStatus.REGISTERED)\
+        .filter_by(pid_type=pid_type)\
+        .with_entities(PersistentIdentifier.object_uuid)\
+        .order_by(PersistentIdentifier.object_uuid)
+    if lower:
+        query = query.filter(PersistentIdentifier.object_uuid >= lower)
+    if upper:
+        query = query.filter(PersistentIdentifier.object_uuid < upper)
+    if from_date or until_date:
+        record_cls = get_record_class_from_schema_or_pid_type(
+            pid_type=pid_type)
+        model_cls = record_cls.model_cls
+        query = query.join(
+            model_cls, model_cls.id == PersistentIdentifier.object_uuid)
+        if from_date:
+            query = query.filter(
+                model_cls.updated > dateparser.parse(from_date))
+        if until_date:
+            query = query.filter(
+                model_cls.updated <= dateparser.parse(until_date))
+    return query
+
+
+def reindex_partition(task, report, batch_size=500):
+    """Reindex the records of a partition.
+
+    The records are loaded and indexed by batches; after each batch the
+    progress is reported with the last indexed UUID (used to resume).
+
+    :param task: the partition task (pid type, partition index, bounds,
+                 dates, target index and last indexed UUID).
+    :param report: function called with the partition index, the last
+                   indexed UUID, the number of indexed records and the number
+                   of errors after each batch.
+    :param batch_size: the number of records indexed at once.
+    """
+    record_cls = get_record_class_from_schema_or_pid_type(
+        pid_type=task['pid_type'])
+    indexer = record_cls.get_indexer_class()()
+    query = partition_query(
+        task['pid_type'], task['lower'], task['upper'],
+        task['from_date'], task['until_date'])
+    last = task['last']
+    while True:
+        page_query = query
+        if last:
+            page_query = query.filter(PersistentIdentifier.object_uuid > last)
+        ids = [str(id_) for id_, in page_query.limit(batch_size)]
+        if not ids:
+            break
+        records = record_cls.get_records(ids)
+        success, errors = indexer.bulk_index_records(
+            records, index=task.get('index'), raise_on_error=False)
+        last = ids[-1]
+        report(task['partition'], last, success, errors)
+        if len(ids) < batch_size:
+            break
+
+
+def _reindex_partition_worker(task, progress, batch_size):
+    """Reindex a partition into a separate process.
+
+    The process has its own application, database session and Elasticsearch
+    client.
+
+    :param task: the partition task.
+    :param progress: the queue to send the progress reports to.
+    :param batch_size: the number of records indexed at once.
+    """
+    from invenio_app.factory import create_api
+
+    def report(partition, last, success, errors):
+        progress.put((partition, last, success, errors))
+
+    app = create_api()
+    with app.app_context():
+        reindex_partition(task, report, batch_size=batch_size)
+
+
+class PartitionedReindex:
+    """Reindex a resource by partitions with a process pool.
+
+    The resource records are split into UUID ranges. Each partition is
+    indexed by batches into its own process. The progress of every partition
+    is saved into a checkpoint file: an interrupted reindex can be resumed
+    from the last indexed batch of each partition.
+    """
+
+    def __init__(self, pid_type, partitions=8, processes=None,
+                 batch_size=500, checkpoint=None, from_date=None,
+                 until_date=None, index=None):
+        """Constructor.
+
+        :param pid_type: the records pid type.
+        :param partitions: the number of partitions.
+        :param processes: the number of processes (default: partitions).
+        :param batch_size: the number of records indexed at once.
+        :param checkpoint: the checkpoint file path.
+        :param from_date: only records updated after this date.
+        :param until_date: only records updated until this date.
+        :param index: the index name (default: the records index).
+        """
+        self.pid_type = pid_type
+        self.partitions = partitions
+        self.processes = processes or partitions
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.from_date = from_date
+        self.until_date = until_date
+        self.index = index
+        self.state = self.load_checkpoint()
+        self.started = {}
+
+    @property
+    def settings(self):
+        """Settings identifying a reindex in the checkpoint file."""
+        return {
+            'partitions': self.partitions,
+            'from_date': self.from_date,
+            'until_date': self.until_date,
+            'index': self.index
+        }
+
+    def _read_checkpoint_file(self):
+        """Read the checkpoint file."""
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint_file:
+                return json.load(checkpoint_file)
+        return {}
+
+    def load_checkpoint(self):
+        """Load the partitions state from the checkpoint file.
+
+        :return: the state of each partition.
+        """
+        data = self._read_checkpoint_file().get(self.pid_type, {})
+        if data.get('settings') == self.settings:
+            return {
+                int(partition): state
+                for partition, state in data['state'].items()
+            }
+        state = {}
+        for partition, (lower, upper) in enumerate(
+                partition_bounds(self.partitions)):
+            state[partition] = {
+                'lower': lower,
+                'upper': upper,
+                'last': None,
+                'count': 0,
+                'errors': 0,
+                'total': partition_query(
+                    self.pid_type, lower, upper,
+                    self.from_date, self.until_date).count(),
+                'done': False
+            }
+        return state
+
+    def save_checkpoint(self):
+        """Save the partitions state into the checkpoint file."""
+        if not self.checkpoint:
+            return
+        data = self._read_checkpoint_file()
+        data[self.pid_type] = {'settings': self.settings, 'state': self.state}
+        tmp_file_name = f'{self.checkpoint}.tmp'
+        with open(tmp_file_name, 'w') as checkpoint_file:
+            json.dump(data, checkpoint_file, indent=2)
+        os.replace(tmp_file_name, self.checkpoint)
+
+    def tasks(self):
+        """Get the tasks of the partitions not yet indexed."""
+        return [
+            {
+                'pid_type': self.pid_type,
+                'partition': partition,
+                'lower': state['lower'],
+                'upper': state['upper'],
+                'last': state['last'],
+                'from_date': self.from_date,
+                'until_date': self.until_date,
+                'index': self.index
+            }
+            for partition, state in self.state.items()
+            if not state['done']
+        ]
+
+    def report(self, partition, last, success, errors):
+        """Record and display the progress of a partition.
+
+        :param partition: the partition index.
+        :param last: the last indexed UUID.
+        :param success: the number of records indexed by the batch.
+        :param errors: the number of errors of the batch.
+        """
+        state = self.state[partition]
+        state['last'] = last
+        state['count'] += success
+        state['errors'] += errors
+        started, start_count = self.started.setdefault(
+            partition, (time(), state['count'] - success))
+        self.save_checkpoint()
+        elapsed = time() - started
+        rate = (state['count'] - start_count) / elapsed if elapsed else 0
+        remaining = max(state['total'] - state['count'], 0)
+        eta = timedelta(seconds=int(remaining / rate)) if rate else '-'
+        click.echo(
+            f'{self.pid_type}\t#{partition}\t'
+            f'{state["count"]}/{state["total"]}\t'
+            f'errors: {state["errors"]}\t{rate:.1f} rec/s\tETA: {eta}'
+        )
+
+    def finish(self, partition):
+        """Mark a partition as indexed.
+
+        :param partition: the partition index.
+        """
+        self.state[partition]['done'] = True
+        self.save_checkpoint()
+
+    def run(self):
+        """Reindex all the partitions not yet indexed.
+
+        :return: the number of indexed records and the number of errors.
+        """
+        tasks = self.tasks()
+        if self.processes == 1:
+            for task in tasks:
+                reindex_partition(task, self.report, self.batch_size)
+                self.finish(task['partition'])
+        elif tasks:
+            self._run_pool(tasks)
+        return (
+            sum(state['count'] for state in self.state.values()),
+            sum(state['errors'] for state in self.state.values())
+        )
+
+    def _run_pool(self, tasks):
+        """Reindex the partitions with a process pool.
+
+        :param tasks: the partition tasks.
+        """
+        ctx = multiprocessing.get_context('spawn')
+        progress = ctx.Manager().Queue()
+        with ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=ctx) as executor:
+            futures = {
+                executor.submit(
+                    _reindex_partition_worker, task, progress,
+                    self.batch_size
+                ): task['partition']
+                for task in tasks
+            }
+            while futures:
+                try:
+                    self.report(*progress.get(timeout=1))
+                    continue
+                except Empty:
+                    pass
+                for future in [f for f in futures if f.done()]:
+                    partition = futures.pop(future)
+                    # reports sent before the end of the process
+                    while not progress.empty():
+                        self.report(*progress.get())
+                    try:
+                        future.result()
+                        self.finish(partition)
+                    except Exception as err:
+                        # the partition will be resumed by the next run
+                        click.secho(
+                            f'{self.pid_type}\t#{partition}\tERROR: {err}',
+                            fg='red')
+
+
+class BlueGreenReindex:
+    """Rebuild an index without search downtime.
+
+    A fresh versioned index is created with the current mapping and bulk
+    loaded from the database with index optimisations (no refresh, no
+    replica). The records changed during the load are replayed using their
+    update date, the index settings are restored and the alias is then
+    atomically moved from the old index to the new one. A last replay
+    indexes the changes made just before the swap.
+    """
+
+    # safety margin for the transactions running when a replay starts
+    margin = timedelta(minutes=1)
+
+    def __init__(self, alias, index=None, partitions=1, processes=1,
+                 batch_size=500, checkpoint=None):
+        """Constructor.
+
+        :param alias: the alias to rebuild such as documents.
+        :param index: the new index name (default: the mapping index name
+                      suffixed by the current date).
+        :param partitions: the number of partitions of the bulk load.
+        :param processes: the number of processes of the bulk load.
+        :param batch_size: the number of records indexed at once.
+        :param checkpoint: the checkpoint file path.
+        """
+        self.alias = alias
+        endpoints = current_app.config.get('RECORDS_REST_ENDPOINTS')
+        self.pid_types = [
+            pid_type for pid_type, endpoint in endpoints.items()
+            if endpoint.get('search_index') == alias
+        ]
+        index_name, self.mapping_file = next(
+            iter(current_search.aliases[alias].items()))
+        now = datetime.utcnow()
+        self.index = index or f'{index_name}-{now:%Y%m%d%H%M%S}'
+        self.partitions = partitions
+        self.processes = processes
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+
+    def get_alias_indices(self):
+        """Get the indices behind the alias and their aliases.
+
+        :return: a dictionary of aliases names by index name.
+        """
+        client = current_search_client
+        if not client.indices.exists_alias(name=self.alias):
+            return {}
+        return {
+            index: list(data.get('aliases', {}).keys())
+            for index, data in client.indices.get_alias(
+                name=self.alias).items()
+            if index != self.index
+        }
+
+    def get_live_settings(self, old_indices):
+        """Get the settings to restore after the bulk load.
+
+        :param old_indices: the indices behind the alias.
+        :return: the replicas and refresh interval settings.
+        """
+        settings = {'number_of_replicas': None, 'refresh_interval': None}
+        for index in old_indices:
+            data = current_search_client.indices.get_settings(index=index)
+            index_settings = data[index]['settings']['index']
+            for key in settings:
+                settings[key] = index_settings.get(key, settings[key])
+        return settings
+
+    def create_index(self):
+        """Create the new index with the load settings."""
+        with open(self.mapping_file) as mapping_file:
+            body = json.load(mapping_file)
+        settings = body.setdefault('settings', {})
+        settings['index'] = dict(
+            settings.get('index', {}),
+            number_of_replicas=0,
+            refresh_interval='-1'
+        )
+        current_search_client.indices.create(index=self.index, body=body)
+
+    def _read_state(self):
+        """Read the rebuild state from the checkpoint file."""
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint_file:
+                return json.load(checkpoint_file).get(
+                    f'{self.alias}::{self.index}', {})
+        return {}
+
+    def _write_state(self, **state):
+        """Write the rebuild state into the checkpoint file."""
+        if not self.checkpoint:
+            return
+        data = {}
+        if os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as checkpoint_file:
+                data = json.load(checkpoint_file)
+        data[f'{self.alias}::{self.index}'] = state
+        tmp_file_name = f'{self.checkpoint}.tmp'
+        with open(tmp_file_name, 'w') as checkpoint_file:
+            json.dump(data, checkpoint_file, indent=2)
+        os.replace(tmp_file_name, self.checkpoint)
+
+    def replay(self, since):
+        """Index into the new index the records changed since a date.
+
+        :param since: the update date lower bound.
+        :return: the start date of this replay and the number of records.
+        """
+        started = datetime.utcnow() - self.margin
+        count = 0
+        for pid_type in self.pid_types:
+            record_cls = get_record_class_from_schema_or_pid_type(
+                pid_type=pid_type)
+            indexer = record_cls.get_indexer_class()()
+            model_cls = record_cls.model_cls
+            rows = db.session\
+                .query(model_cls.id, PersistentIdentifier.status)\
+                .join(
+                    PersistentIdentifier,
+                    PersistentIdentifier.object_uuid == model_cls.id
+                )\
+                .filter(PersistentIdentifier.pid_type == pid_type)\
+                .filter(model_cls.updated >= since)\
+                .all()
+            ids = [
+                str(id_) for id_, status in rows
+                if status == PIDStatus.REGISTERED
+            ]
+            for idx in range(0, len(ids), self.batch_size):
+                records = record_cls.get_records(
+                    ids[idx:idx + self.batch_size])
+                indexer.bulk_index_records(
+                    records, index=self.index, raise_on_error=False)
+            deleted_ids = [
+                str(id_) for id_, status in rows
+                if status != PIDStatus.REGISTERED
+            ]
+            bulk(
+                current_search_client,
+                (
+                    {'_op_type': 'delete', '_index': self.index, '_id': id_}
+                    for id_ in deleted_ids
+                ),
+                raise_on_error=False
+            )
+            count += len(rows)
+        return started, count
+
+    def restore_settings(self, settings):
+        """Restore the search settings of the new index.
+
+        :param settings: the replicas and refresh interval settings.
+        """
+        client = current_search_client
+        client.indices.put_settings(index=self.index, body={'index': settings})
+        client.indices.refresh(index=self.index)
+        # all the primary shards have to be ready to serve the searches
+        health = client.cluster.health(
+            index=self.index, wait_for_status='yellow', timeout='10m')
+        if health.get('timed_out'):
+            raise click.ClickException(
+                f'Index {self.index} is not ready: the alias is not switched.'
+                f' Use "index switch_index" once the index is ready.')
+
+    def swap(self, old_indices):
+        """Move atomically the aliases from the old indices to the new one.
+
+        :param old_indices: the indices behind the alias.
+        """
+        aliases = {self.alias}
+        actions = []
+        for index, index_aliases in old_indices.items():
+            for alias in index_aliases:
+                aliases.add(alias)
+                actions.append({'remove': {'index': index, 'alias': alias}})
+        actions.extend(
+            {'add': {'index': self.index, 'alias': alias}}
+            for alias in sorted(aliases)
+        )
+        current_search_client.indices.update_aliases(
+            body={'actions': actions})
+
+    def run(self, delete_old=False):
+        """Rebuild the index and switch the alias.
+
+        :param delete_old: delete the old indices after the switch.
+        :return: the old indices names.
+        """
+        old_indices = self.get_alias_indices()
+        state = self._read_state()
+        if not current_search_client.indices.exists(index=self.index):
+            self.create_index()
+            state = {}
+        since = state.get('started')
+        if since:
+            since = datetime.fromisoformat(since)
+        else:
+            since = datetime.utcnow() - self.margin
+            self._write_state(started=since.isoformat())
+        click.secho(f'Bulk loading {self.index}', fg='green')
+        for pid_type in self.pid_types:
+            PartitionedReindex(
+                pid_type,
+                partitions=self.partitions,
+                processes=self.processes,
+                batch_size=self.batch_size,
+                checkpoint=self.checkpoint,
+                index=self.index
+            ).run()
+        # replay the changes made during the bulk load
+        since, count = self.replay(since)
+        click.secho(f'Replayed changes: {count}', fg='green')
+        self.restore_settings(self.get_live_settings(old_indices))
+        since, count = self.replay(since)
+        click.secho(f'Replayed changes: {count}', fg='green')
+        self.swap(old_indices)
+        click.secho(
+            f'Alias {self.alias} switched to {self.index}', fg='green')
+        # changes written to the old index just before the switch
+        since, count = self.replay(since)
+        click.secho(f'Replayed changes: {count}', fg='green')
+        if delete_old:
+            for index in old_indices:
+                current_search_client.indices.delete(index=index)
+                click.secho(f'Index {index} deleted', fg='yellow')
+        return list(old_indices)
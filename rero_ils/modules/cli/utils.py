@@ -29,7 +29,7 @@ import os
 import re
 import sys
 import traceback
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from datetime import datetime
 from glob import glob
 from pprint import pprint
@@ -56,6 +56,8 @@ from lxml import etree
 from werkzeug.local import LocalProxy
 from werkzeug.security import gen_salt
 
+from rero_ils.dojson.utils import mef_contributions_batch
+from rero_ils.modules.contributions.mef import MefCache, get_mef_setting
 from rero_ils.modules.locations.api import Location
 
 from ..documents.api import Document, DocumentsIndexer, DocumentsSearch
@@ -73,6 +75,7 @@ from ..tasks import process_bulk_queue
 from ..utils import JsonWriter, extracted_data_from_ref, \
     get_record_class_from_schema_or_pid_type, get_schema_for_resource, \
     read_json_record, read_xml_record
+from ..validation import get_validation_stats, validate_many
 
 _datastore = LocalProxy(lambda: current_app.extensions['security'].datastore)
 _records_state = LocalProxy(lambda: current_app.extensions['invenio-records'])
@@ -225,15 +228,29 @@ def schedules():
         click.echo(value)
 
 
+def echo_validation_stats():
+    """Print the validation timings by schema."""
+    for schema, stats in get_validation_stats(reset=True).items():
+        count = stats['count']
+        per_record = stats['time'] / count * 1000 if count else 0
+        click.echo(
+            f'{schema}: {count} records {stats["errors"]} errors '
+            f'{stats["time"]:.2f}s ({per_record:.2f}ms/record)'
+        )
+
+
 @utils.command('validate_documents_with_items')
 @click.argument('infile', type=click.File('r'), default=sys.stdin)
+@click.option('-p', '--processes', 'processes', default=1, type=int,
+              help='number of validation processes.')
 @click.option('-v', '--verbose', 'verbose', is_flag=True, default=False)
 @click.option('-d', '--debug', 'debug', is_flag=True, default=False)
 @with_appcontext
-def validate_documents_with_items(infile, verbose, debug):
+def validate_documents_with_items(infile, processes, verbose, debug):
     """Validate REROILS records with items.
 
     :param infile: Json file
+    :param processes: number of validation processes
     :param verbose: verbose print
     :param debug: print traceback
     """
@@ -249,55 +266,50 @@ def validate_documents_with_items(infile, verbose, debug):
             'document']['$ref'].replace('{document_pid}', '1')
         return item
 
+    def get_records():
+        """Get the documents followed by their items to validate."""
+        for count, record in enumerate(read_json_record(infile), 1):
+            items = record.pop('items', [])
+            record['$schema'] = doc_schema
+            labels.append((count, record.get('pid'), None))
+            yield record
+            for idx, item in enumerate(items, 1):
+                item['$schema'] = item_schema
+                labels.append((count, record.get('pid'), idx))
+                yield add_org_lib_doc(item)
+
     click.secho(
         f'Validate documents and items from {infile.name}.',
         fg='green'
     )
-    schema_path = current_jsonschemas.url_to_path(
-        get_schema_for_resource('doc'))
-    schema = current_jsonschemas.get_schema(path=schema_path)
-    doc_schema = _records_state.replace_refs(schema)
-    schema_path = current_jsonschemas.url_to_path(
-        get_schema_for_resource('item'))
-    schema = current_jsonschemas.get_schema(path=schema_path)
-    item_schema = _records_state.replace_refs(schema)
-    doc_pid = next(
-        DocumentsSearch().filter('match_all').source('pid').scan()).pid
+    doc_schema = get_schema_for_resource('doc')
+    item_schema = get_schema_for_resource('item')
 
     document_errors = 0
     item_errors = 0
-    for count, record in enumerate(read_json_record(infile), 1):
-        pid = record.get('pid')
-        items = record.pop('items', [])
+    labels = deque()
+    for record, error in validate_many(get_records(), processes=processes):
+        count, pid, idx = labels.popleft()
         if verbose:
-            click.echo(f'{count: <8} document validate {pid}')
-        try:
-            validate(record, doc_schema)
-        except ValidationError as err:
-            document_errors += 1
-            if debug:
-                trace = traceback.format_exc(1)
+            if idx is None:
+                click.echo(f'{count: <8} document validate {pid}')
             else:
-                trace = "\n".join(traceback.format_exc(1).split('\n')[:6])
+                click.echo(f'{"": <12} item validate {idx}')
+        if not error:
+            continue
+        trace = str(error) if debug else error.message
+        if idx is None:
+            document_errors += 1
             click.secho(
                 f'Error validate in document: {count} {pid} {trace}',
                 fg='red'
             )
-        for idx, item in enumerate(items, 1):
-            if verbose:
-                click.echo(f'{"": <12} item validate {idx}')
-            try:
-                validate(add_org_lib_doc(item), item_schema)
-            except ValidationError:
-                item_errors += 1
-                if debug:
-                    trace = traceback.format_exc(1)
-                else:
-                    trace = "\n".join(traceback.format_exc(1).split('\n')[:6])
-                click.secho(
-                    f'Error validate in item: {count} {pid} {idx} {trace}',
-                    fg='red'
-                )
+        else:
+            item_errors += 1
+            click.secho(
+                f'Error validate in item: {count} {pid} {idx} {trace}',
+                fg='red'
+            )
     color = 'green'
     if document_errors or item_errors:
         color = 'red'
@@ -305,11 +317,13 @@ def validate_documents_with_items(infile, verbose, debug):
         f'document errors: {document_errors} item errors: {item_errors}',
         fg=color
     )
+    echo_validation_stats()
 
 
 @utils.command('create_documents_with_items')
 @click.argument('infile', type=click.File('r'), default=sys.stdin)
-@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False)
+@click.option('-l', '--lazy', 'lazy', is_flag=True, default=False,
+              help='deprecated, the file is always read lazily')
 @click.option('-o', '--dont-stop', 'dont_stop_on_error',
               is_flag=True, default=False)
 @click.option('-e', '--save_errors', 'save_errors', type=click.File('w'))
@@ -322,7 +336,7 @@ def create_documents_with_items(infile, lazy, dont_stop_on_error, save_errors,
     """Load REROILS record with items.
 
     :param infile: Json file
-    :param lazy: lazy read file
+    :param lazy: deprecated, the file is always read lazily
     :param dont_stop_on_error: don't stop on error
     :param save_errors: save error records to file
     :param commit: commit to database every count records
@@ -340,12 +354,7 @@ def create_documents_with_items(infile, lazy, dont_stop_on_error, save_errors,
         err_file_name = f'{name}_errors{ext}'
         error_file = JsonWriter(err_file_name)
 
-    if lazy:
-        # try to lazy read json file (slower, better memory management)
-        records = read_json_record(infile)
-    else:
-        # load everything in memory (faster, bad memory management)
-        records = json.load(infile)
+    records = read_json_record(infile)
 
     saved_items = []
     document_ids = []
@@ -631,55 +640,52 @@ def check_license(configfile, verbose, progress):
               help='error file')
 @click.option('-o', '--ok_file', 'ok_file_name', default=None,
               help='ok file')
+@click.option('-p', '--processes', 'processes', default=1, type=int,
+              help='number of validation processes.')
 @with_appcontext
 def check_validate(jsonfile, type, verbose, debug, error_file_name,
-                   ok_file_name):
+                   ok_file_name, processes):
     """Check record validation."""
     click.secho(
         f'Testing json schema for file: {jsonfile.name} type: {type}',
         fg='green'
     )
 
-    schema_path = current_jsonschemas.url_to_path(
-        get_schema_for_resource(type))
-    schema = current_jsonschemas.get_schema(path=schema_path)
-    schema = _records_state.replace_refs(schema)
-
-    datas = json.load(jsonfile)
+    def get_records():
+        """Get the records to validate."""
+        for data in read_json_record(jsonfile):
+            if not data.get('$schema'):
+                data['$schema'] = schema
+            if not data.get('pid'):
+                # create dummy pid in data
+                data['pid'] = 'dummy'
+            yield data
+
+    schema = get_schema_for_resource(type)
     count = 0
     if error_file_name:
         error_file = JsonWriter(error_file_name)
     if ok_file_name:
         ok_file = JsonWriter(ok_file_name)
-    for count, data in enumerate(datas, 1):
+    records = validate_many(get_records(), processes=processes)
+    for count, (data, error) in enumerate(records, 1):
         if verbose:
             click.echo(f'\tTest record: {count}')
-        if not data.get('$schema'):
-            scheme = current_app.config.get('JSONSCHEMAS_URL_SCHEME')
-            host = current_app.config.get('JSONSCHEMAS_HOST')
-            endpoint = current_app.config.get('JSONSCHEMAS_ENDPOINT')
-            url_schema = f'{scheme}://{host}{endpoint}{schema_path}'
-            data['$schema'] = url_schema
-        if not data.get('pid'):
-            # create dummy pid in data
-            data['pid'] = 'dummy'
-        try:
-            validate(data, schema)
+        if not error:
             if ok_file_name:
                 if data['pid'] == 'dummy':
                     del data['pid']
                 ok_file.write(data)
-        except ValidationError:
-            trace_lines = traceback.format_exc(1).split('\n')
-            trace = trace_lines[5].strip()
-            click.secho(
-                f'Error validate in record: {count} {trace}',
-                fg='red'
-            )
-            if error_file_name:
-                error_file.write(data)
-            if debug:
-                pprint(data)
+            continue
+        click.secho(
+            f'Error validate in record: {count} {error.message}',
+            fg='red'
+        )
+        if error_file_name:
+            error_file.write(data)
+        if debug:
+            pprint(data)
+    echo_validation_stats()
 
 
 def error_record(pid, record, notes):
@@ -728,70 +734,73 @@ def do_worker(marc21records, results, pid_required, debug, dojson,
             f'contrib.marc21tojson.{dojson}:marc21')
     else:
         dojson = marc21
-    for data in marc21records:
-        data_json = data['json']
-        pid = data_json.get('001', '???')
-        record = {}
-        try:
-            record = dojson.do(data_json)
-            if not record.get("$schema"):
-                # create dummy schema in data
-                record["$schema"] = 'dummy'
-            if not pid_required:
-                if not record.get("pid"):
-                    # create dummy pid in data
-                    record["pid"] = 'dummy'
-            if schema:
-                validate(record, schema)
-            if record["$schema"] == 'dummy':
-                del record["$schema"]
-            if not pid_required:
-                if record["pid"] == 'dummy':
-                    del record["pid"]
-            results.append({
-                'status': True,
-                'record': record
-            })
-        except ValidationError as err:
-            if debug:
-                pprint(record)
-            trace_lines = traceback.format_exc(1).split('\n')
-            trace = trace_lines[5].strip()
-            field_035 = data_json.get('035__', {})
-            if isinstance(field_035, tuple):
-                field_035 = field_035[0]
-            rero_pid = field_035.get('a', 'UNKNOWN'),
-            msg = f'ERROR:\t{pid}\t{rero_pid}\t{err.args[0]}\t-\t{trace}'
-            click.secho(msg, fg='red')
-            results.append({
-                'pid': pid,
-                'status': False,
-                'data': data['xml'],
-                'record': error_record(
-                    pid,
-                    record,
-                    [f'{err.args[0]}', f'{trace}']
-                )
-            })
-        except Exception as err:
-            field_035 = data_json.get('035__', {})
-            if isinstance(field_035, tuple):
-                field_035 = field_035[0]
-            rero_pid = field_035.get('a', 'UNKNOWN'),
-            msg = f'ERROR:\t{pid}\t{rero_pid}\t{err.args[0]}'
-            click.secho(msg, fg='red')
-            if debug:
-                traceback.print_exc()
-            results.append({
-                'pid': pid,
-                'status': False,
-                'data': data['xml'],
-                'record': error_record(
-                    pid,
-                    record,
-                    [f'{err.args[0]}']
-                )
-            })
+    # resolve the MEF contributions of the chunk at once
+    with mef_contributions_batch(
+            [data['json'] for data in marc21records]):
+        for data in marc21records:
+            data_json = data['json']
+            pid = data_json.get('001', '???')
+            record = {}
+            try:
+                record = dojson.do(data_json)
+                if not record.get("$schema"):
+                    # create dummy schema in data
+                    record["$schema"] = 'dummy'
+                if not pid_required:
+                    if not record.get("pid"):
+                        # create dummy pid in data
+                        record["pid"] = 'dummy'
+                if schema:
+                    validate(record, schema)
+                if record["$schema"] == 'dummy':
+                    del record["$schema"]
+                if not pid_required:
+                    if record["pid"] == 'dummy':
+                        del record["pid"]
+                results.append({
+                    'status': True,
+                    'record': record
+                })
+            except ValidationError as err:
+                if debug:
+                    pprint(record)
+                trace_lines = traceback.format_exc(1).split('\n')
+                trace = trace_lines[5].strip()
+                field_035 = data_json.get('035__', {})
+                if isinstance(field_035, tuple):
+                    field_035 = field_035[0]
+                rero_pid = field_035.get('a', 'UNKNOWN'),
+                msg = f'ERROR:\t{pid}\t{rero_pid}\t{err.args[0]}\t-\t{trace}'
+                click.secho(msg, fg='red')
+                results.append({
+                    'pid': pid,
+                    'status': False,
+                    'data': data['xml'],
+                    'record': error_record(
+                        pid,
+                        record,
+                        [f'{err.args[0]}', f'{trace}']
+                    )
+                })
+            except Exception as err:
+                field_035 = data_json.get('035__', {})
+                if isinstance(field_035, tuple):
+                    field_035 = field_035[0]
+                rero_pid = field_035.get('a', 'UNKNOWN'),
+                msg = f'ERROR:\t{pid}\t{rero_pid}\t{err.args[0]}'
+                click.secho(msg, fg='red')
+                if debug:
+                    traceback.print_exc()
+                results.append({
+                    'pid': pid,
+                    'status': False,
+                    'data': data['xml'],
+                    'record': error_record(
+                        pid,
+                        record,
+                        [f'{err.args[0]}']
+                    )
+                })
 
 
 class Marc21toJson():
@@ -1002,6 +1011,12 @@ def marc21json(xml_file, json_file_ok, xml_file_error, parallel, chunk,
     path = current_jsonschemas.url_to_path(get_schema_for_resource('doc'))
     schema = current_jsonschemas.get_schema(path=path)
     schema = _records_state.replace_refs(schema)
+    # the expired MEF responses are not removed by the cache reads
+    mef_cache = MefCache.from_url(get_mef_setting('RERO_ILS_MEF_CACHE_URL'))
+    if mef_cache:
+        purged = mef_cache.purge()
+        if verbose:
+            click.secho(f'Expired MEF responses removed: {purged}')
     transform = Marc21toJson(xml_file, json_file_ok, xml_file_error, parallel,
                              chunk, transformation, verbose, debug,
                              pid_required, schema, pid_mapping, error_records)
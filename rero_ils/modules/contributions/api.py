@@ -20,14 +20,12 @@
 
 from functools import partial
 
-import requests
 from elasticsearch_dsl import A
 from elasticsearch_dsl.query import Q
 from flask import current_app
 from invenio_db import db
-from requests import codes as requests_codes
-from requests.exceptions import RequestException
 
+from .mef import MefRequestError, get_mef_resolver
 from .models import ContributionIdentifier, ContributionMetadata, \
     ContributionUpdateAction
 from ..api import IlsRecord, IlsRecordsIndexer, IlsRecordsSearch
@@ -137,32 +135,37 @@ class Contribution(IlsRecord):
         return self._get_contribution_for_document()
 
     @classmethod
-    def _get_mef_data_by_type(cls, pid, pid_type, verbose=False):
-        """Request MEF REST API in JSON format."""
-        url = current_app.config.get('RERO_ILS_MEF_AGENTS_URL')
-        if pid_type == 'mef':
-            mef_url = f'{url}/mef/?q=pid:"{pid}"'
-        else:
-            if pid_type == 'viaf':
-                mef_url = f'{url}/mef/?q=viaf_pid:"{pid}"'
-            else:
-                mef_url = f'{url}/mef/?q={pid_type}.pid:"{pid}"'
-        request = requests.get(url=mef_url, params=dict(resolve=1, sources=1))
-        status = request.status_code
-        if request.status_code == requests_codes.ok:
-            try:
-                data = request.json().get('hits', {}).get('hits', [None])
-                return data[0]
-            except Exception as err:
-                msg = f'MEF resolver no metadata: {mef_url}'
-                if verbose:
-                    current_app.logger.warning(msg)
-                raise ValueError(msg)
-        else:
-            msg = f'Mef http error: {status} {mef_url}'
+    def _get_mef_data_by_type(cls, pid, pid_type, verbose=False,
+                              fresh=False):
+        """Request MEF REST API in JSON format.
+
+        The MEF responses are cached (see ``MefResolver``).
+
+        :param pid: the reference pid.
+        :param pid_type: the reference type (mef, viaf, idref, ...).
+        :param verbose: log the errors.
+        :param fresh: request the MEF server even if the response is cached.
+        :return: the first MEF hit.
+        """
+        resolver = get_mef_resolver(
+            current_app.config.get('RERO_ILS_MEF_AGENTS_URL'))
+        try:
+            data = resolver.get(pid_type, pid, fresh=fresh)
+        except MefRequestError as err:
+            if verbose:
+                current_app.logger.error(str(err))
+            raise
+        except ValueError as err:
+            if verbose:
+                current_app.logger.warning(str(err))
+            raise
+        if data is None:
+            msg = f'MEF resolver no metadata: ' \
+                f'{resolver.query_url(pid_type, pid)}'
             if verbose:
-                current_app.logger.error(msg)
-            raise RequestException(msg)
+                current_app.logger.warning(msg)
+            raise ValueError(msg)
+        return data
 
     def get_first(self, key, default=None):
         """Get the first value for given key among MEF source list."""
@@ -274,7 +277,7 @@ class Contribution(IlsRecord):
         pid = self.get('pid')
         try:
             data = self._get_mef_data_by_type(
-                pid=pid, pid_type='mef', verbose=verbose)
+                pid=pid, pid_type='mef', verbose=verbose, fresh=True)
             if data:
                 metadata = data['metadata']
                 metadata['$schema'] = self['$schema']
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""MEF requests with a persistent cache and a batch resolver."""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from flask import current_app, has_app_context
+from redis import Redis
+from requests import codes as requests_codes
+from requests.exceptions import RequestException
+
+from ..utils import requests_retry_session
+
+# process resolvers by settings
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_mef_setting(name, default=None):
+    """Get a MEF setting.
+
+    The application configuration is used when available, the environment
+    variables otherwise (i.e. for the dojson transformations running in
+    worker processes without application).
+
+    :param name: the setting name.
+    :param default: the default value.
+    :return: the setting value.
+    """
+    if has_app_context():
+        return current_app.config.get(name, default)
+    return os.environ.get(name, default)
+
+
+def get_mef_resolver(mef_url, pooled=False):
+    """Get the MEF resolver of the current process.
+
+    :param mef_url: the MEF api url (i.e. https://mef.rero.ch/api).
+    :param pooled: use a pooled session with retries for the requests,
+                   `requests.get` otherwise.
+    :return: the ``MefResolver``.
+    """
+    cache_url = get_mef_setting('RERO_ILS_MEF_CACHE_URL')
+    offline = str(get_mef_setting('RERO_ILS_MEF_OFFLINE', False)).lower() \
+        in ['1', 'true', 'yes']
+    workers = int(get_mef_setting('RERO_ILS_MEF_WORKERS', 8))
+    key = (os.getpid(), mef_url, pooled, cache_url, offline, workers)
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            cache = MefCache.from_url(
+                cache_url,
+                ttl=int(get_mef_setting(
+                    'RERO_ILS_MEF_CACHE_TTL', 7 * 24 * 3600)),
+                negative_ttl=int(get_mef_setting(
+                    'RERO_ILS_MEF_CACHE_NEGATIVE_TTL', 24 * 3600))
+            )
+            resolver = MefResolver(
+                mef_url, cache=cache, offline=offline, workers=workers,
+                pooled=pooled)
+            _resolvers[key] = resolver
+        return resolver
+
+
+class MefRequestError(RequestException):
+    """MEF request error."""
+
+    def __init__(self, url, status_code=None, message=None):
+        """Constructor.
+
+        :param url: the MEF request url.
+        :param status_code: the HTTP status code if any.
+        :param message: the error message.
+        """
+        self.url = url
+        self.status_code = status_code
+        super().__init__(message or f'Mef http error: {status_code} {url}')
+
+
+class MefCache(ABC):
+    """Persistent cache of the MEF responses.
+
+    The responses are stored as JSON by key with a time to live: the found
+    responses are kept `ttl` seconds, the "not found" ones (`None`)
+    `negative_ttl` seconds. The backend is selected by url:
+    `sqlite:///<path>` (SQLAlchemy like url, `sqlite://` for memory) or
+    `redis://...`.
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600, negative_ttl=24 * 3600):
+        """Constructor.
+
+        :param ttl: the time to live of the found responses (in seconds).
+        :param negative_ttl: the time to live of the "not found" responses
+                             (in seconds), `0` to not cache them.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """Create a cache from an url.
+
+        :param url: the cache url, `None` for no cache.
+        :param kwargs: the cache parameters.
+        :return: the ``MefCache`` or `None`.
+        """
+        if not url:
+            return None
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisMefCache(url, **kwargs)
+        if url.startswith('sqlite://'):
+            return SqliteMefCache(url[len('sqlite:///'):] or ':memory:',
+                                  **kwargs)
+        raise ValueError(f'Unsupported MEF cache url: {url}')
+
+    @abstractmethod
+    def _get(self, key):
+        """Get a raw value, `None` if not cached or expired."""
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _set_many(self, values):
+        """Store (key, raw value, ttl) tuples."""
+        raise NotImplementedError()
+
+    def get(self, key):
+        """Get a response.
+
+        :param key: the response key.
+        :return: a (found, response) tuple.
+        """
+        value = self._get(key)
+        if value is None:
+            return False, None
+        return True, json.loads(value)
+
+    def set_many(self, responses):
+        """Store several responses.
+
+        :param responses: the responses by key.
+        """
+        values = []
+        for key, response in responses.items():
+            ttl = self.ttl if response is not None else self.negative_ttl
+            if ttl > 0:
+                values.append((key, json.dumps(response), ttl))
+        if values:
+            self._set_many(values)
+
+    def set(self, key, response):
+        """Store a response.
+
+        :param key: the response key.
+        :param response: the response, `None` for "not found".
+        """
+        self.set_many({key: response})
+
+    def purge(self):
+        """Remove the expired responses.
+
+        Nothing to do if the backend expires the responses itself.
+
+        :return: the number of removed responses.
+        """
+        return 0
+
+
+class SqliteMefCache(MefCache):
+    """SQLite MEF cache.
+
+    The database file can be shared by several processes: a connection is
+    opened by process and the writes are serialized by SQLite.
+    """
+
+    def __init__(self, path, **kwargs):
+        """Constructor.
+
+        :param path: the database file path.
+        :param kwargs: the cache parameters.
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        """Database connection of the current process."""
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            if self.path != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS mef_cache ('
+                'key TEXT PRIMARY KEY, value TEXT, expire REAL)')
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def _get(self, key):
+        """Get a raw value, `None` if not cached or expired."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT value, expire FROM mef_cache WHERE key = ?', (key,)
+            ).fetchone()
+        if row and row[1] > time.time():
+            return row[0]
+        return None
+
+    def _set_many(self, values):
+        """Store (key, raw value, ttl) tuples."""
+        now = time.time()
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN')
+            try:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO mef_cache VALUES (?, ?, ?)',
+                    [(key, value, now + ttl) for key, value, ttl in values])
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def purge(self):
+        """Remove the expired responses.
+
+        :return: the number of removed responses.
+        """
+        with self._lock:
+            return self.connection.execute(
+                'DELETE FROM mef_cache WHERE expire <= ?', (time.time(),)
+            ).rowcount
+
+
+class RedisMefCache(MefCache):
+    """Redis MEF cache, the expiration is done by redis."""
+
+    def __init__(self, url, **kwargs):
+        """Constructor.
+
+        :param url: the redis url.
+        :param kwargs: the cache parameters.
+        """
+        super().__init__(**kwargs)
+        self.redis = Redis.from_url(url)
+
+    def _get(self, key):
+        """Get a raw value, `None` if not cached or expired."""
+        value = self.redis.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def _set_many(self, values):
+        """Store (key, raw value, ttl) tuples."""
+        pipeline = self.redis.pipeline(transaction=False)
+        for key, value, ttl in values:
+            pipeline.setex(key, ttl, value)
+        pipeline.execute()
+
+
+class MefResolver:
+    """Resolve the MEF references.
+
+    A reference is a (pid_type, pid) tuple where pid_type is `mef`, `viaf`
+    or a MEF source (i.e. `idref`). It is resolved by the first hit of the
+    MEF search (with the resolved sources), `None` if not found. The
+    responses are stored in the persistent cache if any: the HTTP errors are
+    never cached. In offline mode, the MEF server is never requested and a
+    reference missing from the cache is an error.
+
+    A batch resolves several references concurrently and keeps the responses
+    in memory (for the current thread) until its end:
+
+        # >>> resolver = get_mef_resolver('https://mef.rero.ch/api')
+        # >>> with resolver.batch([('idref', '003945843'), ('gnd', '1')]):
+        # ...     resolver.get('idref', '003945843')
+    """
+
+    def __init__(self, mef_url, cache=None, offline=False, workers=8,
+                 pooled=False):
+        """Constructor.
+
+        :param mef_url: the MEF api url.
+        :param cache: the persistent ``MefCache`` if any.
+        :param offline: use only the cached responses.
+        :param workers: the number of concurrent requests of a batch.
+        :param pooled: use a pooled session with retries for the requests,
+                       `requests.get` otherwise.
+        """
+        self.mef_url = mef_url
+        self.cache = cache
+        self.offline = offline
+        self.workers = max(1, workers)
+        self.session = requests_retry_session(pool_maxsize=self.workers) \
+            if pooled else None
+        self._local = threading.local()
+
+    @property
+    def _batch(self):
+        """Responses of the current batch by reference."""
+        if not hasattr(self._local, 'responses'):
+            self._local.responses = {}
+        return self._local.responses
+
+    def query_url(self, pid_type, pid):
+        """Get the MEF search url of a reference.
+
+        :param pid_type: the reference type.
+        :param pid: the reference pid.
+        :return: the url.
+        """
+        if pid_type == 'mef':
+            query = f'pid:"{pid}"'
+        elif pid_type == 'viaf':
+            query = f'viaf_pid:"{pid}"'
+        else:
+            query = f'{pid_type}.pid:"{pid}"'
+        return f'{self.mef_url}/mef/?q={query}'
+
+    def cache_key(self, pid_type, pid):
+        """Get the persistent cache key of a reference."""
+        return f'mef:{self.mef_url}/{pid_type}/{pid}'
+
+    def fetch(self, pid_type, pid):
+        """Request the MEF server.
+
+        :param pid_type: the reference type.
+        :param pid: the reference pid.
+        :return: the first hit, `None` if not found.
+        :raises MefRequestError: if the response is not ok.
+        :raises ValueError: if the response is not a MEF search result.
+        """
+        url = self.query_url(pid_type, pid)
+        http_get = self.session.get if self.session else requests.get
+        response = http_get(
+            url=url, params=dict(resolve=1, sources=1), timeout=60)
+        if response.status_code != requests_codes.ok:
+            raise MefRequestError(url, response.status_code)
+        try:
+            hits = response.json()['hits']['hits']
+            return hits[0] if hits else None
+        except Exception:
+            raise ValueError(f'MEF resolver no metadata: {url}')
+
+    def _get_cached(self, pid_type, pid):
+        """Get a response from the batch or the persistent cache.
+
+        :return: a (found, response) tuple.
+        """
+        if (pid_type, pid) in self._batch:
+            return True, copy.deepcopy(self._batch[(pid_type, pid)])
+        if self.cache:
+            return self.cache.get(self.cache_key(pid_type, pid))
+        return False, None
+
+    def get(self, pid_type, pid, fresh=False):
+        """Resolve a reference.
+
+        :param pid_type: the reference type.
+        :param pid: the reference pid.
+        :param fresh: request the MEF server even if the response is cached.
+        :return: the first hit, `None` if not found.
+        :raises MefRequestError: if the MEF request failed or in offline
+                                 mode if the response is not cached.
+        """
+        if not fresh:
+            found, response = self._get_cached(pid_type, pid)
+            if found:
+                return response
+        if self.offline:
+            url = self.query_url(pid_type, pid)
+            raise MefRequestError(
+                url, message=f'MEF offline: no cached response for {url}')
+        response = self.fetch(pid_type, pid)
+        if self.cache:
+            self.cache.set(self.cache_key(pid_type, pid), response)
+        return response
+
+    def _fetch_quietly(self, ref):
+        """Request the MEF server, `(False, None)` on error."""
+        try:
+            return True, self.fetch(*ref)
+        except (RequestException, ValueError):
+            return False, None
+
+    def prefetch(self, refs):
+        """Resolve several references for the current batch.
+
+        The references missing from the cache are requested concurrently.
+        The failed requests are not kept: they are retried by ``get``.
+
+        :param refs: the (pid_type, pid) references.
+        :return: the resolved responses by reference.
+        """
+        responses = {}
+        missing = []
+        for ref in set(refs):
+            found, response = self._get_cached(*ref)
+            if found:
+                responses[ref] = response
+            else:
+                missing.append(ref)
+        if missing and not self.offline:
+            if self.workers > 1 and len(missing) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    results = list(executor.map(self._fetch_quietly, missing))
+            else:
+                results = [self._fetch_quietly(ref) for ref in missing]
+            fetched = {
+                ref: response
+                for ref, (ok, response) in zip(missing, results) if ok
+            }
+            if self.cache and fetched:
+                self.cache.set_many({
+                    self.cache_key(*ref): response
+                    for ref, response in fetched.items()
+                })
+            responses.update(fetched)
+        self._batch.update(responses)
+        return responses
+
+    @contextmanager
+    def batch(self, refs=None):
+        """Batch context: the responses are kept in memory until its end.
+
+        :param refs: the (pid_type, pid) references to prefetch.
+        :return: the prefetched responses by reference.
+        """
+        try:
+            yield self.prefetch(refs or [])
+        finally:
+            self._batch.clear()
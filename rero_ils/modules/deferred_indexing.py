@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Deferred indexing of ILS records.
+
+Inside a ``deferred_indexing`` context, the records of the given types are not
+indexed when they are committed: they are kept and indexed at once when the
+context is flushed. A record committed several times is indexed once, with its
+last committed version.
+
+The deferred types must not be searched inside the context (i.e. the loans
+are searched by the circulation actions and cannot be deferred).
+
+      # >>> with deferred_indexing(['item']) as deferred:
+      # ...     item.status_update(item, dbcommit=True, reindex=True)
+      # >>> deferred.flush()
+      # >>>   1
+"""
+
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+
+DEFERRED_INDEXING_KEY = '_rero_ils_deferred_indexing'
+
+
+class DeferredIndexing:
+    """Records to index later.
+
+    The records are stored by pid type and uuid.
+    """
+
+    def __init__(self, pid_types):
+        """Initialize the deferred indexing.
+
+        :param pid_types: the pid types of the records to defer.
+        """
+        self.pid_types = set(pid_types)
+        # pid type --> (record class, {uuid: None})
+        self._records = {}
+
+    def __len__(self):
+        """Get the number of records to index."""
+        return sum(len(ids) for _, ids in self._records.values())
+
+    def add(self, record):
+        """Defer the indexing of a record.
+
+        :param record: the committed record.
+        :returns: `True` if the record indexing is deferred.
+        """
+        pid_type = record.provider.pid_type
+        if pid_type not in self.pid_types:
+            return False
+        _, ids = self._records.setdefault(pid_type, (record.__class__, {}))
+        ids[str(record.id)] = None
+        return True
+
+    def update(self, other):
+        """Add the records of another deferred indexing.
+
+        :param other: a ``DeferredIndexing``.
+        """
+        for pid_type, (record_cls, ids) in other._records.items():
+            self._records.setdefault(pid_type, (record_cls, {}))[1].update(ids)
+
+    def flush(self):
+        """Index the deferred records.
+
+        The records are loaded with one query by type. They are indexed with
+        one bulk request, except for the indexers with a specific `index`
+        (i.e. items) which index them one by one.
+
+        :returns: the number of indexed records.
+        """
+        from .api import IlsRecordsIndexer
+        records_by_type, self._records = self._records, {}
+        count = 0
+        for record_cls, ids in records_by_type.values():
+            records = record_cls.get_records(list(ids))
+            indexer = record_cls.get_indexer_class()()
+            if type(indexer).index is IlsRecordsIndexer.index:
+                indexer.bulk_index_records(records, refresh=True)
+            else:
+                for record in records:
+                    indexer.index(record)
+            count += len(records)
+        return count
+
+
+def current_deferred_indexing():
+    """Get the active deferred indexing.
+
+    :returns: the active ``DeferredIndexing``, `None` if not active.
+    """
+    if has_app_context():
+        return g.get(DEFERRED_INDEXING_KEY)
+
+
+@contextmanager
+def deferred_indexing(pid_types):
+    """Defer the indexing of some record types in the application context.
+
+    The deferred records are not indexed at the exit of the context: the
+    caller flushes the returned ``DeferredIndexing``.
+
+    :param pid_types: the pid types of the records to defer.
+    """
+    deferred = DeferredIndexing(pid_types)
+    previous = g.get(DEFERRED_INDEXING_KEY)
+    setattr(g, DEFERRED_INDEXING_KEY, deferred)
+    try:
+        yield deferred
+    finally:
+        if previous is None:
+            g.pop(DEFERRED_INDEXING_KEY, None)
+        else:
+            setattr(g, DEFERRED_INDEXING_KEY, previous)
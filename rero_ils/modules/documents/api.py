@@ -19,6 +19,7 @@
 """API for manipulating documents."""
 
 
+from contextlib import contextmanager
 from functools import partial
 
 from flask import current_app
@@ -407,3 +408,14 @@ class DocumentsIndexer(IlsRecordsIndexer):
         :param record_id_iterator: Iterator yielding record UUIDs.
         """
         super().bulk_index(record_id_iterator, doc_type='doc')
+
+    @contextmanager
+    def prefetch_records(self, records):
+        """Prefetch the enrichment data of a batch of documents.
+
+        :param records: the list of documents to index.
+        """
+        from .listener import documents_enrichment
+        with super().prefetch_records(records), \
+                documents_enrichment(records):
+            yield
@@ -17,7 +17,9 @@
 
 """Signals connector for Document."""
 
-from flask.globals import current_app
+from contextlib import contextmanager
+
+from flask.globals import current_app, g
 from isbnlib import is_isbn10, is_isbn13, to_isbn10, to_isbn13
 
 from .utils import create_contributions, title_format_text_head
@@ -25,10 +27,163 @@ from ..documents.api import Document, DocumentsSearch
 from ..holdings.api import HoldingsSearch
 from ..items.api import ItemsSearch
 from ..items.models import ItemNoteTypes
-from ..local_fields.api import LocalField
+from ..local_fields.api import LocalField, LocalFieldsSearch
 from ..utils import extracted_data_from_ref
 from ...utils import language_mapping
 
+ENRICHMENT_DATA_KEY = '_rero_ils_documents_enrichment'
+
+HOLDINGS_FIELDS = [
+    'call_number', 'second_call_number', 'index', 'enumerationAndChronology',
+    'supplementaryContent', 'local_fields'
+]
+
+
+def _holding_data(holding, items):
+    """Build the data of a holdings to index into its document.
+
+    :param holding: the holdings (ES source).
+    :param items: the items (ES sources) attached to the holdings.
+    :return: the holdings data to index into the document.
+    """
+    hold_data = {
+        'pid': holding['pid'],
+        'location': {
+            'pid': holding['location']['pid'],
+        },
+        'circulation_category': {
+            'pid': holding['circulation_category']['pid'],
+        },
+        'organisation': {
+            'organisation_pid': holding['organisation']['pid'],
+            'library_pid': holding['library']['pid']
+        }
+    }
+    # Index additional holdings fields into the document record
+    for field in HOLDINGS_FIELDS:
+        if field in holding:
+            hold_data[field] = holding.get(field)
+    # Index holdings notes
+    notes = [n['content'] for n in holding.get('notes', []) if n]
+    if notes:
+        hold_data['notes'] = notes
+
+    # Index items attached to each holdings record
+    for item in items:
+        item_data = {
+            'pid': item['pid'],
+            'barcode': item['barcode'],
+            'status': item['status'],
+            'local_fields': item.get('local_fields'),
+            'call_number': item.get('call_number'),
+            'second_call_number': item.get('second_call_number')
+        }
+        item_data = {k: v for k, v in item_data.items() if v}
+
+        # item acquisition part.
+        #   We need to store the acquisition data of the items into the
+        #   document. As we need to link acquisition date and org/lib/loc, we
+        #   need to store theses data together in a 'nested' structure.
+        acq_date = item.get('acquisition_date')
+        if acq_date:
+            item_data['acquisition'] = {
+                'organisation_pid': holding['organisation']['pid'],
+                'library_pid': holding['library']['pid'],
+                'location_pid': holding['location']['pid'],
+                'date': acq_date
+            }
+        # item notes content.
+        #   index the content of the public notes into the document.
+        public_notes_content = [
+            n['content']
+            for n in item.get('notes', [])
+            if n['type'] in ItemNoteTypes.PUBLIC
+        ]
+        if public_notes_content:
+            item_data['notes'] = public_notes_content
+        hold_data.setdefault('items', []).append(item_data)
+    return hold_data
+
+
+def _chunks(values, size=1000):
+    """Split a list of values into chunks (used for `terms` queries)."""
+    for idx in range(0, len(values), size):
+        yield values[idx:idx + size]
+
+
+def get_enrichment_data(documents):
+    """Fetch at once the enrichment data of a batch of documents.
+
+    The holdings, items, local fields and host documents of all the documents
+    are loaded with a few `terms` queries, then grouped by document.
+
+    :param documents: the documents to enrich.
+    :return: a dictionary with, by document pid, its `holdings` and
+             `local_fields`, and the titles of the host documents by pid
+             (`host_titles`).
+    """
+    document_pids = list({document['pid'] for document in documents})
+    data = {
+        'documents': {
+            pid: {'holdings': [], 'local_fields': []}
+            for pid in document_pids
+        },
+        'host_titles': {}
+    }
+    holdings = []
+    for pids in _chunks(document_pids):
+        query = HoldingsSearch().filter('terms', document__pid=pids)
+        holdings.extend(hit.to_dict() for hit in query.scan())
+    items = {}
+    for pids in _chunks([holding['pid'] for holding in holdings]):
+        query = ItemsSearch().filter('terms', holding__pid=pids)
+        for hit in query.scan():
+            hit = hit.to_dict()
+            items.setdefault(hit['holding']['pid'], []).append(hit)
+    for holding in holdings:
+        data['documents'][holding['document']['pid']]['holdings'].append(
+            _holding_data(holding, items.get(holding['pid'], [])))
+
+    local_fields = []
+    for pids in _chunks(document_pids):
+        query = LocalFieldsSearch()\
+            .filter('term', parent__type='doc')\
+            .filter('terms', parent__pid=pids)\
+            .source(['organisation', 'fields', 'parent'])
+        local_fields.extend(hit.to_dict() for hit in query.scan())
+    for local_field in sorted(
+            local_fields, key=lambda lf: lf['organisation']['pid']):
+        data['documents'][local_field['parent']['pid']]['local_fields']\
+            .append({
+                'organisation_pid': local_field['organisation']['pid'],
+                'fields': local_field['fields']
+            })
+
+    host_pids = {
+        extracted_data_from_ref(part_of.get('document'))
+        for document in documents
+        for part_of in document.get('partOf', [])
+    }
+    for host in Document.get_records_by_pids(host_pids):
+        data['host_titles'][host.pid] = host.get('title', [])
+    return data
+
+
+@contextmanager
+def documents_enrichment(documents):
+    """Prefetch the enrichment data of a batch of documents.
+
+    Inside this context, `enrich_document_data` uses the prefetched data for
+    the given documents instead of querying them document by document.
+
+    :param documents: the documents to enrich.
+    """
+    setattr(g, ENRICHMENT_DATA_KEY, get_enrichment_data(documents))
+    try:
+        yield
+    finally:
+        g.pop(ENRICHMENT_DATA_KEY, None)
+
 
 def enrich_document_data(sender, json=None, record=None, index=None,
                          doc_type=None, arguments=None, **dummy_kwargs):
@@ -40,81 +195,25 @@ def enrich_document_data(sender, json=None, record=None, index=None,
     :param doc_type: The doc_type for the record.
     """
     if index.split('-')[0] == DocumentsSearch.Meta.index:
-        # HOLDINGS
-        holdings = []
         document_pid = record['pid']
-        es_holdings = HoldingsSearch()\
-            .filter('term', document__pid=document_pid)\
-            .scan()
-        for holding in es_holdings:
-            holding = holding.to_dict()
-            hold_data = {
-                'pid': holding['pid'],
-                'location': {
-                    'pid': holding['location']['pid'],
-                },
-                'circulation_category': {
-                    'pid': holding['circulation_category']['pid'],
-                },
-                'organisation': {
-                    'organisation_pid': holding['organisation']['pid'],
-                    'library_pid': holding['library']['pid']
-                }
-            }
-            # Index additional holdings fields into the document record
-            holdings_fields = [
-                'call_number', 'second_call_number', 'index',
-                'enumerationAndChronology', 'supplementaryContent',
-                'local_fields'
-            ]
-            for field in holdings_fields:
-                if field in holding:
-                    hold_data[field] = holding.get(field)
-            # Index holdings notes
-            notes = [n['content'] for n in holding.get('notes', []) if n]
-            if notes:
-                hold_data['notes'] = notes
-
-            # Index items attached to each holdings record
-            es_items = ItemsSearch()\
-                .filter('term', holding__pid=holding['pid'])\
+        prefetched = g.get(ENRICHMENT_DATA_KEY) or {}
+        document_data = prefetched.get('documents', {}).get(document_pid)
+        host_titles = prefetched.get('host_titles', {})
+        # HOLDINGS
+        if document_data is not None:
+            holdings = document_data['holdings']
+        else:
+            holdings = []
+            es_holdings = HoldingsSearch()\
+                .filter('term', document__pid=document_pid)\
                 .scan()
-            for item in es_items:
-                item = item.to_dict()
-                item_data = {
-                    'pid': item['pid'],
-                    'barcode': item['barcode'],
-                    'status': item['status'],
-                    'local_fields': item.get('local_fields'),
-                    'call_number': item.get('call_number'),
-                    'second_call_number': item.get('second_call_number')
-                }
-                item_data = {k: v for k, v in item_data.items() if v}
-
-                # item acquisition part.
-                #   We need to store the acquisition data of the items into the
-                #   document. As we need to link acquisition date and
-                #   org/lib/loc, we need to store theses data together in a
-                #   'nested' structure.
-                acq_date = item.get('acquisition_date')
-                if acq_date:
-                    item_data['acquisition'] = {
-                        'organisation_pid': holding['organisation']['pid'],
-                        'library_pid': holding['library']['pid'],
-                        'location_pid': holding['location']['pid'],
-                        'date': acq_date
-                    }
-                # item notes content.
-                #   index the content of the public notes into the document.
-                public_notes_content = [
-                    n['content']
-                    for n in item.get('notes', [])
-                    if n['type'] in ItemNoteTypes.PUBLIC
-                ]
-                if public_notes_content:
-                    item_data['notes'] = public_notes_content
-                hold_data.setdefault('items', []).append(item_data)
-            holdings.append(hold_data)
+            for holding in es_holdings:
+                holding = holding.to_dict()
+                es_items = ItemsSearch()\
+                    .filter('term', holding__pid=holding['pid'])\
+                    .scan()
+                items = [item.to_dict() for item in es_items]
+                holdings.append(_holding_data(holding, items))
 
         if holdings:
             json['holdings'] = holdings
@@ -133,8 +232,11 @@ def enrich_document_data(sender, json=None, record=None, index=None,
                 doc_pid = extracted_data_from_ref(
                     part_of.get('document')
                 )
-                document = Document.get_record_by_pid(doc_pid)
-                for part_of_title in document.get('title', []):
+                titles = host_titles.get(doc_pid)
+                if titles is None:
+                    titles = Document.get_record_by_pid(doc_pid)\
+                        .get('title', [])
+                for part_of_title in titles:
                     if 'mainTitle' in part_of_title:
                         title['partOfTitle'] = part_of_title.get(
                             'mainTitle'
@@ -153,8 +255,11 @@ def enrich_document_data(sender, json=None, record=None, index=None,
                 normalize(sort_title, language)
         json['sort_title'] = sort_title
         # Local fields in JSON
-        local_fields = LocalField.get_local_fields_by_resource(
-            'doc', document_pid)
+        if document_data is not None:
+            local_fields = document_data['local_fields']
+        else:
+            local_fields = LocalField.get_local_fields_by_resource(
+                'doc', document_pid)
         if local_fields:
             json['local_fields'] = local_fields
 
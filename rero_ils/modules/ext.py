@@ -28,8 +28,8 @@ from flask_wiki import Wiki
 from invenio_circulation.signals import loan_state_changed
 from invenio_indexer.signals import before_record_index
 from invenio_oaiharvester.signals import oaiharvest_finished
-from invenio_records.signals import after_record_insert, after_record_update, \
-    before_record_update
+from invenio_records.signals import after_record_delete, after_record_insert, \
+    after_record_update, before_record_update
 from invenio_records_rest.errors import JSONSchemaValidationError
 from invenio_userprofiles.signals import after_profile_update
 from jsonschema.exceptions import ValidationError
@@ -53,7 +53,9 @@ from .imports.views import ImportsListResource, ImportsResource, \
     ResultNotFoundOnTheRemoteServer
 from .item_types.listener import negative_availability_changes
 from .items.listener import enrich_item_data
-from .loans.listener import enrich_loan_data, listener_loan_state_changed
+from .loans.listener import enrich_loan_data, \
+    invalidate_loan_operation_log_patron_snapshots, \
+    invalidate_loan_operation_log_snapshot, listener_loan_state_changed
 from .locations.listener import enrich_location_data
 from .normalizer_stop_words import NormalizerStopWords
 from .notifications.listener import enrich_notification_data
@@ -220,6 +222,8 @@ class REROILSAPP(object):
         after_record_insert.connect(create_subscription_patron_transaction)
         after_record_update.connect(create_subscription_patron_transaction)
         after_record_update.connect(update_items_locations_and_types)
+        after_record_update.connect(invalidate_loan_operation_log_snapshot)
+        after_record_delete.connect(invalidate_loan_operation_log_snapshot)
 
         before_record_update.connect(budget_is_active_changed)
         before_record_update.connect(negative_availability_changes)
@@ -232,6 +236,8 @@ class REROILSAPP(object):
 
         # invenio-userprofiles signal
         after_profile_update.connect(update_from_profile)
+        after_profile_update.connect(
+            invalidate_loan_operation_log_patron_snapshots)
 
         # store the username in the session
         user_logged_in.connect(set_user_name)
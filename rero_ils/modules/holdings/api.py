@@ -691,7 +691,7 @@ def get_holdings_by_document_item_type(
         .sort({'pid': {"order": "asc"}}) \
         .source(['pid']) \
         .scan()
-    return [Holding.get_record_by_pid(result.pid) for result in results]
+    return list(Holding.get_records_by_pids(hit.pid for hit in results))
 
 
 def create_holding(
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Request scoped identity map for ILS records.
+
+An identity map keeps the records loaded from the database during a unit of
+work (a Flask request, a Celery task, a circulation transaction, ...). The
+same record asked several times is returned from the map instead of being
+loaded again from the database.
+
+The identity map is opt-in: it is only used inside an ``identity_map``
+context and only for record classes with ``enable_identity_map`` set.
+
+      # >>> with identity_map() as records_map:
+      # ...     lib = Library.get_record_by_pid('1')  # database hit
+      # ...     lib = Library.get_record_by_pid('1')  # identity map hit
+      # >>> records_map.stats
+      # >>>   {'hits': 1, 'misses': 1, 'size': 1}
+"""
+
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+
+IDENTITY_MAP_KEY = '_rero_ils_identity_map'
+
+
+class IdentityMap:
+    """Records identity map.
+
+    Records are stored by uuid. An index allows to retrieve a record from its
+    (pid_type, pid) couple.
+    """
+
+    def __init__(self):
+        """Initialize the identity map."""
+        self._records = {}
+        self._pids = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """Get the number of records into the identity map."""
+        return len(self._records)
+
+    @property
+    def stats(self):
+        """Get the identity map usage counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self)
+        }
+
+    def get(self, pid_type, pid=None, id_=None):
+        """Get a record from the identity map.
+
+        :param pid_type: the record pid type.
+        :param pid: the record pid value.
+        :param id_: the record uuid (used if no pid is given).
+        :returns: the stored record, `None` if not found.
+        """
+        if pid is not None:
+            id_ = self._pids.get((pid_type, str(pid)))
+        record = self._records.get((pid_type, str(id_)))
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def add(self, pid_type, record):
+        """Store a record into the identity map.
+
+        :param pid_type: the record pid type.
+        :param record: the record to store.
+        """
+        self._records[(pid_type, str(record.id))] = record
+        if record.pid:
+            self._pids[(pid_type, str(record.pid))] = str(record.id)
+
+    def invalidate(self, pid_type, pid=None, id_=None):
+        """Remove a record from the identity map.
+
+        :param pid_type: the record pid type.
+        :param pid: the record pid value.
+        :param id_: the record uuid.
+        """
+        if pid is not None:
+            id_ = self._pids.pop((pid_type, str(pid)), id_)
+        record = self._records.pop((pid_type, str(id_)), None)
+        if record is not None and record.pid:
+            self._pids.pop((pid_type, str(record.pid)), None)
+
+    def clear(self):
+        """Remove all records from the identity map."""
+        self._records.clear()
+        self._pids.clear()
+
+
+def current_identity_map():
+    """Get the active identity map.
+
+    :returns: the active ``IdentityMap``, `None` if no identity map is active.
+    """
+    if has_app_context():
+        return g.get(IDENTITY_MAP_KEY)
+
+
+@contextmanager
+def identity_map():
+    """Activate an identity map for the current application context.
+
+    If an identity map is already active, it is reused: nested contexts share
+    the records loaded by the outer one.
+    """
+    records_map = current_identity_map()
+    if records_map is not None:
+        yield records_map
+        return
+    records_map = IdentityMap()
+    setattr(g, IDENTITY_MAP_KEY, records_map)
+    try:
+        yield records_map
+    finally:
+        g.pop(IDENTITY_MAP_KEY, None)
+        current_app.logger.debug(f'Identity map stats: {records_map.stats}')
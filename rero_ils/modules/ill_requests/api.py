@@ -111,8 +111,8 @@ class ILLRequest(IlsRecord):
         :param status: the requests status
         :return a generator of ILLRequest
         """
-        for pid in cls.get_request_pids_by_patron_pid(patron_pid, status):
-            yield ILLRequest.get_record_by_pid(pid)
+        yield from ILLRequest.get_records_by_pids(
+            cls.get_request_pids_by_patron_pid(patron_pid, status))
 
     @property
     def is_copy(self):
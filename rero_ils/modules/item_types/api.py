@@ -66,6 +66,7 @@ class ItemType(IlsRecord):
     fetcher = item_type_id_fetcher
     provider = ItemTypeProvider
     model_cls = ItemTypeMetadata
+    enable_identity_map = True
 
     def extended_validation(self, **kwargs):
         """Validate record against schema.
@@ -109,9 +109,8 @@ class ItemIssue(ItemRecord):
         :return a generator of Item.
         """
         from . import Item
-        for pid in cls.get_issues_pids_by_status(
-                issue_status, holdings_pid=holdings_pid):
-            yield Item.get_record_by_pid(pid)
+        yield from Item.get_records_by_pids(cls.get_issues_pids_by_status(
+            issue_status, holdings_pid=holdings_pid))
 
     @classmethod
     def get_late_serial_holdings_pids(cls):
@@ -24,6 +24,7 @@ from flask import current_app
 from invenio_circulation.errors import CirculationException
 from invenio_records_rest.utils import obj_or_import_string
 
+from rero_ils.modules.identity_map import identity_map
 from rero_ils.modules.loans.api import Loan, \
     get_request_by_item_pid_by_patron_pid
 
@@ -34,10 +35,18 @@ def add_action_parameters_and_flush_indexes(function):
     For each circulation action, this method ensures that all required
     parameters are given. Adds missing parameters if any. Ensures the right
     loan transition for the given action.
+
+    The whole action runs inside an identity map: libraries, locations,
+    policies, ... loaded several times during the action are loaded only once.
     """
     @wraps(function)
     def wrapper(item, *args, **kwargs):
         """Executed before loan action."""
+        with identity_map():
+            return _apply_action(item, *args, **kwargs)
+
+    def _apply_action(item, *args, **kwargs):
+        """Apply the circulation action."""
         checkin_loan = None
         if function.__name__ == 'validate_request':
             # checks if the given loan pid can be validated
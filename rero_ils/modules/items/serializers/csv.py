@@ -19,12 +19,15 @@
 """Item serializers."""
 
 import csv
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import ciso8601
 from elasticsearch_dsl import A
 from flask import current_app, request, stream_with_context
 from invenio_i18n.ext import current_i18n
-from invenio_records_rest.serializers.csv import CSVSerializer, Line
+from invenio_records_rest.serializers.csv import CSVSerializer
 
 from rero_ils.modules.documents.api import DocumentsSearch
 from rero_ils.modules.item_types.api import ItemTypesSearch
@@ -32,6 +35,7 @@ from rero_ils.modules.libraries.api import LibrariesSearch
 from rero_ils.modules.loans.api import LoansSearch
 from rero_ils.modules.loans.models import LoanState
 from rero_ils.modules.locations.api import LocationsSearch
+from rero_ils.modules.patrons.api import current_librarian
 from rero_ils.utils import get_i18n_supported_languages
 
 from ..models import ItemNoteTypes
@@ -61,7 +65,11 @@ role_filter = [
 
 
 class ItemCSVSerializer(CSVSerializer):
-    """Serialize item search for csv."""
+    """Serialize item search for csv.
+
+    The items are written by chunks: the documents and the loans of the next
+    chunk are fetched by a thread pool while the current chunk is written.
+    """
 
     def serialize_search(self, pid_fetcher, search_result, links=None,
                          item_links_factory=None):
@@ -72,223 +80,333 @@ class ItemCSVSerializer(CSVSerializer):
         :param links: Dictionary of links to add to response.
         :param item_links_factory: Factory function for record links.
         """
-        # define chunk size
-        chunk_size = 1000
-
-        # language
-        language = request.args.get("lang", current_i18n.language)
-        if not language or language not in get_i18n_supported_languages():
-            language = current_app.config.get('BABEL_DEFAULT_LANGUAGE', 'en')
-
-        # prepare mapping dictionnaries
-        item_types_map = {}
-        for item_type in ItemTypesSearch().scan():
-            item_types_map[item_type.pid] = item_type.name
-        locations_map = {}
-        for location in LocationsSearch().scan():
-            locations_map[location.pid] = location.name
-        libraries_map = {}
-        for library in LibrariesSearch().scan():
-            libraries_map[library.pid] = library.name
-
-        def generate_csv():
-            def batch(results):
-                """Chunk search results.
-
-                :param results: search results.
-                :return list of chuncked item pids and search records
-                """
-                records = []
-                pids = []
-                for result in results:
-                    pids.append(result.pid)
-                    records.append(result)
-                    if len(records) % chunk_size == 0:
-                        yield pids, records
-                        pids = []
-                        records = []
-                yield pids, records
-
-            def get_documents_by_item_pids(item_pids):
-                """Get documents for the given item pid list."""
-
-                def _build_doc(data):
-                    document_data = {
-                        'document_title': next(
-                            filter(lambda x: x.get('type') == 'bf:Title',
-                                   data.get('title'))
-                        ).get('_text')
-                    }
-                    # process contributions
-                    creator = []
-                    if 'contribution' in data:
-                        for contribution in data.get('contribution'):
-                            if any(role in contribution.get('role')
-                                   for role in role_filter):
-                                authorized_access_point = \
-                                    f'authorized_access_point_{language}'
-                                if authorized_access_point in contribution\
-                                        .get('agent'):
-                                    creator.append(
-                                        contribution['agent'][
-                                            authorized_access_point]
-                                    )
-                    document_data['document_creator'] = ' ; '.join(creator)
-                    document_main_type = []
-                    document_sub_type = []
-                    for document_type in data.get('type'):
-                        # data = document_type.to_dict()
-                        document_main_type.append(
-                            document_type.get('main_type'))
-                        document_sub_type.append(
-                            document_type.get('subtype', ''))
-                    document_data['document_main_type'] = ', '.join(
-                        document_main_type)
-                    document_data['document_sub_type'] = ', '.join(
-                        document_sub_type)
-                    # TODO : build provision activity
-                    return document_data
-
-                doc_search = DocumentsSearch() \
-                    .filter('terms', holdings__items__pid=list(item_pids)) \
-                    .source(
-                    ['pid', 'title', 'contribution', 'provisionActivity',
-                     'type'])
-                docs = {}
-                for doc in doc_search.scan():
-                    docs[doc.pid] = _build_doc(doc.to_dict())
-                return docs
-
-            def get_loans_by_item_pids(item_pids):
-                """Get loans for the given item pid list."""
-                states = \
-                    current_app.config['CIRCULATION_STATES_LOAN_ACTIVE']
-                loan_search = LoansSearch() \
-                    .filter('terms', state=states) \
-                    .filter('terms', item_pid__value=item_pids) \
-                    .source(['pid', 'item_pid.value', 'start_date',
-                            'end_date', 'state', '_created'])
-                agg = A('terms', field='item_pid.value', size=chunk_size)
-                loan_search.aggs.bucket('loans_count', agg)
-
-                loan_search = loan_search.extra(
-                    collapse={
-                        'field': 'item_pid.value',
-                        "inner_hits": {
-                            "name": "most_recent",
-                            "size": 1,
-                            "sort": [{"_created": "desc"}],
-                        }
-                    }
-                )
-                # default results size for the execute method is 10.
-                # We need to set this to the chunk size"
-                results = loan_search[0:chunk_size].execute()
-                agg_buckets = {}
-                for result in results.aggregations.loans_count.buckets:
-                    agg_buckets[result.key] = result.doc_count
-                loans = {}
-                for loan_hit in results:
-                    # get most recent loans
-                    loan_data = loan_hit.meta.inner_hits.most_recent[0]\
-                        .to_dict()
-                    item_pid = loan_data['item_pid']['value']
-                    loans[item_pid] = {
-                        'loans_count': agg_buckets.get(item_pid, 0),
-                        'last_transaction_date': ciso8601.parse_datetime(
-                            loan_data['_created']).date()
-                    }
-                    if loan_data.get('state') == LoanState.ITEM_ON_LOAN:
-                        loans[item_pid]['checkout_date'] = ciso8601.\
-                            parse_datetime(loan_data['start_date']).date()
-                        loans[item_pid]['due_date'] = ciso8601.\
-                            parse_datetime(loan_data['end_date']).date()
-                return loans
-
-            headers = dict.fromkeys(self.csv_included_fields)
-
-            # write the CSV output in memory
-            line = Line()
-            writer = csv.DictWriter(line,
-                                    quoting=csv.QUOTE_ALL,
-                                    fieldnames=headers)
-            writer.writeheader()
-            yield line.read()
-
-            for pids, batch_results in batch(search_result):
-                # get documents
-                documents = get_documents_by_item_pids(pids)
-
-                # get loans
-                loans = get_loans_by_item_pids(pids)
-
-                for hit in batch_results:
-                    csv_data = hit.to_dict()
-                    csv_data['library_name'] = libraries_map[
-                        hit['library']['pid']]
-                    csv_data['location_name'] = locations_map[
-                        hit['location']['pid']]
-
-                    try:
-                        # update csv data with document
-                        csv_data.update(documents.get(hit['document']['pid']))
-                    except Exception as err:
-                        current_app.logger.error(
-                            'ERROR in csv serializer: '
-                            '{message} on document: {pid}'.format(
-                                message=err,
-                                pid=hit['document']['pid'])
-                        )
+        language = get_language()
 
-                    # update csv data with loan
-                    csv_data.update(loans.get(hit['pid'], {'loans_count': 0}))
-
-                    # process item type and temporary item type
-                    csv_data['item_type'] = item_types_map[
-                        hit['item_type']['pid']]
-                    temporary_item_type = csv_data.get('temporary_item_type')
-                    if temporary_item_type:
-                        csv_data['temporary_item_type'] = item_types_map[
-                            temporary_item_type['pid']]
-                        csv_data['temporary_item_type_end_date'] = \
-                            temporary_item_type.get('end_date')
-
-                    # process note
-                    for note in csv_data.get('notes', []):
-                        if any(note_type in note.get('type')
-                               for note_type in
-                               ItemNoteTypes.INVENTORY_LIST_CATEGORY):
-                            csv_data[note.get('type')] = note.get(
-                                'content')
-
-                    csv_data['created'] = ciso8601.parse_datetime(
-                            hit['_created']).date()
-
-                    # process item issue
-                    if hit['type'] == 'issue':
-                        issue = csv_data['issue']
-                        if issue.get('inherited_first_call_number') \
-                                and not csv_data.get('call_number'):
-                            csv_data['call_number'] = \
-                                issue.get('inherited_first_call_number')
-                        csv_data['issue_status'] = issue.get('status')
-                        if issue.get('status_date'):
-                            csv_data['issue_status_date'] = \
-                                ciso8601.parse_datetime(
-                                    issue.get('status_date')).date()
-                        csv_data['issue_claims_count'] = \
-                            issue.get('claims_count', 0)
-                        csv_data['issue_expected_date'] = \
-                            issue.get('expected_date')
-                        csv_data['issue_regular'] = issue.get('regular')
-
-                    # prevent key error
-                    del (csv_data['type'])
-
-                    # write csv data
-                    data = self.process_dict(csv_data)
-                    writer.writerow(data)
-                    yield line.read()
+        # the lookup maps are restricted to the requested organisation
+        organisation_pid = request.args.get('organisation')
+        if not organisation_pid and current_librarian:
+            organisation_pid = current_librarian.organisation_pid
 
         # return streamed content
-        return stream_with_context(generate_csv())
+        return stream_with_context(self.generate_csv(
+            search_result, language, organisation_pid=organisation_pid))
+
+    def generate_csv(self, search_result, language, organisation_pid=None):
+        """Generate the CSV content of the items.
+
+        :param search_result: an iterable of item search hits.
+        :param language: the language of the contribution names.
+        :param organisation_pid: restrict the lookup maps to this
+                                 organisation.
+        :return: a generator of CSV strings, one by chunk of items.
+        """
+        config = current_app.config
+        chunk_size = config.get('RERO_ILS_INVENTORY_CHUNK_SIZE', 1000)
+        app = current_app._get_current_object()
+
+        # prepare mapping dictionaries
+        maps = {
+            'item_types': LookupMap(ItemTypesSearch, organisation_pid),
+            'locations': LookupMap(LocationsSearch, organisation_pid),
+            'libraries': LookupMap(LibrariesSearch, organisation_pid)
+        }
+
+        def in_app_context(func, *args):
+            """Call a function inside the application context."""
+            with app.app_context():
+                return func(*args)
+
+        def prefetch(executor, pids):
+            """Fetch the documents and the loans of a chunk concurrently."""
+            return (
+                executor.submit(in_app_context, get_documents_by_item_pids,
+                                pids, language),
+                executor.submit(in_app_context, get_loans_by_item_pids,
+                                pids, chunk_size)
+            )
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer,
+                                quoting=csv.QUOTE_ALL,
+                                fieldnames=dict.fromkeys(
+                                    self.csv_included_fields))
+
+        def read_buffer():
+            """Get and clear the written CSV content."""
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return data
+
+        writer.writeheader()
+        yield read_buffer()
+
+        executor = ThreadPoolExecutor(
+            max_workers=config.get('RERO_ILS_INVENTORY_PREFETCH_WORKERS', 2))
+        pending = deque()
+        try:
+            for pids, hits in batch(search_result, chunk_size):
+                pending.append((hits, prefetch(executor, pids)))
+                # the next chunk is fetched while the current one is written
+                if len(pending) > 1:
+                    hits, (documents, loans) = pending.popleft()
+                    self.write_chunk(writer, hits, documents.result(),
+                                     loans.result(), maps)
+                    yield read_buffer()
+            while pending:
+                hits, (documents, loans) = pending.popleft()
+                self.write_chunk(writer, hits, documents.result(),
+                                 loans.result(), maps)
+                yield read_buffer()
+        finally:
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            executor.shutdown(wait=False)
+
+    def write_chunk(self, writer, hits, documents, loans, maps):
+        """Write a chunk of items.
+
+        :param writer: the CSV writer.
+        :param hits: the item search hits.
+        :param documents: the document data by document pid.
+        :param loans: the loan data by item pid.
+        :param maps: the item types, locations and libraries lookup maps.
+        """
+        item_types_map = maps['item_types']
+        for hit in hits:
+            csv_data = hit.to_dict()
+            csv_data['library_name'] = maps['libraries'][
+                hit['library']['pid']]
+            csv_data['location_name'] = maps['locations'][
+                hit['location']['pid']]
+
+            try:
+                # update csv data with document
+                csv_data.update(documents.get(hit['document']['pid']))
+            except Exception as err:
+                current_app.logger.error(
+                    'ERROR in csv serializer: '
+                    '{message} on document: {pid}'.format(
+                        message=err,
+                        pid=hit['document']['pid'])
+                )
+
+            # update csv data with loan
+            csv_data.update(loans.get(hit['pid'], {'loans_count': 0}))
+
+            # process item type and temporary item type
+            csv_data['item_type'] = item_types_map[
+                hit['item_type']['pid']]
+            temporary_item_type = csv_data.get('temporary_item_type')
+            if temporary_item_type:
+                csv_data['temporary_item_type'] = item_types_map[
+                    temporary_item_type['pid']]
+                csv_data['temporary_item_type_end_date'] = \
+                    temporary_item_type.get('end_date')
+
+            # process note
+            for note in csv_data.get('notes', []):
+                if any(note_type in note.get('type')
+                       for note_type in
+                       ItemNoteTypes.INVENTORY_LIST_CATEGORY):
+                    csv_data[note.get('type')] = note.get(
+                        'content')
+
+            csv_data['created'] = ciso8601.parse_datetime(
+                    hit['_created']).date()
+
+            # process item issue
+            if hit['type'] == 'issue':
+                issue = csv_data['issue']
+                if issue.get('inherited_first_call_number') \
+                        and not csv_data.get('call_number'):
+                    csv_data['call_number'] = \
+                        issue.get('inherited_first_call_number')
+                csv_data['issue_status'] = issue.get('status')
+                if issue.get('status_date'):
+                    csv_data['issue_status_date'] = \
+                        ciso8601.parse_datetime(
+                            issue.get('status_date')).date()
+                csv_data['issue_claims_count'] = \
+                    issue.get('claims_count', 0)
+                csv_data['issue_expected_date'] = \
+                    issue.get('expected_date')
+                csv_data['issue_regular'] = issue.get('regular')
+
+            # prevent key error
+            del (csv_data['type'])
+
+            # write csv data
+            writer.writerow(self.process_dict(csv_data))
+
+
+class LookupMap(dict):
+    """Names of the records of an index by pid.
+
+    The map is loaded with the records of an organisation. A missing pid
+    (i.e. a record of another organisation) is loaded on demand.
+    """
+
+    def __init__(self, search_class, organisation_pid=None):
+        """Constructor.
+
+        :param search_class: the search class of the index.
+        :param organisation_pid: load the records of this organisation only.
+        """
+        super().__init__()
+        self.search_class = search_class
+        search = search_class().source(['pid', 'name'])
+        if organisation_pid:
+            search = search.filter('term', organisation__pid=organisation_pid)
+        for hit in search.scan():
+            self[hit.pid] = hit.name
+
+    def __missing__(self, pid):
+        """Load a missing record name."""
+        search = self.search_class() \
+            .filter('term', pid=pid) \
+            .source(['pid', 'name'])
+        hit = next(search.scan(), None)
+        if hit is None:
+            raise KeyError(pid)
+        self[pid] = hit.name
+        return hit.name
+
+
+def get_language():
+    """Get the language of the contribution names from the request.
+
+    :return: the requested language if supported, the default one otherwise.
+    """
+    language = request.args.get("lang", current_i18n.language)
+    if not language or language not in get_i18n_supported_languages():
+        language = current_app.config.get('BABEL_DEFAULT_LANGUAGE', 'en')
+    return language
+
+
+def batch(results, chunk_size):
+    """Chunk search results.
+
+    :param results: search results.
+    :param chunk_size: the number of results by chunk.
+    :return: a generator of chunked item pids and search records.
+    """
+    records = []
+    pids = []
+    for result in results:
+        pids.append(result.pid)
+        records.append(result)
+        if len(records) == chunk_size:
+            yield pids, records
+            pids = []
+            records = []
+    if records:
+        yield pids, records
+
+
+def get_documents_by_item_pids(item_pids, language):
+    """Get documents for the given item pid list.
+
+    :param item_pids: the item pids.
+    :param language: the language of the contribution names.
+    :return: the document data by document pid.
+    """
+
+    def _build_doc(data):
+        document_data = {
+            'document_title': next(
+                filter(lambda x: x.get('type') == 'bf:Title',
+                       data.get('title'))
+            ).get('_text')
+        }
+        # process contributions
+        creator = []
+        if 'contribution' in data:
+            for contribution in data.get('contribution'):
+                if any(role in contribution.get('role')
+                       for role in role_filter):
+                    authorized_access_point = \
+                        f'authorized_access_point_{language}'
+                    if authorized_access_point in contribution\
+                            .get('agent'):
+                        creator.append(
+                            contribution['agent'][
+                                authorized_access_point]
+                        )
+        document_data['document_creator'] = ' ; '.join(creator)
+        document_main_type = []
+        document_sub_type = []
+        for document_type in data.get('type'):
+            document_main_type.append(
+                document_type.get('main_type'))
+            document_sub_type.append(
+                document_type.get('subtype', ''))
+        document_data['document_main_type'] = ', '.join(
+            document_main_type)
+        document_data['document_sub_type'] = ', '.join(
+            document_sub_type)
+        # TODO : build provision activity
+        return document_data
+
+    doc_search = DocumentsSearch() \
+        .filter('terms', holdings__items__pid=list(item_pids)) \
+        .source(
+        ['pid', 'title', 'contribution', 'provisionActivity',
+         'type'])
+    docs = {}
+    for doc in doc_search.scan():
+        docs[doc.pid] = _build_doc(doc.to_dict())
+    return docs
+
+
+def get_loans_by_item_pids(item_pids, chunk_size):
+    """Get loans for the given item pid list.
+
+    :param item_pids: the item pids.
+    :param chunk_size: the maximal number of items.
+    :return: the loan data by item pid.
+    """
+    states = \
+        current_app.config['CIRCULATION_STATES_LOAN_ACTIVE']
+    loan_search = LoansSearch() \
+        .filter('terms', state=states) \
+        .filter('terms', item_pid__value=item_pids) \
+        .source(['pid', 'item_pid.value', 'start_date',
+                'end_date', 'state', '_created'])
+    agg = A('terms', field='item_pid.value', size=chunk_size)
+    loan_search.aggs.bucket('loans_count', agg)
+
+    loan_search = loan_search.extra(
+        collapse={
+            'field': 'item_pid.value',
+            "inner_hits": {
+                "name": "most_recent",
+                "size": 1,
+                "sort": [{"_created": "desc"}],
+            }
+        }
+    )
+    # default results size for the execute method is 10.
+    # We need to set this to the chunk size"
+    results = loan_search[0:chunk_size].execute()
+    agg_buckets = {}
+    for result in results.aggregations.loans_count.buckets:
+        agg_buckets[result.key] = result.doc_count
+    loans = {}
+    for loan_hit in results:
+        # get most recent loans
+        loan_data = loan_hit.meta.inner_hits.most_recent[0]\
+            .to_dict()
+        item_pid = loan_data['item_pid']['value']
+        loans[item_pid] = {
+            'loans_count': agg_buckets.get(item_pid, 0),
+            'last_transaction_date': ciso8601.parse_datetime(
+                loan_data['_created']).date()
+        }
+        if loan_data.get('state') == LoanState.ITEM_ON_LOAN:
+            loans[item_pid]['checkout_date'] = ciso8601.\
+                parse_datetime(loan_data['start_date']).date()
+            loans[item_pid]['due_date'] = ciso8601.\
+                parse_datetime(loan_data['end_date']).date()
+    return loans
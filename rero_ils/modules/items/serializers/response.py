@@ -21,10 +21,11 @@ Responsible for creating a HTTP response given the output of a serializer.
 """
 from __future__ import absolute_import, print_function
 
+import zlib
 from datetime import datetime
 
 import pytz
-from flask import current_app
+from flask import current_app, request
 from invenio_records_rest.serializers.response import add_link_header
 
 
@@ -38,18 +39,24 @@ def search_responsify_csv(serializer, mimetype):
 
     def view(pid_fetcher, search_result, code=200, headers=None, links=None,
              item_links_factory=None):
-        response = current_app.response_class(
-            serializer.serialize_search(pid_fetcher, search_result,
-                                        links=links,
-                                        item_links_factory=item_links_factory),
-            mimetype=mimetype)
+        content = serializer.serialize_search(
+            pid_fetcher, search_result, links=links,
+            item_links_factory=item_links_factory)
+        extension = 'csv'
+        content_type = mimetype
+        if request.args.get('compress') == 'gzip':
+            content = gzip_stream(content)
+            extension = 'csv.gz'
+            content_type = 'application/gzip'
+        response = current_app.response_class(content, mimetype=content_type)
         response.status_code = code
         if headers is not None:
             response.headers.extend(headers)
 
-        file_name = '{date}-inventory.csv'.format(
+        file_name = '{date}-inventory.{extension}'.format(
             date=datetime.now(
-                tz=pytz.timezone('Europe/Zurich')).strftime('%Y%m%d')
+                tz=pytz.timezone('Europe/Zurich')).strftime('%Y%m%d'),
+            extension=extension
         )
         if not response.headers.get('Content-Disposition'):
             response.headers['Content-Disposition'] = \
@@ -60,3 +67,19 @@ def search_responsify_csv(serializer, mimetype):
         return response
 
     return view
+
+
+def gzip_stream(chunks, level=6):
+    """Compress a stream of strings in the gzip format.
+
+    :param chunks: an iterable of strings.
+    :param level: the compression level.
+    :return: a generator of compressed bytes.
+    """
+    # 16 + MAX_WBITS: gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -19,11 +19,15 @@
 
 from __future__ import absolute_import, print_function
 
+import os
+import time
+
 from celery import shared_task
 from flask import current_app
 
-from .api import Item
-from .utils import get_provisional_items_pids_candidate_to_delete
+from .api import Item, ItemsSearch
+from .utils import get_inventory_export_path, \
+    get_provisional_items_pids_candidate_to_delete
 from ..api import IlsRecordError
 from ..holdings.api import Holding
 from ..utils import extracted_data_from_ref, set_timestamp
@@ -144,3 +148,54 @@ def delete_holding(holding_pid, force=False, dbcommit=True, delindex=True):
                                delindex=delindex)
         except IlsRecordError.NotDeleted:
             current_app.logger.warning(f'Holding not deleted: {holding_pid}')
+
+
+@shared_task(ignore_result=True)
+def export_inventory(export_id, query, organisation_pid, language):
+    """Export an inventory list into a gzip compressed CSV file.
+
+    The export is written into a `.part` file renamed once complete. On
+    error, the message is written into an `.error` file. The exports older
+    than `RERO_ILS_INVENTORY_EXPORT_TTL` are removed.
+
+    :param export_id: the export identifier.
+    :param query: the items search body (see `Search.to_dict`).
+    :param organisation_pid: the organisation pid of the export.
+    :param language: the language of the contribution names.
+    :return: the path of the export file.
+    """
+    from .serializers import csv_item
+    from .serializers.response import gzip_stream
+
+    path = get_inventory_export_path(organisation_pid, export_id)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # remove the expired exports
+    limit = time.time() - current_app.config.get(
+        'RERO_ILS_INVENTORY_EXPORT_TTL', 86400)
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < limit:
+            os.remove(entry.path)
+
+    search = ItemsSearch().update_from_dict(query)
+    start = time.time()
+    try:
+        with open(f'{path}.part', 'wb') as export_file:
+            for data in gzip_stream(csv_item.generate_csv(
+                    search.scan(), language,
+                    organisation_pid=organisation_pid)):
+                export_file.write(data)
+        os.replace(f'{path}.part', path)
+    except Exception as error:
+        current_app.logger.error(
+            f'Inventory export error: {export_id} {error}')
+        with open(f'{path}.error', 'w') as error_file:
+            error_file.write(str(error))
+        if os.path.exists(f'{path}.part'):
+            os.remove(f'{path}.part')
+        raise
+    set_timestamp(
+        'inventory-export', export_id=export_id,
+        organisation_pid=organisation_pid,
+        duration=round(time.time() - start, 3))
+    return path
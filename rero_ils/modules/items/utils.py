@@ -17,6 +17,9 @@
 
 """Item utils."""
 
+import os
+
+from flask import current_app
 
 from rero_ils.modules.items.models import ItemStatus, TypeOfItem
 from rero_ils.modules.locations.api import LocationsSearch
@@ -115,3 +118,16 @@ def get_provisional_items_pids_candidate_to_delete():
         .source('pid')
     for hit in query.scan():
         yield hit.pid
+
+
+def get_inventory_export_path(organisation_pid, export_id):
+    """Get the file path of an asynchronous inventory list export.
+
+    :param organisation_pid: the organisation pid of the export.
+    :param export_id: the export identifier.
+    :return: the path of the gzip compressed CSV file.
+    """
+    directory = current_app.config.get('RERO_ILS_INVENTORY_EXPORT_DIR') \
+        or os.path.join(current_app.instance_path, 'inventory')
+    return os.path.join(
+        directory, str(organisation_pid), f'{export_id}.csv.gz')
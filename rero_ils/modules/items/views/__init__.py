@@ -21,7 +21,8 @@
 from __future__ import absolute_import
 
 from .api_views import api_blueprint
-from .rest import InventoryListResource
+from .rest import InventoryExportResource, InventoryListResource, \
+    inventory_export_file
 
 inventory_list = InventoryListResource.as_view(
     'inventory_search'
@@ -30,6 +31,15 @@ api_blueprint.add_url_rule(
     '/inventory',
     view_func=inventory_list
 )
+api_blueprint.add_url_rule(
+    '/inventory/export',
+    view_func=InventoryExportResource.as_view('inventory_export'),
+    methods=['POST']
+)
+api_blueprint.add_url_rule(
+    '/inventory/export/<uuid:export_id>',
+    view_func=inventory_export_file
+)
 
 blueprints = [
     api_blueprint,
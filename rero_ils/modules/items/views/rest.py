@@ -20,12 +20,20 @@
 
 from __future__ import absolute_import, print_function
 
+import os
 from functools import partial
+from uuid import uuid4
 
+from flask import abort, jsonify, send_file, url_for
 from invenio_rest import ContentNegotiatedMethodView
 
+from rero_ils.modules.decorators import check_logged_as_librarian
 from rero_ils.modules.items.api import ItemsSearch
 from rero_ils.modules.items.serializers import csv_item_search
+from rero_ils.modules.items.serializers.csv import get_language
+from rero_ils.modules.items.tasks import export_inventory
+from rero_ils.modules.items.utils import get_inventory_export_path
+from rero_ils.modules.patrons.api import current_librarian
 from rero_ils.query import items_search_factory
 
 
@@ -62,3 +70,64 @@ class InventoryListResource(ContentNegotiatedMethodView):
             pid_fetcher=None,
             search_result=search.scan()
         )
+
+
+class InventoryExportResource(InventoryListResource):
+    """Inventory list asynchronous export REST resource.
+
+    The export of large inventory lists is done by a celery task writing a
+    gzip compressed CSV file (see `export_inventory`).
+    """
+
+    decorators = [check_logged_as_librarian]
+
+    def post(self, **kwargs):
+        """Start the export of the inventory list."""
+        search, qs_kwargs = self.search_factory(ItemsSearch())
+        organisation_pid = current_librarian.organisation_pid
+        search = search.filter('term', organisation__pid=organisation_pid)
+        query = search.to_dict()
+        query.pop('aggs', None)
+
+        export_id = str(uuid4())
+        path = get_inventory_export_path(organisation_pid, export_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the export is running until the file is complete
+        open(f'{path}.part', 'wb').close()
+        export_inventory.delay(
+            export_id, query, organisation_pid, get_language())
+        response = jsonify({
+            'id': export_id,
+            'links': {
+                'self': url_for('api_item.inventory_export_file',
+                                export_id=export_id, _external=True)
+            }
+        })
+        # the content negotiation is bypassed for a response object
+        response.status_code = 202
+        return response
+
+
+@check_logged_as_librarian
+def inventory_export_file(export_id):
+    """Get an asynchronous export of the inventory list.
+
+    :param export_id: the export identifier.
+    :return: the gzip compressed CSV file if the export is complete, its
+             status otherwise.
+    """
+    path = get_inventory_export_path(
+        current_librarian.organisation_pid, export_id)
+    if os.path.exists(path):
+        return send_file(
+            path, mimetype='application/gzip', as_attachment=True,
+            attachment_filename=f'{export_id}-inventory.csv.gz')
+    if os.path.exists(f'{path}.part'):
+        return jsonify({'id': str(export_id), 'status': 'running'}), 202
+    if os.path.exists(f'{path}.error'):
+        with open(f'{path}.error') as error_file:
+            return jsonify({
+                'id': str(export_id),
+                'status': f'error: {error_file.read()}'
+            }), 500
+    abort(404)
@@ -19,6 +19,121 @@
 
 from flask import current_app
 from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from sqlalchemy import and_, event, or_
+
+from .cache import SnapshotCache
+
+# process cache of the resolved persistent identifiers (see `get_pids_cache`)
+_pids_cache = None
+
+
+def get_pids_cache():
+    """Get the persistent identifiers cache of the current process.
+
+    The cache stores the (status, pid value) of the persistent identifiers by
+    (pid_type, pid). An entry is invalidated when the status of its
+    persistent identifier changes in the current process, the time to live
+    bounds the staleness for the other processes.
+
+    :returns: the ``SnapshotCache``.
+    """
+    global _pids_cache
+    if _pids_cache is None:
+        config = current_app.config
+        _pids_cache = SnapshotCache(
+            maxsize=config.get('RERO_ILS_JSONRESOLVER_CACHE_SIZE', 100000),
+            ttl=config.get('RERO_ILS_JSONRESOLVER_CACHE_TTL', 300)
+        )
+    return _pids_cache
+
+
+def get_pid_status(pid_type, pid):
+    """Get the status of a persistent identifier.
+
+    :param pid_type: type of pid
+    :param pid: pid value
+    :return: a (status, pid value) tuple.
+    :raise PIDDoesNotExistError: if the pid does not exist.
+    """
+    cache = get_pids_cache()
+    value = cache.get(pid_type, pid)
+    if value is None:
+        persistent_id = PersistentIdentifier.get(pid_type, pid)
+        value = (persistent_id.status, persistent_id.pid_value)
+        cache.set(pid_type, pid, value)
+    return value
+
+
+def iter_json_refs(data):
+    """Iterate over the `$ref` of a record.
+
+    :param data: a record or any json data.
+    :return: a generator of the `$ref` values.
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == '$ref' and isinstance(value, str):
+                yield value
+            else:
+                yield from iter_json_refs(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from iter_json_refs(value)
+
+
+def prewarm_json_refs(refs):
+    """Load the persistent identifiers of several `$ref` in one query.
+
+    The `$ref` are then resolved from the cache (see `resolve_json_refs`).
+
+    :param refs: an iterable of `$ref` values.
+    :return: the number of loaded persistent identifiers.
+    """
+    from .utils import extracted_data_from_ref, get_endpoint_configuration
+    cache = get_pids_cache()
+    pids_by_type = {}
+    for ref in set(refs):
+        resource = extracted_data_from_ref(ref, data='resource')
+        pid = extracted_data_from_ref(ref, data='pid')
+        configuration = get_endpoint_configuration(resource) \
+            if resource else None
+        if not pid or not configuration:
+            continue
+        pid_type = configuration['pid_type']
+        if cache.get(pid_type, pid) is None:
+            pids_by_type.setdefault(pid_type, set()).add(pid)
+    if not pids_by_type:
+        return 0
+    query = PersistentIdentifier.query.filter(or_(*[
+        and_(
+            PersistentIdentifier.pid_type == pid_type,
+            PersistentIdentifier.pid_value.in_(list(pids))
+        )
+        for pid_type, pids in pids_by_type.items()
+    ])).with_entities(
+        PersistentIdentifier.pid_type,
+        PersistentIdentifier.pid_value,
+        PersistentIdentifier.status
+    )
+    count = 0
+    for pid_type, pid_value, status in query:
+        cache.set(pid_type, pid_value, (status, pid_value))
+        count += 1
+    return count
+
+
+@event.listens_for(PersistentIdentifier.status, 'set')
+def invalidate_pid_status(target, value, oldvalue, initiator):
+    """Invalidate the cached status of a persistent identifier."""
+    if _pids_cache is not None and value != oldvalue:
+        _pids_cache.invalidate(target.pid_type, target.pid_value)
+
+
+@event.listens_for(PersistentIdentifier, 'after_delete')
+def invalidate_deleted_pid(mapper, connection, target):
+    """Invalidate the cached status of a removed persistent identifier."""
+    if _pids_cache is not None:
+        _pids_cache.invalidate(target.pid_type, target.pid_value)
 
 
 def resolve_json_refs(pid_type, pid, raise_on_error=True):
@@ -29,13 +144,13 @@ def resolve_json_refs(pid_type, pid, raise_on_error=True):
     :return: resolved persistent identifier
     """
     try:
-        persistent_id = PersistentIdentifier.get(pid_type, pid)
+        status, pid_value = get_pid_status(pid_type, pid)
     except Exception:
         current_app.logger.error(f'Unable to resolve {pid_type} pid: {pid}')
     else:
-        if persistent_id.status == PIDStatus.REGISTERED:
+        if status == PIDStatus.REGISTERED:
             return dict(
-                pid=persistent_id.pid_value,
+                pid=pid_value,
                 type=pid_type
             )
         base_item_route = current_app.config.get(
@@ -43,7 +158,8 @@ def resolve_json_refs(pid_type, pid, raise_on_error=True):
         ).get(pid_type, {}).get('item_route', '/???')
         item_route_parts = ['api'] + base_item_route.split('/')[1:-1] + [pid]
         item_route = '/'.join(item_route_parts)
-        msg = f' Resolve {pid_type}: {item_route} {persistent_id}'
+        msg = f' Resolve {pid_type}: {item_route} {pid_type}:{pid_value} ' \
+            f'({status})'
         current_app.logger.error(msg)
     if raise_on_error:
         raise Exception(f'Unable to resolve {pid_type} pid: {pid}')
@@ -23,8 +23,8 @@ from functools import partial
 
 import pytz
 from dateutil import parser
-from dateutil.rrule import FREQNAMES, rrule
 
+from .calendar import LibraryCalendar
 from .exceptions import LibraryNeverOpen
 from .models import LibraryAddressType, LibraryIdentifier, LibraryMetadata
 from ..api import IlsRecord, IlsRecordsIndexer, IlsRecordsSearch
@@ -32,7 +32,7 @@ from ..fetchers import id_fetcher
 from ..locations.api import LocationsSearch
 from ..minters import id_minter
 from ..providers import Provider
-from ..utils import date_string_to_utc, sorted_pids, strtotime
+from ..utils import date_string_to_utc, sorted_pids
 
 # provider
 LibraryProvider = type(
@@ -74,6 +74,7 @@ class Library(IlsRecord):
     fetcher = library_id_fetcher
     provider = LibraryProvider
     model_cls = LibraryMetadata
+    enable_identity_map = True
     pids_exist_check = {
         'required': {
             'org': 'organisation'
@@ -156,22 +157,6 @@ class Library(IlsRecord):
         except StopIteration:
             return next(self.location_pids()).pid
 
-    def _is_betweentimes(self, time_to_test, times):
-        """Test if time is between times."""
-        times_open = False
-        for time_given in times:
-            start_time = strtotime(time_given['start_time'])
-            end_time = strtotime(time_given['end_time'])
-
-            if time_to_test.hour == time_to_test.minute == \
-                    time_to_test.second == 0:
-                # case when library is open or close few hours per day
-                times_open = times_open or end_time > start_time
-            else:
-                times_open = times_open or ((time_to_test >= start_time) and
-                                            (time_to_test <= end_time))
-        return times_open
-
     def _has_is_open(self):
         """Test if library has opening days."""
         opening_hours = self.get('opening_hours')
@@ -186,92 +171,36 @@ class Library(IlsRecord):
                     return True
         return False
 
-    def _get_exceptions_matching_date(self, date_to_check, day_only=False):
-        """Get all exception matching a given date."""
-        for exception in self.get('exception_dates', []):
-            # Get the start date and the gap (in days) between start date and
-            # end date. If no end_date are supplied, the gap will be 0.
-            start_date = date_string_to_utc(exception['start_date'])
-            end_date = start_date
-            day_gap = 0
-            if exception.get('end_date'):
-                end_date = date_string_to_utc(exception.get('end_date'))
-                day_gap = (end_date - start_date).days
-
-            # If the exception is repeatable, then the start_date should be the
-            # nearest date (lower or equal than date_to_check) related to the
-            # repeat period/interval definition. To know that, we need to know
-            # all exception dates possible (form exception start_date to
-            # date_to_check) and get only the last one.
-            if exception.get('repeat'):
-                period = exception['repeat']['period'].upper()
-                exception_dates = rrule(
-                    freq=FREQNAMES.index(period),
-                    until=date_to_check,
-                    interval=exception['repeat']['interval'],
-                    dtstart=start_date
-                )
-                for start_date in exception_dates:
-                    pass
-                end_date = start_date + timedelta(days=day_gap)
-
-            # Now, check if exception is matching for the date_to_check
-            # If exception defined times, we need to check if the date_to_check
-            # is includes into theses time intervals (only if `day_only` method
-            # argument is set)
-            if start_date.date() <= date_to_check.date() <= end_date.date():
-                if exception.get('times') and not day_only:
-                    times = exception.get('times')
-                    if self._is_betweentimes(date_to_check.time(), times):
-                        yield exception
-                else:
-                    yield exception
-
-    def is_open(self, date=None, day_only=False):
-        """Test library is open."""
-        date = date or datetime.now(pytz.utc)
-        is_open = False
-        rule_hours = []
+    @property
+    def calendar(self):
+        """Get the compiled opening calendar of the library."""
+        return LibraryCalendar.get_calendar(self)
 
-        # First of all, change date to be aware and with timezone.
+    @staticmethod
+    def _to_utc_datetime(date):
+        """Get an aware datetime from a date (string or naive datetime)."""
         if isinstance(date, str):
             date = date_string_to_utc(date)
         if isinstance(date, datetime) and date.tzinfo is None:
             date = date.replace(tzinfo=pytz.utc)
+        return date
 
-        # STEP 1 :: check about regular rules
-        #   Each library could defined if a specific weekday is open or closed.
-        #   Check into this weekday array if the day is open/closed. If the
-        #   searched weekday isn't defined the default value is closed
-        #
-        #   If the find rule defined open time periods, check if date_to_check
-        #   is into this periods (depending of `day_only` method argument).
-        day_name = date.strftime("%A").lower()
-        regular_rule = [
-            rule for rule in self['opening_hours']
-            if rule['day'] == day_name
-        ]
-        if regular_rule:
-            is_open = regular_rule[0].get('is_open', False)
-            rule_hours = regular_rule[0].get('times', [])
-
-        if is_open and not day_only:
-            is_open = self._is_betweentimes(date.time(), rule_hours)
-
-        # STEP 2 :: test each exceptions
-        #   Each library can defined a set of exception dates. These exceptions
-        #   could be repeatable for a specific interval. Check is some
-        #   exceptions are relevant related to date_to_check and if these
-        #   exception changed the behavior of regular rules.
-        #
-        #   Each exception can defined open time periods, check if
-        #   date_to_check is into this periods (depending of `day_only`
-        #   method argument)
-        for exception in self._get_exceptions_matching_date(date, day_only):
-            if is_open != exception['is_open']:
-                is_open = not is_open
-
-        return is_open
+    def is_open(self, date=None, day_only=False):
+        """Test library is open.
+
+        The regular opening hours define if a weekday is open or closed (a
+        non defined weekday is closed). Exception dates (possibly repeatable)
+        could change this behavior. If `day_only` isn't set, the opening
+        periods of the regular rule and the exceptions are checked too.
+
+        :param date: the date to check, default to now.
+        :param day_only: if True, only check the day (not the time).
+        :return True if the library is open.
+        """
+        date = self._to_utc_datetime(date or datetime.now(pytz.utc))
+        if day_only:
+            return self.calendar.is_open_day(date.date())
+        return self.calendar.is_open(date)
 
     def _get_opening_hour_by_day(self, day_name):
         """Get the library opening hour for a specific day."""
@@ -290,10 +219,8 @@ class Library(IlsRecord):
             raise LibraryNeverOpen
         if isinstance(date, str):
             date = parser.parse(date)
-        add_day = -1 if previous else 1
-        date += timedelta(days=add_day)
-        while not self.is_open(date=date, day_only=True):
-            date += timedelta(days=add_day)
+        next_day = self.calendar.next_open_day(date.date(), previous)
+        date += timedelta(days=(next_day - date.date()).days)
         if not ensure:
             return date
         opening_hour = self._get_opening_hour_by_day(date.strftime('%A'))
@@ -314,10 +241,11 @@ class Library(IlsRecord):
         if isinstance(end_date, str):
             end_date = date_string_to_utc(end_date)
 
+        calendar = self.calendar
         dates = []
         end_date += timedelta(days=1)
         while end_date > start_date:
-            if self.is_open(date=start_date, day_only=True):
+            if calendar.is_open_day(start_date.date()):
                 dates.append(start_date)
             start_date += timedelta(days=1)
         return dates
@@ -326,18 +254,34 @@ class Library(IlsRecord):
         """Get number of open day between date interval."""
         start_date = start_date or datetime.now(pytz.utc)
         end_date = end_date or datetime.now(pytz.utc)
-        return len(self.get_open_days(start_date, end_date))
+        if isinstance(start_date, str):
+            start_date = date_string_to_utc(start_date)
+        if isinstance(end_date, str):
+            end_date = date_string_to_utc(end_date)
+        # Same days as `get_open_days`: each day from `start_date` (by step
+        # of one day) lower than the day after `end_date`.
+        interval = end_date + timedelta(days=1) - start_date
+        if interval <= timedelta(0):
+            return 0
+        days = interval.days
+        if interval.seconds or interval.microseconds:
+            days += 1
+        return self.calendar.count_open(
+            start_date.date(),
+            start_date.date() + timedelta(days=days - 1)
+        )
 
     def in_working_days(self, count, date=None):
         """Get date for given working days."""
         date = date or datetime.now(pytz.utc)
-        counting = 1
         if isinstance(date, str):
             date = date_string_to_utc(date)
-        while counting <= count:
-            counting += 1
-            date = self.next_open(date=date)
-        return date
+        if count < 1:
+            return date
+        if not self._has_is_open():
+            raise LibraryNeverOpen
+        next_day = self.calendar.nth_open_day(date.date(), count)
+        return date + timedelta(days=(next_day - date.date()).days)
 
     def get_links_to_me(self, get_pids=False):
         """Record links.
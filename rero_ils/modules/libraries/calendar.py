@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled opening calendar for libraries."""
+
+import hashlib
+from datetime import date, timedelta
+from itertools import accumulate
+from json import dumps
+
+from dateutil.rrule import FREQNAMES, rrule
+
+from ..utils import date_string_to_utc, strtotime
+
+WEEKDAYS = [
+    'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday',
+    'sunday'
+]
+
+
+def is_between_times(time_to_test, times):
+    """Test if time is between times.
+
+    :param time_to_test: the `datetime.time` to test.
+    :param times: a list of opening periods (`start_time`, `end_time`).
+    :return True if the time is included into one of the opening periods.
+    """
+    times_open = False
+    for time_given in times:
+        start_time = strtotime(time_given['start_time'])
+        end_time = strtotime(time_given['end_time'])
+
+        if time_to_test.hour == time_to_test.minute == \
+                time_to_test.second == 0:
+            # case when library is open or close few hours per day
+            times_open = times_open or end_time > start_time
+        else:
+            times_open = times_open or ((time_to_test >= start_time) and
+                                        (time_to_test <= end_time))
+    return times_open
+
+
+class LibraryCalendar:
+    """Compiled opening calendar of a library.
+
+    The regular opening hours and all the (repeatable) exception dates of a
+    library are compiled, year by year, into an open/closed day bitmap. Each
+    compiled year also keeps the exceptions matching each day (needed to
+    check the opening times) and the cumulative number of open days (to
+    count open days between two dates without iterating over them).
+
+    The calendars are kept in the process memory and rebuilt as soon as the
+    library opening hours or exception dates change.
+    """
+
+    # process calendars :: library pid --> LibraryCalendar
+    _calendars = {}
+
+    def __init__(self, opening_hours=None, exception_dates=None,
+                 fingerprint=None):
+        """Initialize the calendar.
+
+        :param opening_hours: the library regular opening hours.
+        :param exception_dates: the library exception dates.
+        :param fingerprint: the library calendar data fingerprint.
+        """
+        self.fingerprint = fingerprint
+        self.regular_rules = {}
+        for rule in opening_hours or []:
+            self.regular_rules.setdefault(WEEKDAYS.index(rule['day']), rule)
+        self.exceptions = []
+        for exception in exception_dates or []:
+            start_date = date_string_to_utc(exception['start_date'])
+            day_gap = 0
+            if exception.get('end_date'):
+                end_date = date_string_to_utc(exception['end_date'])
+                day_gap = (end_date - start_date).days
+            self.exceptions.append((exception, start_date, day_gap))
+        # compiled years :: year --> (open days, exceptions by day, counts)
+        self._years = {}
+
+    @staticmethod
+    def get_fingerprint(library):
+        """Get the fingerprint of the library calendar data.
+
+        :param library: the library.
+        :return a hash of the library opening hours and exception dates.
+        """
+        data = dumps(
+            [library.get('opening_hours'), library.get('exception_dates')],
+            sort_keys=True
+        )
+        return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_calendar(cls, library):
+        """Get the up to date compiled calendar of a library.
+
+        :param library: the library.
+        :return the ``LibraryCalendar`` of the library.
+        """
+        fingerprint = cls.get_fingerprint(library)
+        calendar = cls._calendars.get(library.pid)
+        if calendar is None or calendar.fingerprint != fingerprint:
+            calendar = cls(
+                opening_hours=library.get('opening_hours'),
+                exception_dates=library.get('exception_dates'),
+                fingerprint=fingerprint
+            )
+            cls._calendars[library.pid] = calendar
+        return calendar
+
+    def _exception_start_days(self, exception, start_date, day_gap, first,
+                              last):
+        """Get the start days of an exception impacting a day interval.
+
+        :param exception: the exception date.
+        :param start_date: the exception start date.
+        :param day_gap: the exception length (in days).
+        :param first: the first day of the interval.
+        :param last: the last day of the interval.
+        :return a generator of exception start days.
+        """
+        if not exception.get('repeat'):
+            yield start_date.date()
+            return
+        period = exception['repeat']['period'].upper()
+        occurrences = rrule(
+            freq=FREQNAMES.index(period),
+            interval=exception['repeat']['interval'],
+            dtstart=start_date
+        )
+        for occurrence in occurrences:
+            day = occurrence.date()
+            if day > last:
+                return
+            if day + timedelta(days=day_gap) >= first:
+                yield day
+
+    def _compile_year(self, year):
+        """Compile the calendar of a year.
+
+        :param year: the year to compile.
+        :return a tuple with open days bitmap, the exceptions of each day and
+                the cumulative count of open days.
+        """
+        first = date(year, 1, 1)
+        last = date(year, 12, 31)
+        open_days = bytearray(
+            bool(self.regular_rules.get(
+                (first + timedelta(days=idx)).weekday(), {}
+            ).get('is_open'))
+            for idx in range((last - first).days + 1)
+        )
+        # The last exception matching a day defines if the day is open.
+        day_exceptions = {}
+        for exception, start_date, day_gap in self.exceptions:
+            for day in self._exception_start_days(
+                    exception, start_date, day_gap, first, last):
+                for offset in range(day_gap + 1):
+                    idx = (day - first).days + offset
+                    if not 0 <= idx < len(open_days):
+                        continue
+                    exceptions = day_exceptions.setdefault(idx, [])
+                    if not exceptions or exceptions[-1] is not exception:
+                        exceptions.append(exception)
+                    open_days[idx] = bool(exception['is_open'])
+        counts = list(accumulate(open_days))
+        return open_days, day_exceptions, counts
+
+    def _get_year(self, year):
+        """Get a compiled year, compile it if needed."""
+        if year not in self._years:
+            self._years[year] = self._compile_year(year)
+        return self._years[year]
+
+    def is_open_day(self, day):
+        """Test if the library is open for a day.
+
+        :param day: the `datetime.date` to test.
+        :return True if the library is open this day.
+        """
+        open_days, _, _ = self._get_year(day.year)
+        return bool(open_days[day.timetuple().tm_yday - 1])
+
+    def is_open(self, date_to_check):
+        """Test if the library is open at a specific time.
+
+        :param date_to_check: the `datetime.datetime` to test.
+        :return True if the library is open.
+        """
+        day = date_to_check.date()
+        time_to_check = date_to_check.time()
+        _, day_exceptions, _ = self._get_year(day.year)
+        rule = self.regular_rules.get(day.weekday(), {})
+        is_open = bool(rule.get('is_open')) and \
+            is_between_times(time_to_check, rule.get('times', []))
+        for exception in day_exceptions.get(day.timetuple().tm_yday - 1, []):
+            times = exception.get('times')
+            if not times or is_between_times(time_to_check, times):
+                is_open = bool(exception['is_open'])
+        return is_open
+
+    def count_open(self, start_day, end_day):
+        """Count the open days between two days (both included).
+
+        :param start_day: the first `datetime.date` of the interval.
+        :param end_day: the last `datetime.date` of the interval.
+        :return the number of open days.
+        """
+        count = 0
+        if start_day > end_day:
+            return count
+        for year in range(start_day.year, end_day.year + 1):
+            _, _, counts = self._get_year(year)
+            first = start_day.timetuple().tm_yday - 1 \
+                if year == start_day.year else 0
+            last = end_day.timetuple().tm_yday - 1 \
+                if year == end_day.year else len(counts) - 1
+            count += counts[last] - (counts[first - 1] if first else 0)
+        return count
+
+    def next_open_day(self, day, previous=False):
+        """Get the next open day.
+
+        :param day: the `datetime.date` to start from (excluded).
+        :param previous: if True, get the previous open day.
+        :return the next (or previous) open `datetime.date`.
+        """
+        step = timedelta(days=-1 if previous else 1)
+        day += step
+        while not self.is_open_day(day):
+            day += step
+        return day
+
+    def nth_open_day(self, day, count):
+        """Get the nth open day after a day.
+
+        :param day: the `datetime.date` to start from (excluded).
+        :param count: the number of open days to skip.
+        :return the nth open `datetime.date` after the day.
+        """
+        for _ in range(count):
+            day = self.next_open_day(day)
+        return day
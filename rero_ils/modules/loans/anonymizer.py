@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Batch anonymisation of the concluded loans."""
+
+import math
+from datetime import datetime, timedelta
+from itertools import islice
+
+import ciso8601
+from flask import current_app
+from invenio_db import db
+from invenio_userprofiles.models import UserProfile
+
+from .api import Loan, LoansIndexer, LoansSearch
+from .logs.api import LoanOperationLog
+from .models import LoanState
+from ..notifications.api import NotificationsSearch
+from ..patron_transactions.api import PatronTransactionsSearch
+from ..patrons.api import PatronsSearch
+from ..utils import set_timestamp
+
+
+class LoanAnonymizer:
+    """Anonymize the concluded loans by chunks.
+
+    The candidate loans are read from the loans index. For each chunk of
+    loans, the loans with open events (open fees of their notifications) are
+    found with one aggregation and the `keep_history` settings of the
+    patrons are loaded with one search and one SQL query. The eligible loans
+    (see ``Loan.can_anonymize``) of a chunk are then anonymized with one
+    commit, then the operation logs of the committed loans with one bulk
+    request and the loans are indexed with one bulk request.
+
+    As the anonymized loans are no more candidates, an interrupted
+    anonymisation restarts where it stopped. The progress is exported with
+    the `anonymize-loans-progress` timestamp.
+
+        # >>> LoanAnonymizer().run()
+        # >>>   {'processed': 1200, 'anonymized': 1150}
+    """
+
+    def __init__(self, tstamp=None, chunk_size=None):
+        """Constructor.
+
+        :param tstamp: the execution time (default: `datetime.utcnow()`).
+        :param chunk_size: the number of loans processed at once.
+        """
+        config = current_app.config
+        self.tstamp = tstamp or datetime.utcnow()
+        self.chunk_size = chunk_size or config.get(
+            'RERO_ILS_ANONYMISATION_CHUNK_SIZE', 1000)
+        self.min_limit = config.get(
+            'RERO_ILS_ANONYMISATION_MIN_TIME_LIMIT', -math.inf)
+        self.max_limit = config.get(
+            'RERO_ILS_ANONYMISATION_MAX_TIME_LIMIT', math.inf)
+        self.counters = {'processed': 0, 'anonymized': 0}
+
+    def get_candidate_loans(self):
+        """Get the concluded loans old enough to be anonymized.
+
+        :return: a generator of loan data.
+        """
+        query = LoansSearch() \
+            .filter('terms', state=LoanState.CONCLUDED) \
+            .filter('term', to_anonymize=False) \
+            .source(['pid', 'patron_pid', 'transaction_date'])
+        if not math.isinf(self.min_limit):
+            max_date = self.tstamp - timedelta(days=self.min_limit + 1)
+            query = query.filter(
+                'range', transaction_date={'lt': max_date.isoformat()})
+        for hit in query.scan():
+            yield hit.to_dict()
+
+    def run(self, dbcommit=True, reindex=True):
+        """Anonymize all the eligible loans.
+
+        :param dbcommit: commit the changes in the db after each chunk.
+        :param reindex: index the anonymized loans of each chunk.
+        :return: the number of processed and anonymized loans.
+        """
+        loans = self.get_candidate_loans()
+        chunk = list(islice(loans, self.chunk_size))
+        while chunk:
+            pids = self.get_eligible_pids(chunk)
+            count = self.anonymize(pids, dbcommit=dbcommit, reindex=reindex)
+            self.counters['processed'] += len(chunk)
+            self.counters['anonymized'] += count
+            set_timestamp('anonymize-loans-progress', **self.counters)
+            chunk = list(islice(loans, self.chunk_size))
+        return self.counters
+
+    def get_eligible_pids(self, loans):
+        """Get the loans of a chunk that can be anonymized.
+
+        :param loans: a list of concluded loan data.
+        :return: the list of the loan pids to anonymize.
+        """
+        open_pids = self._get_loans_with_open_events(
+            [loan['pid'] for loan in loans])
+        ages = {}
+        for loan in loans:
+            transaction_date = ciso8601.parse_datetime(
+                loan['transaction_date'])
+            ages[loan['pid']] = \
+                (self.tstamp - transaction_date.replace(tzinfo=None)).days
+        # the patron settings are only needed between the limits
+        keep_history = self._get_keep_history({
+            loan.get('patron_pid') for loan in loans
+            if self.min_limit + 1 <= ages[loan['pid']] <= self.max_limit
+        })
+        pids = []
+        for loan in loans:
+            age = ages[loan['pid']]
+            if loan['pid'] in open_pids or age < self.min_limit + 1:
+                continue
+            if age > self.max_limit or \
+                    not keep_history.get(loan.get('patron_pid'), True):
+                pids.append(loan['pid'])
+        return pids
+
+    def anonymize(self, pids, dbcommit=True, reindex=True):
+        """Anonymize a chunk of loans.
+
+        :param pids: the loan pids.
+        :param dbcommit: commit the changes in the db.
+        :param reindex: index the anonymized loans.
+        :return: the number of anonymized loans.
+        """
+        if not pids:
+            return 0
+        loans = []
+        for loan in Loan.get_records_by_pids(pids):
+            loan['to_anonymize'] = True
+            try:
+                # a failing loan does not roll back the others of the chunk
+                with db.session.begin_nested():
+                    loan._invalidate_identity_map()
+                    loan.commit()
+            except Exception as err:
+                current_app.logger.error(
+                    f'Can not anonymize loan: {loan.pid} {err}')
+                continue
+            loans.append(loan)
+        if dbcommit:
+            db.session.commit()
+        # the logs are only anonymized for the committed loans
+        pids = [loan.pid for loan in loans]
+        try:
+            LoanOperationLog.bulk_anonymize_logs(pids)
+        except Exception as err:
+            current_app.logger.error(
+                f'Can not anonymize the logs of the loans: {pids} {err}')
+        if dbcommit and reindex:
+            LoansIndexer().bulk_index_records(loans)
+        return len(loans)
+
+    @staticmethod
+    def _get_loans_with_open_events(pids):
+        """Get the loans with open fees.
+
+        :param pids: the loan pids.
+        :return: the set of the loan pids having open fees.
+        """
+        notifications = {
+            hit.pid: hit.context.loan.pid
+            for hit in NotificationsSearch()
+            .filter('terms', context__loan__pid=pids)
+            .source(['pid', 'context.loan.pid'])
+            .scan()
+        }
+        if not notifications:
+            return set()
+        search = PatronTransactionsSearch() \
+            .filter('terms', notification__pid=list(notifications)) \
+            .filter('term', status='open') \
+            .extra(size=0)
+        search.aggs.bucket('notifications', 'terms',
+                           field='notification.pid', size=len(notifications))
+        buckets = search.execute().aggregations.notifications.buckets
+        return {notifications[bucket.key] for bucket in buckets}
+
+    @staticmethod
+    def _get_keep_history(patron_pids):
+        """Get the `keep_history` setting of some patrons.
+
+        :param patron_pids: the patron pids.
+        :return: the `keep_history` setting by patron pid, the unknown
+                 patrons are missing.
+        """
+        patron_pids = [pid for pid in patron_pids if pid]
+        if not patron_pids:
+            return {}
+        user_ids = {
+            hit.pid: hit.to_dict().get('user_id')
+            for hit in PatronsSearch()
+            .filter('terms', pid=patron_pids)
+            .source(['pid', 'user_id'])
+            .scan()
+        }
+        profiles = {
+            profile.user_id: profile.keep_history
+            for profile in UserProfile.query.filter(UserProfile.user_id.in_(
+                [uid for uid in user_ids.values() if uid is not None]))
+        }
+        return {
+            pid: profiles[user_id]
+            for pid, user_id in user_ids.items() if user_id in profiles
+        }
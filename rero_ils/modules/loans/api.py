@@ -946,8 +946,7 @@ class Loan(IlsRecord):
                  Q('range', transaction_date={'lt': three_month_ago}))
             ]) \
             .source(['pid'])
-        for hit in query.scan():
-            yield Loan.get_record_by_pid(hit.pid)
+        yield from Loan.get_records_by_pids(hit.pid for hit in query.scan())
 
     @classmethod
     def concluded(cls, loan):
@@ -1177,8 +1176,7 @@ def get_due_soon_loans(tstamp=None):
         .params(preserve_order=True) \
         .sort({'_created': {'order': 'asc'}}) \
         .source(['pid']).scan()
-    for hit in query:
-        yield Loan.get_record_by_pid(hit.pid)
+    yield from Loan.get_records_by_pids(hit.pid for hit in query)
 
 
 def get_expired_request(tstamp=None):
@@ -1192,8 +1190,7 @@ def get_expired_request(tstamp=None):
         .filter('term', state=LoanState.ITEM_AT_DESK) \
         .filter('range', request_expire_date={'lte': end_date}) \
         .source(['pid']).scan()
-    for hit in query:
-        yield Loan.get_record_by_pid(hit.pid)
+    yield from Loan.get_records_by_pids(hit.pid for hit in query)
 
 
 def get_overdue_loan_pids(patron_pid=None, tstamp=None):
@@ -1229,8 +1226,8 @@ def get_overdue_loans(patron_pid=None, tstamp=None):
     :param tstamp: a timestamp to define the execution time of the function
     :return a generator of Loan
     """
-    for pid in get_overdue_loan_pids(patron_pid, tstamp):
-        yield Loan.get_record_by_pid(pid)
+    yield from Loan.get_records_by_pids(
+        get_overdue_loan_pids(patron_pid, tstamp))
 
 
 def loan_has_open_events(loan_pid=None):
@@ -35,6 +35,7 @@ from ..items.models import ItemStatus
 from ..items.utils import item_pid_to_object
 from ..libraries.api import Library
 from ..loans.api import Loan
+from ..loans.logs.api import LoanOperationLog
 from ..locations.api import Location
 from ..notifications.dispatcher import Dispatcher
 from ..notifications.models import NotificationType
@@ -96,6 +97,7 @@ def build_loan_record(transaction, transaction_type, item):
 @click.option('-d', '--debug', 'debug', is_flag=True, default=False)
 @click.argument('infile', type=click.File('r'))
 @with_appcontext
+@LoanOperationLog.batch()
 def load_virtua_transactions(
         infile, lazy, save_errors, transaction_type, verbose, debug):
     """Load Virtua circulation transactions.
@@ -201,6 +203,7 @@ def load_virtua_transactions(
 @click.option('-d', '--debug', 'debug', is_flag=True, default=False)
 @click.argument('infile', type=click.File('r'))
 @with_appcontext
+@LoanOperationLog.batch()
 def create_loans(infile, verbose, debug):
     """Create circulation transactions.
 
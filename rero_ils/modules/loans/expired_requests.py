@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Batch cancellation of the expired requests."""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+
+from flask import current_app
+from invenio_cache.proxies import current_cache
+from invenio_db import db
+
+from .api import LoansSearch
+from .models import LoanState
+from ..circ_policies.api import CircPoliciesSearch, CircPolicy
+from ..deferred_indexing import DeferredIndexing, deferred_indexing
+from ..identity_map import identity_map
+from ..item_types.api import ItemType
+from ..items.api import Item
+from ..libraries.api import Library
+from ..locations.api import Location
+from ..utils import set_timestamp
+
+
+@contextmanager
+def item_lock(item_pid, timeout=600):
+    """Lock an item for a circulation job.
+
+    The lock is shared by the processes using the same cache.
+
+    :param item_pid: the item pid.
+    :param timeout: the lock maximal duration (in seconds).
+    :returns: `True` if the lock is acquired, `False` if the item is already
+              locked.
+    """
+    key = f'circulation-item-lock-{item_pid}'
+    locked = current_cache.add(key, True, timeout=timeout)
+    try:
+        yield locked
+    finally:
+        if locked:
+            current_cache.delete(key)
+
+
+class ExpiredRequestCanceller:
+    """Cancel the expired requests by batches of items.
+
+    The expired requests are read from the loans index and grouped by item.
+    The items of a batch are distributed between a pool of threads. Each
+    thread loads its items with one query, the circulation policies,
+    libraries, locations and item types of its requests with one query by
+    type, then runs the cancellation of the requests item by item, with a
+    lock on the item.
+
+    The circulation actions search the loans: the loans are indexed by the
+    actions. The other records modified by the actions (see
+    `DEFERRED_PID_TYPES`) are indexed once at the end of the batch, even if
+    a thread fails: its unprocessed requests are then counted as errors.
+
+        # >>> ExpiredRequestCanceller().run()
+        # >>>   {'total': 12, 'cancelled': 12, 'locked': 0, 'errors': 0}
+    """
+
+    # the record types indexed at the end of a batch
+    DEFERRED_PID_TYPES = ['item', 'notif']
+
+    def __init__(self, tstamp=None, batch_size=None, workers=None):
+        """Constructor.
+
+        :param tstamp: the limit timestamp (default: `datetime.now()`).
+        :param batch_size: the number of items processed at once.
+        :param workers: the number of threads.
+        """
+        config = current_app.config
+        self.tstamp = tstamp or datetime.now()
+        self.batch_size = batch_size or config.get(
+            'RERO_ILS_EXPIRED_REQUESTS_BATCH_SIZE', 500)
+        self.workers = workers or config.get(
+            'RERO_ILS_EXPIRED_REQUESTS_WORKERS', 1)
+        self.counters = {'total': 0, 'cancelled': 0, 'locked': 0, 'errors': 0}
+
+    def get_expired_requests(self):
+        """Get the expired requests grouped by item.
+
+        :return: a list of (item pid, list of loan data) tuples.
+        """
+        end_date = self.tstamp.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        query = LoansSearch() \
+            .filter('term', state=LoanState.ITEM_AT_DESK) \
+            .filter('range', request_expire_date={'lte': end_date}) \
+            .source(['pid', 'item_pid', 'patron_pid', 'organisation',
+                     'transaction_location_pid', 'pickup_location_pid'])
+        requests = {}
+        for hit in query.scan():
+            loan = hit.to_dict()
+            item_pid = loan.get('item_pid', {}).get('value')
+            requests.setdefault(item_pid, []).append(loan)
+        return list(requests.items())
+
+    def run(self):
+        """Cancel all the expired requests.
+
+        :return: the counters of the processed requests.
+        """
+        requests = self.get_expired_requests()
+        for idx in range(0, len(requests), self.batch_size):
+            deferred = DeferredIndexing(self.DEFERRED_PID_TYPES)
+            try:
+                self.cancel_batch(
+                    requests[idx:idx + self.batch_size], deferred)
+            finally:
+                # the records committed by the threads are indexed anyway
+                deferred.flush()
+            set_timestamp('cancel-expired-request-progress', **self.counters)
+        return self.counters
+
+    def cancel_batch(self, requests, batch_deferred):
+        """Cancel the expired requests of a batch of items.
+
+        :param requests: a list of (item pid, list of loan data) tuples.
+        :param batch_deferred: the ``DeferredIndexing`` of the batch, filled
+                               with the records to index of each thread.
+        """
+        app = current_app._get_current_object()
+        workers = max(1, min(self.workers, len(requests)))
+        chunks = [requests[idx::workers] for idx in range(workers)]
+        lock = Lock()
+
+        def cancel_chunk(chunk, app_context=True):
+            """Cancel the requests of a thread."""
+            if app_context:
+                with app.app_context():
+                    return cancel_chunk(chunk, app_context=False)
+            counters = []
+            with identity_map() as records_map, \
+                    deferred_indexing(self.DEFERRED_PID_TYPES) as deferred:
+                try:
+                    items = {
+                        item.pid: item
+                        for item in Item.get_records_by_pids(
+                            item_pid for item_pid, _ in chunk)
+                    }
+                    self._prefetch(chunk, items.values(), records_map)
+                    for item_pid, loans in chunk:
+                        counters.append(self.cancel_item_requests(
+                            items.get(item_pid), loans))
+                except Exception as error:
+                    db.session.rollback()
+                    counters.append({
+                        'total': 0, 'cancelled': 0, 'locked': 0,
+                        'errors': sum(
+                            len(loans) for _, loans in chunk[len(counters):])
+                    })
+                    current_app.logger.error(
+                        f'Can not cancel the expired requests: {error}',
+                        exc_info=True)
+                finally:
+                    with lock:
+                        batch_deferred.update(deferred)
+            return counters
+
+        if workers == 1:
+            results = [cancel_chunk(chunks[0], app_context=False)]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(cancel_chunk, chunks))
+        for counters in results:
+            for chunk_counters in counters:
+                for key, value in chunk_counters.items():
+                    self.counters[key] += value
+
+    def cancel_item_requests(self, item, loans):
+        """Cancel the expired requests of an item.
+
+        :param item: the item.
+        :param loans: the expired loan data of the item.
+        :return: the counters of the processed requests.
+        """
+        counters = {'total': 0, 'cancelled': 0, 'locked': 0, 'errors': 0}
+        if item is None:
+            counters['errors'] += len(loans)
+            return counters
+        with item_lock(item.pid) as locked:
+            if not locked:
+                # the requests are cancelled by the next execution
+                counters['locked'] += len(loans)
+                return counters
+            for loan in loans:
+                counters['total'] += 1
+                try:
+                    # TODO : trans_user_pid shouldn't be the patron itself,
+                    #        but a system user.
+                    item, actions = item.cancel_item_request(
+                        loan['pid'],
+                        transaction_location_pid=loan.get(
+                            'transaction_location_pid') or
+                        item.holding_location_pid,
+                        transaction_user_pid=loan.get('patron_pid')
+                    )
+                except Exception as error:
+                    db.session.rollback()
+                    counters['errors'] += 1
+                    current_app.logger.error(
+                        f'Can not cancel the expired request: {loan["pid"]} '
+                        f'{error}', exc_info=True)
+                    continue
+                if actions.get('cancel', {}).get('pid') == loan['pid']:
+                    counters['cancelled'] += 1
+        return counters
+
+    @staticmethod
+    def _prefetch(requests, items, records_map):
+        """Load the records needed by the cancellations of some requests.
+
+        :param requests: a list of (item pid, list of loan data) tuples.
+        :param items: the items of the requests.
+        :param records_map: the ``IdentityMap`` to fill.
+        """
+        loans = [loan for _, item_loans in requests for loan in item_loans]
+        organisation_pids = {
+            loan.get('organisation', {}).get('pid') for loan in loans}
+        location_pids = {
+            loan.get(field) for loan in loans
+            for field in ['transaction_location_pid', 'pickup_location_pid']
+        }
+        locations = list(Location.get_records_by_pids(location_pids))
+        policy_pids = [
+            hit.pid for hit in CircPoliciesSearch()
+            .filter('terms', organisation__pid=[
+                pid for pid in organisation_pids if pid])
+            .source(['pid'])
+            .scan()
+        ]
+        item_type_pids = {item.item_type_pid for item in items}
+        for record_cls, records in [
+            (Location, locations),
+            (Library, Library.get_records_by_pids(
+                {location.library_pid for location in locations})),
+            (CircPolicy, CircPolicy.get_records_by_pids(policy_pids)),
+            (ItemType, ItemType.get_records_by_pids(item_type_pids))
+        ]:
+            for record in records:
+                records_map.add(record_cls.provider.pid_type, record)
@@ -25,6 +25,7 @@ from ..items.api import Item
 from ..loans.logs.api import LoanOperationLog
 from ..patron_transactions.utils import \
     create_patron_transaction_from_overdue_loan
+from ..patrons.api import Patron
 
 
 def enrich_loan_data(sender, json=None, record=None, index=None,
@@ -66,3 +67,29 @@ def listener_loan_state_changed(
     #   determine if the loan is overdue and if some fee must be created.
     if trigger in [LoanAction.CHECKIN, 'extend']:
         create_patron_transaction_from_overdue_loan(initial_loan)
+
+
+def invalidate_loan_operation_log_snapshot(sender, record=None, **kwargs):
+    """Invalidate the loan operation log snapshot of a changed record.
+
+    This method should be connected with 'after_record_update' and
+    'after_record_delete'.
+
+    :param record: the changed record.
+    """
+    provider = getattr(record, 'provider', None)
+    if provider and record.get('pid'):
+        LoanOperationLog.invalidate_snapshot(
+            provider.pid_type, record.get('pid'))
+
+
+def invalidate_loan_operation_log_patron_snapshots(
+        sender, profile=None, **kwargs):
+    """Invalidate the loan operation log snapshots of the profile patrons.
+
+    This method should be connected with 'after_profile_update'.
+
+    :param profile: the updated user profile.
+    """
+    for patron in Patron.get_patrons_by_user(profile.user):
+        LoanOperationLog.invalidate_snapshot('ptrn', patron.pid)
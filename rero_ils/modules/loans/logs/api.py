@@ -18,10 +18,16 @@
 """Loans logs API."""
 
 import hashlib
+from contextlib import contextmanager
+from copy import deepcopy
 from datetime import date
 
-from invenio_search import RecordsSearch
+from elasticsearch.helpers import bulk
+from flask import current_app, g
+from invenio_search import RecordsSearch, current_search_client
+from invenio_userprofiles.models import UserProfile
 
+from ...cache import SnapshotCache
 from ...documents.api import Document
 from ...holdings.api import Holding
 from ...items.api import Item
@@ -31,9 +37,49 @@ from ...patron_types.api import PatronType
 from ...patrons.api import Patron, current_librarian
 from ....modules.utils import extracted_data_from_ref
 
+BATCH_KEY = '_rero_ils_loan_operation_logs_batch'
+
+# loan fields needed to build an operation log
+LOAN_FIELDS = [
+    'pid', 'trigger', 'transaction_date', 'transaction_location_pid',
+    'pickup_location_pid', 'patron_pid', 'item_pid', 'selfcheck_terminal_id',
+    'transaction_user_pid'
+]
+
+# record classes of the snapshots :: pid_type --> record class
+SNAPSHOT_CLASSES = {
+    'doc': Document,
+    'hold': Holding,
+    'item': Item,
+    'loc': Location,
+    'ptrn': Patron,
+    'ptty': PatronType
+}
+
+
+def get_age(birth_date):
+    """Calculate age from a birthdate.
+
+    :param Date birth_date: Date of birth.
+    :returns: Age
+    :rtype: int
+    """
+    today = date.today()
+    return today.year - birth_date.year - (
+        (today.month, today.day) < (birth_date.month, birth_date.day))
+
 
 class LoanOperationLog(OperationLog):
-    """Operation log for loans."""
+    """Operation log for loans.
+
+    The data of the related records (item, document, holdings, locations,
+    patrons and patron types) are read from a process cache of record
+    snapshots (see ``SnapshotCache``). A batch of operation logs can be built
+    and indexed at once using ``bulk_create`` or the ``batch`` context.
+    """
+
+    # process record snapshots (see ``get_snapshots``)
+    _snapshots = None
 
     @classmethod
     def create(cls, data, id_=None, index_refresh='false', **kwargs):
@@ -47,7 +93,31 @@ class LoanOperationLog(OperationLog):
             refresh to make this operation visible to search, if `false`
             (the default) then do nothing with refreshes.
             Valid choices: true, false, wait_for
-        :returns: A new :class:`Record` instance.
+        :returns: A new :class:`Record` instance, `None` inside a ``batch``
+            context as the operation log is created when leaving the context.
+        """
+        entries = g.get(BATCH_KEY)
+        if entries is not None:
+            loan = {
+                key: deepcopy(data[key]) for key in LOAN_FIELDS if key in data
+            }
+            entries.append((loan, cls._get_user_data()))
+            if len(entries) >= current_app.config.get(
+                    'RERO_ILS_LOAN_OPERATION_LOG_BATCH_SIZE', 1000):
+                cls._bulk_create(entries)
+                entries.clear()
+            return None
+        log = cls.build_log(data)
+        return super().create(log, index_refresh=index_refresh)
+
+    @classmethod
+    def build_log(cls, data, user_data=None):
+        """Build the operation log of a loan.
+
+        :param data: Dict with the loan metadata.
+        :param user_data: Dict with the user metadata of the operation log,
+                          by default the current librarian.
+        :returns: the operation log data.
         """
         log = {
             'record': {
@@ -77,31 +147,280 @@ class LoanOperationLog(OperationLog):
                 cls._get_item_data(data['item_pid']['value'])
             }
         }
-        if current_librarian:
-            log['user'] = {
+        if user_data is None:
+            user_data = cls._get_user_data()
+        log.update(user_data)
+        # Store transaction user name if not done by SIP2
+        if log['loan']['transaction_channel'] != 'sip2':
+            log['loan']['transaction_user'] = {
+                'pid': data['transaction_user_pid'],
+                'name': cls._get_snapshot(
+                    'ptrn', data['transaction_user_pid'])['name']
+            }
+        return log
+
+    @classmethod
+    def bulk_create(cls, loans, user_data=None):
+        """Create and index the operation logs of a batch of loans.
+
+        The related records are loaded by batch before building the
+        operation logs.
+
+        :param loans: list of dicts with the loan metadata.
+        :param user_data: Dict with the user metadata of the operation logs,
+                          by default the current librarian.
+        :returns: the number of created operation logs.
+        """
+        if user_data is None:
+            user_data = cls._get_user_data()
+        return cls._bulk_create([(loan, user_data) for loan in loans])
+
+    @classmethod
+    def _bulk_create(cls, entries):
+        """Create and index a batch of operation logs.
+
+        :param entries: list of (loan metadata, user metadata) tuples.
+        :returns: the number of created operation logs.
+        """
+        if not entries:
+            return 0
+        cls.prefetch([loan for loan, _ in entries])
+        logs = [
+            cls.build_log(loan, user_data) for loan, user_data in entries
+        ]
+        cls.bulk_index(logs)
+        return len(logs)
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """Create the loan operation logs by batch.
+
+        Inside this context, the loan operation logs are collected and
+        created by batch using ``bulk_create``. This is useful for bulk loan
+        imports.
+
+            # >>> with LoanOperationLog.batch():
+            # ...     for transaction in transactions:
+            # ...         item.checkout(**transaction)
+        """
+        if g.get(BATCH_KEY) is not None:
+            # nested context: the logs are created by the outer context
+            yield
+            return
+        entries = []
+        setattr(g, BATCH_KEY, entries)
+        try:
+            yield
+        finally:
+            g.pop(BATCH_KEY, None)
+            cls._bulk_create(entries)
+
+    @classmethod
+    def _get_user_data(cls):
+        """Get the user metadata of an operation log.
+
+        :returns: the current librarian metadata, the system user otherwise.
+        :rtype: dict
+        """
+        if not current_librarian:
+            return {'user_name': 'system'}
+        return {
+            'user': {
                 'type': 'ptrn',
                 'value': current_librarian.pid
-            }
-            log['user_name'] = current_librarian.formatted_name
-            log['organisation'] = {
+            },
+            'user_name': current_librarian.formatted_name,
+            'organisation': {
                 'value': current_librarian.organisation_pid,
                 'type': 'org'
-            }
-            log['library'] = {
+            },
+            'library': {
                 'value': current_librarian.library_pid,
                 'type': 'lib'
             }
-        else:
-            log['user_name'] = 'system'
-        # Store transaction user name if not done by SIP2
-        if log['loan']['transaction_channel'] != 'sip2':
-            log['loan']['transaction_user'] = {
-                'pid': data['transaction_user_pid'],
-                'name': cls._get_patron_data(
-                    data['transaction_user_pid'])['name']
-            }
+        }
 
-        return super().create(log, index_refresh=index_refresh)
+    @classmethod
+    def get_snapshots(cls):
+        """Get the record snapshots cache of the current process.
+
+        :returns: the ``SnapshotCache``.
+        """
+        if cls._snapshots is None:
+            config = current_app.config
+            cls._snapshots = SnapshotCache(
+                maxsize=config.get(
+                    'RERO_ILS_LOAN_OPERATION_LOG_CACHE_SIZE', 10000),
+                ttl=config.get('RERO_ILS_LOAN_OPERATION_LOG_CACHE_TTL', 300)
+            )
+        return cls._snapshots
+
+    @classmethod
+    def invalidate_snapshot(cls, pid_type, pid):
+        """Invalidate the snapshot of a record.
+
+        :param str pid_type: the record pid type.
+        :param str pid: the record pid.
+        """
+        if cls._snapshots is not None and pid_type in SNAPSHOT_CLASSES:
+            cls._snapshots.invalidate(pid_type, pid)
+
+    @classmethod
+    def prefetch(cls, loans):
+        """Load the snapshots needed by the operation logs of some loans.
+
+        :param loans: list of dicts with the loan metadata.
+        """
+        item_pids, location_pids, patron_pids = set(), set(), set()
+        for loan in loans:
+            item_pids.add(loan['item_pid']['value'])
+            location_pids.update([
+                loan.get('transaction_location_pid'),
+                loan.get('pickup_location_pid')
+            ])
+            patron_pids.update([
+                loan.get('patron_pid'),
+                loan.get('transaction_user_pid')
+            ])
+        items = cls._get_snapshots('item', item_pids)
+        cls._get_snapshots(
+            'doc', {item['document_pid'] for item in items.values()})
+        holdings = cls._get_snapshots(
+            'hold', {item['holding_pid'] for item in items.values()})
+        location_pids.update(
+            holding['location_pid'] for holding in holdings.values())
+        cls._get_snapshots('loc', location_pids)
+        patrons = cls._get_snapshots('ptrn', patron_pids)
+        cls._get_snapshots(
+            'ptty', {patron['type_pid'] for patron in patrons.values()})
+
+    @classmethod
+    def _get_snapshots(cls, pid_type, pids):
+        """Get the snapshots of some records.
+
+        The records missing in the cache are loaded by batch.
+
+        :param str pid_type: the records pid type.
+        :param pids: the records pids.
+        :returns: the snapshots by pid.
+        :rtype: dict
+        """
+        cache = cls.get_snapshots()
+        snapshots, missing = {}, []
+        for pid in set(pids):
+            if pid is None:
+                continue
+            snapshot = cache.get(pid_type, pid)
+            if snapshot is None:
+                missing.append(pid)
+            else:
+                snapshots[pid] = snapshot
+        if missing:
+            records = SNAPSHOT_CLASSES[pid_type].get_records_by_pids(missing)
+            for pid, snapshot in cls._build_snapshots(pid_type, records):
+                cache.set(pid_type, pid, snapshot)
+                snapshots[pid] = snapshot
+        return snapshots
+
+    @classmethod
+    def _get_snapshot(cls, pid_type, pid):
+        """Get the snapshot of a record.
+
+        :param str pid_type: the record pid type.
+        :param str pid: the record pid.
+        :returns: the record snapshot, `None` if the record does not exist.
+        :rtype: dict
+        """
+        return cls._get_snapshots(pid_type, [pid]).get(pid)
+
+    @classmethod
+    def _build_snapshots(cls, pid_type, records):
+        """Build the snapshots of some records.
+
+        :param str pid_type: the records pid type.
+        :param records: the records.
+        :returns: a generator of (pid, snapshot) tuples.
+        """
+        if pid_type == 'ptrn':
+            yield from cls._build_patron_snapshots(records)
+            return
+        for record in records:
+            if pid_type == 'item':
+                snapshot = {
+                    'pid': record.pid,
+                    'library_pid': record.library_pid,
+                    'category': record['type'],
+                    'document_pid': extracted_data_from_ref(
+                        record['document']['$ref']),
+                    'holding_pid': extracted_data_from_ref(
+                        record['holding']['$ref'])
+                }
+                for key in ['call_number', 'enumerationAndChronology']:
+                    if record.get(key):
+                        snapshot[key] = record[key]
+            elif pid_type == 'doc':
+                document = record.dumps()
+                snapshot = {
+                    'pid': document['pid'],
+                    'title': next(
+                        filter(lambda x: x.get('type') == 'bf:Title',
+                               document.get('title'))
+                    ).get('_text'),
+                    'type': document['type'][0].get(
+                        'subtype', document['type'][0]['main_type'])
+                }
+            elif pid_type == 'hold':
+                snapshot = {
+                    'pid': record.pid,
+                    'location_pid': extracted_data_from_ref(
+                        record['location']['$ref'])
+                }
+            else:
+                # locations and patron types
+                snapshot = {'name': record['name']}
+            yield record.pid, snapshot
+
+    @classmethod
+    def _build_patron_snapshots(cls, patrons):
+        """Build the snapshots of some patrons.
+
+        The user profiles of the patrons are loaded by batch.
+
+        :param patrons: the patrons.
+        :returns: a generator of (pid, snapshot) tuples.
+        """
+        patrons = list(patrons)
+        user_ids = {
+            patron.get('user_id') for patron in patrons
+            if patron.get('user_id') is not None
+        }
+        profiles = {
+            profile.user_id: profile
+            for profile in UserProfile.query.filter(
+                UserProfile.user_id.in_(list(user_ids)))
+        } if user_ids else {}
+        for patron in patrons:
+            profile = profiles.get(patron.get('user_id')) or \
+                patron.user.profile
+            name_parts = [
+                profile.last_name.strip(),
+                profile.first_name.strip()
+            ]
+            snapshot = {
+                'pid': patron.pid,
+                'hashed_pid': hashlib.md5(patron.pid.encode()).hexdigest(),
+                'name': ', '.join(part for part in name_parts if part),
+                'type_pid': extracted_data_from_ref(
+                    patron['patron']['type']['$ref'])
+                if patron.get('patron') else None,
+                'birth_date': profile.birth_date,
+                'postal_code': profile.postal_code,
+                'gender': profile.gender or 'other'
+            }
+            if patron.get('local_codes'):
+                snapshot['local_codes'] = patron['local_codes']
+            yield patron.pid, snapshot
 
     @classmethod
     def _get_item_data(cls, item_pid):
@@ -111,21 +430,9 @@ class LoanOperationLog(OperationLog):
         :returns: Item formatted data
         :rtype: dict
         """
-        item = Item.get_record_by_pid(item_pid)
-        data = {
-            'pid': item.pid,
-            'library_pid': item.library_pid,
-            'category': item['type'],
-            'document': cls._get_document_data(
-                extracted_data_from_ref(item['document']['$ref'])),
-            'holding': cls._get_holding_data(
-                extracted_data_from_ref(item['holding']['$ref']))
-        }
-        if item.get('call_number'):
-            data['call_number'] = item.get('call_number')
-        if item.get('enumerationAndChronology'):
-            data['enumerationAndChronology'] =\
-                item.get('enumerationAndChronology')
+        data = dict(cls._get_snapshot('item', item_pid))
+        data['document'] = cls._get_document_data(data.pop('document_pid'))
+        data['holding'] = cls._get_holding_data(data.pop('holding_pid'))
         return data
 
     @classmethod
@@ -136,17 +443,7 @@ class LoanOperationLog(OperationLog):
         :returns: Document formatted data
         :rtype: dict
         """
-        document = Document.get_record_by_pid(document_pid)
-        document = document.dumps()
-        return {
-            'pid': document['pid'],
-            'title': next(filter(lambda x: x.get('type') == 'bf:Title',
-                                 document.get('title'))
-                          ).get('_text'),
-            'type':
-            document['type'][0].get('subtype',
-                                    document['type'][0]['main_type'])
-        }
+        return dict(cls._get_snapshot('doc', document_pid))
 
     @classmethod
     def _get_holding_data(cls, holding_pid):
@@ -156,12 +453,10 @@ class LoanOperationLog(OperationLog):
         :returns: Holding formatted data
         :rtype: dict
         """
-        holding = Holding.get_record_by_pid(holding_pid)
-
+        holding = cls._get_snapshot('hold', holding_pid)
         return {
-            'pid': holding.pid,
-            'location_name': cls._get_location_name(
-                extracted_data_from_ref(holding['location']['$ref']))
+            'pid': holding['pid'],
+            'location_name': cls._get_location_name(holding['location_pid'])
         }
 
     @classmethod
@@ -172,8 +467,7 @@ class LoanOperationLog(OperationLog):
         :returns: Location name
         :rtype: str
         """
-        location = Location.get_record_by_pid(location_pid)
-        return location['name']
+        return cls._get_snapshot('loc', location_pid)['name']
 
     @classmethod
     def _get_patron_data(cls, patron_pid):
@@ -183,39 +477,20 @@ class LoanOperationLog(OperationLog):
         :returns: Patron formatted data
         :rtype: dict
         """
-        patron = Patron.get_record_by_pid(patron_pid)
-
-        patron_type = None
-
-        if patron.get('patron'):
-            patron_type = PatronType.get_record_by_pid(
-                extracted_data_from_ref(patron['patron']['type']['$ref']))
-
-        def get_age(birth_date):
-            """Calculate age from a birthdate.
-
-            :param Date birth_date: Date of birth.
-            :returns: Age
-            :rtype: int
-            """
-            today = date.today()
-            return today.year - birth_date.year - (
-                (today.month, today.day) < (birth_date.month, birth_date.day))
-
-        hashed_pid = hashlib.md5(patron.pid.encode()).hexdigest()
+        patron = cls._get_snapshot('ptrn', patron_pid)
+        patron_type = cls._get_snapshot('ptty', patron['type_pid']) \
+            if patron['type_pid'] else None
         data = {
-            'name': patron.formatted_name,
+            'name': patron['name'],
             'type': patron_type['name'] if patron_type else None,
-            'age': get_age(patron.user.profile.birth_date),
-            'postal_code': patron.user.profile.postal_code,
-            'gender': patron.user.profile.gender or 'other',
-            'pid': patron.pid,
-            'hashed_pid': hashed_pid
+            'age': get_age(patron['birth_date']),
+            'postal_code': patron['postal_code'],
+            'gender': patron['gender'],
+            'pid': patron['pid'],
+            'hashed_pid': patron['hashed_pid']
         }
-
         if patron.get('local_codes'):
             data['local_codes'] = patron['local_codes']
-
         return data
 
     @classmethod
@@ -245,3 +520,35 @@ class LoanOperationLog(OperationLog):
             record['loan']['patron'].pop('name', None)
             record['loan']['patron'].pop('pid', None)
             cls.update(log.meta.id, log['date'], record)
+
+    @classmethod
+    def bulk_anonymize_logs(cls, loan_pids):
+        """Anonymize all logs corresponding to several loans.
+
+        The logs are read with one search and updated with one bulk request.
+
+        :param loan_pids: Loan PIDs.
+        :returns: the number of anonymized logs.
+        """
+        logs = RecordsSearch(index=cls.index_name) \
+            .filter('exists', field='loan.patron.pid') \
+            .filter('terms', record__value=list(loan_pids)) \
+            .scan()
+        actions = []
+        for log in logs:
+            record = log.to_dict()
+            record['loan']['patron'].pop('name', None)
+            record['loan']['patron'].pop('pid', None)
+            actions.append({
+                '_op_type': 'index',
+                '_index': log.meta.index,
+                '_id': log.meta.id,
+                '_source': record
+            })
+        if not actions:
+            return 0
+        n_succeed, errors = bulk(
+            current_search_client, actions, refresh=True)
+        if n_succeed != len(actions):
+            raise Exception(f'Elasticsearch Indexing Errors: {errors}')
+        return n_succeed
@@ -21,8 +21,8 @@ from __future__ import absolute_import, print_function
 
 from celery import shared_task
 
-from ..items.api import Item
-from ..loans.api import Loan, get_expired_request
+from .anonymizer import LoanAnonymizer
+from .expired_requests import ExpiredRequestCanceller
 from ..utils import set_timestamp
 
 
@@ -30,17 +30,16 @@ from ..utils import set_timestamp
 def loan_anonymizer(dbcommit=True, reindex=True):
     """Job to anonymize loans for all organisations.
 
+    The loans are anonymized by chunks (see ``LoanAnonymizer``).
+
     :param reindex: reindex the records.
     :param dbcommit: commit record to database.
     :return a count of updated loans.
     """
-    counter = 0
-    for loan in Loan.get_anonymized_candidates():
-        if Loan.can_anonymize(loan_data=loan, patron=None):
-            loan.anonymize(loan, dbcommit=dbcommit, reindex=reindex)
-            counter += 1
-
-    set_timestamp('anonymize-loans', count=counter)
+    counters = LoanAnonymizer().run(dbcommit=dbcommit, reindex=reindex)
+    counter = counters['anonymized']
+    set_timestamp('anonymize-loans', count=counter,
+                  processed=counters['processed'])
     return counter
 
 
@@ -48,22 +47,16 @@ def loan_anonymizer(dbcommit=True, reindex=True):
 def cancel_expired_request_task(tstamp=None):
     """Cancel all expired loans for all organisations.
 
+    The expired requests are cancelled by batches of items (see
+    ``ExpiredRequestCanceller``).
+
     :param tstamp: the timestamp to check. Default is `datetime.now()`
     :return a tuple with total performed loans ans total cancelled loans.
     """
-    total_loans_counter = total_cancelled_loans = 0
-    for loan in get_expired_request(tstamp):
-        total_loans_counter += 1
-        item = Item.get_record_by_pid(loan.item_pid)
-        # TODO : trans_user_pid shouldn't be the patron itself, but a system
-        #        user.
-        _, actions = item.cancel_item_request(
-            loan.pid,
-            transaction_location_pid=loan.location_pid,
-            transaction_user_pid=loan.patron_pid
-        )
-        if actions.get('cancel', {}).get('pid') == loan.pid:
-            total_cancelled_loans += 1
+    counters = ExpiredRequestCanceller(tstamp=tstamp).run()
+    total_loans_counter = counters['total']
+    total_cancelled_loans = counters['cancelled']
     set_timestamp('cancel-expired-request-task', total=total_loans_counter,
-                  cancelled=total_cancelled_loans)
+                  cancelled=total_cancelled_loans, locked=counters['locked'],
+                  errors=counters['errors'])
     return total_loans_counter, total_cancelled_loans
@@ -64,6 +64,7 @@ class Location(IlsRecord):
     fetcher = location_id_fetcher
     provider = LocationProvider
     model_cls = LocationMetadata
+    enable_identity_map = True
     pids_exist_check = {
         'required': {
             'lib': 'library'
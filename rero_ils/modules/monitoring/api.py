@@ -24,7 +24,9 @@ from elasticsearch.exceptions import NotFoundError
 from flask import current_app
 from invenio_pidstore.models import PersistentIdentifier, PIDStatus
 from invenio_search import RecordsSearch
-from sqlalchemy import text
+
+from .consistency import ConsistencyChecker
+from ..utils import iter_persistent_identifiers
 
 db_connection_counts_query = """
         select
@@ -154,22 +156,17 @@ class Monitoring(object):
             query = query.filter_by(status=PIDStatus.REGISTERED)
         if date:
             query = query.filter(PersistentIdentifier.created < date)
-        if limit:
-            count = query.count()
-            # slower, less memory
-            query = query.order_by(text('pid_value')).limit(limit)
-            offset = 0
-            while offset < count:
-                for identifier in query.offset(offset):
-                    yield identifier.pid_value
-                offset += limit
-        else:
-            # faster, more memory
-            for identifier in query:
-                yield identifier.pid_value
+        for identifier in iter_persistent_identifiers(query, limit=limit):
+            yield identifier.pid_value
 
     def get_es_db_missing_pids(self, doc_type, with_deleted=False):
-        """Get ES and DB counts."""
+        """Get ES and DB missing pids.
+
+        :param doc_type: doc type to check.
+        :param with_deleted: check also deleted items in database.
+        :returns: pids missing in DB, pids missing in ES, pids indexed
+                  several times in ES and the ES index.
+        """
         endpoint = current_app.config.get(
             'RECORDS_REST_ENDPOINTS'
         ).get(doc_type, {})
@@ -178,25 +175,14 @@ class Monitoring(object):
         pids_es = []
         pids_db = []
         if index and doc_type not in self.has_no_db:
-            date = datetime.utcnow() - timedelta(minutes=self.time_delta)
-            pids_es = {}
-            es_query = RecordsSearch(index=index) \
-                .filter('range', _created={'lte': date})
-            for hit in es_query.source('pid').scan():
-                if pids_es.get(hit.pid):
-                    pids_es_double.append(hit.pid)
-                pids_es[hit.pid] = 1
-            pids_db = []
-            for pid in self.get_all_pids(
+            result = ConsistencyChecker(
                 doc_type,
-                with_deleted=with_deleted,
-                date=date
-            ):
-                if pids_es.get(pid):
-                    pids_es.pop(pid)
-                else:
-                    pids_db.append(pid)
-            pids_es = [v for v in pids_es]
+                time_delta=self.time_delta,
+                with_deleted=with_deleted
+            ).check()
+            pids_es = result['missing_in_db']
+            pids_db = result['missing_in_es']
+            pids_es_double = result['duplicates']
         return pids_es, pids_db, pids_es_double, index
 
     def info(self, with_deleted=False, difference_db_es=False):
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental consistency checker between the database and the index."""
+
+from calendar import timegm
+from datetime import datetime, timedelta
+
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from flask import current_app
+from invenio_cache.proxies import current_cache
+from invenio_db import db
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+from invenio_search import RecordsSearch
+from sqlalchemy import BigInteger, cast, func
+
+from ..utils import get_record_class_from_schema_or_pid_type
+
+# Bucket intervals used to drill into the differences, from the coarsest to
+# the finest. The name is understood by both PostgreSQL `date_trunc` and
+# Elasticsearch `date_histogram`.
+INTERVALS = [
+    ('year', relativedelta(years=1)),
+    ('month', relativedelta(months=1)),
+    ('day', relativedelta(days=1)),
+    ('hour', relativedelta(hours=1))
+]
+
+# Modulus of the update dates (in milliseconds) summed into the bucket
+# checksums: the sums stay exact with the Elasticsearch double precision.
+CHECKSUM_MODULUS = 1000003
+
+
+def to_millis(value):
+    """Convert a date to an epoch timestamp in milliseconds.
+
+    Elasticsearch stores dates with a millisecond precision: both database
+    and index dates are compared with this precision.
+
+    :param value: a naive UTC `datetime`, an ISO date string or `None`.
+    :return: the number of milliseconds since epoch.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parser.parse(value)
+    return timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000
+
+
+class ConsistencyChecker:
+    """Consistency checker between the database and the search index.
+
+    Instead of loading all the pids of a resource from both sides, the
+    records are grouped into buckets of creation date. A bucket digest is the
+    number of records and the sum of their update dates (modulo
+    `CHECKSUM_MODULUS`): every outdated record changes it, whatever its
+    position in the bucket. It is computed by a SQL aggregation and an
+    Elasticsearch `date_histogram` aggregation. Only the
+    buckets with different digests are split into finer buckets, down to the
+    records of an hour which are then compared pid by pid.
+
+    The date of the last committed check is stored into the cache: an
+    incremental check only compares the records updated (or deleted) since
+    this checkpoint. The checkpoint is only committed once the differences
+    are repaired (i.e. by `index reindex_missing`): a read only check does
+    not hide the differences from the next incremental checks.
+    """
+
+    def __init__(self, doc_type, time_delta=1, with_deleted=False):
+        """Constructor.
+
+        :param doc_type: the resource pid type.
+        :param time_delta: minutes to subtract from now to ignore the records
+                           which are probably not yet indexed.
+        :param with_deleted: check also the deleted records.
+        """
+        self.doc_type = doc_type
+        self.with_deleted = with_deleted
+        endpoint = current_app.config.get(
+            'RECORDS_REST_ENDPOINTS').get(doc_type, {})
+        self.index = endpoint.get('search_index')
+        self.record_class = get_record_class_from_schema_or_pid_type(
+            pid_type=doc_type)
+        self.until = datetime.utcnow() - timedelta(minutes=int(time_delta))
+
+    @property
+    def cache_key(self):
+        """Cache key of the last check date."""
+        return f'monitoring::consistency::{self.doc_type}'
+
+    @property
+    def last_check(self):
+        """Date of the last committed check, `None` if never committed."""
+        last_check = current_cache.get(self.cache_key)
+        return parser.parse(last_check) if last_check else None
+
+    def _db_query(self, *columns, with_deleted=None):
+        """Query the database records of the resource.
+
+        :param columns: the columns to select.
+        :param with_deleted: include the deleted records (default to the
+                             checker setting).
+        """
+        if with_deleted is None:
+            with_deleted = self.with_deleted
+        model_cls = self.record_class.model_cls
+        query = db.session.query(*columns)\
+            .join(
+                PersistentIdentifier,
+                PersistentIdentifier.object_uuid == model_cls.id
+            )\
+            .filter(PersistentIdentifier.pid_type == self.doc_type)\
+            .filter(model_cls.created < self.until)
+        if not with_deleted:
+            query = query.filter(
+                PersistentIdentifier.status == PIDStatus.REGISTERED)
+        return query
+
+    def _es_query(self):
+        """Query the indexed records of the resource."""
+        return RecordsSearch(index=self.index)\
+            .filter('range', _created={'lt': self.until})
+
+    def _db_buckets(self, interval, start=None, end=None):
+        """Get the database digests by bucket.
+
+        :param interval: the bucket interval.
+        :param start: the creation date lower bound.
+        :param end: the creation date upper bound.
+        :return: a dictionary of (count, update checksum) by bucket date.
+        """
+        model_cls = self.record_class.model_cls
+        bucket = func.date_trunc(interval, model_cls.created)
+        # update date in milliseconds, truncated as `to_millis` does
+        seconds = cast(func.extract(
+            'epoch', func.date_trunc('second', model_cls.updated)),
+            BigInteger)
+        millis = cast(func.floor(
+            cast(func.extract('microseconds', model_cls.updated), BigInteger)
+            % 1000000 / 1000), BigInteger)
+        checksum = func.sum((seconds * 1000 + millis) % CHECKSUM_MODULUS)
+        query = self._db_query(bucket, func.count(model_cls.id), checksum)
+        if start:
+            query = query.filter(model_cls.created >= start)
+        if end:
+            query = query.filter(model_cls.created < end)
+        return {
+            to_millis(key): (count, int(checksum or 0))
+            for key, count, checksum in query.group_by(bucket)
+        }
+
+    def _es_buckets(self, interval, start=None, end=None):
+        """Get the index digests by bucket.
+
+        :param interval: the bucket interval.
+        :param start: the creation date lower bound.
+        :param end: the creation date upper bound.
+        :return: a dictionary of (count, update checksum) by bucket date.
+        """
+        search = self._es_query().extra(size=0)
+        if start:
+            search = search.filter('range', _created={'gte': start})
+        if end:
+            search = search.filter('range', _created={'lt': end})
+        search.aggs\
+            .bucket('buckets', 'date_histogram', field='_created',
+                    calendar_interval=interval, min_doc_count=1)\
+            .metric('checksum', 'sum', script={
+                'source': "doc['_updated'].size() == 0 ? 0 : "
+                          "doc['_updated'].value.toInstant().toEpochMilli()"
+                          " % params.modulus",
+                'params': {'modulus': CHECKSUM_MODULUS}
+            })
+        buckets = search.execute().aggregations.buckets.buckets
+        return {
+            int(bucket.key): (
+                bucket.doc_count, int(round(bucket.checksum.value or 0)))
+            for bucket in buckets
+        }
+
+    def _compare(self, db_pids, es_pids, result):
+        """Compare records pid by pid.
+
+        :param db_pids: the database update dates by pid.
+        :param es_pids: the list of index update dates by pid.
+        :param result: the result to complete.
+        """
+        for pid, updated in db_pids.items():
+            if pid not in es_pids:
+                result['missing_in_es'].add(pid)
+            elif updated not in es_pids[pid]:
+                result['outdated'].add(pid)
+        for pid, updates in es_pids.items():
+            if len(updates) > 1:
+                result['duplicates'].add(pid)
+            if pid not in db_pids:
+                result['missing_in_db'].add(pid)
+
+    def _es_pids(self, search):
+        """Get the index update dates by pid.
+
+        :param search: the Elasticsearch search.
+        :return: the list of update dates by pid.
+        """
+        es_pids = {}
+        for hit in search.source(['pid', '_updated']).scan():
+            hit = hit.to_dict()
+            es_pids.setdefault(hit['pid'], []).append(
+                to_millis(hit.get('_updated')))
+        return es_pids
+
+    def _compare_records(self, start, end, result):
+        """Compare the records created in a range pid by pid.
+
+        :param start: the creation date lower bound.
+        :param end: the creation date upper bound.
+        :param result: the result to complete.
+        """
+        model_cls = self.record_class.model_cls
+        query = self._db_query(
+            PersistentIdentifier.pid_value, model_cls.updated)
+        search = self._es_query()
+        if start:
+            query = query.filter(model_cls.created >= start)
+            search = search.filter('range', _created={'gte': start})
+        if end:
+            query = query.filter(model_cls.created < end)
+            search = search.filter('range', _created={'lt': end})
+        db_pids = {pid: to_millis(updated) for pid, updated in query}
+        self._compare(db_pids, self._es_pids(search), result)
+
+    def _compare_buckets(self, result, level=0, start=None, end=None):
+        """Compare the bucket digests and drill into the different ones.
+
+        :param result: the result to complete.
+        :param level: the current interval level.
+        :param start: the creation date lower bound.
+        :param end: the creation date upper bound.
+        """
+        if level >= len(INTERVALS):
+            self._compare_records(start, end, result)
+            return
+        interval, step = INTERVALS[level]
+        db_buckets = self._db_buckets(interval, start, end)
+        es_buckets = self._es_buckets(interval, start, end)
+        for key in set(db_buckets) | set(es_buckets):
+            if db_buckets.get(key) != es_buckets.get(key):
+                result['buckets'] += 1
+                bucket_start = datetime.utcfromtimestamp(key / 1000)
+                bucket_end = bucket_start + step
+                if end:
+                    bucket_end = min(bucket_end, end)
+                self._compare_buckets(
+                    result, level + 1, bucket_start, bucket_end)
+
+    def _compare_updated_since(self, since, result):
+        """Compare the records updated (or deleted) since a date.
+
+        :param since: the update date lower bound.
+        :param result: the result to complete.
+        """
+        model_cls = self.record_class.model_cls
+        # deleted records are needed to remove them from the index
+        query = self._db_query(
+            PersistentIdentifier.pid_value,
+            PersistentIdentifier.status,
+            model_cls.updated,
+            with_deleted=True
+        ).filter(model_cls.updated >= since)
+        rows = query.all()
+        db_pids = {}
+        for pid, status, updated in rows:
+            if self.with_deleted or status == PIDStatus.REGISTERED:
+                db_pids[pid] = to_millis(updated)
+        pids = list({pid for pid, _, _ in rows})
+        es_pids = {}
+        for idx in range(0, len(pids), 1000):
+            search = self._es_query()\
+                .filter('terms', pid=pids[idx:idx + 1000])
+            for pid, updates in self._es_pids(search).items():
+                es_pids.setdefault(pid, []).extend(updates)
+        search = self._es_query().filter('range', _updated={'gte': since})
+        unknown_pids = {
+            pid: updates
+            for pid, updates in self._es_pids(search).items()
+            if pid not in es_pids
+        }
+        if unknown_pids:
+            # indexed records updated since the last check but not in the
+            # database result: are they still registered?
+            registered = self._db_query(PersistentIdentifier.pid_value)\
+                .filter(PersistentIdentifier.pid_value.in_(list(unknown_pids)))
+            for pid, in registered:
+                result['outdated'].add(pid)
+                unknown_pids.pop(pid)
+            es_pids.update(unknown_pids)
+        self._compare(db_pids, es_pids, result)
+
+    def commit_checkpoint(self):
+        """Store the date of this check as the last check date."""
+        current_cache.set(self.cache_key, self.until.isoformat(), timeout=0)
+
+    def check(self, incremental=False, commit_checkpoint=False):
+        """Check the consistency between the database and the index.
+
+        :param incremental: only check the records updated since the last
+                            check (full check if never checked).
+        :param commit_checkpoint: store the date of this check as the last
+                                  check date.
+        :return: a dictionary with the sorted lists of pids missing in the
+                 index (`missing_in_es`), missing in the database
+                 (`missing_in_db`), indexed several times (`duplicates`) or
+                 with an outdated index version (`outdated`), and the number
+                 of different buckets (`buckets`).
+        """
+        result = {
+            'missing_in_es': set(),
+            'missing_in_db': set(),
+            'duplicates': set(),
+            'outdated': set(),
+            'buckets': 0
+        }
+        since = self.last_check if incremental else None
+        if since:
+            self._compare_updated_since(since, result)
+        else:
+            self._compare_buckets(result, end=self.until)
+        if commit_checkpoint:
+            self.commit_checkpoint()
+        for key in ['missing_in_es', 'missing_in_db', 'duplicates',
+                    'outdated']:
+            result[key] = sorted(result[key])
+        return result
@@ -25,6 +25,7 @@ from datetime import datetime
 from functools import partial
 
 from flask import current_app
+from invenio_db import db
 
 from .extensions import NotificationSubclassExtension
 from .models import NotificationIdentifier, NotificationMetadata, \
@@ -243,6 +244,30 @@ class Notification(IlsRecord, ABC):
         return self.update(
             data=self.dumps(), commit=True, dbcommit=True, reindex=True)
 
+    @classmethod
+    def bulk_update_process_date(cls, results):
+        """Update the process date of several notifications.
+
+        The notifications are stored with one database commit and indexed
+        with one bulk request.
+
+        :param results: a list of (notification, sent, status) tuples.
+        :return the updated notifications.
+        """
+        if not results:
+            return []
+        process_date = datetime.utcnow().isoformat()
+        notifications = []
+        for notification, sent, status in results:
+            notification['process_date'] = process_date
+            notification['notification_sent'] = sent
+            notification['status'] = status
+            notifications.append(
+                notification.update(data=notification.dumps(), commit=True))
+        db.session.commit()
+        NotificationsIndexer().bulk_index_records(notifications)
+        return notifications
+
 
 class NotificationsIndexer(IlsRecordsIndexer):
     """Holdings indexing class."""
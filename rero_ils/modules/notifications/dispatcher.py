@@ -19,12 +19,20 @@
 
 from __future__ import absolute_import, print_function
 
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
 from flask import current_app
 from invenio_mail.api import TemplatedMessage
 from invenio_mail.tasks import send_email as task_send_email
 
 from .api import Notification
-from .models import NotificationType, RecipientType
+from .models import NotificationStatus, NotificationType, RecipientType
+
+# dispatch worker state: the transports opened by the current thread
+_worker = threading.local()
 
 
 class Dispatcher:
@@ -32,31 +40,29 @@ class Dispatcher:
 
     @classmethod
     def dispatch_notifications(cls, notification_pids=None, resend=False,
-                               verbose=False):
+                               verbose=False, pooled=False):
         """Dispatch the notification.
 
+        In pooled mode, the aggregated notifications are sent by batches. The
+        aggregation groups of a batch are sent by a pool of threads
+        (`RERO_ILS_NOTIFICATIONS_DISPATCH_WORKERS`), each thread reusing its
+        own transports (i.e. one SMTP connection) for all the messages it
+        sends. The process dates of a batch are stored with one database
+        commit and one bulk indexing request.
+
         :param notification_pids: Notification pids to send.
         :param resend: Resend notification if already send.
         :param verbose: Verbose output.
-        :returns: dictionary with processed and send count
+        :param pooled: dispatch the notifications by batches with a pool of
+                       threads and transports.
+        :returns: dictionary with processed and send count, and the counters
+                  by communication channel.
         """
-        def get_dispatcher_function(channel):
-            """Find the dispatcher function to use by communication channel."""
-            try:
-                communication_switcher = current_app.config.get(
-                    'RERO_ILS_COMMUNICATION_DISPATCHER_FUNCTIONS', [])
-                return communication_switcher[channel]
-            except KeyError:
-                current_app.logger.warning(
-                    f'The communication channel: {channel}'
-                    ' is not yet implemented')
-                return Dispatcher.not_yet_implemented
-
-        sent = not_sent = errors = 0
+        errors = 0
         aggregated = {}
+        processed = []
         pids = notification_pids or []
-        notifications = [Notification.get_record_by_pid(pid) for pid in pids]
-        notifications = list(filter(None, notifications))
+        notifications = list(Notification.get_records_by_pids(pids))
 
         # PROCESS NOTIFICATIONS
         #   For each notification to process, we try to determine if this
@@ -65,7 +71,7 @@ class Dispatcher:
         for notification in notifications:
             try:
                 cls._process_notification(
-                    notification, resend, aggregated)
+                    notification, resend, aggregated, processed)
             except Exception as error:
                 errors += 1
                 current_app.logger.error(
@@ -78,40 +84,208 @@ class Dispatcher:
         #   are always send to same recipient (patron, lib, vendor, ...) with
         #   the same communication channel. So we can check any notification
         #   of the set to get the theses informations.
-        for aggr_key, aggr_notifications in aggregated.items():
-            notification = aggr_notifications[0]
+        result = {
+            'processed': len(notifications),
+            'sent': 0,
+            'not_sent': 0,
+            'errors': errors,
+            'channels': {}
+        }
+        config = current_app.config
+        groups = list(aggregated.values())
+        batch_size = len(groups) or 1
+        if pooled:
+            batch_size = config.get(
+                'RERO_ILS_NOTIFICATIONS_DISPATCH_BATCH_SIZE', 500)
+        for idx in range(0, len(groups), batch_size):
+            batch = groups[idx:idx + batch_size]
+            if pooled:
+                dispatched = cls._dispatch_batch(batch, verbose, config.get(
+                    'RERO_ILS_NOTIFICATIONS_DISPATCH_WORKERS', 1))
+            else:
+                dispatched = [
+                    cls._dispatch_group(group, verbose) for group in batch]
+            for channel, group, sent, error, duration in dispatched:
+                counters = result['channels'].setdefault(channel, {
+                    'sent': 0, 'not_sent': 0, 'errors': 0, 'duration': 0})
+                counters['duration'] += duration
+                if error:
+                    # the notifications will be processed again
+                    counters['errors'] += len(group)
+                    result['errors'] += len(group)
+                    continue
+                key = 'sent' if sent else 'not_sent'
+                counters[key] += len(group)
+                result[key] += len(group)
+                processed.extend(
+                    (notification, sent, NotificationStatus.DONE)
+                    for notification in group)
+            Notification.bulk_update_process_date(processed)
+            processed = []
+        # the cancelled notifications without aggregated notifications
+        Notification.bulk_update_process_date(processed)
+
+        for counters in result['channels'].values():
+            duration = counters['duration']
+            counters['duration'] = round(duration, 3)
+            counters['throughput'] = round(
+                (counters['sent'] + counters['not_sent']) / duration, 3) \
+                if duration else None
+        return result
+
+    @classmethod
+    def _dispatch_batch(cls, groups, verbose, workers):
+        """Send a batch of aggregated notifications with a pool of threads.
+
+        The groups are distributed between the threads, each thread opens
+        its transports once for all its groups.
+
+        :param groups: the list of aggregated notifications.
+        :param verbose: Verbose output.
+        :param workers: the number of threads.
+        :returns: the list of the dispatched groups
+                  (see ``_dispatch_group``).
+        """
+        app = current_app._get_current_object()
+        workers = max(1, min(workers, len(groups)))
+        chunks = [groups[idx::workers] for idx in range(workers)]
+
+        def dispatch_chunk(chunk, app_context=True):
+            """Send the groups of a thread."""
+            if app_context:
+                with app.app_context():
+                    return dispatch_chunk(chunk, app_context=False)
+            with cls.open_transports():
+                return [cls._dispatch_group(group, verbose)
+                        for group in chunk]
+
+        if workers == 1:
+            return dispatch_chunk(chunks[0], app_context=False)
+        dispatched = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for results in executor.map(dispatch_chunk, chunks):
+                dispatched.extend(results)
+        return dispatched
+
+    @classmethod
+    def _dispatch_group(cls, notifications, verbose=False):
+        """Send a set of aggregated notifications.
+
+        :param notifications: the aggregated notifications.
+        :param verbose: Verbose output.
+        :returns: a (channel, notifications, sent, error, duration) tuple,
+                  `error` is the raised exception if any.
+        """
+        def get_dispatcher_function(channel):
+            """Find the dispatcher function to use by communication channel."""
+            try:
+                communication_switcher = current_app.config.get(
+                    'RERO_ILS_COMMUNICATION_DISPATCHER_FUNCTIONS', [])
+                return communication_switcher[channel]
+            except KeyError:
+                current_app.logger.warning(
+                    f'The communication channel: {channel}'
+                    ' is not yet implemented')
+                return Dispatcher.not_yet_implemented
+
+        start = time.monotonic()
+        notification = notifications[0]
+        comm_channel = None
+        try:
             comm_channel = notification.get_communication_channel()
             dispatcher_function = get_dispatcher_function(comm_channel)
-            counter = len(aggr_notifications)
             if verbose:
                 current_app.logger.info(
                     f'Dispatch notifications: {notification.type} '
                     f'library: {notification.library.pid} '
                     f'patron: {notification.patron.pid} '
-                    f'documents: {counter}'
+                    f'documents: {len(notifications)}'
                 )
-            result = dispatcher_function(aggr_notifications)
-            for notification in aggr_notifications:
-                notification.update_process_date(sent=result)
-            if result:
-                sent += counter
-            else:
-                not_sent += counter
-        return {
-            'processed': len(notifications),
-            'sent': sent,
-            'not_sent': not_sent,
-            'errors': errors
-        }
+            sent = dispatcher_function(notifications)
+        except Exception as error:
+            current_app.logger.error(
+                f'Notifications have not be sent (pids: '
+                f'{", ".join(n.pid for n in notifications)}): {error}',
+                exc_info=True, stack_info=True)
+            # a broken transport is opened again by the next group
+            cls.close_transports()
+            return comm_channel, notifications, False, error, \
+                time.monotonic() - start
+        return comm_channel, notifications, sent, None, \
+            time.monotonic() - start
+
+    @staticmethod
+    @contextmanager
+    def open_transports():
+        """Allow the current thread to reuse its transports.
+
+        The transports are opened on first use (see ``get_transport``) and
+        closed at the exit of the context.
+        """
+        _worker.transports = {}
+        _worker.stack = ExitStack()
+        try:
+            yield
+        finally:
+            Dispatcher.close_transports()
+            _worker.stack = None
+
+    @staticmethod
+    def close_transports():
+        """Close the opened transports of the current thread."""
+        stack = getattr(_worker, 'stack', None)
+        if stack is None:
+            return
+        _worker.transports = {}
+        _worker.stack = ExitStack()
+        try:
+            stack.close()
+        except Exception as error:
+            current_app.logger.warning(
+                f'Notification transports closing error: {error}')
+
+    @staticmethod
+    def get_transport(name):
+        """Get a transport opened by the current thread.
+
+        The transport factories are defined by
+        `RERO_ILS_NOTIFICATIONS_DISPATCH_TRANSPORTS`.
+
+        :param name: the transport name (i.e. 'mail').
+        :returns: the opened transport, `None` outside of
+                  ``open_transports`` or if the transport cannot be opened.
+        """
+        stack = getattr(_worker, 'stack', None)
+        if stack is None:
+            return None
+        if name not in _worker.transports:
+            transport = None
+            factory = current_app.config.get(
+                'RERO_ILS_NOTIFICATIONS_DISPATCH_TRANSPORTS', {}).get(name)
+            if factory:
+                try:
+                    transport = stack.enter_context(factory())
+                except Exception as error:
+                    current_app.logger.warning(
+                        f'Notification transport {name} error: {error}')
+            _worker.transports[name] = transport
+        return _worker.transports[name]
+
+    @staticmethod
+    def mail_connection():
+        """Get a new Flask-Mail connection (one SMTP connection)."""
+        return current_app.extensions['mail'].connect()
 
     @classmethod
-    def _process_notification(cls, notification, resend, aggregated):
+    def _process_notification(cls, notification, resend, aggregated,
+                              processed):
         """Process one notification.
 
         :param notification: the notification to process.
         :param resend: is the notification should be resend notification
                        if already send.
         :param aggregated: ``dict`` to store notification results.
+        :param processed: ``list`` to store the cancelled notifications.
         """
         # 1. Check if notification has already been processed and if we
         #    need to resend it. If not, skip this notification and continue
@@ -131,7 +305,8 @@ class Dispatcher:
         if can_cancel:
             msg = f'Notification #{notification.pid} cancelled: {reason}'
             current_app.logger.info(msg)
-            notification.update_process_date(sent=False, status='cancelled')
+            processed.append(
+                (notification, False, NotificationStatus.CANCELLED))
             return
 
         # 3. Aggregate notifications
@@ -163,6 +338,22 @@ class Dispatcher:
         msg.body = '\n'.join(text[1:])
         return msg
 
+    @staticmethod
+    def _send_email(msg, delay=0):
+        """Send an email message.
+
+        The message is sent with the mail transport of the current thread if
+        any, otherwise (or if it should be delayed) by a celery task.
+
+        :param msg: the message to send.
+        :param delay: the number of seconds to wait before sending it.
+        """
+        connection = Dispatcher.get_transport('mail')
+        if connection and not delay:
+            connection.send(msg)
+        else:
+            task_send_email.apply_async((msg.__dict__,), countdown=delay)
+
     @staticmethod
     def not_yet_implemented(*args):
         """Do nothing placeholder for a notification."""
@@ -238,7 +429,7 @@ class Dispatcher:
             ctx_data=context,
             template=notification.get_template_path()
         )
-        task_send_email.apply_async((msg.__dict__,))
+        Dispatcher._send_email(msg)
         return True
 
     @staticmethod
@@ -278,5 +469,5 @@ class Dispatcher:
             template=notification.get_template_path()
         )
         delay = context.get('delay', 0)
-        task_send_email.apply_async((msg.__dict__,), countdown=delay)
+        Dispatcher._send_email(msg, delay=delay)
         return True
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Batch creation of the reminder notifications."""
+
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import ciso8601
+from flask import current_app
+from invenio_db import db
+
+from .api import Notification, NotificationsIndexer, NotificationsSearch
+from .models import NotificationStatus, NotificationType
+from ..circ_policies.api import DUE_SOON_REMINDER_TYPE, \
+    OVERDUE_REMINDER_TYPE, CircPolicy
+from ..circ_policies.utils import CircPoliciesMatrix
+from ..holdings.api import HoldingsSearch
+from ..items.api import ItemsSearch
+from ..libraries.api import Library
+from ..loans.api import LoansSearch
+from ..loans.models import LoanState
+from ..locations.api import LocationsSearch
+from ..patron_transactions.utils import \
+    create_patron_transaction_from_notification
+from ..patrons.api import PatronsSearch
+from ..utils import date_string_to_utc, get_ref_for_pid
+
+# maximal number of existing reminders of a loan by notification type
+MAX_LOAN_REMINDERS = 100
+
+
+class ReminderEngine:
+    """Create the DUE_SOON and OVERDUE notifications of the loans by batches.
+
+    The candidate loans are read at once from the loans index with the
+    fields needed to resolve their circulation policy. For each batch of
+    loans, the linked items, holdings, patrons and locations are loaded with
+    one search by index and the existing reminders with one aggregation. The
+    due reminders are then computed in memory using the circulation policies
+    matrix and the compiled library calendars. The missing notifications of
+    a batch are created with one commit and indexed with one bulk request.
+
+        # >>> engine = ReminderEngine(tstamp=datetime.now(timezone.utc))
+        # >>> engine.create_reminders(NotificationType.OVERDUE)
+        # >>>   12
+    """
+
+    def __init__(self, tstamp=None, batch_size=None):
+        """Constructor.
+
+        :param tstamp: the execution time (default: `datetime.now()`).
+        :param batch_size: the number of loans processed at once.
+        """
+        self.tstamp = tstamp or datetime.now(timezone.utc)
+        self.batch_size = batch_size or current_app.config.get(
+            'RERO_ILS_NOTIFICATIONS_REMINDERS_BATCH_SIZE', 1000)
+        # location pid --> library pid
+        self._locations = {}
+        # library pid --> Library
+        self._libraries = {}
+        # circulation policy pid --> reminders by type
+        self._reminders = {}
+
+    def get_candidate_loans(self, notification_type):
+        """Get the on loan loans candidate to a reminder.
+
+        :param notification_type: the reminder notification type.
+        :return: a list of loan data.
+        """
+        date_field = 'end_date'
+        if notification_type == NotificationType.DUE_SOON:
+            date_field = 'due_soon_date'
+        end_date = self.tstamp.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        query = LoansSearch() \
+            .filter('term', state=LoanState.ITEM_ON_LOAN) \
+            .filter('range', **{date_field: {'lte': end_date}}) \
+            .source(['pid', 'item_pid', 'patron_pid', 'organisation',
+                     'library_pid', 'transaction_location_pid',
+                     'transaction_date', 'end_date'])
+        # All the loans are read before processing them to prevent the
+        # following error during long operations:
+        #  elasticsearch.helpers.errors.ScanError:
+        #  Scroll request has only succeeded on X (+0 skipped) shards out of Y.
+        return [hit.to_dict() for hit in query.scan()]
+
+    def create_reminders(self, notification_type):
+        """Create the missing reminders of a type.
+
+        :param notification_type: the reminder notification type.
+        :return: the number of created notifications.
+        """
+        if notification_type in current_app.config.get(
+                'RERO_ILS_DISABLED_NOTIFICATION_TYPE', []):
+            return 0
+        count = 0
+        loans = iter(self.get_candidate_loans(notification_type))
+        batch = list(islice(loans, self.batch_size))
+        while batch:
+            records = self.get_due_reminders(batch, notification_type)
+            count += self._create_notifications(records)
+            batch = list(islice(loans, self.batch_size))
+        return count
+
+    def get_due_reminders(self, loans, notification_type):
+        """Get the notifications to create for a batch of loans.
+
+        :param loans: a list of loan data.
+        :param notification_type: the reminder notification type.
+        :return: a list of notification data.
+        """
+        policies = self._get_policy_pids(loans)
+        notified = self._get_notified_counts(loans, notification_type)
+        reminder_type = DUE_SOON_REMINDER_TYPE \
+            if notification_type == NotificationType.DUE_SOON \
+            else OVERDUE_REMINDER_TYPE
+        creation_date = datetime.now(timezone.utc).isoformat()
+        records = []
+        for loan in loans:
+            policy_pid = policies.get(loan['pid'])
+            if not policy_pid:
+                current_app.logger.warning(
+                    f'No circulation policy for loan: {loan["pid"]}')
+                continue
+            reminders = self._get_reminders(policy_pid, reminder_type)
+            if notification_type == NotificationType.DUE_SOON:
+                counters = range(1 if reminders else 0)
+            else:
+                open_days = self._get_open_days(loan)
+                due = sum(
+                    1 for reminder in reminders
+                    if reminder.get('days_delay') <= open_days
+                )
+                counters = range(due)
+            for counter in counters:
+                if counter < notified.get(loan['pid'], 0):
+                    # already notified
+                    continue
+                records.append({
+                    'creation_date': creation_date,
+                    'notification_type': notification_type,
+                    'status': NotificationStatus.CREATED,
+                    'context': {
+                        'loan': {
+                            '$ref': get_ref_for_pid('loans', loan['pid'])
+                        },
+                        'reminder_counter': counter
+                    }
+                })
+        return records
+
+    def _get_notified_counts(self, loans, notification_type):
+        """Count the existing reminders of the current transaction of loans.
+
+        Only the reminders created after the loan transaction date are
+        counted (a renewal restarts the reminders).
+
+        :param loans: a list of loan data.
+        :param notification_type: the reminder notification type.
+        :return: the number of existing reminders by loan pid.
+        """
+        pids = [loan['pid'] for loan in loans]
+        search = NotificationsSearch() \
+            .filter('terms', context__loan__pid=pids) \
+            .filter('term', notification_type=notification_type) \
+            .extra(size=0)
+        search.aggs.bucket(
+            'loans', 'terms', field='context.loan.pid', size=len(pids)
+        ).bucket(
+            'dates', 'terms', field='creation_date', size=MAX_LOAN_REMINDERS
+        )
+        buckets = {
+            bucket['key']: bucket['dates']['buckets']
+            for bucket in search.execute().aggregations.to_dict()[
+                'loans']['buckets']
+        }
+        counts = {}
+        for loan in loans:
+            trans_date = ciso8601.parse_datetime(
+                loan['transaction_date']).timestamp() * 1000
+            counts[loan['pid']] = sum(
+                bucket['doc_count']
+                for bucket in buckets.get(loan['pid'], [])
+                if bucket['key'] > trans_date
+            )
+        return counts
+
+    def _get_policy_pids(self, loans):
+        """Resolve the circulation policy of a batch of loans.
+
+        The circulation policy is resolved as `get_circ_policy` does: using
+        the loan transaction library, the patron type and the item temporary
+        item type or the holding circulation category.
+
+        :param loans: a list of loan data.
+        :return: the circulation policy pid by loan pid.
+        """
+        item_pids = {loan['item_pid']['value'] for loan in loans}
+        items = {
+            hit.pid: hit.to_dict() for hit in ItemsSearch()
+            .filter('terms', pid=list(item_pids))
+            .source(['pid', 'holding', 'temporary_item_type'])
+            .scan()
+        }
+        holding_pids = {
+            item['holding']['pid'] for item in items.values()
+            if item.get('holding')
+        }
+        holdings = {
+            hit.pid: hit.to_dict() for hit in HoldingsSearch()
+            .filter('terms', pid=list(holding_pids))
+            .source(['pid', 'circulation_category', 'location'])
+            .scan()
+        }
+        patron_pids = {loan['patron_pid'] for loan in loans}
+        patron_types = {
+            hit.pid: hit.to_dict().get('patron', {}).get('type', {}).get('pid')
+            for hit in PatronsSearch()
+            .filter('terms', pid=list(patron_pids))
+            .source(['pid', 'patron.type'])
+            .scan()
+        }
+        self._load_locations(
+            [loan.get('transaction_location_pid') for loan in loans] +
+            [holding.get('location', {}).get('pid')
+             for holding in holdings.values()]
+        )
+
+        now = datetime.now(timezone.utc)
+        policies = {}
+        for loan in loans:
+            item = items.get(loan['item_pid']['value'], {})
+            holding = holdings.get(item.get('holding', {}).get('pid'), {})
+            location_pid = loan.get('transaction_location_pid') or \
+                holding.get('location', {}).get('pid')
+            item_type_pid = holding.get('circulation_category', {}).get('pid')
+            temporary_item_type = item.get('temporary_item_type')
+            if temporary_item_type:
+                end_date = temporary_item_type.get('end_date')
+                if not end_date or date_string_to_utc(end_date) >= now:
+                    item_type_pid = temporary_item_type['pid']
+            organisation_pid = loan.get('organisation', {}).get('pid')
+            if not organisation_pid:
+                continue
+            policies[loan['pid']] = CircPoliciesMatrix.get_matrix(
+                organisation_pid).resolve(
+                    self._locations.get(location_pid),
+                    patron_types.get(loan['patron_pid']),
+                    item_type_pid
+                )
+        return policies
+
+    def _load_locations(self, location_pids):
+        """Load the library pid of the locations.
+
+        :param location_pids: a list of location pids.
+        """
+        missing = {
+            pid for pid in location_pids
+            if pid and pid not in self._locations
+        }
+        if missing:
+            query = LocationsSearch() \
+                .filter('terms', pid=list(missing)) \
+                .source(['pid', 'library'])
+            for hit in query.scan():
+                self._locations[hit.pid] = hit.library.pid
+
+    def _get_reminders(self, policy_pid, reminder_type):
+        """Get the reminders of a circulation policy.
+
+        :param policy_pid: the circulation policy pid.
+        :param reminder_type: the reminder type.
+        :return: the list of reminders.
+        """
+        if policy_pid not in self._reminders:
+            policy = CircPolicy.get_record_by_pid(policy_pid)
+            self._reminders[policy_pid] = {
+                _type: list(policy.get_reminders(reminder_type=_type))
+                for _type in [DUE_SOON_REMINDER_TYPE, OVERDUE_REMINDER_TYPE]
+            }
+        return self._reminders[policy_pid][reminder_type]
+
+    def _get_open_days(self, loan):
+        """Count the library open days since the loan is overdue.
+
+        :param loan: the loan data.
+        :return: the number of open days.
+        """
+        location_pid = loan.get('transaction_location_pid')
+        library_pid = self._locations.get(location_pid) or \
+            loan.get('library_pid')
+        if library_pid not in self._libraries:
+            self._libraries[library_pid] = \
+                Library.get_record_by_pid(library_pid)
+        library = self._libraries[library_pid]
+        if not library:
+            return 0
+        # same as `Loan.overdue_date`
+        after = date_string_to_utc(loan['end_date']) + timedelta(days=1)
+        overdue_date = datetime(
+            year=after.year, month=after.month, day=after.day,
+            tzinfo=timezone.utc
+        )
+        return library.count_open(start_date=overdue_date,
+                                  end_date=self.tstamp)
+
+    def _create_notifications(self, records):
+        """Create and index a batch of notifications.
+
+        :param records: a list of notification data.
+        :return: the number of created notifications.
+        """
+        if not records:
+            return 0
+        results = Notification._bulk_create(records)
+        created = []
+        for record, error in results:
+            if error:
+                current_app.logger.error(
+                    f'Unable to create {record.get("notification_type")} '
+                    f'notification :: {error}')
+            else:
+                created.append(record)
+        db.session.commit()
+        NotificationsIndexer().bulk_index_records(created)
+        NotificationsSearch.flush_and_refresh()
+        # overdue fees
+        for notification in created:
+            create_patron_transaction_from_notification(
+                notification=notification, dbcommit=True, reindex=True)
+        return len(created)
@@ -27,9 +27,6 @@ from flask import current_app
 from .dispatcher import Dispatcher
 from .models import NotificationType
 from .utils import get_notifications
-from ..circ_policies.api import OVERDUE_REMINDER_TYPE
-from ..libraries.api import Library
-from ..loans.api import get_due_soon_loans, get_overdue_loans
 from ..utils import set_timestamp
 
 
@@ -37,13 +34,18 @@ from ..utils import set_timestamp
 def process_notifications(notification_type, verbose=True):
     """Dispatch notifications.
 
+    The notifications are dispatched by batches with a pool of threads and
+    transports. The counters by communication channel are exported with the
+    task timestamp.
+
     :param notification_type: notification type to dispatch the notifications.
     :param verbose: is the task should be verbose.
     """
     notification_pids = get_notifications(notification_type=notification_type)
     result = Dispatcher.dispatch_notifications(
         notification_pids=notification_pids,
-        verbose=verbose
+        verbose=verbose,
+        pooled=True
     )
     set_timestamp(f'notification-dispatch-{notification_type}', **result)
     return result
@@ -58,72 +60,21 @@ def create_notifications(types=None, tstamp=None, verbose=True):
                    default it will be `datetime.now()`.
     :param verbose: is the task should be verbose.
     """
-    from ..loans.utils import get_circ_policy
+    from .reminders import ReminderEngine
     types = types or []
     tstamp = tstamp or datetime.now(timezone.utc)
-    logger = current_app.logger
     notification_counter = {}
+    engine = ReminderEngine(tstamp=tstamp)
 
-    # DUE SOON NOTIFICATIONS
-    if NotificationType.DUE_SOON in types:
-        notification_counter[NotificationType.DUE_SOON] = 0
-        logger.debug("DUE_SOON_NOTIFICATION_CREATION -------------")
-        for loan in get_due_soon_loans(tstamp=tstamp):
-            try:
-                logger.debug(f"* Loan#{loan.pid} is considerate as 'due_soon'")
-                loan.create_notification(_type=NotificationType.DUE_SOON)
-                notification_counter[NotificationType.DUE_SOON] += 1
-            except Exception as error:
-                logger.error(
-                    f'Unable to create DUE_SOON notification :: {error}',
-                    exc_info=True, stack_info=True
-                )
-        process_notifications(NotificationType.DUE_SOON)
-    # OVERDUE NOTIFICATIONS
-    if NotificationType.OVERDUE in types:
-        logger.debug("OVERDUE_NOTIFICATION_CREATION --------------")
-        notification_counter[NotificationType.OVERDUE] = 0
-        for loan in get_overdue_loans(tstamp=tstamp):
-            logger.debug(f"* Loan#{loan.pid} is considerate as 'overdue'")
-            # For each overdue loan, we need to get the 'overdue' reminders
-            # to should be sent from the due_date and the current used date.
-            loan_library = Library.get_record_by_pid(loan.library_pid)
-            open_days = loan_library.count_open(
-                start_date=loan.overdue_date,
-                end_date=tstamp
-            )
-            circ_policy = get_circ_policy(loan)
-            logger.debug(f'  - this loan use the cipo#{circ_policy.pid}')
-            logger.debug(f'  - open days from loans due_date :: {open_days}')
-            reminders = circ_policy.get_reminders(
-                reminder_type=OVERDUE_REMINDER_TYPE,
-                limit=open_days
-            )
-            # For each reminder, try to create it.
-            #   the `create_notification` method will check if the notification
-            #   is already sent. If the notification has already sent, it will
-            #   not be created again
-            for idx, reminder in enumerate(reminders):
-                try:
-                    notification = loan.create_notification(
-                        _type=NotificationType.OVERDUE,
-                        counter=idx
-                    )
-                    if notification:
-                        msg = f'  --> Overdue notification#{idx+1} created'
-                        logger.debug(msg)
-                        notification_counter[NotificationType.OVERDUE] += 1
-
-                    else:
-                        msg = f'  --> Overdue notification#{idx+1} skipped ' \
-                              ':: already sent'
-                        logger.debug(msg)
-                except Exception as error:
-                    logger.error(
-                        f'Unable to create OVERDUE notification :: {error}',
-                        exc_info=True, stack_info=True
-                    )
-        process_notifications(NotificationType.OVERDUE)
+    # The reminders are created by batches: the due reminders of the
+    # candidate loans are computed by the `ReminderEngine` (the already
+    # created notifications are not created again).
+    for notification_type in [NotificationType.DUE_SOON,
+                              NotificationType.OVERDUE]:
+        if notification_type in types:
+            notification_counter[notification_type] = \
+                engine.create_reminders(notification_type)
+            process_notifications(notification_type)
     notification_sum = sum(notification_counter.values())
     counters = {k: v for k, v in notification_counter.items() if v > 0}
 
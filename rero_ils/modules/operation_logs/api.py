@@ -26,6 +26,7 @@ from invenio_records.api import RecordBase
 from invenio_search import RecordsSearch, current_search_client
 
 from .extensions import DatesExtension, IDExtension, ResolveRefsExtension
+from .writer import OperationLogWriter
 from ..api import IlsRecordsSearch
 from ..fetchers import FetchedPID
 
@@ -80,6 +81,10 @@ class OperationLog(RecordBase):
             (the default) then do nothing with refreshes.
             Valid choices: 'true', 'false', 'wait_for'
         :returns: A new :class:`Record` instance.
+
+        If the `RERO_ILS_OPERATION_LOG_BUFFER` setting is enabled, the records
+        which do not need an index refresh are buffered and indexed later by
+        batch (see ``OperationLogWriter``).
         """
         if id_:
             data['pid'] = id_
@@ -104,12 +109,16 @@ class OperationLog(RecordBase):
                 use_model=False
             )
 
-        current_search_client.index(
-            index=cls.get_index(record),
-            body=record.dumps(),
-            id=record['pid'],
-            refresh=index_refresh
-        )
+        if index_refresh == 'false' and \
+                current_app.config.get('RERO_ILS_OPERATION_LOG_BUFFER'):
+            OperationLogWriter.get_writer().write(record.dumps())
+        else:
+            current_search_client.index(
+                index=cls.get_index(record),
+                body=record.dumps(),
+                id=record['pid'],
+                refresh=index_refresh
+            )
 
         # Run post create extensions
         for e in cls._extensions:
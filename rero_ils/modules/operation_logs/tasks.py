@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Celery tasks for operation logs."""
+
+from __future__ import absolute_import, print_function
+
+from datetime import datetime, timezone
+
+from celery import shared_task
+from dateutil import parser
+
+from .api import OperationLog
+from ..utils import set_timestamp
+
+
+@shared_task(ignore_result=True)
+def index_operation_logs(logs):
+    """Index a batch of buffered operation logs.
+
+    :param logs: list of dumped operation logs.
+    :return: the number of indexed operation logs.
+    """
+    OperationLog.bulk_index(logs)
+    now = datetime.now(timezone.utc)
+    created = [
+        parser.parse(log['_created']) for log in logs if log.get('_created')
+    ]
+    latency = (now - min(created)).total_seconds() if created else None
+    set_timestamp('operation-logs-flush', count=len(logs), latency=latency)
+    return len(logs)
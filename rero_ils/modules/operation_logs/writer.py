@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Buffered writer for operation logs."""
+
+import atexit
+import os
+import threading
+import time
+
+from flask import current_app
+
+
+class OperationLogWriter:
+    """Buffered operation log writer.
+
+    The operation logs are kept into a process buffer instead of being
+    indexed one by one. The buffer is flushed when it reaches a given size or
+    when its oldest operation log is older than a given delay (checked by a
+    background thread). A flush sends the buffered operation logs as a single
+    celery task message: the logs are then stored by the message broker until
+    a worker indexes them using ``OperationLog.bulk_index``.
+    """
+
+    # process writer
+    _writer = None
+    _writer_lock = threading.Lock()
+
+    def __init__(self, app, max_size=500, max_delay=5):
+        """Constructor.
+
+        :param app: the flask application.
+        :param max_size: the number of buffered logs triggering a flush.
+        :param max_delay: the maximum time (in seconds) a log can be buffered.
+        """
+        self.app = app
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pid = os.getpid()
+        self._buffer = []
+        self._oldest = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.last_flush = None
+        self.last_flush_latency = None
+
+    @classmethod
+    def get_writer(cls):
+        """Get the writer of the current process.
+
+        A new writer is created after a fork: the buffer inherited from the
+        parent process belongs to the parent.
+
+        :return: the ``OperationLogWriter`` of the current process.
+        """
+        with cls._writer_lock:
+            writer = cls._writer
+            if writer is None or writer.pid != os.getpid():
+                config = current_app.config
+                writer = cls(
+                    current_app._get_current_object(),
+                    max_size=config.get(
+                        'RERO_ILS_OPERATION_LOG_BUFFER_SIZE', 500),
+                    max_delay=config.get(
+                        'RERO_ILS_OPERATION_LOG_BUFFER_DELAY', 5)
+                )
+                cls._writer = writer
+                atexit.register(writer.stop)
+            return writer
+
+    @property
+    def metrics(self):
+        """Writer metrics.
+
+        :return: a dictionary with the number of buffered logs (`backlog`),
+                 the age of the oldest buffered log (`backlog_age`), the
+                 number of flushed logs (`flushed`), the last flush time and
+                 its latency (time between the oldest log and the flush).
+        """
+        with self._lock:
+            return {
+                'backlog': len(self._buffer),
+                'backlog_age': time.time() - self._oldest
+                if self._oldest else 0,
+                'flushed': self.flushed,
+                'last_flush': self.last_flush,
+                'last_flush_latency': self.last_flush_latency
+            }
+
+    def write(self, data):
+        """Buffer an operation log.
+
+        :param data: the dumped operation log.
+        """
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.time()
+            self._buffer.append(data)
+            size = len(self._buffer)
+        self._start()
+        if size >= self.max_size:
+            self.flush()
+
+    def flush(self):
+        """Send the buffered operation logs to the message broker.
+
+        :return: the number of sent operation logs.
+        """
+        from .tasks import index_operation_logs
+        with self._lock:
+            logs, oldest = self._buffer, self._oldest
+            self._buffer, self._oldest = [], None
+            if not logs:
+                return 0
+            try:
+                index_operation_logs.delay(logs)
+            except Exception:
+                # keep the logs for the next flush
+                self._buffer, self._oldest = logs + self._buffer, oldest
+                raise
+            now = time.time()
+            self.flushed += len(logs)
+            self.last_flush = now
+            self.last_flush_latency = now - oldest
+        return len(logs)
+
+    def _start(self):
+        """Start the background flush thread if needed."""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(
+                        target=self._run,
+                        name='operation-logs-writer',
+                        daemon=True
+                    )
+                    self._thread.start()
+
+    def _run(self):
+        """Flush the buffer when its oldest log is older than the delay."""
+        while not self._stop.wait(min(1, self.max_delay)):
+            oldest = self._oldest
+            if oldest and time.time() - oldest >= self.max_delay:
+                with self.app.app_context():
+                    try:
+                        self.flush()
+                    except Exception as error:
+                        self.app.logger.error(
+                            f'Operation logs flush error: {error}')
+
+    def stop(self):
+        """Stop the background thread and flush the remaining logs."""
+        self._stop.set()
+        if self._buffer:
+            with self.app.app_context():
+                self.flush()
@@ -76,6 +76,7 @@ class Organisation(IlsRecord):
     fetcher = organisation_id_fetcher
     provider = OrganisationProvider
     model_cls = OrganisationMetadata
+    enable_identity_map = True
 
     @classmethod
     def get_all(cls):
@@ -147,9 +148,7 @@ class Organisation(IlsRecord):
 
     def get_libraries(self):
         """Get all libraries related to the organisation."""
-        pids = self.get_libraries_pids()
-        for pid in pids:
-            yield Library.get_record_by_pid(pid)
+        yield from Library.get_records_by_pids(self.get_libraries_pids())
 
     def get_vendor_pids(self):
         """Get all vendor pids related to the organisation."""
@@ -161,9 +160,7 @@ class Organisation(IlsRecord):
 
     def get_vendors(self):
         """Get all vendors related to the organisation."""
-        pids = self.get_vendor_pids()
-        for pid in pids:
-            yield Vendor.get_record_by_pid(pid)
+        yield from Vendor.get_records_by_pids(self.get_vendor_pids())
 
     def get_links_to_me(self, get_pids=False):
         """Record links.
@@ -72,6 +72,7 @@ class PatronType(IlsRecord):
     fetcher = patron_type_id_fetcher
     provider = PatronTypeProvider
     model_cls = PatronTypeMetadata
+    enable_identity_map = True
     pids_exist_check = {
         'required': {
             'org': 'organisation',
@@ -334,7 +334,7 @@ class Patron(IlsRecord):
                 .filter('term', user_id=user.id)\
                 .source(includes='pid')\
                 .scan()
-            patrons = [cls.get_record_by_pid(hit.pid) for hit in result]
+            patrons = list(cls.get_records_by_pids(hit.pid for hit in result))
         return patrons
 
     @classmethod
@@ -24,6 +24,7 @@ from invenio_db import db
 from invenio_pidstore.errors import PIDDoesNotExistError
 from invenio_pidstore.models import PIDStatus
 from invenio_pidstore.providers.base import BaseProvider
+from sqlalchemy import text
 
 
 def append_fixtures_new_identifiers(identifier, pids, pid_type, limit=100000):
@@ -78,3 +79,29 @@ class Provider(BaseProvider):
             return super().create(
                 object_type=object_type, object_uuid=object_uuid, **kwargs
             )
+
+    @classmethod
+    def next_pids(cls, count):
+        """Reserve a block of new identifiers.
+
+        With PostgreSQL, the identifiers are taken from the identifier
+        sequence and inserted with a single query each.
+
+        :param count: the number of identifiers to reserve.
+        :returns: the list of the new pid values.
+        """
+        if count <= 0:
+            return []
+        identifier = cls.identifier
+        if db.engine.dialect.name != 'postgresql':
+            return [str(identifier.next()) for _ in range(count)]
+        recids = [
+            recid for recid, in db.session.execute(text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'recid')) "
+                'FROM generate_series(1, :count)'
+            ), dict(table=identifier.__tablename__, count=count))
+        ]
+        db.session.execute(identifier.__table__.insert().values([
+            dict(recid=recid) for recid in recids
+        ]))
+        return [str(recid) for recid in recids]
@@ -26,6 +26,7 @@ from invenio_circulation.errors import CirculationException, \
     ItemNotAvailableError
 
 from .models import SelfcheckTerminal
+from .summary import PatronSummary
 from .utils import authorize_selfckeck_patron, authorize_selfckeck_terminal, \
     check_sip2_module, format_patron_address, get_patron_status, \
     map_item_circulation_status, map_media_type
@@ -35,13 +36,9 @@ from ..errors import ItemBarcodeNotFound, NoCirculationAction
 from ..items.api import Item
 from ..items.models import ItemNoteTypes
 from ..libraries.api import Library
-from ..loans.api import Loan, get_loans_by_item_pid_by_patron_pid, \
-    get_loans_by_patron_pid
+from ..loans.api import Loan, get_loans_by_item_pid_by_patron_pid
 from ..loans.models import LoanAction, LoanState
-from ..patron_transactions.api import PatronTransaction
-from ..patron_transactions.utils import get_last_transaction_by_loan_pid, \
-    get_transactions_pids_for_patron, \
-    get_transactions_total_amount_for_patron
+from ..patron_transactions.utils import get_last_transaction_by_loan_pid
 from ..patrons.api import Patron
 
 
@@ -165,9 +162,9 @@ def patron_status(barcode, **kwargs):
                 valid_patron=patron.is_patron
             )
 
-            fee_amount = get_transactions_total_amount_for_patron(
-                    patron.pid, status='open', with_subscription=False)
-            patron_status_response['fee_amount'] = '%.2f' % fee_amount
+            summary = PatronSummary.get(patron.pid)
+            patron_status_response['fee_amount'] = \
+                '%.2f' % summary.fee_amount
             return patron_status_response
         else:
             return SelfcheckPatronStatus(
@@ -209,48 +206,16 @@ def patron_information(barcode, **kwargs):
                 valid_patron=patron.is_patron
             )
 
-            filter_states = [
-                LoanState.PENDING,
-                LoanState.ITEM_AT_DESK,
-                LoanState.ITEM_IN_TRANSIT_FOR_PICKUP,
-                LoanState.ITEM_ON_LOAN
-            ]
-            loans = get_loans_by_patron_pid(patron.pid, filter_states)
-            for loan in loans:
-                item = Item.get_record_by_pid(loan.item_pid)
-                if loan['state'] == LoanState.ITEM_ON_LOAN:
-                    patron_account_information.get('charged_items', []).append(
-                        item.get('barcode'))
-                    if loan.is_loan_overdue():
-                        patron_account_information.get('overdue_items', []) \
-                            .append(item.get('barcode'))
-                elif loan['state'] in [
-                    LoanState.PENDING,
-                    LoanState.ITEM_AT_DESK,
-                    LoanState.ITEM_IN_TRANSIT_FOR_PICKUP
-                ]:
-                    patron_account_information.get('hold_items', []).append(
-                        item.get('barcode')
-                    )
-
-            fee_amount = get_transactions_total_amount_for_patron(
-                    patron.pid, status='open', with_subscription=False)
-            patron_account_information['fee_amount'] = '%.2f' % fee_amount
-            # check for fine items
-            if fee_amount > 0:
-                # Check if fine items exist
-                transaction_pids = get_transactions_pids_for_patron(
-                        patron.pid, status='open')
-                for transaction_pid in transaction_pids:
-                    # TODO: return screen message to notify patron if there are
-                    #  other open transactions
-                    transaction = PatronTransaction \
-                        .get_record_by_pid(transaction_pid)
-                    if transaction.loan_pid:
-                        loan = Loan.get_record_by_pid(transaction.loan_pid)
-                        item = Item.get_record_by_pid(loan.item_pid)
-                        patron_account_information.get('fine_items', []) \
-                            .append(item.get('barcode'))
+            summary = PatronSummary.get(patron.pid)
+            for key in [
+                'charged_items', 'overdue_items', 'hold_items', 'fine_items'
+            ]:
+                patron_account_information.get(key, []).extend(
+                    getattr(summary, key))
+            patron_account_information['fee_amount'] = \
+                '%.2f' % summary.fee_amount
+            # TODO: return screen message to notify patron if there are
+            #  other open transactions
             return patron_account_information
         else:
             return SelfcheckPatronInformation(
@@ -376,6 +341,7 @@ def selfcheck_checkout(transaction_user_pid, item_barcode, patron_barcode,
                         item_pid=item.pid,
                         selfcheck_terminal_id=str(terminal.id),
                     )
+                    PatronSummary.invalidate(patron.pid)
                     if LoanAction.CHECKOUT in data:
                         loan = data[LoanAction.CHECKOUT]
                         checkout['checkout'] = True
@@ -472,6 +438,8 @@ def selfcheck_checkin(transaction_user_pid, item_barcode, **kwargs):
                         selfcheck_terminal_id=str(terminal.id),
                     )
                     if LoanAction.CHECKIN in data:
+                        PatronSummary.invalidate(
+                            data[LoanAction.CHECKIN].get('patron_pid'))
                         checkin['checkin'] = True
                         checkin['resensitize'] = True
                         if item.get_requests(output='count') > 0:
@@ -544,6 +512,7 @@ def selfcheck_renew(transaction_user_pid, item_barcode, **kwargs):
                     )
                     if LoanAction.EXTEND in data:
                         loan = data[LoanAction.EXTEND]
+                        PatronSummary.invalidate(loan.get('patron_pid'))
                         renew['success'] = True
                         renew['renewal'] = True
                         renew['desensitize'] = True
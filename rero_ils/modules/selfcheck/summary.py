@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Selfcheck patron account summary."""
+
+from datetime import datetime, timezone
+
+import ciso8601
+from flask import current_app
+from invenio_cache.proxies import current_cache
+
+from ..items.api import ItemsSearch
+from ..loans.api import Loan, LoansSearch
+from ..loans.models import LoanState
+from ..patron_transactions.api import PatronTransactionsSearch
+
+HOLD_STATES = [
+    LoanState.PENDING,
+    LoanState.ITEM_AT_DESK,
+    LoanState.ITEM_IN_TRANSIT_FOR_PICKUP
+]
+
+
+class PatronSummary:
+    """Patron account summary for the selfcheck.
+
+    The summary holds the barcodes of the charged, overdue, hold and fine
+    items and the open fees amount of a patron. It is built from three
+    searches (loans, open transactions and items barcodes) instead of
+    loading every loan, transaction and item from the database. Only the
+    loans with a past due date are loaded to apply the circulation policy
+    overdue rules.
+
+    A summary is kept in the shared cache for a short time: it is reused by
+    the requests of a selfcheck session (patron status, patron information,
+    ...) and removed by the selfcheck circulation operations.
+    """
+
+    def __init__(self, patron_pid, charged_items=None, overdue_items=None,
+                 hold_items=None, fine_items=None, fee_amount=0):
+        """Constructor.
+
+        :param patron_pid: the patron pid.
+        :param charged_items: the barcodes of the items on loan.
+        :param overdue_items: the barcodes of the overdue items.
+        :param hold_items: the barcodes of the requested items.
+        :param fine_items: the barcodes of the items with an open fee.
+        :param fee_amount: the total amount of the open fees without the
+                           subscriptions.
+        """
+        self.patron_pid = patron_pid
+        self.charged_items = charged_items or []
+        self.overdue_items = overdue_items or []
+        self.hold_items = hold_items or []
+        self.fine_items = fine_items or []
+        self.fee_amount = fee_amount
+
+    @staticmethod
+    def _cache_key(patron_pid):
+        """Get the shared cache key of a patron summary."""
+        return f'selfcheck::patron_summary::{patron_pid}'
+
+    @classmethod
+    def get(cls, patron_pid):
+        """Get the summary of a patron, from the cache if possible.
+
+        :param patron_pid: the patron pid.
+        :return: the patron summary.
+        :rtype: PatronSummary
+        """
+        data = current_cache.get(cls._cache_key(patron_pid))
+        if data:
+            return cls(**data)
+        summary = cls.build(patron_pid)
+        timeout = current_app.config.get(
+            'RERO_ILS_SELFCHECK_PATRON_SUMMARY_TIMEOUT', 30)
+        if timeout:
+            current_cache.set(
+                cls._cache_key(patron_pid), summary.to_dict(),
+                timeout=timeout)
+        return summary
+
+    @classmethod
+    def invalidate(cls, patron_pid):
+        """Remove the summary of a patron from the cache.
+
+        :param patron_pid: the patron pid.
+        """
+        if patron_pid:
+            current_cache.delete(cls._cache_key(patron_pid))
+
+    @classmethod
+    def build(cls, patron_pid):
+        """Build the summary of a patron.
+
+        :param patron_pid: the patron pid.
+        :return: the patron summary.
+        :rtype: PatronSummary
+        """
+        now = datetime.now(timezone.utc)
+        charged, holds, overdue_candidates = [], [], []
+        loans = LoansSearch()\
+            .filter('term', patron_pid=patron_pid)\
+            .filter('terms', state=[LoanState.ITEM_ON_LOAN] + HOLD_STATES)\
+            .filter('term', to_anonymize=False)\
+            .params(preserve_order=True)\
+            .sort({'_created': {'order': 'asc'}})\
+            .source(['pid', 'state', 'item_pid', 'end_date'])
+        for hit in loans.scan():
+            item_pid = hit.item_pid.value
+            if hit.state == LoanState.ITEM_ON_LOAN:
+                charged.append(item_pid)
+                # a loan can only be overdue after its due date
+                if hit.end_date and \
+                        ciso8601.parse_datetime(hit.end_date) < now:
+                    overdue_candidates.append(hit.pid)
+            else:
+                holds.append(item_pid)
+        overdue = [
+            loan.item_pid for loan in Loan.get_records_by_pids(
+                overdue_candidates) if loan.is_loan_overdue()
+        ]
+
+        fee_amount = 0
+        fines = []
+        transactions = PatronTransactionsSearch()\
+            .filter('term', patron__pid=patron_pid)\
+            .filter('term', status='open')\
+            .source(['type', 'total_amount', 'item'])
+        for hit in transactions.scan():
+            if hit.type != 'subscription':
+                fee_amount += hit.total_amount or 0
+            item_pid = hit.to_dict().get('item', {}).get('pid')
+            if item_pid:
+                fines.append(item_pid)
+
+        item_pids = set(charged + holds + fines)
+        barcodes = {
+            hit.pid: hit.to_dict().get('barcode')
+            for hit in ItemsSearch()
+            .filter('terms', pid=list(item_pids))
+            .source(['pid', 'barcode'])
+            .scan()
+        } if item_pids else {}
+        return cls(
+            patron_pid,
+            charged_items=[barcodes.get(pid) for pid in charged],
+            overdue_items=[barcodes.get(pid) for pid in overdue],
+            hold_items=[barcodes.get(pid) for pid in holds],
+            fine_items=[barcodes.get(pid) for pid in fines],
+            fee_amount=round(fee_amount, 2)
+        )
+
+    def to_dict(self):
+        """Get the summary data.
+
+        :return: the summary as a dictionary.
+        """
+        return {
+            'patron_pid': self.patron_pid,
+            'charged_items': self.charged_items,
+            'overdue_items': self.overdue_items,
+            'hold_items': self.hold_items,
+            'fine_items': self.fine_items,
+            'fee_amount': self.fee_amount
+        }
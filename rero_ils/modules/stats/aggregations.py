@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Single pass aggregation of statistics metrics."""
+
+from elasticsearch_dsl import A, Q
+
+# precision threshold of the cardinality aggregations (its maximal value).
+# The cardinality is a HyperLogLog++ estimation: the distinct counts are
+# expected to be close to accurate below this threshold, above it the error
+# can reach a few percents.
+CARDINALITY_PRECISION = 40000
+
+
+class StatsAggregation:
+    """Compute several metrics of an index in a single search.
+
+    Each metric is computed for each group of documents: a group is either a
+    value of a field (`terms` aggregation) or a named filter (`filters`
+    aggregation). A metric can be computed for several date ranges at once.
+    The metrics without date field are computed once (point in time) and
+    returned for all the date ranges. The distinct counts are approximated
+    by `cardinality` aggregations (see `CARDINALITY_PRECISION`).
+
+        # >>> aggregation = StatsAggregation(
+        # ...     ItemsSearch(), {'2021-01': {'gte': ..., 'lte': ...}})
+        # >>> aggregation.count('items', 'library.pid')
+        # >>> aggregation.count(
+        # ...     'new_items', 'library.pid', date_field='_created')
+        # >>> aggregation.execute()
+        # >>>   {'2021-01': {'items': {'lib1': 12}, 'new_items': {'lib1': 2}}}
+    """
+
+    def __init__(self, search, date_ranges, size=10000):
+        """Constructor.
+
+        :param search: the search of the index.
+        :param date_ranges: the date ranges by key.
+        :param size: the maximal number of groups or terms.
+        """
+        self.search = search
+        self.date_ranges = date_ranges
+        self.size = size
+        self.metrics = []
+
+    def _add_metric(self, kind, name, group, filters, date_field=None,
+                    date_ranges=None, range_filters=None, **params):
+        """Add a metric.
+
+        :param kind: the metric kind (count, sum, distinct or terms).
+        :param name: the metric name.
+        :param group: the field to group by or the group filters by key.
+        :param filters: the filters of the metric.
+        :param date_field: the date field to filter with the date ranges,
+                           `None` for a point in time metric.
+        :param date_ranges: the date ranges by key if they are different
+                            from the aggregation date ranges.
+        :param range_filters: additional filters by date range key.
+        :param params: the metric specific parameters.
+        :return: the aggregation itself.
+        """
+        self.metrics.append(dict(
+            kind=kind,
+            name=name,
+            group=group,
+            filters=list(filters),
+            date_field=date_field,
+            date_ranges=date_ranges,
+            range_filters=range_filters or {},
+            **params
+        ))
+        return self
+
+    def count(self, name, group, *filters, sum_field=None, **kwargs):
+        """Count the documents of each group.
+
+        :param name: the metric name.
+        :param group: the field to group by or the group filters by key.
+        :param filters: the filters of the metric.
+        :param sum_field: sum the values of this field instead of counting
+                          the documents (i.e. for pre-aggregated documents).
+        :param kwargs: the date options (see ``_add_metric``).
+        :return: the aggregation itself.
+        """
+        if sum_field:
+            return self._add_metric(
+                'sum', name, group, filters, field=sum_field, **kwargs)
+        return self._add_metric('count', name, group, filters, **kwargs)
+
+    def distinct(self, name, group, field, *filters, **kwargs):
+        """Count the distinct values of a field for each group.
+
+        The count is an approximation (see `CARDINALITY_PRECISION`).
+
+        :param name: the metric name.
+        :param group: the field to group by or the group filters by key.
+        :param field: the field to count the distinct values of.
+        :param filters: the filters of the metric.
+        :param kwargs: the date options (see ``_add_metric``).
+        :return: the aggregation itself.
+        """
+        return self._add_metric(
+            'distinct', name, group, filters, field=field, **kwargs)
+
+    def terms(self, name, group, field, *filters, distinct_field=None,
+              missing=None, **kwargs):
+        """Count the documents by value of a field for each group.
+
+        :param name: the metric name.
+        :param group: the field to group by or the group filters by key.
+        :param field: the field to count the documents by value.
+        :param filters: the filters of the metric.
+        :param distinct_field: count the distinct values of this field
+                               instead of the documents (approximated, see
+                               `CARDINALITY_PRECISION`).
+        :param missing: the value to use for the documents without value.
+        :param kwargs: the date options (see ``_add_metric``).
+        :return: the aggregation itself.
+        """
+        return self._add_metric(
+            'terms', name, group, filters, field=field,
+            distinct_field=distinct_field, missing=missing, **kwargs)
+
+    def _metric_queries(self, metric):
+        """Get the queries of a metric for each date range.
+
+        :param metric: the metric.
+        :return: a generator of (date range key, query) tuples, the key is
+                 `None` for a point in time metric.
+        """
+        if not metric['date_field']:
+            yield None, Q('bool', filter=metric['filters'])
+            return
+        date_ranges = metric['date_ranges'] or self.date_ranges
+        for key, date_range in date_ranges.items():
+            filters = metric['filters'] + [
+                Q('range', **{metric['date_field']: date_range})
+            ] + metric['range_filters'].get(key, [])
+            yield key, Q('bool', filter=filters)
+
+    def _metric_aggregation(self, metric, query):
+        """Get the aggregation of a sum, distinct or terms metric.
+
+        :param metric: the metric.
+        :param query: the metric query.
+        :return: the metric aggregation.
+        """
+        aggregation = A('filter', query)
+        if metric['kind'] == 'sum':
+            aggregation.metric('value', 'sum', field=metric['field'])
+            return aggregation
+        if metric['kind'] == 'distinct':
+            aggregation.metric(
+                'value', 'cardinality', field=metric['field'],
+                precision_threshold=CARDINALITY_PRECISION)
+            return aggregation
+        params = {}
+        if metric['missing'] is not None:
+            params['missing'] = metric['missing']
+        terms = aggregation.bucket(
+            'terms', 'terms', field=metric['field'], size=self.size, **params)
+        if metric['distinct_field']:
+            terms.metric(
+                'value', 'cardinality', field=metric['distinct_field'],
+                precision_threshold=CARDINALITY_PRECISION)
+        return aggregation
+
+    @staticmethod
+    def _metric_value(metric, data):
+        """Get the value of a metric from an aggregation result.
+
+        :param metric: the metric.
+        :param data: the aggregation result of the metric.
+        :return: the metric value.
+        """
+        if metric['kind'] == 'count':
+            return data['doc_count']
+        if metric['kind'] == 'sum':
+            return int(data['value']['value'])
+        if metric['kind'] == 'distinct':
+            return data['value']['value']
+        return {
+            bucket['key']: bucket['value']['value']
+            if metric['distinct_field'] else bucket['doc_count']
+            for bucket in data['terms']['buckets']
+        }
+
+    def execute(self):
+        """Compute all the metrics in a single search.
+
+        :return: the metric values by date range key, metric name and group.
+        :rtype: dict
+        """
+        search = self.search.extra(size=0)
+        groups = {}
+        slots = []
+        queries = []
+        for idx, metric in enumerate(self.metrics):
+            group_key = repr(metric['group'])
+            group = groups.setdefault(group_key, {
+                'name': f'group_{len(groups)}',
+                'group': metric['group'],
+                'counts': {},
+                'aggs': {}
+            })
+            for range_idx, (key, query) in enumerate(
+                    self._metric_queries(metric)):
+                name = f'metric_{idx}_{range_idx}'
+                slots.append((group['name'], name, metric, key))
+                queries.append(query)
+                if metric['kind'] == 'count':
+                    group['counts'][name] = query
+                else:
+                    group['aggs'][name] = self._metric_aggregation(
+                        metric, query)
+        if not slots:
+            return {key: {} for key in self.date_ranges}
+        # only the documents of at least one metric are aggregated
+        search = search.filter('bool', should=queries)
+        for group in groups.values():
+            if isinstance(group['group'], dict):
+                aggregation = search.aggs.bucket(
+                    group['name'], 'filters', filters=group['group'])
+            else:
+                aggregation = search.aggs.bucket(
+                    group['name'], 'terms', field=group['group'],
+                    size=self.size)
+            if group['counts']:
+                aggregation.bucket('counts', 'filters',
+                                   filters=group['counts'])
+            for name, metric_aggregation in group['aggs'].items():
+                aggregation.bucket(name, metric_aggregation)
+        aggregations = search.execute().aggregations.to_dict()
+
+        results = {
+            key: {metric['name']: {} for metric in self.metrics}
+            for key in self.date_ranges
+        }
+        for group_name, name, metric, key in slots:
+            buckets = aggregations[group_name]['buckets']
+            if isinstance(buckets, dict):
+                # filters aggregation: buckets by group key
+                buckets = [
+                    dict(bucket, key=group)
+                    for group, bucket in buckets.items()
+                ]
+            for bucket in buckets:
+                if metric['kind'] == 'count':
+                    data = bucket['counts']['buckets'][name]
+                else:
+                    data = bucket[name]
+                value = self._metric_value(metric, data)
+                for range_key in [key] if key is not None else results:
+                    results.setdefault(range_key, {}).setdefault(
+                        metric['name'], {})[bucket['key']] = value
+        return results
@@ -22,10 +22,13 @@ from functools import partial
 
 import arrow
 from dateutil.relativedelta import relativedelta
+from elasticsearch_dsl import Q
 from flask import current_app
 from invenio_search.api import RecordsSearch
 
+from .aggregations import StatsAggregation
 from .models import StatIdentifier, StatMetadata
+from .rollups import CirculationRollup
 from ..acq_order_lines.api import AcqOrderLinesSearch
 from ..api import IlsRecord, IlsRecordsIndexer, IlsRecordsSearch
 from ..documents.api import DocumentsSearch
@@ -50,6 +53,17 @@ stat_id_minter = partial(id_minter, provider=StatProvider)
 # fetcher
 stat_id_fetcher = partial(id_fetcher, provider=StatProvider)
 
+# loan operation logs fields of the circulation statistics by usage: the logs
+# have no transaction library and each log counts for one operation.
+OPERATION_LOG_FIELDS = {
+    'library': None,
+    'item_library': 'loan.item.library_pid',
+    'trigger': 'loan.trigger',
+    'patron': 'loan.patron.hashed_pid',
+    'postal_code': 'loan.patron.postal_code',
+    'count': None
+}
+
 
 class StatsSearch(IlsRecordsSearch):
     """ItemTypeSearch."""
@@ -66,7 +80,11 @@ class StatsSearch(IlsRecordsSearch):
 
 
 class StatsForPricing:
-    """Statistics for pricing."""
+    """Statistics for pricing.
+
+    The statistics of all the libraries are computed with one aggregation
+    search by index (see ``StatsAggregation``).
+    """
 
     def __init__(self, to_date=None):
         """Constructor."""
@@ -112,208 +130,166 @@ class StatsForPricing:
             return stat_pid[0]
         return
 
-    def collect(self):
-        """Compute all the statistics."""
-        stats = []
-        for lib in self.get_all_libraries():
-            stats.append({
-                'library': {
-                    'pid': lib.pid,
-                    'name': lib.name
-                },
-                'number_of_documents': self.number_of_documents(lib.pid),
-                'number_of_libraries': self.number_of_libraries(
-                    lib.organisation.pid),
-                'number_of_librarians': self.number_of_librarians(lib.pid),
-                'number_of_active_patrons': self.number_of_active_patrons(
-                    lib.pid),
-                'number_of_order_lines': self.number_of_order_lines(lib.pid),
-                'number_of_checkouts':
-                    self.number_of_circ_operations(lib.pid, 'checkout'),
-                'number_of_renewals':
-                    self.number_of_circ_operations(lib.pid, 'extend'),
-                'number_of_satisfied_ill_request':
-                    self.number_of_satisfied_ill_request(lib.pid),
-                'number_of_items': self.number_of_items(lib.pid),
-                'number_of_new_items': self.number_of_new_items(lib.pid),
-                'number_of_deleted_items': self.number_of_deleted_items(
-                    lib.pid),
-                'number_of_patrons': self.number_of_patrons(
-                    lib.organisation.pid),
-                'number_of_new_patrons': self.number_of_patrons(
-                    lib.organisation.pid),
-                'number_of_checkins':
-                    self.number_of_circ_operations(lib.pid, 'checkin'),
-                'number_of_requests':
-                    self.number_of_circ_operations(lib.pid, 'request')
-            })
-        return stats
-
-    def number_of_documents(self, library_pid):
-        """Number of documents linked to my library.
-
-        point in time
-        :param library_pid: string - the library to filter with
-        :return: the number of matched documents
-        :rtype: integer
-        """
-        # can be done using the facet
-        return DocumentsSearch().filter(
-            'term', holdings__organisation__library_pid=library_pid).count()
-
-    def number_of_libraries(self, organisation_pid):
-        """Number of libraries of the given organisation.
+    @staticmethod
+    def execute_aggregations(aggregations, date_ranges):
+        """Execute some aggregations and merge their results.
 
-        point in time
-        :param organisation_pid: string - the organisation to filter with
-        :return: the number of matched libraries
-        :rtype: integer
+        :param aggregations: the ``StatsAggregation`` to execute.
+        :param date_ranges: the date ranges by key.
+        :return: the metric values by date range key, metric name and group.
+        :rtype: dict
         """
-        return LibrariesSearch().filter(
-            'term', organisation__pid=organisation_pid).count()
-
-    def number_of_librarians(self, library_pid):
-        """Number of users with a librarian role.
-
-        point in time
-        :param library_pid: string - the library to filter with
-        :return: the number of matched librarians
-        :rtype: integer
+        values = {key: {} for key in date_ranges}
+        for aggregation in aggregations:
+            for key, metrics in aggregation.execute().items():
+                values[key].update(metrics)
+        return values
+
+    @staticmethod
+    def get_circulation_aggregation(date_ranges):
+        """Get the aggregation of the circulation statistics.
+
+        The circulation statistics are computed from the daily circulation
+        rollups if enabled, from the loan operation logs otherwise.
+
+        :param date_ranges: the date ranges by key.
+        :return: the aggregation and the fields to use by usage.
+        :rtype: tuple
         """
-        return PatronsSearch()\
-            .filter('term', roles='librarian')\
-            .filter('term', libraries__pid=library_pid)\
-            .count()
-
-    def number_of_active_patrons(self, library_pid):
-        """Number of patrons who did a transaction in a the past 365 days.
-
-        :param library_pid: string - the library to filter with
-        :return: the number of matched active patrons
-        :rtype: integer
+        if current_app.config.get('RERO_ILS_STATS_CIRCULATION_ROLLUPS'):
+            return StatsAggregation(
+                CirculationRollup.search(), date_ranges
+            ), CirculationRollup.FIELDS
+        return StatsAggregation(
+            RecordsSearch(index=LoanOperationLog.index_name), date_ranges
+        ), OPERATION_LOG_FIELDS
+
+    @staticmethod
+    def _get_year_range(date_range):
+        """Get the 12 months date range ending with the given date range.
+
+        :param date_range: the date range.
+        :return: the 12 months date range.
+        :rtype: dict
         """
-        ptrns = set()
-        _to = self.to_date.format(fmt='YYYY-MM-DDT23:59:59')
-        _from = (self.to_date - relativedelta(months=12))\
+        _from = (arrow.get(date_range['lte']) - relativedelta(months=12))\
             .format(fmt='YYYY-MM-DDT00:00:00')
-        date_range = {'gte': _from, 'lte': _to}
-        for res in RecordsSearch(index=LoanOperationLog.index_name)\
-                .filter('range', date=date_range)\
-                .filter('terms', loan__trigger=['checkout', 'extend'])\
-                .filter('term', loan__item__library_pid=library_pid)\
-                .source(['loan'])\
-                .scan():
-            ptrns.add(res.loan.patron.hashed_pid)
-
-        return len(ptrns)
-
-    def number_of_order_lines(self, library_pid):
-        """Number of order lines created during the specified timeframe.
-
-        :param library_pid: string - the library to filter with
-        :return: the number of matched order lines
-        :rtype: integer
-        """
-        return AcqOrderLinesSearch()\
-            .filter('range', _created=self.date_range)\
-            .filter('term', library__pid=library_pid).count()
+        return {'gte': _from, 'lte': date_range['lte']}
 
-    def number_of_circ_operations(self, library_pid, trigger):
-        """Number of circulation operation  during the specified timeframe.
+    def aggregate(self, date_ranges):
+        """Compute the statistics metrics.
 
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name
-        :return: the number of matched circulation operation
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('term', loan__trigger=trigger)\
-            .filter('term', loan__item__library_pid=library_pid)\
-            .count()
-
-    def number_of_satisfied_ill_request(self, library_pid):
-        """Number of ILL requests created during the specified timeframe.
-
-        :param library_pid: string - the library to filter with
-        :return: the number of matched inter library loan request
-        :rtype: integer
-        """
-        requests = set()
-        for res in RecordsSearch(index=LoanOperationLog.index_name)\
-                .filter('range', date=self.date_range)\
-                .filter('term', record__type='illr')\
-                .filter('term', library__pid=library_pid)\
-                .filter('term', ill_request__status='validated')\
-                .source(['record'])\
-                .scan():
-            requests.add(res.record.pid)
-        return len(requests)
-
-    # -------- optional -----------
-    def number_of_items(self, library_pid):
-        """Number of items linked to my library.
-
-        point in time
-        :param library_pid: string - the library to filter with
-        :return: the number of matched items
-        :rtype: integer
+        :param date_ranges: the date ranges by key.
+        :return: the metric values by date range key, metric name and group.
+        :rtype: dict
         """
-        # can be done using the facet
-        return ItemsSearch().filter(
-            'term', library__pid=library_pid).count()
-
-    def number_of_deleted_items(self, library_pid):
-        """Number of deleted items during the specified timeframe.
+        # patrons who did a transaction in a the past 365 days, the distinct
+        # count is close to accurate up to 40000 patrons by library (see
+        # `CARDINALITY_PRECISION`)
+        year_ranges = {
+            key: self._get_year_range(date_range)
+            for key, date_range in date_ranges.items()
+        }
+        circulation, fields = self.get_circulation_aggregation(date_ranges)
+        for name, trigger in [
+            ('number_of_checkouts', 'checkout'),
+            ('number_of_renewals', 'extend'),
+            ('number_of_checkins', 'checkin'),
+            ('number_of_requests', 'request')
+        ]:
+            circulation.count(
+                name, fields['item_library'],
+                Q('term', **{fields['trigger']: trigger}),
+                date_field='date', sum_field=fields['count'])
+        circulation.distinct(
+            'number_of_active_patrons', fields['item_library'],
+            fields['patron'],
+            Q('terms', **{fields['trigger']: ['checkout', 'extend']}),
+            date_field='date', date_ranges=year_ranges)
+        operation_logs = StatsAggregation(
+            RecordsSearch(index=LoanOperationLog.index_name), date_ranges)\
+            .distinct(
+                'number_of_satisfied_ill_request', 'library.value',
+                'record.value', Q('term', record__type='illr'),
+                Q('term', ill_request__status='validated'),
+                date_field='date')\
+            .count(
+                'number_of_deleted_items', 'library.value',
+                Q('term', operation='delete'), Q('term', record__type='item'),
+                date_field='date')
+        return self.execute_aggregations([
+            circulation,
+            operation_logs,
+            StatsAggregation(DocumentsSearch(), date_ranges)
+            .count('number_of_documents', 'holdings.organisation.library_pid'),
+            StatsAggregation(LibrariesSearch(), date_ranges)
+            .count('number_of_libraries', 'organisation.pid'),
+            StatsAggregation(PatronsSearch(), date_ranges)
+            .count('number_of_librarians', 'libraries.pid',
+                   Q('term', roles='librarian'))
+            .count('number_of_patrons', 'organisation.pid',
+                   Q('term', roles='patron'))
+            .count('number_of_new_patrons', 'organisation.pid',
+                   date_field='_created'),
+            StatsAggregation(AcqOrderLinesSearch(), date_ranges)
+            .count('number_of_order_lines', 'library.pid',
+                   date_field='_created'),
+            StatsAggregation(ItemsSearch(), date_ranges)
+            .count('number_of_items', 'library.pid')
+            .count('number_of_new_items', 'library.pid',
+                   date_field='_created')
+        ], date_ranges)
 
-        :param library_pid: string - the library to filter with
-        :return: the number of matched deleted items
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('term', operation='delete')\
-            .filter('term', record__type='item')\
-            .filter('term', library__pid=library_pid)\
-            .count()
-
-    def number_of_new_items(self, library_pid):
-        """Number of new created items during the specified timeframe.
-
-        :param library_pid: string - the library to filter with
-        :return: the number of matched newly created items
-        :rtype: integer
-        """
-        # can be done using the facet or operation logs
-        return ItemsSearch()\
-            .filter('range', _created=self.date_range)\
-            .filter('term', library__pid=library_pid).count()
+    def collect(self):
+        """Compute all the statistics."""
+        return self.collect_ranges({'range': self.date_range})['range']
 
-    def number_of_new_patrons(self, organisation_pid):
-        """New patrons for an organisation during the specified timeframe.
+    def collect_ranges(self, date_ranges):
+        """Compute all the statistics for several date ranges at once.
 
-        :param organisation_pid: string - the organisation to filter with
-        :return: the number of matched newly created patrons
-        :rtype: integer
+        :param date_ranges: the date ranges by key.
+        :return: the statistics by date range key.
+        :rtype: dict
         """
-        return PatronsSearch()\
-            .filter('range', _created=self.date_range)\
-            .filter('term', organisation__pid=organisation_pid)\
-            .count()
-
-    def number_of_patrons(self, organisation_pid):
-        """Number of users with a librarian role.
+        libraries = self.get_all_libraries()
+        values = self.aggregate(date_ranges)
+        stats = {}
+        for key in date_ranges:
+            metrics = values[key]
 
-        point in time
+            def value(name, group):
+                return metrics.get(name, {}).get(group, 0)
 
-        :param organisation_pid: string - the organisation to filter with
-        :return: the number of matched patrons
-        :rtype: integer
-        """
-        return PatronsSearch()\
-            .filter('term', roles='patron')\
-            .filter('term', organisation__pid=organisation_pid)\
-            .count()
+            stats[key] = [{
+                'library': {
+                    'pid': lib.pid,
+                    'name': lib.name
+                },
+                'number_of_documents': value('number_of_documents', lib.pid),
+                'number_of_libraries': value(
+                    'number_of_libraries', lib.organisation.pid),
+                'number_of_librarians': value(
+                    'number_of_librarians', lib.pid),
+                'number_of_active_patrons': value(
+                    'number_of_active_patrons', lib.pid),
+                'number_of_order_lines': value(
+                    'number_of_order_lines', lib.pid),
+                'number_of_checkouts': value('number_of_checkouts', lib.pid),
+                'number_of_renewals': value('number_of_renewals', lib.pid),
+                'number_of_satisfied_ill_request': value(
+                    'number_of_satisfied_ill_request', lib.pid),
+                'number_of_items': value('number_of_items', lib.pid),
+                'number_of_new_items': value('number_of_new_items', lib.pid),
+                'number_of_deleted_items': value(
+                    'number_of_deleted_items', lib.pid),
+                'number_of_patrons': value(
+                    'number_of_patrons', lib.organisation.pid),
+                'number_of_new_patrons': value(
+                    'number_of_new_patrons', lib.organisation.pid),
+                'number_of_checkins': value('number_of_checkins', lib.pid),
+                'number_of_requests': value('number_of_requests', lib.pid)
+            } for lib in libraries]
+        return stats
 
 
 class StatsForLibrarian(StatsForPricing):
@@ -355,324 +331,237 @@ class StatsForLibrarian(StatsForPricing):
                             )
         return list(library_pids)
 
-    def collect(self):
-        """Compute statistics for librarian."""
-        stats = []
+    @staticmethod
+    def get_all_locations():
+        """Get all locations in the system.
+
+        :return: the locations (library pid, code and name) by pid.
+        :rtype: dict
+        """
+        return {
+            location.pid: location.to_dict()
+            for location in LocationsSearch()
+            .source(['pid', 'code', 'name', 'library']).scan()
+        }
+
+    def _get_new_patrons(self, date_range):
+        """Hashed pids of the patrons created during a date range.
+
+        :param date_range: the date range.
+        :return: list of hashed patron pids.
+        :rtype: list
+        """
+        search = PatronsSearch()\
+            .filter('range', _created=date_range)\
+            .source('pid').scan()
+        return [hashlib.md5(p.pid.encode()).hexdigest() for p in search]
+
+    def aggregate(self, date_ranges, locations=None):
+        """Compute the statistics metrics.
+
+        :param date_ranges: the date ranges by key.
+        :param locations: the locations by pid.
+        :return: the metric values by date range key, metric name and group.
+        :rtype: dict
+        """
+        if locations is None:
+            locations = self.get_all_locations()
+        # transactions done in a location of each library
+        library_locations = {}
+        for pid, location in locations.items():
+            library_locations.setdefault(
+                location['library']['pid'], []).append(pid)
+        transaction_libraries = {
+            library_pid: Q('terms', loan__transaction_location__pid=pids)
+            for library_pid, pids in library_locations.items()
+        }
+        new_patrons = {
+            key: [Q('terms', loan__patron__hashed_pid=self._get_new_patrons(
+                date_range))]
+            for key, date_range in date_ranges.items()
+        }
+        circulation, fields = self.get_circulation_aggregation(date_ranges)
+        # the operation logs have no transaction library
+        transaction_group = fields['library'] or transaction_libraries
+        if transaction_group:
+            circulation\
+                .count(
+                    'checkouts_for_transaction_library', transaction_group,
+                    Q('term', **{fields['trigger']: 'checkout'}),
+                    date_field='date', sum_field=fields['count'])\
+                .terms(
+                    'active_patrons_by_postal_code', transaction_group,
+                    fields['postal_code'],
+                    Q('terms', **{
+                        fields['trigger']: ['request', 'checkin', 'checkout']
+                    }),
+                    distinct_field=fields['patron'], missing='unknown',
+                    date_field='date')
+        circulation\
+            .count(
+                'checkouts_for_owning_library', fields['item_library'],
+                Q('term', **{fields['trigger']: 'checkout'}),
+                date_field='date', sum_field=fields['count'])\
+            .count(
+                'renewals', fields['item_library'],
+                Q('term', **{fields['trigger']: 'extend'}),
+                date_field='date', sum_field=fields['count'])
+        operation_logs = StatsAggregation(
+            RecordsSearch(index=LoanOperationLog.index_name), date_ranges)
+        if transaction_libraries:
+            # the new patrons are not known by the circulation rollups
+            operation_logs.terms(
+                'new_active_patrons_by_postal_code', transaction_libraries,
+                'loan.patron.postal_code',
+                Q('terms', loan__trigger=['request', 'checkin', 'checkout']),
+                distinct_field='loan.patron.hashed_pid', missing='unknown',
+                date_field='date', range_filters=new_patrons)
+        operation_logs\
+            .count(
+                'new_documents', 'library.value',
+                Q('term', operation='create'), Q('term', record__type='doc'),
+                date_field='date')\
+            .count(
+                'validated_requests', 'library.value',
+                Q('term', loan__trigger='validate'), date_field='date')
+        # items created until the end of the date ranges
+        until_ranges = {
+            key: {'lte': date_range['lte']}
+            for key, date_range in date_ranges.items()
+        }
+        items = StatsAggregation(ItemsSearch(), date_ranges)\
+            .count('new_items', 'library.pid', date_field='_created')\
+            .terms('new_items_by_location', 'library.pid', 'location.pid',
+                   date_field='_created')\
+            .terms('items_by_document_type', 'library.pid',
+                   'document.document_type.main_type', date_field='_created',
+                   date_ranges=until_ranges)\
+            .terms('items_by_document_subtype', 'library.pid',
+                   'document.document_type.subtype', date_field='_created',
+                   date_ranges=until_ranges)
+        return self.execute_aggregations(
+            [circulation, operation_logs, items], date_ranges)
+
+    def collect_ranges(self, date_ranges):
+        """Compute statistics for librarian for several date ranges at once.
+
+        :param date_ranges: the date ranges by key.
+        :return: the statistics by date range key.
+        :rtype: dict
+        """
         libraries = self.get_all_libraries()
         libraries_map = {lib.pid: lib.name for lib in libraries}
+        locations = self.get_all_locations()
+        values = self.aggregate(date_ranges, locations)
+        stats = {}
+        for key, date_range in date_ranges.items():
+            metrics = values[key]
+
+            def value(name, group, default=0):
+                return metrics.get(name, {}).get(group, default)
 
-        for lib in libraries:
-            stats.append({
+            loans_by_location = \
+                self.loans_of_transaction_library_by_item_location(
+                    libraries_map, locations, date_range)
+            stats[key] = [{
                 'library': {
                     'pid': lib.pid,
                     'name': lib.name
                 },
                 'checkouts_for_transaction_library':
-                    self.checkouts_for_transaction_library(lib.pid,
-                                                           ['checkout']),
+                    value('checkouts_for_transaction_library', lib.pid),
                 'checkouts_for_owning_library':
-                    self.checkouts_for_owning_library(lib.pid,
-                                                      ['checkout']),
+                    value('checkouts_for_owning_library', lib.pid),
                 'active_patrons_by_postal_code':
-                    self.active_patrons_by_postal_code(lib.pid,
-                                                       ['request',
-                                                        'checkin',
-                                                        'checkout']),
+                    self._by_postal_code(value(
+                        'active_patrons_by_postal_code', lib.pid, {})),
                 'new_active_patrons_by_postal_code':
-                    self.new_active_patrons_by_postal_code(lib.pid,
-                                                           ['request',
-                                                            'checkin',
-                                                            'checkout']),
+                    self._by_postal_code(value(
+                        'new_active_patrons_by_postal_code', lib.pid, {})),
                 'new_documents':
-                    self.new_documents(lib.pid),
+                    value('new_documents', lib.pid),
                 'new_items':
-                    self.number_of_new_items(lib.pid),
+                    value('new_items', lib.pid),
                 'renewals':
-                    self.renewals(lib.pid, ['extend']),
+                    value('renewals', lib.pid),
                 'validated_requests':
-                    self.validated_requests(lib.pid, ['validate']),
-                'items_by_document_type_and_subtype':
-                    self.items_by_document_type_and_subtype(lib.pid),
+                    value('validated_requests', lib.pid),
+                'items_by_document_type_and_subtype': {
+                    **value('items_by_document_type', lib.pid, {}),
+                    **value('items_by_document_subtype', lib.pid, {})
+                },
                 'new_items_by_location':
-                    self.new_items_by_location(lib.pid),
+                    self._by_location_code_name(
+                        locations,
+                        value('new_items_by_location', lib.pid, {})),
                 'loans_of_transaction_library_by_item_location':
-                    self.loans_of_transaction_library_by_item_location(
-                        libraries_map,
-                        lib.pid,
-                        ['checkin',
-                         'checkout'])
-            })
+                    loans_by_location.get(lib.pid, {})
+            } for lib in libraries]
         return stats
 
-    def _get_locations_pid(self, library_pid):
-        """Locations pid for given library.
-
-        :param library_pid: string - the library to filter with
-        :return: list of pid locations
-        :rtype: list
-        """
-        locations = LocationsSearch()\
-            .filter('term', library__pid=library_pid).source('pid').scan()
-        return [location.pid for location in locations]
-
-    def _get_location_code_name(self, location_pid):
-        """Location code and name.
-
-        :param location_pid: string - the location to filter with
-        :return: concatenated code and name of location
-        :rtype: string
-        """
-        location_search = LocationsSearch()\
-            .filter('term', pid=location_pid)\
-            .source(['code', 'name']).scan()
-        location = next(location_search)
-        return f'{location.code} - {location.name}'
-
-    def checkouts_for_transaction_library(self, library_pid, trigger):
-        """Number of circulation operation during the specified timeframe.
-
-        Number of loans of items when transaction location is equal to
-        any of the library locations
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name (checkout)
-        :return: the number of matched circulation operation
-        :rtype: integer
-        """
-        location_pids = self._get_locations_pid(library_pid)
-
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('terms', loan__transaction_location__pid=location_pids)\
-            .count()
-
-    def checkouts_for_owning_library(self, library_pid, trigger):
-        """Number of circulation operation during the specified timeframe.
-
-        Number of loans of items per library when the item is owned by
-        the library
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name (checkout)
-        :return: the number of matched circulation operation
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('term', loan__item__library_pid=library_pid)\
-            .count()
+    @staticmethod
+    def _by_postal_code(values):
+        """Merge the values without postal code.
 
-    def active_patrons_by_postal_code(self, library_pid, trigger):
-        """Number of circulation operation during the specified timeframe.
-
-        Number of patrons per library and CAP when transaction location
-        is equal to any of the library locations
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name (request, checkin, checkout)
-        :return: the number of matched circulation operation
-        :rtype: dict
-        """
-        location_pids = self._get_locations_pid(library_pid)
-
-        search = RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('terms', loan__transaction_location__pid=location_pids)\
-            .scan()
-
-        stats = {}
-        patron_pids = set()
-        # Main postal code from user profile
-        for s in search:
-            patron_pid = s.loan.patron.hashed_pid
-            if 'postal_code' not in s.loan.patron or\
-                    not s.loan.patron.postal_code:
-                postal_code = 'unknown'
-            else:
-                postal_code = s.loan.patron.postal_code
-
-            if postal_code not in stats:
-                stats[postal_code] = 1
-            else:
-                if patron_pid not in patron_pids:
-                    stats[postal_code] += 1
-            patron_pids.add(patron_pid)
-        return stats
-
-    def new_active_patrons_by_postal_code(self, library_pid, trigger):
-        """Number of circulation operation during the specified timeframe.
-
-        Number of new patrons per library and CAP when transaction location
-        is equal to any of the library locations
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name (request, checkin, checkout)
-        :return: the number of matched circulation operation
-        :rtype: dict
-        """
-        location_pids = self._get_locations_pid(library_pid)
-
-        search = RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('terms', loan__transaction_location__pid=location_pids)\
-            .scan()
-
-        # Get new patrons in date range and hash the pids
-        search_patron = PatronsSearch()\
-            .filter("range", _created=self.date_range)\
-            .source('pid').scan()
-        new_patron_pids = set()
-        for p in search_patron:
-            hashed_pid = hashlib.md5(p.pid.encode()).hexdigest()
-            new_patron_pids.add(hashed_pid)
-
-        stats = {}
-        patron_pids = set()
-        # Main postal code from user profile
-        for s in search:
-            patron_pid = s.loan.patron.hashed_pid
-            if patron_pid in new_patron_pids:
-                if 'postal_code' not in s.loan.patron or\
-                        not s.loan.patron.postal_code:
-                    postal_code = 'unknown'
-                else:
-                    postal_code = s.loan.patron.postal_code
-
-                if postal_code not in stats:
-                    stats[postal_code] = 1
-                else:
-                    if patron_pid not in patron_pids:
-                        stats[postal_code] += 1
-                patron_pids.add(patron_pid)
-
-        return stats
-
-    def new_documents(self, library_pid):
-        """Number of new documents per library for given time interval.
-
-        :param library_pid: string - the library to filter with
-        :return: the number of matched documents
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('term', operation='create')\
-            .filter('term', record__type='doc')\
-            .filter('term', library__value=library_pid)\
-            .count()
-
-    def renewals(self, library_pid, trigger):
-        """Number of items with loan extended.
-
-        Number of items with loan extended per library for given time interval
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name extend
-        :return: the number of matched documents
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('term', loan__item__library_pid=library_pid)\
-            .count()
-
-    def validated_requests(self, library_pid, trigger):
-        """Number of validated requests.
-
-        Number of validated requests per library for given time interval
-        Match is done on the library of the librarian.
-        Note: trigger is 'validate' and not 'validate_request'
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name validate
-        :return: the number of matched documents
-        :rtype: integer
-        """
-        return RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('term', library__value=library_pid)\
-            .count()
-
-    def new_items_by_location(self, library_pid):
-        """Number of new items per library by location.
-
-        Note: items created and then deleted during the time interval
-        are not included.
-        :param library_pid: string - the library to filter with
-        :return: the number of matched documents
+        :param values: the values by postal code.
+        :return: the values by postal code, `unknown` if no postal code.
         :rtype: dict
         """
-        search = ItemsSearch()[0:0]\
-            .filter('range', _created=self.date_range)\
-            .filter('term', library__pid=library_pid)\
-            .source('location.pid')
-        search.aggs.bucket('location_pid', 'terms', field='location.pid',
-                           size=10000)
-        res = search.execute()
         stats = {}
-        for bucket in res.aggregations.location_pid.buckets:
-            location_code_name = self._get_location_code_name(bucket.key)
-            stats[location_code_name] = bucket.doc_count
+        for postal_code, count in values.items():
+            postal_code = postal_code or 'unknown'
+            stats[postal_code] = stats.get(postal_code, 0) + count
         return stats
 
-    def items_by_document_type_and_subtype(self, library_pid):
-        """Number of items per library by document type and sub-type.
+    @staticmethod
+    def _by_location_code_name(locations, values):
+        """Use the location code and name as keys.
 
-        Note: if item has more than one doc type/subtype the item is counted
-        multiple times
-        :param library_pid: string - the library to filter with
-        :return: the number of matched documents
+        :param locations: the locations by pid.
+        :param values: the values by location pid.
+        :return: the values by concatenated code and name of location.
         :rtype: dict
         """
-        search = ItemsSearch()[0:0]\
-            .filter('range', _created={'lte': self.date_range['lte']})\
-            .filter('term', library__pid=library_pid)\
-            .source('document.document_type')
-        search.aggs\
-              .bucket('main_type', 'terms',
-                      field='document.document_type.main_type', size=10000)
-        search.aggs\
-              .bucket('subtype', 'terms',
-                      field='document.document_type.subtype', size=10000)
-        res = search.execute()
         stats = {}
-        for bucket in res.aggregations.main_type.buckets:
-            stats[bucket.key] = bucket.doc_count
-        for bucket in res.aggregations.subtype.buckets:
-            stats[bucket.key] = bucket.doc_count
+        for location_pid, count in values.items():
+            location = locations.get(location_pid)
+            if location:
+                location_pid = f'{location["code"]} - {location["name"]}'
+            stats[location_pid] = count
         return stats
 
-    def loans_of_transaction_library_by_item_location(self,
-                                                      libraries_map,
-                                                      library_pid,
-                                                      trigger):
+    def loans_of_transaction_library_by_item_location(self, libraries_map,
+                                                      locations, date_range):
         """Number of circulation operation during the specified timeframe.
 
         Number of loans of items by location when transaction location
-        is equal to any of the library locations
+        is equal to any of the library locations. The operation logs of all
+        the libraries are read at once.
         :param libraries_map: dict - map of library pid and name
-        :param library_pid: string - the library to filter with
-        :param trigger: string - action name (checkin, checkout)
-        :return: the number of matched circulation operation
+        :param locations: dict - the locations by pid
+        :param date_range: dict - the date range
+        :return: the number of matched circulation operation by library
         :rtype: dict
         """
-        location_pids = self._get_locations_pid(library_pid)
         search = RecordsSearch(index=LoanOperationLog.index_name)\
-            .filter('range', date=self.date_range)\
-            .filter('terms', loan__trigger=trigger)\
-            .filter('terms', loan__transaction_location__pid=location_pids)\
+            .filter('range', date=date_range)\
+            .filter('terms', loan__trigger=['checkin', 'checkout'])\
+            .filter('terms', loan__transaction_location__pid=list(locations))\
             .source('loan').scan()
 
         stats = {}
         for s in search:
+            transaction_location = locations[s.loan.transaction_location.pid]
+            library_stats = stats.setdefault(
+                transaction_location['library']['pid'], {})
             item_library_pid = s.loan.item.library_pid
             item_library_name = libraries_map[item_library_pid]
             location_name = s.loan.item.holding.location_name
 
             key = f'{item_library_pid}: {item_library_name} - {location_name}'
-            stats.setdefault(key, {'location_name': location_name,
-                                   'checkin': 0, 'checkout': 0})
-            stats[key][s.loan.trigger] += 1
+            library_stats.setdefault(key, {'location_name': location_name,
+                                           'checkin': 0, 'checkout': 0})
+            library_stats[key][s.loan.trigger] += 1
 
         return stats
 
@@ -27,6 +27,7 @@ from flask import current_app
 from flask.cli import with_appcontext
 
 from rero_ils.modules.stats.api import Stat, StatsForLibrarian, StatsForPricing
+from rero_ils.modules.stats.rollups import CirculationRollup
 
 
 @click.group()
@@ -103,6 +104,17 @@ def collect_year(year, timespan, n_months, force):
                 raise click.Abort()
             n_months += 1
 
+            # collect the statistics of all the months at once
+            date_ranges = {}
+            for month in range(1, n_months):
+                to_date = arrow.get(f'{year}-{month:02d}-01', 'YYYY-MM-DD')\
+                    + relativedelta(months=1) - relativedelta(days=1)
+                date_ranges[month] = {
+                    'gte': f'{year}-{month:02d}-01T00:00:00',
+                    'lte': to_date.format(fmt='YYYY-MM-DDT23:59:59')
+                }
+            months_values = StatsForLibrarian().collect_ranges(date_ranges)
+
             for month in range(1, n_months):
                 first_day = f'{year}-{month:02d}-01T23:59:59'\
                             .format(fmt='YYYY-MM-DDT23:59:59')
@@ -126,7 +138,7 @@ def collect_year(year, timespan, n_months, force):
                     return
 
                 stat_data = dict(type=type, date_range=date_range,
-                                 values=_stats.collect())
+                                 values=months_values[month])
 
                 with current_app.app_context():
                     if stat_pid:
@@ -184,3 +196,23 @@ def collect_year(year, timespan, n_months, force):
                             New pid: {stat.pid}', fg='green')
 
         return
+
+
+@stats.command('rollup')
+@click.option('-f', '--from-date', 'from_date', type=click.DateTime(),
+              help='First day to roll up (default: first log day).')
+@click.option('-u', '--until-date', 'until_date', type=click.DateTime(),
+              help='Day after the last day to roll up (default: tomorrow).')
+@click.option('-i', '--incremental', is_flag=True, default=False,
+              help='Roll up the days since the last rollup.')
+@with_appcontext
+def rollup(from_date, until_date, incremental):
+    """Roll up the loan operation logs into daily circulation buckets."""
+    if incremental:
+        count = CirculationRollup.rollup_incremental()
+    else:
+        count = CirculationRollup.rollup(
+            from_date=from_date.date() if from_date else None,
+            until_date=until_date.date() if until_date else None
+        )
+    click.secho(f'{count} circulation buckets rolled up.', fg='green')
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Daily circulation rollups."""
+
+import hashlib
+from datetime import date, datetime, timedelta
+from json import dumps
+
+from dateutil import parser
+from elasticsearch.helpers import bulk
+from elasticsearch_dsl import A
+from invenio_cache.proxies import current_cache
+from invenio_search import RecordsSearch, current_search_client
+
+from ..libraries.api import LibrariesSearch
+from ..loans.logs.api import LoanOperationLog
+from ..locations.api import LocationsSearch
+
+
+class CirculationRollup:
+    """Daily circulation rollups.
+
+    The loan operation logs are pre-aggregated into daily buckets stored in
+    the `circulation_rollups` indices (one index per year). A bucket is
+    identified by its day, transaction location, item library, trigger,
+    item category, patron type and patron postal code. It stores the
+    transaction library and organisation, the number of operations and the
+    hashed pids of the distinct patrons: a `cardinality` aggregation on the
+    patrons gives the distinct patrons of any set of buckets.
+
+    The date of the last rolled up day is stored into the cache: an
+    incremental rollup rolls up the days since this date.
+    """
+
+    index_name = 'circulation_rollups'
+
+    cache_key = 'stats::circulation_rollups'
+
+    # bucket fields :: rollup field --> loan operation log field
+    SOURCES = [
+        ('location_pid', 'loan.transaction_location.pid'),
+        ('item_library_pid', 'loan.item.library_pid'),
+        ('trigger', 'loan.trigger'),
+        ('item_category', 'loan.item.category'),
+        ('patron_type', 'loan.patron.type'),
+        ('postal_code', 'loan.patron.postal_code')
+    ]
+
+    # statistics fields :: usage --> rollup field
+    FIELDS = {
+        'library': 'library_pid',
+        'item_library': 'item_library_pid',
+        'trigger': 'trigger',
+        'patron': 'patrons',
+        'postal_code': 'postal_code',
+        'count': 'count'
+    }
+
+    @classmethod
+    def search(cls):
+        """Search on the circulation rollups."""
+        return RecordsSearch(index=cls.index_name)
+
+    @classmethod
+    def get_index(cls, day):
+        """Get the index name of a day bucket.
+
+        :param day: the bucket day as `YYYY-MM-DD` string.
+        :return: the index name.
+        """
+        return f'{cls.index_name}-{day[:4]}'
+
+    @classmethod
+    def get_last_day(cls):
+        """Get the last rolled up day, `None` if never rolled up."""
+        last_day = current_cache.get(cls.cache_key)
+        return parser.parse(last_day).date() if last_day else None
+
+    @classmethod
+    def _logs_search(cls, from_date, until_date):
+        """Search the loan operation logs of a day interval.
+
+        :param from_date: the first day.
+        :param until_date: the day after the last day.
+        :return: the search.
+        """
+        return RecordsSearch(index=LoanOperationLog.index_name)\
+            .filter('exists', field='loan')\
+            .filter('range', date={
+                'gte': from_date.isoformat(),
+                'lt': until_date.isoformat()
+            })
+
+    @classmethod
+    def _get_buckets(cls, from_date, until_date, size=1000):
+        """Aggregate the loan operation logs into daily buckets.
+
+        :param from_date: the first day.
+        :param until_date: the day after the last day.
+        :param size: the number of buckets by search.
+        :return: a generator of composite aggregation buckets.
+        """
+        sources = [{
+            'date': A('date_histogram', field='date', calendar_interval='1d',
+                      format='yyyy-MM-dd')
+        }] + [
+            {name: A('terms', field=field, missing_bucket=True)}
+            for name, field in cls.SOURCES
+        ]
+        after_key = None
+        while True:
+            search = cls._logs_search(from_date, until_date).extra(size=0)
+            params = {'sources': sources, 'size': size}
+            if after_key:
+                params['after'] = after_key
+            search.aggs.bucket('buckets', 'composite', **params)\
+                .bucket('patrons', 'terms', field='loan.patron.hashed_pid',
+                        size=10000)
+            result = search.execute().aggregations.to_dict()['buckets']
+            yield from result['buckets']
+            after_key = result.get('after_key')
+            if not result['buckets'] or not after_key:
+                return
+
+    @classmethod
+    def _get_actions(cls, from_date, until_date):
+        """Build the bulk index actions of the rollup buckets.
+
+        :param from_date: the first day.
+        :param until_date: the day after the last day.
+        :return: a generator of bulk index actions.
+        """
+        locations = {
+            hit.pid: hit.library.pid
+            for hit in LocationsSearch().source(['pid', 'library']).scan()
+        }
+        libraries = {
+            hit.pid: hit.organisation.pid
+            for hit in LibrariesSearch().source(['pid', 'organisation'])
+            .scan()
+        }
+        for bucket in cls._get_buckets(from_date, until_date):
+            key = bucket['key']
+            library_pid = locations.get(key['location_pid'])
+            source = dict(
+                key,
+                library_pid=library_pid,
+                organisation_pid=libraries.get(library_pid),
+                count=bucket['doc_count'],
+                patrons=[
+                    patron['key'] for patron in bucket['patrons']['buckets']
+                ]
+            )
+            _id = hashlib.md5(
+                dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+            yield {
+                '_op_type': 'index',
+                '_index': cls.get_index(key['date']),
+                '_id': _id,
+                '_source': source
+            }
+
+    @classmethod
+    def rollup(cls, from_date=None, until_date=None):
+        """Roll up the loan operation logs of a day interval.
+
+        The existing buckets of the interval are replaced.
+
+        :param from_date: the first day, default to the first log day.
+        :param until_date: the day after the last day, default to tomorrow.
+        :return: the number of rolled up buckets.
+        """
+        if not current_search_client.indices.exists(
+                index=LoanOperationLog.index_name):
+            return 0
+        if until_date is None:
+            until_date = date.today() + timedelta(days=1)
+        if from_date is None:
+            search = cls._logs_search(date.min, until_date).extra(size=0)
+            search.aggs.metric('first', 'min', field='date')
+            first = search.execute().aggregations.first.value
+            if first is None:
+                return 0
+            from_date = datetime.utcfromtimestamp(first / 1000).date()
+        current_search_client.delete_by_query(
+            index=f'{cls.index_name}*',
+            body={'query': {'range': {'date': {
+                'gte': from_date.isoformat(),
+                'lt': until_date.isoformat()
+            }}}},
+            conflicts='proceed',
+            refresh=True
+        )
+        count, _ = bulk(
+            current_search_client,
+            cls._get_actions(from_date, until_date),
+            refresh=True
+        )
+        # the last day can be incomplete: it is rolled up again next time
+        last_day = until_date - timedelta(days=1)
+        if last_day > (cls.get_last_day() or date.min):
+            current_cache.set(cls.cache_key, last_day.isoformat(), timeout=0)
+        return count
+
+    @classmethod
+    def rollup_incremental(cls):
+        """Roll up the loan operation logs since the last rolled up day.
+
+        :return: the number of rolled up buckets.
+        """
+        return cls.rollup(from_date=cls.get_last_day())
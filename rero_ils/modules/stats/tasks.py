@@ -21,6 +21,8 @@ from celery import shared_task
 from flask import current_app
 
 from .api import Stat, StatsForLibrarian, StatsForPricing
+from .rollups import CirculationRollup
+from ..utils import set_timestamp
 
 
 @shared_task()
@@ -49,3 +51,17 @@ def collect_stats_librarian():
             dbcommit=True, reindex=True)
         return f'New statistics of type {stat["type"]} has\
             been created with a pid of: {stat.pid}'
+
+
+@shared_task()
+def rollup_circulation(incremental=True):
+    """Roll up the loan operation logs into daily circulation buckets.
+
+    :param incremental: only roll up the days since the last rollup.
+    """
+    if incremental:
+        count = CirculationRollup.rollup_incremental()
+    else:
+        count = CirculationRollup.rollup()
+    set_timestamp('rollup-circulation', count=count)
+    return f'{count} circulation buckets rolled up'
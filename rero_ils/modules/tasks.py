@@ -27,7 +27,7 @@ from .utils import set_timestamp
 
 @shared_task(ignore_result=True)
 def process_bulk_queue(version_type=None, queue=None, es_bulk_kwargs=None,
-                       stats_only=True):
+                       stats_only=True, batch_size=None, parallel=None):
     """Process bulk indexing queue.
 
     :param str version_type: Elasticsearch version type.
@@ -38,6 +38,8 @@ def process_bulk_queue(version_type=None, queue=None, es_bulk_kwargs=None,
     :param boolean stats_only: if `True` only report number of
             successful/failed operations instead of just number of
             successful and a list of error responses.
+    :param int batch_size: number of messages consumed at once.
+    :param int parallel: number of concurrent bulk requests.
     Note: You can start multiple versions of this task.
     """
     from .cli.index import connect_queue
@@ -52,7 +54,8 @@ def process_bulk_queue(version_type=None, queue=None, es_bulk_kwargs=None,
         routing_key=queue
     )
     return indexer.process_bulk_queue(
-        es_bulk_kwargs=es_bulk_kwargs, stats_only=stats_only)
+        es_bulk_kwargs=es_bulk_kwargs, stats_only=stats_only,
+        batch_size=batch_size, parallel=parallel)
 
 
 @shared_task(ignore_result=True)
@@ -17,9 +17,11 @@
 
 """Utilities for rero-ils editor."""
 
+import codecs
 import cProfile
 import os
 import pstats
+import re
 import unicodedata
 from datetime import date, datetime, time
 from functools import wraps
@@ -44,6 +46,9 @@ from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+# separators between the records of a json file
+JSON_RECORDS_SEPARATORS = re.compile(r'[\s,\[\]]*')
+
 
 def cached(timeout=50, key_prefix='default', query_string=False):
     """Cache traffic.
@@ -136,40 +141,49 @@ def date_string_to_utc(date):
     return pytz.utc.localize(parsed_date)
 
 
-def read_json_record(json_file, buf_size=1024, decoder=JSONDecoder()):
-    """Read lasy json records from file.
+def read_json_record(json_file, buf_size=65536, decoder=JSONDecoder()):
+    """Read lazy json records from file.
+
+    The file contains a json list of records or records separated by
+    whitespaces (i.e. json lines). The file is read by blocks and every
+    record is decoded in place from the current block: the memory is bounded
+    by the block and the largest record size and the reading time is linear
+    with the file size.
 
-    :param json_file: json file handle
+    :param json_file: json file handle (text or binary mode)
     :param buf_size: buffer size for file read
     :param decoder: decoder to use for decoding
     :return: record Generator
+    :raises JSONDecodeError: if the file ends with an invalid record.
     """
-    buffer = json_file.read(2).replace('\n', '')
-    # we have to delete the first [ for an list of records
-    if buffer.startswith('['):
-        buffer = buffer[1:].lstrip()
+    bytes_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    pos = 0
+    eof = False
     while True:
-        block = json_file.read(buf_size)
-        if not block:
-            break
-        buffer += block.replace('\n', '')
-        pos = 0
-        while True:
+        # skip the list brackets and the records delimiters
+        pos = JSON_RECORDS_SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer):
             try:
-                buffer = buffer.lstrip()
-                obj, pos = decoder.raw_decode(buffer)
+                record, pos = decoder.raw_decode(buffer, pos)
             except JSONDecodeError:
-                break
+                # incomplete record: read more data
+                if eof:
+                    raise
             else:
-                yield obj
-                buffer = buffer[pos:].lstrip()
-
-                if len(buffer) <= 0:
-                    # buffer is empty read more data
-                    buffer = json_file.read(buf_size)
-                if buffer.startswith(','):
-                    # delete records deliminators
-                    buffer = buffer[1:].lstrip()
+                yield record
+                continue
+        elif eof:
+            return
+        # keep the unread data only, and read at least as much as kept to
+        # decode a large record in a logarithmic number of attempts.
+        buffer = buffer[pos:]
+        pos = 0
+        block = json_file.read(max(buf_size, len(buffer)))
+        eof = not block
+        if isinstance(block, bytes):
+            block = bytes_decoder.decode(block, final=eof)
+        buffer += block
 
 
 def lazyxmlstrings(file, opening_tag, closing_tag):
@@ -991,7 +1005,8 @@ def number_records_in_file(json_file, type):
 
 
 def requests_retry_session(retries=5, backoff_factor=0.5,
-                           status_forcelist=(500, 502, 504), session=None):
+                           status_forcelist=(500, 502, 504), session=None,
+                           pool_maxsize=10):
     """Request retry session.
 
     :params retries: The total number of retry attempts to make.
@@ -999,6 +1014,7 @@ def requests_retry_session(retries=5, backoff_factor=0.5,
         {backoff factor} * (2 ** ({number of total retries} - 1))
     :params status_forcelist: The HTTP response codes to retry on..
     :params session: Session to use.
+    :params pool_maxsize: Maximum number of connections kept by host.
 
     """
     session = session or requests.Session()
@@ -1009,7 +1025,7 @@ def requests_retry_session(retries=5, backoff_factor=0.5,
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -1091,3 +1107,36 @@ def sorted_pids(query):
     except Exception as err:
         current_app.logger.info(f'Can not sort pids from query: {err}')
     return pids
+
+
+def iter_persistent_identifiers(query, limit=100000):
+    """Iterate over persistent identifiers using keyset pagination.
+
+    The identifiers are read by pages ordered by pid value, each page
+    starting after the last pid value of the previous one. Unlike an
+    `OFFSET` pagination, reading a page does not require to scan all the
+    previous rows: iterating a whole table stays linear.
+
+    :param query: a `PersistentIdentifier` query (all filtered on the same
+                  pid type).
+    :param limit: the page size, if `0` all identifiers are read at once.
+    :returns: a generator of (pid_value, object_uuid) rows.
+    """
+    query = query.with_entities(
+        PersistentIdentifier.pid_value,
+        PersistentIdentifier.object_uuid
+    ).order_by(PersistentIdentifier.pid_value)
+    if not limit:
+        yield from query
+        return
+    last_pid_value = None
+    while True:
+        page_query = query
+        if last_pid_value is not None:
+            page_query = query.filter(
+                PersistentIdentifier.pid_value > last_pid_value)
+        page = page_query.limit(limit).all()
+        yield from page
+        if len(page) < limit:
+            return
+        last_pid_value = page[-1].pid_value
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compiled JSON schema validation."""
+
+import json
+import multiprocessing
+import threading
+import time
+from collections import deque
+from itertools import groupby, islice
+
+from flask import current_app
+from invenio_jsonschemas.proxies import current_jsonschemas
+from invenio_records.api import _records_state
+from invenio_records.validators import _create_validator
+from jsonschema.exceptions import ValidationError, best_match
+
+# compiled validators of the current process by schema url
+_validators = {}
+_validators_lock = threading.Lock()
+# validation timings of the current process by schema url
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_schema(schema_url):
+    """Get a schema with all its references replaced.
+
+    The references are inlined as plain dictionaries, the schema can then be
+    used without application or sent to another process.
+
+    :param schema_url: the schema url.
+    :returns: the resolved schema, `None` if the schema is not local.
+    """
+    path = current_jsonschemas.url_to_path(schema_url)
+    if not path:
+        return None
+    schema = _records_state.replace_refs(current_jsonschemas.get_schema(path))
+    try:
+        return json.loads(json.dumps(schema))
+    except ValueError:
+        # recursive references can not be inlined
+        return schema
+
+
+def _compile(schema_url, schema, custom_checks=None):
+    """Compile a schema and cache its validator.
+
+    :param schema_url: the schema url, key of the cache.
+    :param schema: the resolved schema.
+    :param custom_checks: the custom type checks.
+    :returns: the schema validator.
+    """
+    with _validators_lock:
+        validator = _validators.get(schema_url)
+        if validator is None:
+            validator_cls = _create_validator(
+                schema=schema, custom_checks=custom_checks)
+            validator_cls.check_schema(schema)
+            validator = _validators[schema_url] = validator_cls(schema)
+        return validator
+
+
+def get_validator(schema_url):
+    """Get the compiled validator of a schema.
+
+    The schema is resolved and compiled once per process.
+
+    :param schema_url: the schema url.
+    :returns: the schema validator, `None` if the schema is not local.
+    """
+    validator = _validators.get(schema_url)
+    if validator is None:
+        schema = get_schema(schema_url)
+        if schema is None:
+            return None
+        validator = _compile(
+            schema_url, schema,
+            current_app.config.get('RECORDS_VALIDATION_TYPES', {}))
+    return validator
+
+
+def _add_stats(schema_url, count, errors, duration):
+    """Add validation timings.
+
+    :param schema_url: the schema url.
+    :param count: the number of validated records.
+    :param errors: the number of invalid records.
+    :param duration: the validation duration (in seconds).
+    """
+    with _stats_lock:
+        stats = _stats.setdefault(
+            schema_url, {'count': 0, 'errors': 0, 'time': 0})
+        stats['count'] += count
+        stats['errors'] += errors
+        stats['time'] += duration
+
+
+def get_validation_stats(reset=False):
+    """Get the validation timings of the current process.
+
+    :param reset: reset the timings.
+    :returns: the number of records, of errors and the total time (in
+              seconds) by schema url.
+    """
+    with _stats_lock:
+        stats = {key: dict(value) for key, value in _stats.items()}
+        if reset:
+            _stats.clear()
+    return stats
+
+
+def validate(data, schema_url=None):
+    """Validate a record with the compiled validator of its schema.
+
+    :param data: the record data (json encoded).
+    :param schema_url: the schema url, default to the record `$schema`.
+    :raises ValidationError: if the record is not valid.
+    :raises ValueError: if the schema is not local.
+    """
+    schema_url = schema_url or data['$schema']
+    validator = get_validator(schema_url)
+    if validator is None:
+        raise ValueError(f'Unknown local schema: {schema_url}')
+    start = time.perf_counter()
+    error = best_match(validator.iter_errors(data))
+    _add_stats(schema_url, 1, int(error is not None),
+               time.perf_counter() - start)
+    if error is not None:
+        raise error
+
+
+def _validate_chunk(args):
+    """Validate a chunk of records in a worker process.
+
+    :param args: the schema url, the resolved schema, the custom type checks
+                 and the records.
+    :returns: the errors (`None` or message, path and schema path) and the
+              validation duration.
+    """
+    schema_url, schema, custom_checks, records = args
+    validator = _compile(schema_url, schema, custom_checks)
+    start = time.perf_counter()
+    errors = []
+    for data in records:
+        error = best_match(validator.iter_errors(data))
+        errors.append(error and (
+            error.message, list(error.path), list(error.schema_path)))
+    return errors, time.perf_counter() - start
+
+
+def validate_many(records, schema_url=None, processes=1, chunk_size=100):
+    """Validate many records.
+
+    The records are validated by chunks of records with the same schema. With
+    several processes, the resolved schemas are sent with the chunks and
+    compiled once per worker process.
+
+    :param records: an iterable of record data (json encoded).
+    :param schema_url: the schema url, default to the records `$schema`.
+    :param processes: the number of validation processes.
+    :param chunk_size: the number of records sent to a process at once.
+    :returns: a generator of (data, error) tuples in the order of the given
+              records, `error` is `None` if the record is valid. A record
+              with a schema which is not local has a `ValidationError`.
+    """
+    def get_chunks():
+        """Get the chunks of records with the same schema."""
+        records_iter = iter(records)
+        while True:
+            chunk = list(islice(records_iter, chunk_size))
+            if not chunk:
+                return
+            for url, group in groupby(
+                    chunk, key=lambda data: schema_url or data['$schema']):
+                yield url, list(group)
+
+    if processes <= 1:
+        for _, chunk in get_chunks():
+            for data in chunk:
+                try:
+                    validate(data, schema_url)
+                    yield data, None
+                except ValidationError as error:
+                    yield data, error
+                except ValueError as error:
+                    yield data, ValidationError(str(error))
+        return
+
+    def get_results(url, chunk, result):
+        """Get the validation results of a chunk."""
+        if result is None:
+            # the schema is not local
+            for data in chunk:
+                yield data, ValidationError(f'Unknown local schema: {url}')
+            return
+        errors, duration = result.get()
+        _add_stats(url, len(chunk), len(list(filter(None, errors))), duration)
+        for data, error in zip(chunk, errors):
+            if error:
+                message, path, schema_path = error
+                error = ValidationError(
+                    message, path=path, schema_path=schema_path)
+            yield data, error
+
+    custom_checks = current_app.config.get('RECORDS_VALIDATION_TYPES', {})
+    schemas = {}
+    with multiprocessing.Pool(processes) as pool:
+        # a bounded number of chunks are sent to the processes at once
+        pending = deque()
+        for url, chunk in get_chunks():
+            if url not in schemas:
+                schemas[url] = get_schema(url)
+            result = None
+            if schemas[url] is not None:
+                result = pool.apply_async(_validate_chunk, (
+                    (url, schemas[url], custom_checks, chunk),))
+            pending.append((url, chunk, result))
+            if len(pending) >= 2 * processes:
+                yield from get_results(*pending.popleft())
+        while pending:
+            yield from get_results(*pending.popleft())
@@ -316,6 +316,7 @@ setup(
         'invenio_search.templates': [
             'rero_ils = rero_ils.es_templates:list_es_templates',
             'operation_logs = rero_ils.modules.operation_logs.es_templates:list_es_templates',
+            'stats = rero_ils.modules.stats.es_templates:list_es_templates',
         ],
         'invenio_celery.tasks': [
             'apiharvester = rero_ils.modules.apiharvester.tasks',
@@ -327,6 +328,7 @@ setup(
             'loans = rero_ils.modules.loans.tasks',
             'modules = rero_ils.modules.tasks',
             'notifications = rero_ils.modules.notifications.tasks',
+            'operation_logs = rero_ils.modules.operation_logs.tasks',
             'patrons = rero_ils.modules.patrons.tasks',
             'stats = rero_ils.modules.stats.tasks',
         ],
@@ -16,6 +16,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 """Tests REST API items."""
+import gzip
 import json
 
 from flask import url_for
@@ -268,3 +269,35 @@ def test_patron_checkouts_order(client, librarian_martigny,
     assert res.status_code == 500
     data = get_json(res)
     assert 'RequestError(400' in data['status']
+
+
+def test_inventory_export(app, client, tmpdir, monkeypatch, item_lib_martigny,
+                          item_lib_fully, librarian_martigny, librarian_sion):
+    """Test the asynchronous inventory list export."""
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_INVENTORY_EXPORT_DIR', str(tmpdir))
+    export_url = url_for('api_item.inventory_export')
+
+    # only librarians can start an export
+    res = client.post(export_url)
+    assert res.status_code == 401
+
+    login_user_via_session(client, librarian_martigny.user)
+    res = client.post(export_url)
+    assert res.status_code == 202
+    data = get_json(res)
+    assert data['id']
+
+    # the task is eager: the export is complete
+    res = client.get(data['links']['self'])
+    assert res.status_code == 200
+    assert res.mimetype == 'application/gzip'
+    content = gzip.decompress(res.data).decode('utf-8')
+    assert content.startswith('"pid","document_pid"')
+    assert item_lib_martigny.pid in content
+    assert item_lib_fully.pid in content
+
+    # the export belongs to the librarian organisation
+    login_user_via_session(client, librarian_sion.user)
+    res = client.get(data['links']['self'])
+    assert res.status_code == 404
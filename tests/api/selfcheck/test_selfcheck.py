@@ -38,6 +38,7 @@ from rero_ils.modules.selfcheck.api import authorize_patron, enable_patron, \
     item_information, patron_information, patron_status, selfcheck_checkin, \
     selfcheck_checkout, selfcheck_login, selfcheck_renew, system_status, \
     validate_patron_account
+from rero_ils.modules.selfcheck.summary import PatronSummary
 from rero_ils.modules.selfcheck.utils import check_sip2_module
 
 # skip tests if invenio-sip2 module is not installed
@@ -171,9 +172,17 @@ def test_patron_information(client, librarian_martigny,
     )
     assert res.status_code == 200
     # get patron information
+    PatronSummary.invalidate(selfcheck_patron_martigny.pid)
     response = patron_information(selfcheck_patron_martigny.get(
         'patron', {}).get('barcode')[0])
     assert response
+    assert response['charged_items'] == [item_lib_martigny.get('barcode')]
+    assert response['overdue_items'] == [item_lib_martigny.get('barcode')]
+    assert response['hold_items'] == [item2_lib_martigny.get('barcode')]
+    # the summary is cached for the next requests
+    summary = PatronSummary.get(selfcheck_patron_martigny.pid)
+    assert summary.to_dict() == PatronSummary.build(
+        selfcheck_patron_martigny.pid).to_dict()
 
     # get patron status
     response = patron_status(selfcheck_patron_martigny.get(
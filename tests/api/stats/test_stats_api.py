@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Stats API tests."""
+
+import arrow
+from elasticsearch_dsl import Q
+
+from rero_ils.modules.items.api import ItemsSearch
+from rero_ils.modules.stats.aggregations import StatsAggregation
+from rero_ils.modules.stats.api import StatsForLibrarian, StatsForPricing
+
+
+def test_stats_aggregation(item_lib_martigny, item_lib_fully, item_lib_sion):
+    """Test stats single pass aggregation."""
+    library_pid = item_lib_martigny.library_pid
+    items_count = ItemsSearch().filter('term', library__pid=library_pid)\
+        .count()
+    date_ranges = {
+        'now': {'lte': arrow.utcnow().format(fmt='YYYY-MM-DDT23:59:59')},
+        'past': {'lte': '2000-01-01T00:00:00'}
+    }
+    values = StatsAggregation(ItemsSearch(), date_ranges)\
+        .count('items', 'library.pid')\
+        .count('new_items', 'library.pid', date_field='_created')\
+        .distinct('locations', 'library.pid', 'location.pid')\
+        .terms('new_items_by_location', 'library.pid', 'location.pid',
+               date_field='_created')\
+        .count('martigny', {
+            'martigny': Q('term', library__pid=library_pid)
+        })\
+        .execute()
+
+    # point in time metrics are the same for all the date ranges
+    for key in ['now', 'past']:
+        assert values[key]['items'][library_pid] == items_count
+        assert values[key]['martigny'] == {'martigny': items_count}
+        assert values[key]['locations'][library_pid] == 1
+    assert values['now']['new_items'][library_pid] == items_count
+    assert values['now']['new_items_by_location'][library_pid] == {
+        item_lib_martigny.location_pid: items_count
+    }
+    assert values['past']['new_items'] == {}
+    assert values['past']['new_items_by_location'] == {}
+
+
+def test_stats_collect_ranges(item_lib_martigny, item_lib_fully,
+                              item_lib_sion):
+    """Test stats collection for several date ranges."""
+    to_date = arrow.utcnow()
+    pricing = StatsForPricing(to_date=to_date)
+    stats = pricing.collect_ranges({
+        'now': pricing.date_range,
+        'past': {'gte': '1999-01-01T00:00:00', 'lte': '1999-12-31T23:59:59'}
+    })
+    assert stats['now'] == pricing.collect()
+    for now, past in zip(stats['now'], stats['past']):
+        assert now['library'] == past['library']
+        assert now['number_of_items'] == past['number_of_items']
+        assert now['number_of_new_items'] == now['number_of_items']
+        assert past['number_of_new_items'] == 0
+
+    librarian = StatsForLibrarian(to_date=to_date)
+    stats = librarian.collect_ranges({'now': librarian.date_range})
+    assert stats['now'] == librarian.collect()
+    library_stats = next(
+        stat for stat in stats['now']
+        if stat['library']['pid'] == item_lib_martigny.library_pid)
+    assert library_stats['new_items'] == 1
+    assert sum(library_stats['new_items_by_location'].values()) == 1
+    assert library_stats['items_by_document_type_and_subtype']
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Circulation rollups tests."""
+
+from invenio_search import current_search
+
+from rero_ils.modules.loans.logs.api import LoanOperationLog
+from rero_ils.modules.stats.api import StatsForLibrarian, StatsForPricing
+from rero_ils.modules.stats.rollups import CirculationRollup
+
+
+def test_circulation_rollups(
+        app, monkeypatch, item2_on_loan_martigny_patron_and_loan_on_loan):
+    """Test circulation rollups."""
+    item, patron, loan = item2_on_loan_martigny_patron_and_loan_on_loan
+    current_search.flush_and_refresh(LoanOperationLog.index_name)
+
+    assert CirculationRollup.rollup() > 0
+    assert CirculationRollup.get_last_day()
+    buckets = [
+        hit.to_dict() for hit in CirculationRollup.search()
+        .filter('term', item_library_pid=item.library_pid)
+        .filter('term', trigger='checkout').scan()
+    ]
+    assert sum(bucket['count'] for bucket in buckets) >= 1
+    assert all(bucket['patrons'] for bucket in buckets)
+    # a new rollup replaces the existing buckets
+    count = CirculationRollup.search().count()
+    CirculationRollup.rollup_incremental()
+    assert CirculationRollup.search().count() == count
+
+    # same statistics with and without the rollups
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_STATS_CIRCULATION_ROLLUPS', False)
+    pricing = StatsForPricing().collect()
+    librarian = StatsForLibrarian().collect()
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_STATS_CIRCULATION_ROLLUPS', True)
+    assert StatsForPricing().collect() == pricing
+    for stats, expected in zip(StatsForLibrarian().collect(), librarian):
+        for name in ['checkouts_for_owning_library', 'renewals']:
+            assert stats[name] == expected[name]
@@ -17,6 +17,8 @@
 
 """Tests Serializers."""
 
+import gzip
+
 import mock
 from flask import url_for
 from utils import VerifyRecordPermissionPatch, flush_index, get_csv, \
@@ -162,6 +164,17 @@ def test_items_serializers(
            '"due_date","last_transaction_date","status","created",' \
            '"issue_status","issue_status_date","issue_claims_count",' \
            '"issue_expected_date","issue_regular"' in data
+    assert item_lib_martigny.pid in data
+    assert item_lib_fully.pid in data
+
+    # gzip compressed stream
+    response = client.get(
+        url_for('api_item.inventory_search', compress='gzip'),
+        headers=csv_header)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert 'inventory.csv.gz' in response.headers['Content-Disposition']
+    assert gzip.decompress(response.data).decode('utf-8') == data
 
 
 def test_loans_serializers(
@@ -23,18 +23,24 @@ import ciso8601
 from freezegun import freeze_time
 from invenio_accounts.testutils import login_user_via_session
 from invenio_records.signals import after_record_update
-from utils import flush_index, postdata
+from utils import flush_index, item_record_to_a_specific_loan_state, postdata
 
-from rero_ils.modules.items.api import Item
+from rero_ils.modules.circ_policies.api import OVERDUE_REMINDER_TYPE
+from rero_ils.modules.items.api import Item, ItemsSearch
+from rero_ils.modules.items.models import ItemStatus
 from rero_ils.modules.items.tasks import \
     clean_obsolete_temporary_item_types_and_locations
 from rero_ils.modules.libraries.api import Library
 from rero_ils.modules.loans.api import Loan, LoansSearch, get_due_soon_loans, \
     get_overdue_loans
+from rero_ils.modules.loans.expired_requests import ExpiredRequestCanceller, \
+    item_lock
 from rero_ils.modules.loans.models import LoanAction, LoanState
 from rero_ils.modules.loans.tasks import cancel_expired_request_task
+from rero_ils.modules.loans.utils import get_circ_policy
 from rero_ils.modules.notifications.api import NotificationsSearch
 from rero_ils.modules.notifications.models import NotificationType
+from rero_ils.modules.notifications.reminders import ReminderEngine
 from rero_ils.modules.notifications.tasks import create_notifications
 from rero_ils.modules.notifications.utils import get_notification, \
     number_of_notifications_sent
@@ -195,6 +201,40 @@ def test_notifications_task(
     assert res.status_code == 200
 
 
+def test_reminder_engine(item_on_loan_martigny_patron_and_loan_on_loan,
+                         loc_public_martigny, librarian_martigny):
+    """Test the batch creation of the reminders."""
+    item, patron, loan = item_on_loan_martigny_patron_and_loan_on_loan
+    end_date = datetime.now(timezone.utc) - timedelta(days=365)
+    loan['end_date'] = end_date.isoformat()
+    loan = loan.update(loan, dbcommit=True, reindex=True)
+    flush_index(LoansSearch.Meta.index)
+
+    engine = ReminderEngine()
+    loans = [
+        data for data in engine.get_candidate_loans(NotificationType.OVERDUE)
+        if data['pid'] == loan.pid
+    ]
+    assert len(loans) == 1
+    reminders = list(get_circ_policy(loan).get_reminders(
+        reminder_type=OVERDUE_REMINDER_TYPE))
+    records = engine.get_due_reminders(loans, NotificationType.OVERDUE)
+    assert [
+        record['context']['reminder_counter'] for record in records
+    ] == list(range(len(reminders)))
+
+    assert engine.create_reminders(NotificationType.OVERDUE) >= len(records)
+    if reminders:
+        assert loan.is_notified(NotificationType.OVERDUE, len(reminders) - 1)
+    # the existing reminders are not created again
+    assert not engine.get_due_reminders(loans, NotificationType.OVERDUE)
+
+    item.checkin(
+        transaction_location_pid=loc_public_martigny.pid,
+        transaction_user_pid=librarian_martigny.pid
+    )
+
+
 def test_clear_and_renew_subscription(patron_type_grown_sion,
                                       patron_sion):
     """Test the `task patrons.tasks.clear_and_renew_subscription`."""
@@ -342,3 +382,110 @@ def test_expired_request_task(
     loan2 = Loan.get_record_by_pid(loan2.pid)
     assert loan['state'] == LoanState.CANCELLED
     assert loan2['state'] == LoanState.ITEM_AT_DESK
+
+
+def test_expired_request_task_concurrency(
+    app, monkeypatch, item_lib_martigny, loc_public_martigny,
+    patron_martigny, patron2_martigny, librarian_martigny,
+    circulation_policies, yesterday
+):
+    """Test the cancellation of expired requests by several threads."""
+    monkeypatch.setitem(app.config, 'RERO_ILS_EXPIRED_REQUESTS_WORKERS', 4)
+    params = {
+        'patron_pid': patron_martigny.pid,
+        'transaction_location_pid': loc_public_martigny.pid,
+        'transaction_user_pid': librarian_martigny.pid,
+        'pickup_location_pid': loc_public_martigny.pid
+    }
+    # STEP#0 :: CREATE THE EXPIRED REQUESTS
+    #   * four items at desk for the same patron, the request of each one
+    #     is expired.
+    #   * the first item is also requested by an other patron.
+    #   * the last item is locked by an other circulation job.
+    requests = []
+    for _ in range(4):
+        item, loan = item_record_to_a_specific_loan_state(
+            item=item_lib_martigny, loan_state=LoanState.ITEM_AT_DESK,
+            params=dict(params), copy_item=True)
+        loan['request_expire_date'] = yesterday.isoformat()
+        loan.update(loan, dbcommit=True, reindex=True)
+        requests.append((item, loan))
+    item, actions = requests[0][0].request(
+        **dict(params, patron_pid=patron2_martigny.pid))
+    pending_loan = Loan.get_record_by_pid(actions['request']['pid'])
+    flush_index(LoansSearch.Meta.index)
+
+    # STEP#1 :: RUN THE TASK
+    #   * the requests of the free items are cancelled.
+    #   * the pending request of the first item is now ready to pickup.
+    #   * the request of the locked item is kept for the next execution.
+    locked_item, locked_loan = requests.pop()
+    with item_lock(locked_item.pid) as locked:
+        assert locked
+        assert cancel_expired_request_task() == (3, 3)
+    for item, loan in requests:
+        loan = Loan.get_record_by_pid(loan.pid)
+        assert loan['state'] == LoanState.CANCELLED
+    pending_loan = Loan.get_record_by_pid(pending_loan.pid)
+    assert pending_loan['state'] == LoanState.ITEM_AT_DESK
+    statuses = [
+        Item.get_record_by_pid(item.pid).get('status')
+        for item, _ in requests
+    ]
+    assert statuses == [
+        ItemStatus.AT_DESK, ItemStatus.ON_SHELF, ItemStatus.ON_SHELF]
+    locked_loan = Loan.get_record_by_pid(locked_loan.pid)
+    assert locked_loan['state'] == LoanState.ITEM_AT_DESK
+    assert Item.get_record_by_pid(locked_item.pid).get('status') == \
+        ItemStatus.AT_DESK
+
+    # STEP#2 :: RUN THE TASK ONCE THE ITEM IS RELEASED
+    assert cancel_expired_request_task() == (1, 1)
+    locked_loan = Loan.get_record_by_pid(locked_loan.pid)
+    assert locked_loan['state'] == LoanState.CANCELLED
+    assert Item.get_record_by_pid(locked_item.pid).get('status') == \
+        ItemStatus.ON_SHELF
+
+
+def test_expired_request_task_failing_thread(
+    app, monkeypatch, item_lib_martigny, loc_public_martigny,
+    patron_martigny, librarian_martigny, circulation_policies, yesterday
+):
+    """Test the cancellation of expired requests with a failing thread."""
+    monkeypatch.setitem(app.config, 'RERO_ILS_EXPIRED_REQUESTS_WORKERS', 2)
+    params = {
+        'patron_pid': patron_martigny.pid,
+        'transaction_location_pid': loc_public_martigny.pid,
+        'transaction_user_pid': librarian_martigny.pid,
+        'pickup_location_pid': loc_public_martigny.pid
+    }
+    requests = []
+    for _ in range(2):
+        item, loan = item_record_to_a_specific_loan_state(
+            item=item_lib_martigny, loan_state=LoanState.ITEM_AT_DESK,
+            params=dict(params), copy_item=True)
+        loan['request_expire_date'] = yesterday.isoformat()
+        loan.update(loan, dbcommit=True, reindex=True)
+        requests.append((item, loan))
+    flush_index(LoansSearch.Meta.index)
+
+    # the thread of the second item fails before cancelling its request
+    (item, loan), (failing_item, failing_loan) = requests
+    prefetch = ExpiredRequestCanceller._prefetch
+
+    def failing_prefetch(chunk, items, records_map):
+        if any(item_pid == failing_item.pid for item_pid, _ in chunk):
+            raise Exception('prefetch error')
+        return prefetch(chunk, items, records_map)
+
+    monkeypatch.setattr(
+        ExpiredRequestCanceller, '_prefetch', staticmethod(failing_prefetch))
+    assert ExpiredRequestCanceller().run() == {
+        'total': 1, 'cancelled': 1, 'locked': 0, 'errors': 1}
+    # the item of the other thread is indexed with its new status
+    assert Loan.get_record_by_pid(loan.pid)['state'] == LoanState.CANCELLED
+    flush_index(ItemsSearch.Meta.index)
+    assert ItemsSearch().get_record_by_pid(item.pid)['status'] == \
+        ItemStatus.ON_SHELF
+    assert Loan.get_record_by_pid(failing_loan.pid)['state'] == \
+        LoanState.ITEM_AT_DESK
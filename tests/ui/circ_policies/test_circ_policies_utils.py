@@ -20,6 +20,7 @@
 from __future__ import absolute_import, print_function
 
 from rero_ils.modules.circ_policies.api import CircPolicy
+from rero_ils.modules.circ_policies.utils import CircPoliciesMatrix
 
 
 def test_circ_policy_search(app, circulation_policies):
@@ -80,3 +81,23 @@ def test_circ_policy_search(app, circulation_policies):
             row['item_type_pid']
         )
         assert cipo.pid == row['cipo']
+
+
+def test_circ_policies_matrix(app, circulation_policies):
+    """Test the circulation policies resolution table."""
+    matrix = CircPoliciesMatrix.get_matrix('org1')
+    assert matrix.resolve('lib1', 'ptty1', 'itty1') == 'cipo2'
+    assert matrix.resolve('lib2', 'ptty2', 'itty2') == 'cipo1'
+    # the resolution table is built only once
+    assert CircPoliciesMatrix.get_matrix('org1') is matrix
+
+    # any policy change invalidates the resolution table
+    cipo = CircPolicy.get_record_by_pid('cipo2')
+    cipo.update(cipo, dbcommit=True, reindex=True)
+    new_matrix = CircPoliciesMatrix.get_matrix('org1')
+    assert new_matrix is not matrix
+    assert new_matrix.resolve('lib1', 'ptty1', 'itty1') == 'cipo2'
+
+    # the record changes invalidate the table even without indexing
+    cipo.update(cipo, dbcommit=True, reindex=False)
+    assert CircPoliciesMatrix.get_matrix('org1') is not new_matrix
@@ -22,7 +22,8 @@ from __future__ import absolute_import, print_function
 import pytest
 
 from rero_ils.modules.api import IlsRecordError
-from rero_ils.modules.documents.api import Document, document_id_fetcher
+from rero_ils.modules.documents.api import Document, DocumentsIndexer, \
+    document_id_fetcher
 from rero_ils.modules.ebooks.tasks import create_records
 
 
@@ -176,3 +177,15 @@ def test_document_get_identifiers(document):
     assert not document.get_identifier_values(filters=['dummy_type'])
     assert len(document.get('identifiedBy', [])) == \
            len(document.get_identifier_values())
+
+
+def test_document_batch_enrichment(document, item_lib_martigny):
+    """Test document batch enrichment."""
+    indexer = DocumentsIndexer()
+    expected = indexer._record_action(document, {})['_source']
+    assert expected['holdings'][0]['items'][0]['pid'] == \
+        item_lib_martigny.pid
+    with indexer.prefetch_records([document]):
+        source = indexer._record_action(document, {})['_source']
+    assert source['holdings'] == expected['holdings']
+    assert source.get('local_fields') == expected.get('local_fields')
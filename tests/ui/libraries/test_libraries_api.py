@@ -19,7 +19,8 @@
 
 from __future__ import absolute_import, print_function
 
-from datetime import datetime, timedelta
+from copy import deepcopy
+from datetime import date, datetime, timedelta
 
 import pytz
 from dateutil import parser
@@ -185,3 +186,27 @@ def test_library_get_email(lib_martigny):
     assert lib_martigny.get_email(NotificationType.RECALL) == \
         notification_email(lib_martigny, NotificationType.RECALL)
     assert not lib_martigny.get_email('dummy_notification_type')
+
+
+def test_library_calendar(lib_martigny):
+    """Test the compiled library calendar."""
+    calendar = lib_martigny.calendar
+    assert calendar is lib_martigny.calendar
+    # '2018-12-15' is an open saturday by exception, Christmas break starts
+    # on '2018-12-22'.
+    assert calendar.is_open_day(date(2018, 12, 15))
+    assert not calendar.is_open_day(date(2018, 12, 24))
+    assert calendar.count_open(date(2018, 12, 10), date(2018, 12, 15)) == 6
+    assert calendar.count_open(date(2018, 12, 22), date(2019, 1, 6)) == 0
+    assert calendar.next_open_day(date(2018, 12, 21)) == date(2019, 1, 7)
+    assert calendar.next_open_day(date(2019, 1, 7), previous=True) == \
+        date(2018, 12, 21)
+    assert calendar.nth_open_day(date(2018, 12, 10), 6) == date(2018, 12, 17)
+
+    # any change of the library opening data rebuilds the calendar
+    lib = Library(deepcopy(dict(lib_martigny)))
+    lib['exception_dates'] = []
+    new_calendar = lib.calendar
+    assert new_calendar is not calendar
+    assert not new_calendar.is_open_day(date(2018, 12, 15))
+    assert new_calendar.is_open_day(date(2018, 12, 24))
@@ -27,12 +27,16 @@ import mock
 from freezegun import freeze_time
 from invenio_circulation.proxies import current_circulation
 from invenio_circulation.search.api import LoansSearch
-from utils import flush_index, get_mapping
+from utils import flush_index, get_mapping, \
+    item_record_to_a_specific_loan_state
 
 from rero_ils.modules.circ_policies.api import DUE_SOON_REMINDER_TYPE
+from rero_ils.modules.items.api import Item
 from rero_ils.modules.items.models import ItemStatus
 from rero_ils.modules.libraries.api import Library
+from rero_ils.modules.loans.anonymizer import LoanAnonymizer
 from rero_ils.modules.loans.api import Loan, get_expired_request
+from rero_ils.modules.loans.logs.api import LoanOperationLog
 from rero_ils.modules.loans.models import LoanAction, LoanState
 from rero_ils.modules.loans.tasks import loan_anonymizer
 from rero_ils.modules.loans.utils import get_circ_policy, \
@@ -425,6 +429,99 @@ def test_anonymize_candidates(
     assert loan.pid in candidates
 
 
+def test_loan_anonymizer_eligibility(patron_martigny):
+    """Test the loans eligible to the batch anonymisation."""
+    anonymizer = LoanAnonymizer(chunk_size=10)
+    tstamp = anonymizer.tstamp
+    loans = [{
+        'pid': f'anonymizer-{days}',
+        'patron_pid': patron_martigny.pid,
+        'transaction_date': (tstamp - timedelta(days=days)).isoformat()
+    } for days in [10, 120, 365]]
+    loans.append({
+        'pid': 'anonymizer-unknown',
+        'patron_pid': 'unknown',
+        'transaction_date': (tstamp - timedelta(days=120)).isoformat()
+    })
+
+    # recent loans are never anonymized, old loans are always anonymized
+    patron_martigny.set_keep_history(True)
+    assert anonymizer.get_eligible_pids(loans) == ['anonymizer-365']
+
+    # the patron does not keep its history
+    patron_martigny.set_keep_history(False)
+    assert anonymizer.get_eligible_pids(loans) == [
+        'anonymizer-120', 'anonymizer-365']
+    patron_martigny.set_keep_history(True)
+
+
+def test_loan_anonymizer_run(
+        item_lib_martigny, loc_public_martigny, librarian_martigny,
+        patron_martigny, circulation_policies, loan_overdue_martigny,
+        patron_transaction_overdue_martigny):
+    """Test the batch anonymisation of the concluded loans."""
+    params = {
+        'patron_pid': patron_martigny.pid,
+        'transaction_location_pid': loc_public_martigny.pid,
+        'transaction_user_pid': librarian_martigny.pid,
+        'pickup_location_pid': loc_public_martigny.pid
+    }
+    checkin_params = {
+        'transaction_location_pid': loc_public_martigny.pid,
+        'transaction_user_pid': librarian_martigny.pid
+    }
+    # two loans returned one year ago
+    loans = []
+    for _ in range(2):
+        item, loan = item_record_to_a_specific_loan_state(
+            item=item_lib_martigny, loan_state=LoanState.ITEM_ON_LOAN,
+            params=dict(params), copy_item=True)
+        item.checkin(**checkin_params)
+        loans.append(Loan.get_record_by_pid(loan.pid))
+    # a loan returned one year ago with an open overdue fee
+    item = Item.get_record_by_pid(loan_overdue_martigny.item_pid)
+    item.checkin(**checkin_params)
+    fee_loan = Loan.get_record_by_pid(loan_overdue_martigny.pid)
+    assert fee_loan['state'] == LoanState.ITEM_RETURNED
+    assert patron_transaction_overdue_martigny.status == 'open'
+
+    one_year_ago = datetime.now(timezone.utc) - timedelta(days=365)
+    for loan in loans + [fee_loan]:
+        loan['transaction_date'] = one_year_ago.isoformat()
+        loan.update(loan, dbcommit=True, reindex=True)
+    flush_index(LoansSearch.Meta.index)
+    flush_index(LoanOperationLog.index_name)
+    for loan in loans + [fee_loan]:
+        logs = LoanOperationLog.get_logs_by_record_pid(loan.pid)
+        assert logs
+        for log in logs:
+            assert log['loan']['patron']['pid'] == patron_martigny.pid
+
+    # the loans are processed one by one
+    candidates = list(LoanAnonymizer().get_candidate_loans())
+    counters = LoanAnonymizer(chunk_size=1).run()
+    assert counters['processed'] == len(candidates)
+    assert 2 <= counters['anonymized'] < len(candidates)
+    flush_index(LoansSearch.Meta.index)
+    for loan in loans:
+        assert Loan.get_record_by_pid(loan.pid).get('to_anonymize')
+        logs = LoanOperationLog.get_logs_by_record_pid(loan.pid)
+        assert logs
+        for log in logs:
+            assert not log['loan']['patron'].get('pid')
+            assert not log['loan']['patron'].get('name')
+    # the loan with an open fee is kept
+    assert not Loan.get_record_by_pid(fee_loan.pid).get('to_anonymize')
+    for log in LoanOperationLog.get_logs_by_record_pid(fee_loan.pid):
+        assert log['loan']['patron']['pid'] == patron_martigny.pid
+
+    # the anonymized loans are no more candidates
+    assert LoanAnonymizer(chunk_size=1).run() == {
+        'processed': len(candidates) - counters['anonymized'],
+        'anonymized': 0
+    }
+
+
 def test_loan_get_overdue_fees(item_on_loan_martigny_patron_and_loan_on_loan):
     """Test the overdue fees computation."""
 
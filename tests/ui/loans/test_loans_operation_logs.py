@@ -24,6 +24,7 @@ from invenio_jsonschemas import current_jsonschemas
 from utils import flush_index, login_user_for_view
 
 from rero_ils.modules.loans.logs.api import LoanOperationLog
+from rero_ils.modules.locations.api import Location
 
 
 def test_loan_operation_log(client, operation_log_data,
@@ -110,3 +111,41 @@ def test_anonymize_logs(item2_on_loan_martigny_patron_and_loan_on_loan):
         assert log['loan']['patron']['hashed_pid'] == f'{md5_hash}'
         assert not log['loan']['patron'].get('name')
         assert not log['loan']['patron'].get('pid')
+
+
+def test_loan_operation_logs_batch(loan_validated_martigny):
+    """Test loan operation logs batch creation."""
+    loan = loan_validated_martigny
+    snapshots = LoanOperationLog.get_snapshots()
+    snapshots.clear()
+    flush_index(LoanOperationLog.index_name)
+    count = len(LoanOperationLog.get_logs_by_record_pid(loan['pid']))
+
+    assert LoanOperationLog.bulk_create([deepcopy(loan), deepcopy(loan)]) == 2
+    assert snapshots.stats['hits'] > 0
+    flush_index(LoanOperationLog.index_name)
+    logs = LoanOperationLog.get_logs_by_record_pid(loan['pid'])
+    assert len(logs) == count + 2
+    assert logs[0]['loan']['patron']['name'] == 'Roduit, Louis'
+
+    # the logs are created when leaving the batch context
+    with LoanOperationLog.batch():
+        assert LoanOperationLog.create(deepcopy(loan)) is None
+        with LoanOperationLog.batch():
+            assert LoanOperationLog.create(deepcopy(loan)) is None
+        flush_index(LoanOperationLog.index_name)
+        assert len(LoanOperationLog.get_logs_by_record_pid(loan['pid'])) \
+            == count + 2
+    flush_index(LoanOperationLog.index_name)
+    assert len(LoanOperationLog.get_logs_by_record_pid(loan['pid'])) \
+        == count + 4
+
+    # a record update invalidates its snapshot
+    location = Location.get_record_by_pid(loan['transaction_location_pid'])
+    name = location['name']
+    location['name'] = 'New name'
+    location.update(location, dbcommit=True, reindex=True)
+    assert LoanOperationLog._get_location_name(location.pid) == 'New name'
+    location['name'] = name
+    location.update(location, dbcommit=True, reindex=True)
+    assert LoanOperationLog._get_location_name(location.pid) == name
@@ -19,8 +19,13 @@
 
 from __future__ import absolute_import, print_function
 
+import threading
+from contextlib import contextmanager
+
+from rero_ils.modules.notifications.api import Notification
 from rero_ils.modules.notifications.dispatcher import Dispatcher
-from rero_ils.modules.notifications.models import NotificationType
+from rero_ils.modules.notifications.models import NotificationStatus, \
+    NotificationType
 
 
 def test_notification_organisation_pid(
@@ -84,3 +89,96 @@ def test_notification_email_aggregated(notification_availability_martigny,
         if notification_setting['type'] == NotificationType.AVAILABILITY:
             recipient = notification_setting['email']
     assert mailbox[0].recipients == [recipient]
+
+
+def test_notification_pooled_dispatch(notification_late_martigny,
+                                      notification_late_sion, lib_martigny,
+                                      patron_sion, mailbox):
+    """Test the dispatch of notifications with pooled transports."""
+    mailbox.clear()
+    result = Dispatcher.dispatch_notifications([
+        notification_late_martigny['pid'],
+        notification_late_sion['pid']
+    ], resend=True, pooled=True)
+    assert result['processed'] == 2
+    assert result['sent'] == 2
+    assert result['channels']['mail']['sent'] == 1
+    assert result['channels']['email']['sent'] == 1
+    assert result['channels']['email']['errors'] == 0
+    assert len(mailbox) == 2
+    assert [patron_sion.dumps()['email']] in \
+        [message.recipients for message in mailbox]
+
+    # the process dates are stored
+    notification = Notification.get_record_by_pid(
+        notification_late_sion['pid'])
+    assert notification['notification_sent']
+    assert notification['status'] == NotificationStatus.DONE
+
+    # the transports are only opened by the dispatch threads
+    assert Dispatcher.get_transport('mail') is None
+
+
+def test_notification_concurrent_dispatch(
+        app, monkeypatch, notification_late_martigny, notification_late_sion):
+    """Test the dispatch of notifications by several threads."""
+    sent = []
+    opened = []
+    lock = threading.Lock()
+
+    @contextmanager
+    def fake_transport():
+        """Transport recording the sent notifications of a thread."""
+        transport = []
+        yield transport
+        with lock:
+            opened.append(threading.get_ident())
+            sent.extend(transport)
+
+    def send(notifications):
+        """Send the notifications with the thread transport."""
+        Dispatcher.get_transport('fake').extend(
+            notification.pid for notification in notifications)
+        return True
+
+    def fail(notifications):
+        """Fail to send the notifications."""
+        raise Exception('transport error')
+
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_NOTIFICATIONS_DISPATCH_WORKERS', 4)
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_NOTIFICATIONS_DISPATCH_TRANSPORTS',
+        {'fake': fake_transport})
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_COMMUNICATION_DISPATCHER_FUNCTIONS',
+        {'email': send, 'mail': send})
+    pids = [notification_late_martigny.pid, notification_late_sion.pid]
+    result = Dispatcher.dispatch_notifications(pids, resend=True, pooled=True)
+    assert result['processed'] == 2
+    assert result['sent'] == 2
+    assert result['errors'] == 0
+    assert result['channels']['mail']['sent'] == 1
+    assert result['channels']['email']['sent'] == 1
+    # each notification is sent once, each thread closes its transport
+    assert sorted(sent) == sorted(pids)
+    assert len(opened) == 2
+    # the process dates are stored by one bulk update
+    for pid in pids:
+        notification = Notification.get_record_by_pid(pid)
+        assert notification['status'] == NotificationStatus.DONE
+        assert notification['notification_sent']
+        assert notification.get('process_date')
+
+    # the failed groups are counted and keep their process date
+    process_date = Notification.get_record_by_pid(
+        notification_late_sion.pid)['process_date']
+    monkeypatch.setitem(
+        app.config, 'RERO_ILS_COMMUNICATION_DISPATCHER_FUNCTIONS',
+        {'email': fail, 'mail': send})
+    result = Dispatcher.dispatch_notifications(pids, resend=True, pooled=True)
+    assert result['sent'] == 1
+    assert result['errors'] == 1
+    assert result['channels']['email']['errors'] == 1
+    assert Notification.get_record_by_pid(
+        notification_late_sion.pid)['process_date'] == process_date
@@ -24,6 +24,8 @@ import pytest
 from invenio_search import current_search
 
 from rero_ils.modules.operation_logs.api import OperationLog
+from rero_ils.modules.operation_logs.writer import OperationLogWriter
+from rero_ils.modules.utils import get_timestamp
 
 
 def test_operation_create(client, es_clear, operation_log_data):
@@ -78,6 +80,48 @@ def test_operation_bulk_index(client, es_clear, operation_log_data):
     assert OperationLog.delete_indices()
 
 
+def test_operation_buffered_create(
+        app, es_clear, operation_log_data, monkeypatch):
+    """Test buffered operation logs creation."""
+    monkeypatch.setitem(app.config, 'RERO_ILS_OPERATION_LOG_BUFFER', True)
+    monkeypatch.setitem(app.config, 'RERO_ILS_OPERATION_LOG_BUFFER_SIZE', 3)
+    monkeypatch.setattr(OperationLogWriter, '_writer', None)
+    writer = OperationLogWriter.get_writer()
+
+    # the logs are buffered until the buffer is full
+    pids = [
+        OperationLog.create(deepcopy(operation_log_data)).id
+        for _ in range(2)
+    ]
+    assert writer.metrics['backlog'] == 2
+    assert writer.metrics['flushed'] == 0
+    assert not OperationLog.get_indices()
+
+    pids.append(OperationLog.create(deepcopy(operation_log_data)).id)
+    metrics = writer.metrics
+    assert metrics['backlog'] == 0
+    assert metrics['flushed'] == 3
+    assert metrics['last_flush_latency'] >= 0
+    assert get_timestamp('operation-logs-flush')['count'] == 3
+    current_search.flush_and_refresh(OperationLog.index_name)
+    for pid in pids:
+        assert OperationLog.get_record(pid)
+
+    # a refresh request bypasses the buffer
+    oplg = OperationLog.create(
+        deepcopy(operation_log_data), index_refresh='wait_for')
+    assert OperationLog.get_record(oplg.id)
+    assert writer.metrics['backlog'] == 0
+
+    # explicit flush
+    OperationLog.create(deepcopy(operation_log_data))
+    assert writer.flush() == 1
+    assert writer.flush() == 0
+    writer.stop()
+    # clean up the index
+    assert OperationLog.delete_indices()
+
+
 def test_update(app, es_clear, operation_log_data, monkeypatch):
     """Test update log."""
     operation_log = OperationLog.create(deepcopy(operation_log_data),
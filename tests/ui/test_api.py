@@ -19,6 +19,7 @@
 
 
 from functools import partial
+from uuid import uuid4
 
 import pytest
 from invenio_db import db
@@ -28,7 +29,8 @@ from invenio_search import current_search
 from jsonschema.exceptions import ValidationError
 from utils import flush_index
 
-from rero_ils.modules.api import IlsRecord, IlsRecordError, IlsRecordsSearch
+from rero_ils.modules.api import IlsRecord, IlsRecordError, \
+    IlsRecordsIndexer, IlsRecordsSearch
 from rero_ils.modules.fetchers import id_fetcher
 from rero_ils.modules.minters import id_minter
 from rero_ils.modules.providers import Provider
@@ -143,6 +145,22 @@ def test_ilsrecord(app, es_default_index, ils_record, ils_record_2):
     assert sorted(RecordTest.get_all_pids()) == [
         '1', 'ilsrecord_pid', 'ilsrecord_pid_2'
     ]
+    # keyset pagination, ordered by pid value
+    assert list(RecordTest.get_all_pids(limit=1)) == [
+        '1', 'ilsrecord_pid', 'ilsrecord_pid_2'
+    ]
+    assert list(RecordTest.get_all_ids(limit=2)) == [
+        RecordTest.get_id_by_pid(pid)
+        for pid in ['1', 'ilsrecord_pid', 'ilsrecord_pid_2']
+    ]
+
+    """Test IlsRecord get records by pids."""
+    pids = ['ilsrecord_pid_2', 'unknown', None, '1', 'ilsrecord_pid']
+    records = list(RecordTest.get_records_by_pids(pids, chunk_size=2))
+    assert [record.pid for record in records] == \
+        ['ilsrecord_pid_2', '1', 'ilsrecord_pid']
+    assert all(isinstance(record, RecordTest) for record in records)
+    assert list(RecordTest.get_records_by_pids([])) == []
 
     """Test IlsRecord update."""
     record = RecordTest.get_record_by_pid('ilsrecord_pid')
@@ -291,3 +309,52 @@ def test_ilsrecord_failed_pid(app, es_default_index, ils_record, ils_record_2):
     next_pid += 1
     db.session.commit()
     assert record4.pid == str(next_pid)
+
+
+def test_ilsrecord_bulk_create(app):
+    """Test IlsRecord bulk creation."""
+    schema = {
+        'type': 'object',
+        'properties': {
+            'pid': {'type': 'string'},
+            'name': {'type': 'string'}
+        },
+        'required': ['pid', 'name']
+    }
+    count = FailedIlsRecord.count()
+    next_pid = FailedIlsRecord.provider.identifier.next()
+    records = [
+        {'$schema': schema, 'name': 'bulk 1'},
+        {'$schema': schema, 'pid': 'bulk2', 'name': 'bulk 2'},
+        {'$schema': schema, 'pid': 'bulk2', 'name': 'bulk 2 again'},
+        {'$schema': schema},
+        {'$schema': schema, 'name': 'bulk 5'}
+    ]
+    results = list(FailedIlsRecord.bulk_create(
+        records, batch_size=2, workers=2, dbcommit=True))
+    assert [error is None for _, error in results] == [
+        True, True, False, False, True]
+    assert isinstance(results[2][1], IlsRecordError.PidAlreadyUsed)
+    assert isinstance(results[3][1], ValidationError)
+    # pids are minted by block
+    assert results[0][0].pid == str(next_pid + 1)
+    assert results[4][0].pid == str(next_pid + 3)
+    assert FailedIlsRecord.count() == count + 3
+    record = FailedIlsRecord.get_record_by_pid('bulk2')
+    assert record['name'] == 'bulk 2'
+    assert record.persistent_identifier.status == PIDStatus.REGISTERED
+
+
+def test_ilsrecord_batched_bulk_indexing(app, lib_martigny, lib_saxon):
+    """Test IlsRecordsIndexer batched bulk indexing."""
+    indexer = IlsRecordsIndexer()
+    indexer.bulk_index(
+        [lib_martigny.id, uuid4(), lib_saxon.id], doc_type='lib')
+    name, (success, errors) = indexer.process_bulk_queue(
+        batch_size=2, parallel=2)
+    # unknown record messages are rejected, others are indexed.
+    assert success == 2
+    assert errors == 0
+    # the queue is empty
+    name, (success, errors) = indexer.process_bulk_queue(batch_size=2)
+    assert success == 0
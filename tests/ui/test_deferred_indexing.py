@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Deferred indexing tests."""
+
+from utils import flush_index
+
+from rero_ils.modules.deferred_indexing import current_deferred_indexing, \
+    deferred_indexing
+from rero_ils.modules.libraries.api import LibrariesSearch, Library
+
+
+def test_deferred_indexing(lib_martigny):
+    """Test the deferred indexing of records."""
+    assert current_deferred_indexing() is None
+    library = Library.get_record_by_pid(lib_martigny.pid)
+    name = library['name']
+
+    with deferred_indexing(['lib']) as deferred:
+        assert current_deferred_indexing() == deferred
+        library['name'] = 'deferred name'
+        library = library.update(library, dbcommit=True, reindex=True)
+        library = library.update(library, dbcommit=True, reindex=True)
+        flush_index(LibrariesSearch.Meta.index)
+        hit = LibrariesSearch().get_record_by_pid(library.pid)
+        assert hit['name'] == name
+        # the record is indexed once
+        assert len(deferred) == 1
+
+        # the other record types are indexed
+        with deferred_indexing(['item']) as nested:
+            assert not nested.add(library)
+
+    assert current_deferred_indexing() is None
+    assert deferred.flush() == 1
+    assert len(deferred) == 0
+    hit = LibrariesSearch().get_record_by_pid(library.pid)
+    assert hit['name'] == 'deferred name'
+
+    # restore the library
+    library['name'] = name
+    library.update(library, dbcommit=True, reindex=True)
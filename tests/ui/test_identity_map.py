@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Identity map tests."""
+
+from rero_ils.modules.identity_map import current_identity_map, identity_map
+from rero_ils.modules.libraries.api import Library
+
+
+def test_identity_map(lib_martigny):
+    """Test records identity map."""
+    # no identity map outside the context
+    assert current_identity_map() is None
+    lib_1 = Library.get_record_by_pid(lib_martigny.pid)
+    lib_2 = Library.get_record_by_pid(lib_martigny.pid)
+    assert lib_1 is not lib_2
+
+    with identity_map() as records_map:
+        assert current_identity_map() == records_map
+        lib_1 = Library.get_record_by_pid(lib_martigny.pid)
+        lib_2 = Library.get_record_by_pid(lib_martigny.pid)
+        lib_3 = Library.get_record_by_id(lib_martigny.id)
+        assert lib_1 is lib_2 is lib_3
+        assert records_map.stats == {'hits': 2, 'misses': 1, 'size': 1}
+
+        # nested contexts share the same identity map
+        with identity_map() as nested_map:
+            assert nested_map is records_map
+
+        # any update invalidates the stored record
+        lib_1.update(lib_1, dbcommit=True)
+        lib_4 = Library.get_record_by_pid(lib_martigny.pid)
+        assert lib_4 is not lib_1
+        assert lib_4.revision_id == lib_1.revision_id
+
+        # deleted records are never loaded from the identity map
+        lib_5 = Library.get_record_by_pid(lib_martigny.pid, with_deleted=True)
+        assert lib_5 is not lib_4
+
+    assert current_identity_map() is None
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Cached $ref resolution tests."""
+
+import mock
+from invenio_pidstore.models import PersistentIdentifier, PIDStatus
+
+from rero_ils.modules.jsonresolver import get_pids_cache, iter_json_refs, \
+    prewarm_json_refs, resolve_json_refs
+
+
+def test_jsonresolver_cache(item_lib_martigny, loc_public_martigny,
+                            document):
+    """Test the cached resolution of the $ref."""
+    cache = get_pids_cache()
+    cache.clear()
+    refs = list(iter_json_refs(item_lib_martigny))
+    location_ref = f'https://bib.rero.ch/api/locations/' \
+        f'{loc_public_martigny.pid}'
+    document_ref = f'https://bib.rero.ch/api/documents/{document.pid}'
+    assert location_ref in refs
+    assert document_ref in refs
+    refs.append('https://bib.rero.ch/api/locations/n_e')
+
+    # all the refs are loaded with one query
+    assert prewarm_json_refs(refs) == len(set(refs)) - 1
+    # the loaded refs are not reloaded
+    assert prewarm_json_refs(refs) == 0
+
+    # resolved from the cache
+    with mock.patch(
+        'rero_ils.modules.jsonresolver.PersistentIdentifier.get',
+        side_effect=Exception
+    ):
+        assert resolve_json_refs('loc', loc_public_martigny.pid) == {
+            'pid': loc_public_martigny.pid,
+            'type': 'loc'
+        }
+        assert resolve_json_refs('loc', 'n_e', raise_on_error=False) is None
+    assert cache.stats['hits'] >= 1
+
+    # a status change invalidates the cached pid
+    persistent_id = PersistentIdentifier.get('loc', loc_public_martigny.pid)
+    persistent_id.status = PIDStatus.DELETED
+    assert cache.get('loc', loc_public_martigny.pid) is None
+    assert resolve_json_refs(
+        'loc', loc_public_martigny.pid, raise_on_error=False) is None
+    persistent_id.status = PIDStatus.REGISTERED
+    assert resolve_json_refs('loc', loc_public_martigny.pid)
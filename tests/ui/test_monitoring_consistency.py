@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Test monitoring consistency checker."""
+
+from copy import deepcopy
+
+from utils import flush_index
+
+from rero_ils.modules.documents.api import Document, DocumentsSearch
+from rero_ils.modules.monitoring.consistency import INTERVALS, \
+    ConsistencyChecker
+
+
+def test_consistency_checker(app, document_sion_items_data):
+    """Test the ES/DB consistency checker."""
+    doc = Document.create(
+        data=document_sion_items_data,
+        delete_pid=False,
+        dbcommit=True,
+        reindex=True
+    )
+    flush_index(DocumentsSearch.Meta.index)
+    result = ConsistencyChecker('doc', time_delta=0).check(
+        commit_checkpoint=True)
+    assert result == {
+        'missing_in_es': [],
+        'missing_in_db': [],
+        'duplicates': [],
+        'outdated': [],
+        'buckets': 0
+    }
+
+    # updated without reindexing
+    doc = doc.update(doc, dbcommit=True, reindex=False)
+    checker = ConsistencyChecker('doc', time_delta=0)
+    last_check = checker.last_check
+    assert last_check
+    result = checker.check(incremental=True)
+    assert result['outdated'] == [doc.pid]
+    # a read only check keeps the checkpoint
+    assert checker.last_check == last_check
+    result = ConsistencyChecker('doc', time_delta=0).check(incremental=True)
+    assert result['outdated'] == [doc.pid]
+    # the full check finds the same record
+    result = ConsistencyChecker('doc', time_delta=0).check()
+    assert result['outdated'] == [doc.pid]
+    assert result['buckets'] == len(INTERVALS)
+
+    doc.reindex()
+    flush_index(DocumentsSearch.Meta.index)
+    result = ConsistencyChecker('doc', time_delta=0).check(
+        incremental=True, commit_checkpoint=True)
+    assert result['outdated'] == []
+
+    # deleted without removing it from the index
+    doc.delete(dbcommit=True, delindex=False)
+    result = ConsistencyChecker('doc', time_delta=0).check(incremental=True)
+    assert result['missing_in_db'] == [doc.pid]
+    result = ConsistencyChecker('doc', time_delta=0).check()
+    assert result['missing_in_db'] == [doc.pid]
+
+
+def test_consistency_checker_bucket_checksum(app, document_sion_items_data):
+    """Test the detection of an outdated record in a bucket."""
+    old_doc, new_doc = [
+        Document.create(
+            data=deepcopy(document_sion_items_data),
+            delete_pid=True,
+            dbcommit=True,
+            reindex=True
+        )
+        for _ in range(2)
+    ]
+    flush_index(DocumentsSearch.Meta.index)
+    # the older record is outdated in the index, the newer one is updated
+    # after it: the last update date of the bucket is the same on both sides
+    old_doc = old_doc.update(old_doc, dbcommit=True, reindex=False)
+    new_doc = new_doc.update(new_doc, dbcommit=True, reindex=True)
+    flush_index(DocumentsSearch.Meta.index)
+    result = ConsistencyChecker('doc', time_delta=0).check()
+    assert result['outdated'] == [old_doc.pid]
+
+    old_doc.reindex()
+    flush_index(DocumentsSearch.Meta.index)
+    result = ConsistencyChecker('doc', time_delta=0).check()
+    assert result['outdated'] == []
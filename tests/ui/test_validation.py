@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compiled JSON schema validation tests."""
+
+from copy import deepcopy
+
+import pytest
+from jsonschema.exceptions import ValidationError
+
+from rero_ils.modules.utils import get_schema_for_resource
+from rero_ils.modules.validation import get_validation_stats, get_validator, \
+    validate, validate_many
+
+
+def test_validate(app, document_data):
+    """Test compiled schema validation."""
+    schema = get_schema_for_resource('doc')
+    data = deepcopy(document_data)
+    data['$schema'] = schema
+    # the schema is compiled once
+    assert get_validator(schema) is get_validator(schema)
+    get_validation_stats(reset=True)
+    validate(data)
+    invalid = deepcopy(data)
+    invalid.pop('title')
+    with pytest.raises(ValidationError):
+        validate(invalid)
+    stats = get_validation_stats(reset=True)
+    assert stats[schema]['count'] == 2
+    assert stats[schema]['errors'] == 1
+    with pytest.raises(ValueError):
+        validate(data, 'https://unknown.org/schemas/doc.json')
+
+    # the same results with several processes
+    records = [data, invalid] * 5
+    for processes in [1, 2]:
+        results = list(validate_many(
+            records, processes=processes, chunk_size=3))
+        assert [record for record, _ in results] == records
+        assert [error is None for _, error in results] == [True, False] * 5
+        stats = get_validation_stats(reset=True)
+        assert stats[schema]['count'] == 10
+        assert stats[schema]['errors'] == 5
+
+    # a record with an unknown schema is reported with its error
+    unknown = dict(data, **{'$schema': 'https://unknown.org/schemas/doc.json'})
+    records = [data, unknown, invalid]
+    for processes in [1, 2]:
+        results = list(validate_many(records, processes=processes))
+        assert [record for record, _ in results] == records
+        assert results[0][1] is None
+        assert 'Unknown local schema' in results[1][1].message
+        assert isinstance(results[2][1], ValidationError)
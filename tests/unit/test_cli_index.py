@@ -17,10 +17,14 @@
 
 """Test cli."""
 
+import json
+
 from click.testing import CliRunner
+from invenio_search import current_search_client
 
 from rero_ils.modules.cli.index import delete_queue, init_queue, purge_queue, \
-    reindex, reindex_missing, run
+    rebuild, reindex, reindex_missing, run
+from rero_ils.modules.cli.reindex import partition_bounds
 from rero_ils.modules.organisations.api import Organisation
 
 
@@ -147,3 +151,77 @@ def test_cli_reindex_missing(app, script_info, org_sion_data):
     assert res.output.strip().split('\n') == [
         f'Queue has been deleted: {queue_name}'
     ]
+
+
+def test_cli_reindex_partitions(app, script_info, org_martigny, tmpdir):
+    """Test partitioned reindex cli."""
+    count = Organisation.count()
+    assert partition_bounds(1) == [(None, None)]
+    assert partition_bounds(2) == [
+        (None, '80000000-0000-0000-0000-000000000000'),
+        ('80000000-0000-0000-0000-000000000000', None)
+    ]
+
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    runner = CliRunner()
+    res = runner.invoke(
+        reindex,
+        ['-t', 'org', '-p', '2', '--processes', '1', '-c', checkpoint,
+         '--yes-i-know'],
+        obj=script_info
+    )
+    output = res.output.strip().split('\n')
+    assert output[0] == 'Indexing org by 2 partitions:'
+    assert output[-1] == f'"org" indexed: {count} error: 0'
+    with open(checkpoint) as checkpoint_file:
+        state = json.load(checkpoint_file)['org']['state']
+    assert all(partition['done'] for partition in state.values())
+    assert sum(partition['total'] for partition in state.values()) == count
+
+    # everything is already indexed: nothing to resume
+    res = runner.invoke(
+        reindex,
+        ['-t', 'org', '-p', '2', '--processes', '1', '-c', checkpoint,
+         '--yes-i-know'],
+        obj=script_info
+    )
+    assert res.output.strip().split('\n') == [
+        'Indexing org by 2 partitions:',
+        f'"org" indexed: {count} error: 0'
+    ]
+
+
+def test_cli_rebuild(app, script_info, org_martigny):
+    """Test blue/green index rebuild cli."""
+    new_index = 'organisations-organisation-v0.0.1-test'
+    old_indices = current_search_client.indices.get_alias(
+        name='organisations')
+    runner = CliRunner()
+    try:
+        res = runner.invoke(
+            rebuild,
+            ['organisations', '-n', new_index, '--yes-i-know'],
+            obj=script_info
+        )
+        assert res.exit_code == 0
+        assert res.output.strip().split('\n')[-1].endswith(
+            f'-> {new_index}')
+        assert list(current_search_client.indices.get_alias(
+            name='organisations')) == [new_index]
+        current_search_client.indices.refresh(index=new_index)
+        assert current_search_client.count(index='organisations')['count'] \
+            == Organisation.count()
+        settings = current_search_client.indices.get_settings(
+            index=new_index)
+        assert settings[new_index]['settings']['index'].get(
+            'refresh_interval') != '-1'
+    finally:
+        # the old index is kept by the rebuild: move the aliases back to it
+        current_search_client.indices.update_aliases(body={'actions': [
+            {'add': {'index': index, 'alias': alias}}
+            for index, data in old_indices.items()
+            for alias in data.get('aliases', {})
+        ]})
+        current_search_client.indices.delete(index=new_index, ignore=404)
+    assert current_search_client.indices.get_alias(
+        name='organisations') == old_indices
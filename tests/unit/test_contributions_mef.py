@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# RERO ILS
+# Copyright (C) 2021 RERO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""MEF resolver tests."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from dojson.contrib.marc21.utils import create_record
+
+from rero_ils.dojson import utils as dojson_utils
+from rero_ils.dojson.utils import mef_contributions_batch
+from rero_ils.modules.contributions.mef import MefCache, MefRequestError, \
+    MefResolver
+from rero_ils.modules.documents.dojson.contrib.marc21tojson.rero import marc21
+
+
+@pytest.fixture()
+def mef_server():
+    """Local stand-in MEF server."""
+    agents = {
+        'idref.pid:"1"': {'metadata': {'pid': 'm1', 'idref': {'pid': '1'}}},
+        'viaf_pid:"v1"': {'metadata': {'pid': 'm1', 'idref': {'pid': '1'}}}
+    }
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        """MEF search handler."""
+
+        def do_GET(self):
+            """Search the agents."""
+            query = parse_qs(urlparse(self.path).query)['q'][0]
+            requested.append(query)
+            if query == 'idref.pid:"error"':
+                self.send_response(404)
+                self.end_headers()
+                return
+            hits = [agents[query]] if query in agents else []
+            body = json.dumps({'hits': {'hits': hits, 'total': len(hits)}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body.encode('utf-8'))
+
+        def log_message(self, *args):
+            """No logs."""
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.requested = requested
+    server.url = f'http://127.0.0.1:{server.server_port}/api'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_mef_resolver_cache(mef_server, tmpdir):
+    """Test MEF resolver with a persistent cache."""
+    cache_url = f'sqlite:///{tmpdir.join("mef.db")}'
+    resolver = MefResolver(
+        mef_server.url, cache=MefCache.from_url(cache_url), workers=4,
+        pooled=True)
+
+    with resolver.batch([
+        ('idref', '1'), ('viaf', 'v1'), ('gnd', '2'), ('idref', 'error')
+    ]) as hits:
+        assert hits[('idref', '1')]['metadata']['pid'] == 'm1'
+        assert hits[('gnd', '2')] is None
+        # errors are not kept
+        assert ('idref', 'error') not in hits
+        assert resolver.get('idref', '1')['metadata']['pid'] == 'm1'
+    assert len(mef_server.requested) == 4
+
+    # responses and "not found" are cached, errors are not
+    resolver = MefResolver(
+        mef_server.url, cache=MefCache.from_url(cache_url), offline=True)
+    assert resolver.get('viaf', 'v1')['metadata']['pid'] == 'm1'
+    assert resolver.get('gnd', '2') is None
+    with pytest.raises(MefRequestError):
+        resolver.get('idref', 'error')
+    assert len(mef_server.requested) == 4
+
+    # without cache, each get requests the server
+    resolver = MefResolver(mef_server.url)
+    with pytest.raises(MefRequestError) as err:
+        resolver.get('idref', 'error')
+    assert err.value.status_code == 404
+    assert resolver.get('idref', '1', fresh=True)['metadata']['pid'] == 'm1'
+    assert resolver.get('idref', '1')['metadata']['pid'] == 'm1'
+    assert len(mef_server.requested) == 7
+
+
+def test_mef_contributions_batch(mef_server, monkeypatch):
+    """Test the MEF contributions resolution of a chunk of records."""
+    monkeypatch.setattr(dojson_utils, '_get_mef_url', lambda: mef_server.url)
+
+    marc21records = [create_record("""
+    <record>
+      <datafield tag="100" ind1=" " ind2=" ">
+        <subfield code="a">Dupont, Jean</subfield>
+        <subfield code="0">(viaf)v1</subfield>
+      </datafield>
+    </record>
+    """), create_record("""
+    <record>
+      <datafield tag="700" ind1=" " ind2=" ">
+        <subfield code="a">Dupont, Jean</subfield>
+        <subfield code="0">(viaf)v1</subfield>
+      </datafield>
+      <datafield tag="700" ind1=" " ind2=" ">
+        <subfield code="a">Inconnu, Paul</subfield>
+        <subfield code="0">(IdRef)2</subfield>
+      </datafield>
+    </record>
+    """)]
+    with mef_contributions_batch(marc21records):
+        # the viaf references are resolved first, then their idref pids
+        assert sorted(mef_server.requested) == [
+            'idref.pid:"1"', 'idref.pid:"2"', 'viaf_pid:"v1"']
+        data = [marc21.do(record) for record in marc21records]
+    # the conversions use the resolved references
+    assert len(mef_server.requested) == 3
+    assert [
+        [contribution['agent'].get('$ref')
+         for contribution in record['contribution']]
+        for record in data
+    ] == [
+        [f'{mef_server.url}/idref/1'],
+        [f'{mef_server.url}/idref/1', None]
+    ]
+
+
+def test_mef_cache_purge(tmpdir):
+    """Test the removal of the expired MEF responses."""
+    cache = MefCache.from_url(f'sqlite:///{tmpdir.join("mef.db")}')
+    cache.set('idref:1', {'pid': 'm1'})
+    # a response expired one second ago
+    cache._set_many([('idref:2', '{"pid": "m2"}', -1)])
+    assert cache.get('idref:2') == (False, None)
+    assert cache.purge() == 1
+    assert cache.purge() == 0
+    assert cache.get('idref:1') == (True, {'pid': 'm1'})
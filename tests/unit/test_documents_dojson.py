@@ -5385,7 +5385,7 @@ def test_get_contribution_link(mock_get, capsys):
     out, err = capsys.readouterr()
     assert out == (
         'WARNING GET MEF CONTRIBUTION:\t1\t1\t100..\t(IdRef)123456789\t'
-        'https://mef.xxx.rero.ch/api/mef/?q=idref.pid:"123456789"\t404\t0\t\n'
+        'https://mef.xxx.rero.ch/api/mef/?q=idref.pid:"123456789"\t404\t\n'
     )
 
     mock_get.return_value = mock_response(status=400)
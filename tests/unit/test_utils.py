@@ -19,6 +19,10 @@
 
 import os
 from datetime import datetime
+from io import BytesIO, StringIO
+from json import JSONDecodeError, dumps
+
+import pytest
 
 from rero_ils.modules.patron_types.api import PatronType
 from rero_ils.modules.patrons.api import Patron
@@ -46,6 +50,27 @@ def test_read_json_record(request):
         assert count == 2
 
 
+def test_read_json_record_streaming():
+    """Test streaming read of json records."""
+    records = [
+        {'pid': str(idx), 'title': 'é' * idx, 'data': [{'value': '[,]'}]}
+        for idx in range(100)
+    ]
+    json_list = dumps(records, indent=2)
+    json_lines = '\n'.join(dumps(record) for record in records)
+    for data in [json_list, json_lines]:
+        # block smaller than a record, multi bytes characters split
+        for buf_size in [3, 1024]:
+            assert list(read_json_record(
+                StringIO(data), buf_size=buf_size)) == records
+            assert list(read_json_record(
+                BytesIO(data.encode('utf-8')), buf_size=buf_size)) == records
+    assert list(read_json_record(StringIO('[]'))) == []
+    assert list(read_json_record(StringIO(''))) == []
+    with pytest.raises(JSONDecodeError):
+        list(read_json_record(StringIO('[{"pid": "1"}, {"pid": ')))
+
+
 def test_add_years():
     """Test adding years to a date."""
     initial_date = datetime.now()